@@ -29,6 +29,14 @@ ROOT_HELPER_OPTS = [
                help=_('Root helper application.')),
 ]
 
+ROOT_HELPER_DAEMON_OPTS = [
+    cfg.StrOpt('root_helper_daemon',
+               help=_('Root helper daemon application to use when possible. '
+                      'Commands run as root are sent to a long-lived '
+                      'privileged process over a local socket instead of '
+                      'spawning a new root helper per command.')),
+]
+
 AGENT_STATE_OPTS = [
     cfg.FloatOpt('report_interval', default=30,
                  help=_('Seconds between nodes reporting state to server; '
@@ -49,6 +57,12 @@ USE_NAMESPACES_OPTS = [
 IPTABLES_OPTS = [
     cfg.BoolOpt('comment_iptables_rules', default=True,
                 help=_("Add comments to iptables rules.")),
+    cfg.BoolOpt('cache_iptables_state', default=False,
+                help=_("Keep the iptables rules last applied by the agent in "
+                       "memory and compute changes against them, only "
+                       "running iptables-save again if iptables-restore "
+                       "fails. Only enable it if no other process modifies "
+                       "the iptables chains used by the agent.")),
 ]
 
 
@@ -83,6 +97,7 @@ def register_root_helper(conf):
     # The first call is to ensure backward compatibility
     conf.register_opts(ROOT_HELPER_OPTS)
     conf.register_opts(ROOT_HELPER_OPTS, 'AGENT')
+    conf.register_opts(ROOT_HELPER_DAEMON_OPTS, 'AGENT')
 
 
 def register_agent_state_opts_helper(conf):
@@ -13,6 +13,7 @@
 #    under the License.
 #
 
+import copy
 import sys
 
 import eventlet
@@ -79,6 +80,19 @@ FIP_PR_START = 32768
 FIP_PR_END = FIP_PR_START + 40000
 RPC_LOOP_INTERVAL = 1
 FLOATING_IP_CIDR_SUFFIX = '/32'
+# The keys of the router dict read by each step of process_router. A step
+# is run again only when one of its keys changed since the router was
+# last processed.
+ROUTER_KEYS = ('distributed', 'ha', l3_constants.HA_INTERFACE_KEY)
+INTERNAL_PORTS_KEYS = ROUTER_KEYS + (l3_constants.INTERFACE_KEY,
+                                     l3_constants.SNAT_ROUTER_INTF_KEY,
+                                     'gw_port', 'gw_port_host')
+EXTERNAL_GATEWAY_KEYS = ROUTER_KEYS + (l3_constants.INTERFACE_KEY,
+                                       l3_constants.SNAT_ROUTER_INTF_KEY,
+                                       'gw_port', 'gw_port_host',
+                                       'enable_snat')
+ROUTES_KEYS = ROUTER_KEYS + ('routes',)
+FLOATING_IPS_KEYS = ROUTER_KEYS + (l3_constants.FLOATINGIP_KEY, 'gw_port')
 
 
 class L3PluginApi(object):
@@ -92,6 +106,7 @@ class L3PluginApi(object):
               - get_agent_gateway_port
               Needed by the agent when operating in DVR/DVR_SNAT mode
         1.3 - Get the list of activated services
+        1.5 - Get the routers known by the agent as deltas
 
     """
 
@@ -100,8 +115,18 @@ class L3PluginApi(object):
         target = messaging.Target(topic=topic, version='1.0')
         self.client = n_rpc.get_client(target)
 
-    def get_routers(self, context, router_ids=None):
-        """Make a remote process call to retrieve the sync data for routers."""
+    def get_routers(self, context, router_ids=None, known_routers=None):
+        """Make a remote process call to retrieve the sync data for routers.
+
+        The routers of known_routers, which maps their ids to the
+        revision_number and the digests of the sub-resources known by the
+        agent, are returned as deltas.
+        """
+        if known_routers:
+            cctxt = self.client.prepare(version='1.5')
+            return cctxt.call(context, 'sync_routers', host=self.host,
+                              router_ids=router_ids,
+                              known_routers=known_routers)
         cctxt = self.client.prepare()
         return cctxt.call(context, 'sync_routers', host=self.host,
                           router_ids=router_ids)
@@ -202,6 +227,10 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback,
                    default='$state_path/metadata_proxy',
                    help=_('Location of Metadata Proxy UNIX domain '
                           'socket')),
+        cfg.IntOpt('router_processing_workers', default=8,
+                   help=_("Number of routers processed concurrently. The "
+                          "updates of a router are always processed one "
+                          "at a time.")),
     ]
 
     def __init__(self, host, conf=None):
@@ -700,6 +729,7 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback,
         # Update floating IP status on the neutron server
         self.plugin_rpc.update_floatingip_statuses(
             self.context, ri.router_id, fip_statuses)
+        return fip_statuses
 
     def _process_ha_router(self, ri):
         if ri.is_ha:
@@ -714,23 +744,47 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback,
         if 'distributed' not in ri.router:
             ri.router['distributed'] = False
 
+        # Only the steps whose data changed since the router was last
+        # processed are run, all of them when its last processing failed
+        router = copy.deepcopy(ri.router)
+        changed = ri.changed_keys(router)
+        ri.processed_router = None
+        LOG.debug("Keys of router %(router_id)s changed: %(changed)s",
+                  {'router_id': ri.router_id,
+                   'changed': 'all' if changed is None else changed})
+
+        def _changed(keys):
+            return changed is None or not changed.isdisjoint(keys)
+
         ri.iptables_manager.defer_apply_on()
-        self._process_internal_ports(ri)
-        self._process_external_gateway(ri)
+        if _changed(INTERNAL_PORTS_KEYS):
+            self._process_internal_ports(ri)
+        if _changed(EXTERNAL_GATEWAY_KEYS):
+            self._process_external_gateway(ri)
 
         # Process static routes for router
-        self.routes_updated(ri)
+        if _changed(ROUTES_KEYS):
+            self.routes_updated(ri)
 
         # Process SNAT/DNAT rules for floating IPs
-        self._process_snat_dnat_for_fip(ri)
+        if _changed(FLOATING_IPS_KEYS):
+            fip_statuses = self._process_snat_dnat_for_fip(ri)
+            if (fip_statuses and l3_constants.FLOATINGIP_STATUS_ERROR in
+                    fip_statuses.values()):
+                # Retry the floating IPs in error on the next update
+                router.pop(l3_constants.FLOATINGIP_KEY, None)
+        else:
+            ri.iptables_manager.defer_apply_off()
 
         # Enable or disable keepalived for ha routers
-        self._process_ha_router(ri)
+        if changed is None or changed:
+            self._process_ha_router(ri)
 
         # Update ex_gw_port and enable_snat on the router info cache
         ri.ex_gw_port = self._get_ex_gw_port(ri)
         ri.snat_ports = ri.router.get(l3_constants.SNAT_ROUTER_INTF_KEY, [])
         ri.enable_snat = ri.router.get('enable_snat')
+        ri.processed_router = router
 
     def _handle_router_snat_rules(self, ri, ex_gw_port,
                                   interface_name, action):
@@ -1560,6 +1614,58 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback,
         self.event_observers.notify(
             adv_svc.AdvancedService.after_router_updated, ri)
 
+    def _apply_router_delta(self, router):
+        """Return the router of a delta of the copy processed by the agent.
+
+        None is returned when the delta is not based on that copy.
+        """
+        if l3_constants.ROUTER_BASE_REVISION_KEY not in router:
+            return router
+        base_revision = router.pop(l3_constants.ROUTER_BASE_REVISION_KEY)
+        ri = self.router_info.get(router['id'])
+        base = ri and ri.processed_router
+        if not base or base.get('revision_number') != base_revision:
+            return None
+        if router['revision_number'] == base_revision:
+            return copy.deepcopy(base)
+        for key in router.pop(l3_constants.ROUTER_UNCHANGED_KEY):
+            router[key] = copy.deepcopy(base[key])
+        return router
+
+    def _fetch_routers(self, router_ids=None):
+        """Fetch the routers, as deltas of the ones already processed.
+
+        All the routers of the agent are fetched when router_ids is None.
+        The routers whose delta does not apply to the copy processed by the
+        agent, which changed in the meantime, are fetched entirely.
+        """
+        known_routers = {}
+        if router_ids is None:
+            known_router_ids = list(self.router_info)
+        else:
+            known_router_ids = router_ids
+        for router_id in known_router_ids:
+            ri = self.router_info.get(router_id)
+            router = ri and ri.processed_router
+            if router and router.get('revision_number') is not None:
+                known_routers[router_id] = {
+                    'revision_number': router['revision_number'],
+                    'digests': common_utils.get_router_digests(router)}
+        routers = []
+        gap_router_ids = []
+        for delta in self.plugin_rpc.get_routers(
+                self.context, router_ids, known_routers=known_routers):
+            router = self._apply_router_delta(delta)
+            if router is None:
+                gap_router_ids.append(delta['id'])
+            else:
+                routers.append(router)
+        if gap_router_ids:
+            LOG.debug("Fetching entirely routers %s", gap_router_ids)
+            routers.extend(self.plugin_rpc.get_routers(self.context,
+                                                       gap_router_ids))
+        return routers
+
     def _process_router_update(self):
         for rp, update in self._queue.each_update_to_next_router():
             LOG.debug("Starting router update for %s", update.id)
@@ -1567,8 +1673,7 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback,
             if update.action != queue.DELETE_ROUTER and not router:
                 try:
                     update.timestamp = timeutils.utcnow()
-                    routers = self.plugin_rpc.get_routers(self.context,
-                                                          [update.id])
+                    routers = self._fetch_routers([update.id])
                 except Exception:
                     msg = _LE("Failed to fetch router information for '%s'")
                     LOG.exception(msg, update.id)
@@ -1596,7 +1701,7 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback,
 
     def _process_routers_loop(self):
         LOG.debug("Starting _process_routers_loop")
-        pool = eventlet.GreenPool(size=8)
+        pool = eventlet.GreenPool(size=self.conf.router_processing_workers)
         while True:
             pool.spawn_n(self._process_router_update)
 
@@ -1621,18 +1726,22 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback,
         prev_router_ids = set(self.router_info)
         timestamp = timeutils.utcnow()
 
+        # Only the routers which changed since they were last processed are
+        # returned entirely by the server and updated
         try:
             if self.conf.use_namespaces:
-                routers = self.plugin_rpc.get_routers(context)
+                routers = self._fetch_routers()
             else:
-                routers = self.plugin_rpc.get_routers(context,
-                                                      [self.conf.router_id])
+                routers = self._fetch_routers([self.conf.router_id])
 
         except messaging.MessagingException:
             LOG.exception(_LE("Failed synchronizing routers due to RPC error"))
         else:
             LOG.debug('Processing :%r', routers)
             for r in routers:
+                ri = self.router_info.get(r['id'])
+                if ri and ri.processed_router == r:
+                    continue
                 update = queue.RouterUpdate(r['id'],
                                             queue.PRIORITY_SYNC_ROUTERS_TASK,
                                             router=r,
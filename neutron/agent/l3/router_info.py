@@ -38,6 +38,8 @@ class RouterInfo(ha.RouterMixin):
             namespace=self.ns_name)
         self.snat_iptables_manager = None
         self.routes = []
+        # Copy of the router dict last processed without error
+        self.processed_router = None
         # DVR Data
         # Linklocal subnet for router and floating IP namespace link
         self.rtr_fip_subnet = None
@@ -64,6 +66,18 @@ class RouterInfo(ha.RouterMixin):
             # Gateway port was removed, remove rules
             self._snat_action = 'remove_rules'
 
+    def changed_keys(self, router):
+        """Return the keys of the router dict changed since it was processed.
+
+        None is returned when the router was never processed without error,
+        all of it must be processed.
+        """
+        if self.processed_router is None:
+            return None
+        keys = set(self.processed_router) | set(router)
+        return set(key for key in keys
+                   if self.processed_router.get(key) != router.get(key))
+
     def perform_snat_action(self, snat_callback, *args):
         # Process SNAT rules for attached subnets
         if self._snat_action:
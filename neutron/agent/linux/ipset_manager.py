@@ -11,10 +11,15 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+import contextlib
+
+from oslo.utils import excutils
+
 from neutron.agent.linux import utils as linux_utils
 from neutron.common import utils
 
-IPSET_ADD_BULK_THRESHOLD = 5
+IPSET_TYPE_IP = 'hash:ip'
+IPSET_TYPE_NET = 'hash:net'
 SWAP_SUFFIX = '-new'
 IPSET_NAME_MAX_LENGTH = 31 - len(SWAP_SUFFIX)
 
@@ -22,15 +27,22 @@ IPSET_NAME_MAX_LENGTH = 31 - len(SWAP_SUFFIX)
 class IpsetManager(object):
     """Smart wrapper for ipset.
 
-       Keeps track of ip addresses per set, using bulk
-       or single ip add/remove for smaller changes.
+       Keeps track of ip addresses per set, adding/removing
+       the changed members or swapping a new set in for bigger
+       changes. The commands are sent in a single ipset restore,
+       which can be deferred to coalesce the updates of several sets.
     """
 
     def __init__(self, execute=None, root_helper=None, namespace=None):
         self.execute = execute or linux_utils.execute
         self.root_helper = root_helper
         self.namespace = namespace
+        # Members of the sets, as last sent to ipset
         self.ipset_sets = {}
+        self.ipset_deferred = False
+        self._pending_input = []
+        self._pending_sets = set()
+        self._pending_destroyed_sets = {}
 
     @staticmethod
     def get_name(id, ethertype):
@@ -45,33 +57,54 @@ class IpsetManager(object):
         set_name = self.get_name(id, ethertype)
         return set_name in self.ipset_sets
 
+    def defer_apply_on(self):
+        self.ipset_deferred = True
+
     @utils.synchronized('ipset', external=True)
-    def set_members(self, id, ethertype, member_ips):
+    def defer_apply_off(self):
+        self.ipset_deferred = False
+        self._apply_pending()
+
+    @contextlib.contextmanager
+    def _batch(self):
+        """Send the commands queued in the block in a single restore."""
+        deferred, self.ipset_deferred = self.ipset_deferred, True
+        try:
+            yield
+        finally:
+            self.ipset_deferred = deferred
+        if not deferred:
+            self._apply_pending()
+
+    @utils.synchronized('ipset', external=True)
+    def set_members(self, id, ethertype, member_ips, set_type=IPSET_TYPE_IP):
         """Create or update a specific set by name and ethertype.
         It will make sure that a set is created, updated to
         add / remove new members, or swapped atomically if
-        that's faster.
+        that's faster. Sets of IPSET_TYPE_NET type hold CIDRs
+        instead of addresses.
         """
         set_name = self.get_name(id, ethertype)
-        if not self.set_exists(id, ethertype):
-            # The initial creation is handled with create/refresh to
-            # avoid any downtime for existing sets (i.e. avoiding
-            # a flush/restore), as the restore operation of ipset is
-            # additive to the existing set.
-            self._create_set(set_name, ethertype)
-            self._refresh_set(set_name, member_ips, ethertype)
-            # TODO(majopela,shihanzhang,haleyb): Optimize this by
-            # gathering the system ipsets at start. So we can determine
-            # if a normal restore is enough for initial creation.
-            # That should speed up agent boot up time.
-        else:
+        with self._batch():
+            if not self.set_exists(id, ethertype):
+                # The initial creation is handled with create/refresh to
+                # avoid any downtime for existing sets (i.e. avoiding
+                # a flush/restore), as the restore operation of ipset is
+                # additive to the existing set.
+                self._create_set(set_name, ethertype, set_type)
+                self._refresh_set(set_name, member_ips, ethertype, set_type)
+                # TODO(majopela,shihanzhang,haleyb): Optimize this by
+                # gathering the system ipsets at start. So we can determine
+                # if a normal restore is enough for initial creation.
+                # That should speed up agent boot up time.
+                return
             add_ips = self._get_new_set_ips(set_name, member_ips)
             del_ips = self._get_deleted_set_ips(set_name, member_ips)
-            if (len(add_ips) + len(del_ips) < IPSET_ADD_BULK_THRESHOLD):
+            if len(add_ips) + len(del_ips) <= len(member_ips):
                 self._add_members_to_set(set_name, add_ips)
                 self._del_members_from_set(set_name, del_ips)
             else:
-                self._refresh_set(set_name, member_ips, ethertype)
+                self._refresh_set(set_name, member_ips, ethertype, set_type)
 
     @utils.synchronized('ipset', external=True)
     def destroy(self, id, ethertype, forced=False):
@@ -79,33 +112,58 @@ class IpsetManager(object):
         self._destroy(set_name, forced)
 
     def _add_member_to_set(self, set_name, member_ip):
-        cmd = ['ipset', 'add', '-exist', set_name, member_ip]
-        self._apply(cmd)
-        self.ipset_sets[set_name].append(member_ip)
+        self.ipset_sets[set_name].add(member_ip)
+        self._queue_input(set_name, ['add %s %s' % (set_name, member_ip)])
 
-    def _refresh_set(self, set_name, member_ips, ethertype):
+    def _refresh_set(self, set_name, member_ips, ethertype,
+                     set_type=IPSET_TYPE_IP):
         new_set_name = set_name + SWAP_SUFFIX
-        set_type = self._get_ipset_set_type(ethertype)
-        process_input = ["create %s hash:ip family %s" % (new_set_name,
-                                                          set_type)]
+        process_input = ["create %s %s family %s" % (
+            new_set_name, set_type, self._get_ipset_set_type(ethertype))]
         for ip in member_ips:
             process_input.append("add %s %s" % (new_set_name, ip))
+        process_input.append("swap %s %s" % (new_set_name, set_name))
+        process_input.append("destroy %s" % new_set_name)
 
-        self._restore_sets(process_input)
-        self._swap_sets(new_set_name, set_name)
-        self._destroy(new_set_name, True)
-        self.ipset_sets[set_name] = member_ips
+        self.ipset_sets[set_name] = set(member_ips)
+        self._queue_input(set_name, process_input)
 
     def _del_member_from_set(self, set_name, member_ip):
-        cmd = ['ipset', 'del', set_name, member_ip]
-        self._apply(cmd)
-        self.ipset_sets[set_name].remove(member_ip)
-
-    def _create_set(self, set_name, ethertype):
-        cmd = ['ipset', 'create', '-exist', set_name, 'hash:ip', 'family',
-               self._get_ipset_set_type(ethertype)]
-        self._apply(cmd)
-        self.ipset_sets[set_name] = []
+        self.ipset_sets[set_name].discard(member_ip)
+        self._queue_input(set_name, ['del %s %s' % (set_name, member_ip)])
+
+    def _create_set(self, set_name, ethertype, set_type=IPSET_TYPE_IP):
+        self._pending_destroyed_sets.pop(set_name, None)
+        self.ipset_sets[set_name] = set()
+        self._queue_input(set_name, ['create %s %s family %s' % (
+            set_name, set_type, self._get_ipset_set_type(ethertype))])
+
+    def _queue_input(self, set_name, process_input):
+        self._pending_sets.add(set_name)
+        self._pending_input.extend(process_input)
+        if not self.ipset_deferred:
+            self._apply_pending()
+
+    def _apply_pending(self):
+        process_input = self._pending_input
+        pending_sets = self._pending_sets
+        destroyed_sets = self._pending_destroyed_sets
+        self._pending_input = []
+        self._pending_sets = set()
+        self._pending_destroyed_sets = {}
+        if not process_input:
+            return
+        try:
+            self._restore_sets(process_input)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                # The commands are applied up to the failing one, so the
+                # members of the sets aren't known anymore: forget the sets
+                # to rebuild them on their next update, and keep the
+                # destroyed ones to be able to destroy them again.
+                for set_name in pending_sets:
+                    self.ipset_sets.pop(set_name, None)
+                self.ipset_sets.update(destroyed_sets)
 
     def _apply(self, cmd, input=None):
         input = '\n'.join(input) if input else None
@@ -118,14 +176,10 @@ class IpsetManager(object):
                      process_input=input)
 
     def _get_new_set_ips(self, set_name, expected_ips):
-        new_member_ips = (set(expected_ips) -
-                          set(self.ipset_sets.get(set_name, [])))
-        return list(new_member_ips)
+        return list(set(expected_ips) - self.ipset_sets.get(set_name, set()))
 
     def _get_deleted_set_ips(self, set_name, expected_ips):
-        deleted_member_ips = (set(self.ipset_sets.get(set_name, [])) -
-                              set(expected_ips))
-        return list(deleted_member_ips)
+        return list(self.ipset_sets.get(set_name, set()) - set(expected_ips))
 
     def _add_members_to_set(self, set_name, add_ips):
         for ip in add_ips:
@@ -144,12 +198,9 @@ class IpsetManager(object):
         cmd = ['ipset', 'restore', '-exist']
         self._apply(cmd, process_input)
 
-    def _swap_sets(self, src_set, dest_set):
-        cmd = ['ipset', 'swap', src_set, dest_set]
-        self._apply(cmd)
-
     def _destroy(self, set_name, forced=False):
         if set_name in self.ipset_sets or forced:
-            cmd = ['ipset', 'destroy', set_name]
-            self._apply(cmd)
-            self.ipset_sets.pop(set_name, None)
+            members = self.ipset_sets.pop(set_name, None)
+            if members is not None:
+                self._pending_destroyed_sets[set_name] = members
+            self._queue_input(set_name, ['destroy %s' % set_name])
@@ -28,6 +28,7 @@ PAIR_DROP = 'Drop traffic without an IP/MAC allow rule.'
 DHCP_CLIENT = 'Allow DHCP client traffic.'
 DHCP_SPOOF = 'Prevent DHCP Spoofing by VM.'
 UNMATCHED = 'Send unmatched traffic to the fallback chain.'
+SG_SHARED = 'Jump to the chain shared by ports of the same security groups.'
 STATELESS_DROP = 'Drop packets that are not associated with a state.'
 ALLOW_ASSOC = ('Direct packets associated with a known session to the RETURN '
                'chain.')
@@ -13,6 +13,9 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import hashlib
+
 import netaddr
 from oslo.config import cfg
 
@@ -22,7 +25,7 @@ from neutron.agent.linux import iptables_comments as ic
 from neutron.agent.linux import iptables_manager
 from neutron.common import constants
 from neutron.common import ipv6_utils
-from neutron.i18n import _LI
+from neutron.i18n import _LI, _LW
 from neutron.openstack.common import log as logging
 
 
@@ -34,6 +37,8 @@ SPOOF_FILTER = 'spoof-filter'
 CHAIN_NAME_PREFIX = {INGRESS_DIRECTION: 'i',
                      EGRESS_DIRECTION: 'o',
                      SPOOF_FILTER: 's'}
+SHARED_CHAIN_NAME_PREFIX = {INGRESS_DIRECTION: 'gi',
+                            EGRESS_DIRECTION: 'go'}
 DIRECTION_IP_PREFIX = {'ingress': 'source_ip_prefix',
                        'egress': 'dest_ip_prefix'}
 IPSET_DIRECTION = {INGRESS_DIRECTION: 'src',
@@ -67,6 +72,17 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         self.sg_members = {}
         self.pre_sg_members = None
         self.enable_ipset = cfg.CONF.SECURITYGROUP.enable_ipset
+        self.enable_shared_chains = cfg.CONF.SECURITYGROUP.enable_shared_chains
+        if self.enable_shared_chains and not self.enable_ipset:
+            LOG.warn(_LW('enable_shared_chains requires enable_ipset, '
+                         'security group chains will not be shared'))
+            self.enable_shared_chains = False
+        # Chains holding the rules of the security groups shared by ports
+        self.shared_chains = set()
+        # hash:net ipsets used by the shared chains, and the ones not used
+        # anymore which are destroyed once iptables stop referencing them
+        self.net_ipsets = {}
+        self.unused_net_ipsets = {}
 
     @property
     def ports(self):
@@ -133,6 +149,11 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
             self._remove_chain(port, INGRESS_DIRECTION)
             self._remove_chain(port, EGRESS_DIRECTION)
             self._remove_chain(port, SPOOF_FILTER)
+        for chain_name in self.shared_chains:
+            self._remove_chain_by_name_v4v6(chain_name)
+        self.shared_chains.clear()
+        self.unused_net_ipsets.update(self.net_ipsets)
+        self.net_ipsets.clear()
         self._remove_chain_by_name_v4v6(SG_CHAIN)
 
     def _setup_chain(self, port, DIRECTION):
@@ -331,7 +352,12 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         chain_name = self._port_chain_name(port, direction)
         # select rules for current direction
         security_group_rules = self._select_sgr_by_direction(port, direction)
-        security_group_rules += self._select_sg_rules_for_port(port, direction)
+        shared_chain = None
+        if self.enable_shared_chains and port.get('security_groups'):
+            shared_chain = self._setup_shared_chain(port, direction)
+        else:
+            security_group_rules += self._select_sg_rules_for_port(
+                port, direction)
         if self.enable_ipset:
             remote_sg_ids = self._get_remote_sg_ids(port, direction)
             # update the corresponding ipset members
@@ -351,13 +377,116 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
         if direction == INGRESS_DIRECTION:
             ipv6_iptables_rule += self._accept_inbound_icmpv6()
         ipv4_iptables_rule += self._convert_sgr_to_iptables_rules(
-            ipv4_sg_rules)
+            ipv4_sg_rules, shared_chain)
         ipv6_iptables_rule += self._convert_sgr_to_iptables_rules(
-            ipv6_sg_rules)
+            ipv6_sg_rules, shared_chain)
         self._add_rule_to_chain_v4v6(chain_name,
                                      ipv4_iptables_rule,
                                      ipv6_iptables_rule)
 
+    def _shared_chain_name(self, sg_ids, direction):
+        digest = hashlib.sha1(','.join(sg_ids)).hexdigest()
+        return iptables_manager.get_chain_name(
+            '%s%s' % (SHARED_CHAIN_NAME_PREFIX[direction], digest))
+
+    def _setup_shared_chain(self, port, direction):
+        """Setup the chain holding the rules of the port security groups.
+
+        The chain is shared by all the ports of the same security groups and
+        only built once.
+        """
+        sg_ids = sorted(set(port['security_groups']))
+        chain_name = self._shared_chain_name(sg_ids, direction)
+        if chain_name in self.shared_chains:
+            return chain_name
+        self.shared_chains.add(chain_name)
+        self._add_chain_by_name_v4v6(chain_name)
+
+        security_group_rules = [rule for sg_id in sg_ids
+                                for rule in self.sg_rules.get(sg_id, [])
+                                if rule['direction'] == direction]
+        ipv4_sg_rules, ipv6_sg_rules = self._split_sgr_by_ethertype(
+            security_group_rules)
+        self._add_rule_to_chain_v4v6(
+            chain_name,
+            self._convert_shared_sgr_to_iptables_rules(chain_name,
+                                                       ipv4_sg_rules),
+            self._convert_shared_sgr_to_iptables_rules(chain_name,
+                                                       ipv6_sg_rules))
+        return chain_name
+
+    def _convert_shared_sgr_to_iptables_rules(self, chain_name,
+                                              security_group_rules):
+        """Convert the rules of a shared chain to iptables rules.
+
+        The remote IP prefixes of the rules only differing by their prefix
+        are grouped in a hash:net ipset matched by a single rule.
+        """
+        iptables_rules = []
+        prefixes_by_rule = collections.OrderedDict()
+        for rule in security_group_rules:
+            remote_gid = rule.get('remote_group_id')
+            if remote_gid:
+                iptables_rules.extend(
+                    self._generate_ipset_chain(rule, remote_gid))
+                continue
+            ip_prefix_key = DIRECTION_IP_PREFIX[rule['direction']]
+            ip_prefix = rule.get(ip_prefix_key)
+            if not ip_prefix or not netaddr.IPNetwork(ip_prefix).prefixlen:
+                # hash:net ipsets can't hold /0 prefixes
+                iptables_rules.append(self._convert_sgr_to_iptables_rule(rule))
+                continue
+            net_rule = dict(rule)
+            del net_rule[ip_prefix_key]
+            prefixes = prefixes_by_rule.setdefault(
+                tuple(sorted(net_rule.items())), [])
+            ip_prefix = str(netaddr.IPNetwork(ip_prefix).cidr)
+            if ip_prefix not in prefixes:
+                prefixes.append(ip_prefix)
+
+        for net_rule, prefixes in prefixes_by_rule.iteritems():
+            net_rule = dict(net_rule)
+            if len(prefixes) == 1:
+                net_rule[DIRECTION_IP_PREFIX[net_rule['direction']]] = (
+                    prefixes[0])
+                iptables_rules.append(
+                    self._convert_sgr_to_iptables_rule(net_rule))
+                continue
+            iptables_rules.append(
+                self._generate_net_ipset_rule(chain_name, net_rule, prefixes))
+
+        iptables_rules += [comment_rule('-j $sg-fallback',
+                                        comment=ic.UNMATCHED)]
+        return iptables_rules
+
+    def _generate_net_ipset_rule(self, chain_name, sg_rule, prefixes):
+        ethertype = sg_rule['ethertype']
+        # The set is identified by the chain and the other parameters of the
+        # rule, so that it is kept as long as they don't change
+        set_id = 'N' + hashlib.sha1(
+            '%s %s' % (chain_name, sorted(sg_rule.items()))).hexdigest()
+        self.ipset.set_members(set_id, ethertype, prefixes,
+                               set_type=ipset_manager.IPSET_TYPE_NET)
+        self.net_ipsets[set_id] = ethertype
+        self.unused_net_ipsets.pop(set_id, None)
+
+        args = self._ip_prefix_arg('s', sg_rule.get('source_ip_prefix'))
+        args += self._ip_prefix_arg('d', sg_rule.get('dest_ip_prefix'))
+        args += self._protocol_arg(sg_rule.get('protocol'))
+        args += self._port_arg('sport',
+                               sg_rule.get('protocol'),
+                               sg_rule.get('source_port_range_min'),
+                               sg_rule.get('source_port_range_max'))
+        args += self._port_arg('dport',
+                               sg_rule.get('protocol'),
+                               sg_rule.get('port_range_min'),
+                               sg_rule.get('port_range_max'))
+        args += ['-m set', '--match-set',
+                 self.ipset.get_name(set_id, ethertype),
+                 IPSET_DIRECTION[sg_rule['direction']]]
+        args += ['-j RETURN']
+        return ' '.join(args)
+
     def _get_cur_sg_member_ips(self, sg_id, ethertype):
         return self.sg_members.get(sg_id, {}).get(ethertype, [])
 
@@ -390,7 +519,8 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
             iptables_rules += [' '.join(args)]
         return iptables_rules
 
-    def _convert_sgr_to_iptables_rules(self, security_group_rules):
+    def _convert_sgr_to_iptables_rules(self, security_group_rules,
+                                       shared_chain=None):
         iptables_rules = []
         self._drop_invalid_packets(iptables_rules)
         self._allow_established(iptables_rules)
@@ -401,31 +531,38 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
                     iptables_rules.extend(
                         self._generate_ipset_chain(rule, remote_gid))
                     continue
-            # These arguments MUST be in the format iptables-save will
-            # display them: source/dest, protocol, sport, dport, target
-            # Otherwise the iptables_manager code won't be able to find
-            # them to preserve their [packet:byte] counts.
-            args = self._ip_prefix_arg('s',
-                                       rule.get('source_ip_prefix'))
-            args += self._ip_prefix_arg('d',
-                                        rule.get('dest_ip_prefix'))
-            args += self._protocol_arg(rule.get('protocol'))
-            args += self._port_arg('sport',
-                                   rule.get('protocol'),
-                                   rule.get('source_port_range_min'),
-                                   rule.get('source_port_range_max'))
-            args += self._port_arg('dport',
-                                   rule.get('protocol'),
-                                   rule.get('port_range_min'),
-                                   rule.get('port_range_max'))
-            args += ['-j RETURN']
-            iptables_rules += [' '.join(args)]
+            iptables_rules.append(self._convert_sgr_to_iptables_rule(rule))
 
-        iptables_rules += [comment_rule('-j $sg-fallback',
-                                        comment=ic.UNMATCHED)]
+        if shared_chain:
+            iptables_rules += [comment_rule('-j $%s' % shared_chain,
+                                            comment=ic.SG_SHARED)]
+        else:
+            iptables_rules += [comment_rule('-j $sg-fallback',
+                                            comment=ic.UNMATCHED)]
 
         return iptables_rules
 
+    def _convert_sgr_to_iptables_rule(self, rule):
+        # These arguments MUST be in the format iptables-save will
+        # display them: source/dest, protocol, sport, dport, target
+        # Otherwise the iptables_manager code won't be able to find
+        # them to preserve their [packet:byte] counts.
+        args = self._ip_prefix_arg('s',
+                                   rule.get('source_ip_prefix'))
+        args += self._ip_prefix_arg('d',
+                                    rule.get('dest_ip_prefix'))
+        args += self._protocol_arg(rule.get('protocol'))
+        args += self._port_arg('sport',
+                               rule.get('protocol'),
+                               rule.get('source_port_range_min'),
+                               rule.get('source_port_range_max'))
+        args += self._port_arg('dport',
+                               rule.get('protocol'),
+                               rule.get('port_range_min'),
+                               rule.get('port_range_max'))
+        args += ['-j RETURN']
+        return ' '.join(args)
+
     def _drop_invalid_packets(self, iptables_rules):
         # Always drop invalid packets
         iptables_rules += [comment_rule('-m state --state ' 'INVALID -j DROP',
@@ -483,6 +620,7 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
     def filter_defer_apply_on(self):
         if not self._defer_apply:
             self.iptables.defer_apply_on()
+            self.ipset.defer_apply_on()
             self._pre_defer_filtered_ports = dict(self.filtered_ports)
             self.pre_sg_members = dict(self.sg_members)
             self.pre_sg_rules = dict(self.sg_rules)
@@ -531,11 +669,18 @@ class IptablesFirewallDriver(firewall.FirewallDriver):
             if remove_group_id in self.sg_rules:
                 self.sg_rules.pop(remove_group_id, None)
 
+        # Remove the ipsets of the shared chains not used anymore
+        for set_id, ethertype in self.unused_net_ipsets.items():
+            self.ipset.destroy(set_id, ethertype)
+        self.unused_net_ipsets.clear()
+
     def filter_defer_apply_off(self):
         if self._defer_apply:
             self._defer_apply = False
             self._remove_chains_apply(self._pre_defer_filtered_ports)
             self._setup_chains_apply(self.filtered_ports)
+            # the ipsets must be updated before iptables rules use them
+            self.ipset.defer_apply_off()
             self.iptables.defer_apply_off()
             self._remove_unused_security_group_info()
             self._pre_defer_filtered_ports = None
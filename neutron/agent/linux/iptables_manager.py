@@ -18,6 +18,7 @@
 
 """Implements iptables rules using linux utilities."""
 
+import collections
 import os
 import re
 import sys
@@ -55,6 +56,10 @@ MAX_CHAIN_LEN_NOWRAP = 28
 # a failure during iptables-restore
 IPTABLES_ERROR_LINES_OF_CONTEXT = 5
 
+# Comments are saved by iptables-save before the target of a rule while we
+# append them at the end, so they are matched apart from the rest of a rule.
+COMMENT_RE = re.compile(r' -m comment --comment ("[^"]*"|\S+)')
+
 
 def comment_rule(rule, comment):
     if not cfg.CONF.AGENT.comment_iptables_rules or not comment:
@@ -69,6 +74,97 @@ def get_chain_name(chain_name, wrap=True):
         return chain_name[:MAX_CHAIN_LEN_NOWRAP]
 
 
+def _strip_packets_bytes(line):
+    """Strip the [packet:byte] counts of a rule."""
+    if line.startswith('['):
+        # for example, "[0:0] -A neutron-billing..."
+        line = line.split('] ', 1)[1]
+    return line.strip()
+
+
+def _get_rule_key(rule):
+    """Return a key matching a rule whatever the position of its comment."""
+    match = COMMENT_RE.search(rule)
+    if not match:
+        return rule, None
+    return (rule[:match.start()] + rule[match.end():],
+            match.group(1).strip('"'))
+
+
+def _get_table_chains_and_rules(lines):
+    """Return the chain names and the rules per chain of a table dump."""
+    chains = []
+    rules = collections.OrderedDict()
+    for line in lines:
+        line = line.strip()
+        if line.startswith(':'):
+            chains.append(line[1:].split(' ', 1)[0])
+        elif line.startswith('[') or line.startswith('-A '):
+            rule = _strip_packets_bytes(line)
+            rules.setdefault(rule.split(' ', 2)[1], []).append(rule)
+    return chains, rules
+
+
+def _generate_chain_diff_iptables_commands(chain, old_rules, new_rules):
+    """Return the iptables-restore commands turning old_rules into new_rules.
+
+    Rules are matched through a hash of the new rules, so this is linear in
+    the size of the chain.  The old rules which are found in the same order
+    in the new rules are left untouched, keeping their [packet:byte] counts,
+    the other ones are deleted and the missing new rules are inserted at
+    their position.
+    """
+    if old_rules == new_rules:
+        return []
+    if not new_rules:
+        return ['-F %s' % chain]
+
+    positions = dict((rule, index) for index, rule in enumerate(new_rules))
+    kept = set()
+    deleted = []
+    last_position = -1
+    for index, rule in enumerate(old_rules):
+        position = positions.get(rule, -1)
+        if position > last_position:
+            kept.add(rule)
+            last_position = position
+        else:
+            deleted.append(index + 1)
+
+    # Delete from the bottom so that the rule numbers stay valid
+    commands = ['-D %s %d' % (chain, number) for number in reversed(deleted)]
+    for index, rule in enumerate(new_rules):
+        if rule not in kept:
+            rule_spec = rule.split(' ', 2)[2:]
+            commands.append(' '.join(['-I', chain, str(index + 1)] +
+                                     rule_spec))
+    return commands
+
+
+def _generate_table_diff_iptables_commands(old_lines, new_lines):
+    """Return the iptables-restore --noflush commands updating a table.
+
+    Only the chains whose rules differ between the two dumps are touched.
+    """
+    old_chains, old_rules = _get_table_chains_and_rules(old_lines)
+    new_chains, new_rules = _get_table_chains_and_rules(new_lines)
+    old_chain_set = set(old_chains)
+    new_chain_set = set(new_chains)
+    removed_chains = [chain for chain in old_chains
+                      if chain not in new_chain_set]
+
+    commands = [':%s - [0:0]' % chain for chain in new_chains
+                if chain not in old_chain_set]
+    for chain, rules in new_rules.iteritems():
+        commands += _generate_chain_diff_iptables_commands(
+            chain, old_rules.get(chain, []), rules)
+    for chain in old_rules:
+        if chain not in new_rules:
+            commands.append('-F %s' % chain)
+    commands += ['-X %s' % chain for chain in removed_chains]
+    return commands
+
+
 class IptablesRule(object):
     """An iptables rule.
 
@@ -114,6 +210,14 @@ class IptablesTable(object):
         self.unwrapped_chains = set()
         self.remove_chains = set()
         self.wrap_name = binary_name[:16]
+        # Names, as seen by iptables, of the chains modified since the last
+        # apply
+        self.dirty_chains = set()
+
+    def _mark_dirty(self, chain, wrap):
+        if wrap:
+            chain = '%s-%s' % (self.wrap_name, chain)
+        self.dirty_chains.add(chain)
 
     def add_chain(self, name, wrap=True):
         """Adds a named chain to the table.
@@ -128,10 +232,10 @@ class IptablesTable(object):
 
         """
         name = get_chain_name(name, wrap)
-        if wrap:
-            self.chains.add(name)
-        else:
-            self.unwrapped_chains.add(name)
+        chain_set = self._select_chain_set(wrap)
+        if name not in chain_set:
+            chain_set.add(name)
+            self._mark_dirty(name, wrap)
 
     def _select_chain_set(self, wrap):
         if wrap:
@@ -157,6 +261,7 @@ class IptablesTable(object):
             return
 
         chain_set.remove(name)
+        self._mark_dirty(name, wrap)
 
         if not wrap:
             # non-wrapped chains and rules need to be dealt with specially,
@@ -178,6 +283,9 @@ class IptablesTable(object):
             jump_snippet = '-j %s-%s' % (self.wrap_name, name)
 
         # finally, remove rules from list that have a matching jump chain
+        for r in self.rules:
+            if jump_snippet in r.rule:
+                self._mark_dirty(r.chain, r.wrap)
         self.rules = [r for r in self.rules
                       if jump_snippet not in r.rule]
 
@@ -203,6 +311,7 @@ class IptablesTable(object):
 
         self.rules.append(IptablesRule(chain, rule, wrap, top, self.wrap_name,
                                        tag, comment))
+        self._mark_dirty(chain, wrap)
 
     def _wrap_target_chain(self, s, wrap):
         if s.startswith('$'):
@@ -227,6 +336,7 @@ class IptablesTable(object):
             self.rules.remove(IptablesRule(chain, rule, wrap, top,
                                            self.wrap_name,
                                            comment=comment))
+            self._mark_dirty(chain, wrap)
             if not wrap:
                 self.remove_rules.append(IptablesRule(chain, rule, wrap, top,
                                                       self.wrap_name,
@@ -247,16 +357,23 @@ class IptablesTable(object):
 
     def empty_chain(self, chain, wrap=True):
         """Remove all rules from a chain."""
-        chained_rules = self._get_chain_rules(chain, wrap)
-        for rule in chained_rules:
-            self.rules.remove(rule)
+        chain = get_chain_name(chain, wrap)
+        rules = [rule for rule in self.rules
+                 if rule.chain != chain or rule.wrap != wrap]
+        if len(rules) != len(self.rules):
+            self.rules = rules
+            self._mark_dirty(chain, wrap)
 
     def clear_rules_by_tag(self, tag):
         if not tag:
             return
-        rules = [rule for rule in self.rules if rule.tag == tag]
-        for rule in rules:
-            self.rules.remove(rule)
+        rules = []
+        for rule in self.rules:
+            if rule.tag == tag:
+                self._mark_dirty(rule.chain, rule.wrap)
+            else:
+                rules.append(rule)
+        self.rules = rules
 
 
 class IptablesManager(object):
@@ -296,6 +413,9 @@ class IptablesManager(object):
         self.namespace = namespace
         self.iptables_apply_deferred = False
         self.wrap_name = binary_name[:16]
+        # Lines of the tables last applied, per command, when
+        # cache_iptables_state is enabled
+        self.applied_tables = {}
 
         self.ipv4 = {'filter': IptablesTable(binary_name=self.wrap_name)}
         self.ipv6 = {'filter': IptablesTable(binary_name=self.wrap_name)}
@@ -399,7 +519,10 @@ class IptablesManager(object):
 
         This will blow away any rules left over from previous runs of the
         same component of Nova, and replace them with our current set of
-        rules. This happens atomically, thanks to iptables-restore.
+        rules. Only the chains which differ from the current rules are
+        modified, atomically, thanks to iptables-restore --noflush.
+
+        Tables which were not modified since the last apply are skipped.
 
         """
         s = [('iptables', self.ipv4)]
@@ -407,46 +530,122 @@ class IptablesManager(object):
             s += [('ip6tables', self.ipv6)]
 
         for cmd, tables in s:
+            dirty_tables = [table_name for table_name, table
+                            in tables.iteritems() if table.dirty_chains]
+            if not dirty_tables:
+                continue
+            applied_tables = self.applied_tables.setdefault(cmd, {})
+            use_cache = (cfg.CONF.AGENT.cache_iptables_state and
+                         all(table_name in applied_tables
+                             for table_name in dirty_tables))
+            try:
+                self._apply_tables(cmd, tables, dirty_tables, use_cache)
+            except RuntimeError:
+                if not use_cache:
+                    raise
+                # The rules were probably modified by another process, read
+                # them again before retrying
+                LOG.warn(_LW("Failed to apply %s rules from their cached "
+                             "state, retrying with the current rules"), cmd)
+                applied_tables.clear()
+                self._apply_tables(cmd, tables, dirty_tables, False)
+
+            # flush lists, the changes are now applied
+            for table_name in dirty_tables:
+                table = tables[table_name]
+                table.remove_chains.clear()
+                del table.remove_rules[:]
+                table.dirty_chains.clear()
+        LOG.debug("IPTablesManager.apply completed with success")
+
+    def _get_current_tables(self, cmd, tables, table_names):
+        """Return the current lines of the given tables."""
+        if len(table_names) == len(tables):
+            # Everything is needed, dump all the tables at once
+            saves = [(None, table_names)]
+        else:
+            saves = [(table_name, [table_name]) for table_name in table_names]
+
+        current_tables = {}
+        for save_table, saved_table_names in saves:
             args = ['%s-save' % (cmd,), '-c']
+            if save_table:
+                args[1:1] = ['-t', save_table]
             if self.namespace:
                 args = ['ip', 'netns', 'exec', self.namespace] + args
             all_tables = self.execute(args, root_helper=self.root_helper)
             all_lines = all_tables.split('\n')
-            # Traverse tables in sorted order for predictable dump output
-            for table_name in sorted(tables):
-                table = tables[table_name]
+            for table_name in saved_table_names:
                 start, end = self._find_table(all_lines, table_name)
-                all_lines[start:end] = self._modify_rules(
-                    all_lines[start:end], table, table_name)
+                current_tables[table_name] = all_lines[start:end]
+        return current_tables
 
-            args = ['%s-restore' % (cmd,), '-c']
-            if self.namespace:
-                args = ['ip', 'netns', 'exec', self.namespace] + args
-            try:
-                self.execute(args, process_input='\n'.join(all_lines),
-                             root_helper=self.root_helper)
-            except RuntimeError as r_error:
-                with excutils.save_and_reraise_exception():
-                    try:
-                        line_no = int(re.search(
-                            'iptables-restore: line ([0-9]+?) failed',
-                            str(r_error)).group(1))
-                        context = IPTABLES_ERROR_LINES_OF_CONTEXT
-                        log_start = max(0, line_no - context)
-                        log_end = line_no + context
-                    except AttributeError:
-                        # line error wasn't found, print all lines instead
-                        log_start = 0
-                        log_end = len(all_lines)
-                    log_lines = ('%7d. %s' % (idx, l)
-                                 for idx, l in enumerate(
-                                     all_lines[log_start:log_end],
-                                     log_start + 1)
-                                 )
-                    LOG.error(_LE("IPTablesManager.apply failed to apply the "
-                                  "following set of iptables rules:\n%s"),
-                              '\n'.join(log_lines))
-        LOG.debug("IPTablesManager.apply completed with success")
+    def _apply_tables(self, cmd, tables, table_names, use_cache):
+        applied_tables = self.applied_tables[cmd]
+        if use_cache:
+            current_tables = applied_tables
+        else:
+            current_tables = self._get_current_tables(cmd, tables,
+                                                      table_names)
+
+        commands = []
+        new_tables = {}
+        # Traverse tables in reverse sorted order for predictable restore
+        # input
+        for table_name in sorted(table_names, reverse=True):
+            table = tables[table_name]
+            old_lines = current_tables[table_name]
+            new_lines = self._modify_rules(old_lines, table, table_name)
+            new_tables[table_name] = new_lines
+            if not old_lines:
+                # Nothing to diff against, restore the whole table
+                commands += new_lines
+                continue
+            table_commands = _generate_table_diff_iptables_commands(
+                old_lines, new_lines)
+            if table_commands:
+                commands += (['# Generated by iptables_manager',
+                              '*%s' % table_name] + table_commands +
+                             ['COMMIT', '# Completed by iptables_manager'])
+
+        if commands:
+            # iptables-restore input always ends with a new line
+            commands.append('')
+            self._restore(cmd, commands)
+        else:
+            LOG.debug("No change to apply to %s rules", cmd)
+
+        if cfg.CONF.AGENT.cache_iptables_state:
+            applied_tables.update(new_tables)
+
+    def _restore(self, cmd, commands):
+        args = ['%s-restore' % (cmd,), '-n', '-c']
+        if self.namespace:
+            args = ['ip', 'netns', 'exec', self.namespace] + args
+        try:
+            self.execute(args, process_input='\n'.join(commands),
+                         root_helper=self.root_helper)
+        except RuntimeError as r_error:
+            with excutils.save_and_reraise_exception():
+                try:
+                    line_no = int(re.search(
+                        'iptables-restore: line ([0-9]+?) failed',
+                        str(r_error)).group(1))
+                    context = IPTABLES_ERROR_LINES_OF_CONTEXT
+                    log_start = max(0, line_no - context)
+                    log_end = line_no + context
+                except AttributeError:
+                    # line error wasn't found, print all lines instead
+                    log_start = 0
+                    log_end = len(commands)
+                log_lines = ('%7d. %s' % (idx, l)
+                             for idx, l in enumerate(
+                                 commands[log_start:log_end],
+                                 log_start + 1)
+                             )
+                LOG.error(_LE("IPTablesManager.apply failed to apply the "
+                              "following set of iptables rules:\n%s"),
+                          '\n'.join(log_lines))
 
     def _find_table(self, lines, table_name):
         if len(lines) < 3:
@@ -461,29 +660,6 @@ class IptablesManager(object):
         end = lines[start:].index('COMMIT') + start + 2
         return (start, end)
 
-    def _find_rules_index(self, lines):
-        seen_chains = False
-        rules_index = 0
-        for rules_index, rule in enumerate(lines):
-            if not seen_chains:
-                if rule.startswith(':'):
-                    seen_chains = True
-            else:
-                if not rule.startswith(':'):
-                    break
-
-        if not seen_chains:
-            rules_index = 2
-
-        return rules_index
-
-    def _find_last_entry(self, filter_list, match_str):
-        # find a matching entry, starting from the bottom
-        for s in reversed(filter_list):
-            s = s.strip()
-            if match_str in s:
-                return s
-
     def _modify_rules(self, current_lines, table, table_name):
         # Chains are stored as sets to avoid duplicates.
         # Sort the output chains here to make their order predictable.
@@ -499,149 +675,64 @@ class IptablesManager(object):
                           '# Completed by iptables_manager']
             current_lines = fake_table
 
-        # Fill old_filter with any chains or rules we might have added,
-        # they could have a [packet:byte] count we want to preserve.
-        # Fill new_filter with any chains or rules without our name in them.
-        old_filter, new_filter = [], []
+        # Index the current chains by name and the current rules by rule
+        # text.  If a rule is duplicated, its *last* occurrence takes
+        # precedence since it could have a non-zero [packet:byte] count we
+        # want to preserve.
+        header, footer = [], []
+        current_chains = collections.OrderedDict()
+        current_rules = collections.OrderedDict()
         for line in current_lines:
-            (old_filter if self.wrap_name in line else
-             new_filter).append(line.strip())
-
-        rules_index = self._find_rules_index(new_filter)
-
-        all_chains = [':%s' % name for name in unwrapped_chains]
-        all_chains += [':%s-%s' % (self.wrap_name, name) for name in chains]
-
-        # Iterate through all the chains, trying to find an existing
-        # match.
-        our_chains = []
-        for chain in all_chains:
-            chain_str = str(chain).strip()
-
-            old = self._find_last_entry(old_filter, chain_str)
-            if not old:
-                dup = self._find_last_entry(new_filter, chain_str)
-            new_filter = [s for s in new_filter if chain_str not in s.strip()]
-
-            # if no old or duplicates, use original chain
-            if old or dup:
-                chain_str = str(old or dup)
+            line = line.strip()
+            if footer or line == 'COMMIT':
+                footer.append(line)
+            elif line.startswith(':'):
+                current_chains[line[1:].split(' ', 1)[0]] = line
+            elif line.startswith('[') or line.startswith('-A '):
+                key = _get_rule_key(_strip_packets_bytes(line))
+                current_rules.pop(key, None)
+                current_rules[key] = line
             else:
-                # add-on the [packet:bytes]
-                chain_str += ' - [0:0]'
-
-            our_chains += [chain_str]
+                header.append(line)
 
-        # Iterate through all the rules, trying to find an existing
-        # match.
-        our_rules = []
-        bot_rules = []
-        for rule in rules:
+        # Use the current declaration of our chains when they exist, or
+        # add-on the [packet:bytes]
+        our_chains = []
+        for name in unwrapped_chains + ['%s-%s' % (self.wrap_name, name)
+                                        for name in chains]:
+            our_chains.append(current_chains.pop(name, None) or
+                              ':%s - [0:0]' % name)
+
+        # rule.top == True means we want this rule to be at the top.
+        # When a rule was added more than once, its last occurrence is
+        # used.
+        ordered_rules = ([rule for rule in rules if rule.top] +
+                         [rule for rule in rules if not rule.top])
+        our_rules = collections.OrderedDict()
+        for rule in reversed(ordered_rules):
             rule_str = str(rule).strip()
-            # Further down, we weed out duplicates from the bottom of the
-            # list, so here we remove the dupes ahead of time.
-
-            old = self._find_last_entry(old_filter, rule_str)
-            if not old:
-                dup = self._find_last_entry(new_filter, rule_str)
-            new_filter = [s for s in new_filter if rule_str not in s.strip()]
-
-            # if no old or duplicates, use original rule
-            if old or dup:
-                rule_str = str(old or dup)
-                # backup one index so we write the array correctly
-                if not old:
-                    rules_index -= 1
-            else:
-                # add-on the [packet:bytes]
-                rule_str = '[0:0] ' + rule_str
-
-            if rule.top:
-                # rule.top == True means we want this rule to be at the top.
-                our_rules += [rule_str]
-            else:
-                bot_rules += [rule_str]
-
-        our_rules += bot_rules
-
-        new_filter[rules_index:rules_index] = our_rules
-        new_filter[rules_index:rules_index] = our_chains
-
-        def _strip_packets_bytes(line):
-            # strip any [packet:byte] counts at start or end of lines
-            if line.startswith(':'):
-                # it's a chain, for example, ":neutron-billing - [0:0]"
-                line = line.split(':')[1]
-                line = line.split(' - [', 1)[0]
-            elif line.startswith('['):
-                # it's a rule, for example, "[0:0] -A neutron-billing..."
-                line = line.split('] ', 1)[1]
-            line = line.strip()
-            return line
-
-        seen_chains = set()
-
-        def _weed_out_duplicate_chains(line):
-            # ignore [packet:byte] counts at end of lines
-            if line.startswith(':'):
-                line = _strip_packets_bytes(line)
-                if line in seen_chains:
-                    return False
-                else:
-                    seen_chains.add(line)
-
-            # Leave it alone
-            return True
-
-        seen_rules = set()
-
-        def _weed_out_duplicate_rules(line):
-            if line.startswith('['):
-                line = _strip_packets_bytes(line)
-                if line in seen_rules:
-                    return False
-                else:
-                    seen_rules.add(line)
-
-            # Leave it alone
-            return True
-
-        def _weed_out_removes(line):
-            # We need to find exact matches here
-            if line.startswith(':'):
-                line = _strip_packets_bytes(line)
-                for chain in remove_chains:
-                    if chain == line:
-                        remove_chains.remove(chain)
-                        return False
-            elif line.startswith('['):
-                line = _strip_packets_bytes(line)
-                for rule in remove_rules:
-                    rule_str = _strip_packets_bytes(str(rule))
-                    if rule_str == line:
-                        remove_rules.remove(rule)
-                        return False
-
-            # Leave it alone
-            return True
-
-        # We filter duplicates.  Go through the chains and rules, letting
-        # the *last* occurrence take precedence since it could have a
-        # non-zero [packet:byte] count we want to preserve.  We also filter
-        # out anything in the "remove" list.
-        new_filter.reverse()
-        new_filter = [line for line in new_filter
-                      if _weed_out_duplicate_chains(line) and
-                      _weed_out_duplicate_rules(line) and
-                      _weed_out_removes(line)]
-        new_filter.reverse()
-
-        # flush lists, just in case we didn't find something
-        remove_chains.clear()
-        for rule in remove_rules:
-            remove_rules.remove(rule)
-
-        return new_filter
+            key = _get_rule_key(rule_str)
+            if key not in our_rules:
+                our_rules[key] = (current_rules.pop(key, None) or
+                                  '[0:0] ' + rule_str)
+
+        # Keep the chains and rules of other components, unless they were
+        # removed.  What is left with our name in it is from a previous run.
+        remove_keys = set(_get_rule_key(str(rule).strip())
+                          for rule in remove_rules)
+        other_chains = [chain_line
+                        for chain_name, chain_line in
+                        current_chains.iteritems()
+                        if chain_name not in remove_chains and
+                        self.wrap_name not in chain_line]
+        other_rules = [rule_line
+                       for rule_key, rule_line in current_rules.iteritems()
+                       if rule_key not in remove_keys and
+                       self.wrap_name not in rule_line and
+                       rule_key[0].split(' ', 2)[1] not in remove_chains]
+
+        return (header + other_chains + our_chains +
+                list(reversed(our_rules.values())) + other_rules + footer)
 
     def _get_traffic_counters_cmd_tables(self, chain, wrap=True):
         name = get_chain_name(chain, wrap)
@@ -13,14 +13,19 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import contextlib
+import functools
 import itertools
 import operator
 
+from eventlet import corolocal
 from oslo.config import cfg
 from oslo.serialization import jsonutils
 from oslo.utils import excutils
 
 from neutron.agent.linux import ip_lib
+from neutron.agent.linux import ovsdb_client
 from neutron.agent.linux import utils
 from neutron.common import exceptions
 from neutron.i18n import _LE, _LI, _LW
@@ -37,11 +42,37 @@ OPTS = [
     cfg.IntOpt('ovs_vsctl_timeout',
                default=DEFAULT_OVS_VSCTL_TIMEOUT,
                help=_('Timeout in seconds for ovs-vsctl commands')),
+    cfg.StrOpt('ovsdb_interface',
+               choices=['vsctl', 'native'],
+               default='vsctl',
+               help=_('The interface used to query and update OVSDB. '
+                      '"native" keeps a connection to ovsdb-server open '
+                      'and answers queries from a local replica of the '
+                      'database instead of running ovs-vsctl.')),
+    cfg.StrOpt('ovsdb_connection',
+               default='tcp:127.0.0.1:6640',
+               help=_('The connection string for the native OVSDB '
+                      'interface, either unix:<path> or tcp:<ip>:<port>. '
+                      'A tcp connection requires ovsdb-server to listen on '
+                      'it, e.g. "ovs-vsctl set-manager '
+                      'ptcp:6640:127.0.0.1".')),
+    cfg.BoolOpt('ovs_ofctl_bundle',
+                default=False,
+                help=_('Apply deferred flow changes of a bridge atomically '
+                       'with a single "ovs-ofctl --bundle" call. Requires '
+                       'Open vSwitch 2.4 or later and OpenFlow 1.4 to be '
+                       'enabled on the bridges.')),
 ]
 cfg.CONF.register_opts(OPTS)
 
 LOG = logging.getLogger(__name__)
 
+# Flow changes deferred by deferred_flows(), per greenthread
+_deferred = corolocal.local()
+
+# Flow mod commands used in 'ovs-ofctl --bundle add-flows' input
+BUNDLE_FLOW_COMMANDS = {'add': 'add', 'mod': 'modify', 'del': 'delete'}
+
 
 class VifPort:
     def __init__(self, port_name, ofport, vif_id, vif_mac, switch):
@@ -64,6 +95,14 @@ class BaseOVS(object):
         self.root_helper = root_helper
         self.vsctl_timeout = cfg.CONF.ovs_vsctl_timeout
 
+    @property
+    def ovsdb(self):
+        """The native OVSDB client, or None to use ovs-vsctl."""
+        if cfg.CONF.ovsdb_interface != 'native':
+            return None
+        return ovsdb_client.get_client(cfg.CONF.ovsdb_connection,
+                                       self.vsctl_timeout)
+
     def run_vsctl(self, args, check_error=False):
         full_args = ["ovs-vsctl", "--timeout=%d" % self.vsctl_timeout] + args
         try:
@@ -84,6 +123,9 @@ class BaseOVS(object):
         self.run_vsctl(["--", "--if-exists", "del-br", bridge_name])
 
     def bridge_exists(self, bridge_name):
+        ovsdb = self.ovsdb
+        if ovsdb:
+            return ovsdb.get_row('Bridge', bridge_name) is not None
         try:
             self.run_vsctl(['br-exists', bridge_name], check_error=True)
         except RuntimeError as e:
@@ -94,6 +136,9 @@ class BaseOVS(object):
         return True
 
     def get_bridge_name_for_port_name(self, port_name):
+        ovsdb = self.ovsdb
+        if ovsdb:
+            return ovsdb.get_bridge_for_port(port_name)
         try:
             return self.run_vsctl(['port-to-br', port_name], check_error=True)
         except RuntimeError as e:
@@ -109,6 +154,8 @@ class OVSBridge(BaseOVS):
     def __init__(self, br_name, root_helper):
         super(OVSBridge, self).__init__(root_helper)
         self.br_name = br_name
+        # Cookie set on added or modified flows which do not specify one
+        self.default_cookie = None
 
     def set_controller(self, controller_names):
         vsctl_command = ['--', 'set-controller', self.br_name]
@@ -163,11 +210,29 @@ class OVSBridge(BaseOVS):
         self.run_vsctl(["--", "--if-exists", "del-port", self.br_name,
                         port_name])
 
+    def _native_set_column(self, table_name, record, column, value):
+        ovsdb = self.ovsdb
+        if not ovsdb or (table_name, column) not in (
+                ovsdb_client.WRITABLE_COLUMNS):
+            return False
+        try:
+            ovsdb.set_column(table_name, record, column, value)
+        except Exception as e:
+            LOG.error(_LE("Unable to set %(column)s of %(table)s %(record)s "
+                          "in OVSDB. Exception: %(exception)s"),
+                      {'column': column, 'table': table_name,
+                       'record': record, 'exception': e})
+        return True
+
     def set_db_attribute(self, table_name, record, column, value):
+        if self._native_set_column(table_name, record, column, value):
+            return
         args = ["set", table_name, record, "%s=%s" % (column, value)]
         self.run_vsctl(args)
 
     def clear_db_attribute(self, table_name, record, column):
+        if self._native_set_column(table_name, record, column, None):
+            return
         args = ["clear", table_name, record, column]
         self.run_vsctl(args)
 
@@ -186,6 +251,10 @@ class OVSBridge(BaseOVS):
         return len(flow_list) - 1
 
     def remove_all_flows(self):
+        deferred_br = self._get_deferred_bridge()
+        if deferred_br:
+            # Pending changes would be removed anyway
+            deferred_br.action_flow_tuples = []
         self.run_ofctl("del-flows", [])
 
     def get_port_ofport(self, port_name):
@@ -202,18 +271,59 @@ class OVSBridge(BaseOVS):
         return self.db_get_val('Bridge',
                                self.br_name, 'datapath_id').strip('"')
 
+    def _set_default_cookie(self, action, flow_dict):
+        if (self.default_cookie is not None and action != 'del' and
+                'cookie' not in flow_dict):
+            flow_dict['cookie'] = self.default_cookie
+
     def do_action_flows(self, action, kwargs_list):
+        for kw in kwargs_list:
+            self._set_default_cookie(action, kw)
         flow_strs = [_build_flow_expr_str(kw, action) for kw in kwargs_list]
         self.run_ofctl('%s-flows' % action, ['-'], '\n'.join(flow_strs))
 
+    def _get_deferred_bridge(self):
+        deferred_brs = getattr(_deferred, 'bridges', None)
+        if deferred_brs is None:
+            return
+        deferred_br = deferred_brs.get(self.br_name)
+        if deferred_br is None:
+            deferred_br = DeferredOVSBridge(
+                self, full_ordered=True,
+                use_bundle=cfg.CONF.ovs_ofctl_bundle, apply_on_exit=False)
+            deferred_brs[self.br_name] = deferred_br
+        return deferred_br
+
     def add_flow(self, **kwargs):
-        self.do_action_flows('add', [kwargs])
+        deferred_br = self._get_deferred_bridge()
+        if deferred_br:
+            deferred_br.add_flow(**kwargs)
+        else:
+            self.do_action_flows('add', [kwargs])
 
     def mod_flow(self, **kwargs):
-        self.do_action_flows('mod', [kwargs])
+        deferred_br = self._get_deferred_bridge()
+        if deferred_br:
+            deferred_br.mod_flow(**kwargs)
+        else:
+            self.do_action_flows('mod', [kwargs])
 
     def delete_flows(self, **kwargs):
-        self.do_action_flows('del', [kwargs])
+        deferred_br = self._get_deferred_bridge()
+        if deferred_br:
+            deferred_br.delete_flows(**kwargs)
+        else:
+            self.do_action_flows('del', [kwargs])
+
+    def do_bundled_flows(self, action_flow_tuples):
+        """Apply flow changes of any kind in one atomic transaction."""
+        for action, kw in action_flow_tuples:
+            self._set_default_cookie(action, kw)
+        flow_strs = ['%s %s' % (BUNDLE_FLOW_COMMANDS[action],
+                                _build_flow_expr_str(kw, action))
+                     for action, kw in action_flow_tuples]
+        self.run_ofctl('add-flows', ['--bundle', '-O', 'OpenFlow14', '-'],
+                       '\n'.join(flow_strs))
 
     def dump_flows_for_table(self, table):
         retval = None
@@ -224,7 +334,31 @@ class OVSBridge(BaseOVS):
                                if 'NXST' not in item)
         return retval
 
+    def get_flow_cookies(self):
+        """Return the set of cookies used by the flows of the bridge."""
+        cookies = set()
+        flows = self.run_ofctl("dump-flows", [])
+        for flow in (flows or '').splitlines():
+            for field in flow.split(','):
+                field = field.strip()
+                if field.startswith('cookie='):
+                    cookies.add(int(field[len('cookie='):], 16))
+                    break
+        return cookies
+
+    def delete_stale_flows(self):
+        """Delete the flows which do not carry the default cookie."""
+        if self.default_cookie is None:
+            return
+        for cookie in self.get_flow_cookies() - set([self.default_cookie]):
+            self.delete_flows(cookie='%#x/-1' % cookie)
+
     def deferred(self, **kwargs):
+        deferred_br = self._get_deferred_bridge()
+        if deferred_br:
+            # Within deferred_flows(), the flow changes join the ones
+            # queued for the bridge, in order
+            return deferred_br
         return DeferredOVSBridge(self, **kwargs)
 
     def add_tunnel_port(self, port_name, remote_ip, local_ip,
@@ -255,12 +389,33 @@ class OVSBridge(BaseOVS):
         return ofport
 
     def add_patch_port(self, local_name, remote_name):
-        self.run_vsctl(["add-port", self.br_name, local_name,
+        self.run_vsctl(["--", "--may-exist", "add-port", self.br_name,
+                        local_name,
                         "--", "set", "Interface", local_name,
                         "type=patch", "options:peer=%s" % remote_name])
         return self.get_port_ofport(local_name)
 
+    def _native_get_value(self, table, record, column):
+        """Return (found, value) for a column from the OVSDB replica."""
+        ovsdb = self.ovsdb
+        if not ovsdb or not ovsdb.has_column(table, column):
+            return False, None
+        row = ovsdb.get_row(table, record)
+        # The replica may not have the update of a row just added or
+        # configured by ovs-vsctl yet, e.g. the ofport of a new port:
+        # ovs-vsctl is asked instead
+        if row is None:
+            LOG.debug("%(table)s %(record)s not found in the OVSDB replica",
+                      {'table': table, 'record': record})
+            return False, None
+        if column == 'ofport' and row[column] == []:
+            return False, None
+        return True, row[column]
+
     def db_get_map(self, table, record, column, check_error=False):
+        found, value = self._native_get_value(table, record, column)
+        if found:
+            return value or {}
         output = self.run_vsctl(["get", table, record, column], check_error)
         if output:
             output_str = output.rstrip("\n\r")
@@ -268,6 +423,11 @@ class OVSBridge(BaseOVS):
         return {}
 
     def db_get_val(self, table, record, column, check_error=False):
+        found, value = self._native_get_value(table, record, column)
+        if found:
+            if value is not None:
+                return ovsdb_client.to_vsctl_str(value)
+            return
         output = self.run_vsctl(["get", table, record, column], check_error)
         if output:
             return output.rstrip("\n\r")
@@ -283,6 +443,10 @@ class OVSBridge(BaseOVS):
         return ret
 
     def get_port_name_list(self):
+        ovsdb = self.ovsdb
+        if ovsdb:
+            return sorted(port['name']
+                          for port in ovsdb.get_bridge_ports(self.br_name))
         res = self.run_vsctl(["list-ports", self.br_name], check_error=True)
         if res:
             return res.strip().split("\n")
@@ -302,15 +466,27 @@ class OVSBridge(BaseOVS):
                               "Exception: %(exception)s"),
                           {'cmd': args, 'exception': e})
 
+    def _get_native_interfaces(self, ovsdb):
+        return [iface for port in ovsdb.get_bridge_ports(self.br_name)
+                for iface in ovsdb.get_port_interfaces(port)]
+
     # returns a VIF object for each VIF port
     def get_vif_ports(self):
+        ovsdb = self.ovsdb
+        if ovsdb:
+            interfaces = ((iface['name'], iface['external_ids'],
+                           ovsdb_client.to_vsctl_str(iface['ofport']))
+                          for iface in self._get_native_interfaces(ovsdb))
+        else:
+            interfaces = (
+                (name,
+                 self.db_get_map("Interface", name, "external_ids",
+                                 check_error=True),
+                 self.db_get_val("Interface", name, "ofport",
+                                 check_error=True))
+                for name in self.get_port_name_list())
         edge_ports = []
-        port_names = self.get_port_name_list()
-        for name in port_names:
-            external_ids = self.db_get_map("Interface", name, "external_ids",
-                                           check_error=True)
-            ofport = self.db_get_val("Interface", name, "ofport",
-                                     check_error=True)
+        for name, external_ids, ofport in interfaces:
             if "iface-id" in external_ids and "attached-mac" in external_ids:
                 p = VifPort(name, ofport, external_ids["iface-id"],
                             external_ids["attached-mac"], self)
@@ -326,19 +502,27 @@ class OVSBridge(BaseOVS):
 
         return edge_ports
 
-    def get_vif_port_set(self):
+    def _get_vsctl_interface_rows(self):
         port_names = self.get_port_name_list()
-        edge_ports = set()
         args = ['--format=json', '--', '--columns=name,external_ids,ofport',
                 'list', 'Interface']
         result = self.run_vsctl(args, check_error=True)
         if not result:
-            return edge_ports
-        for row in jsonutils.loads(result)['data']:
-            name = row[0]
-            if name not in port_names:
-                continue
-            external_ids = dict(row[1][1])
+            return []
+        return [(row[0], dict(row[1][1]), row[2])
+                for row in jsonutils.loads(result)['data']
+                if row[0] in port_names]
+
+    def get_vif_port_set(self):
+        edge_ports = set()
+        ovsdb = self.ovsdb
+        if ovsdb:
+            rows = [(iface['name'], iface['external_ids'], iface['ofport'])
+                    for iface in self._get_native_interfaces(ovsdb)]
+        else:
+            rows = self._get_vsctl_interface_rows()
+        for row in rows:
+            external_ids = row[1]
             # Do not consider VIFs which aren't yet ready
             # This can happen when ofport values are either [] or ["set", []]
             # We will therefore consider only integer values for ofport
@@ -379,6 +563,10 @@ class OVSBridge(BaseOVS):
         in the "Interface" table queried by the get_vif_port_set() method.
 
         """
+        ovsdb = self.ovsdb
+        if ovsdb:
+            return dict((port['name'], port['tag'])
+                        for port in ovsdb.get_bridge_ports(self.br_name))
         port_names = self.get_port_name_list()
         args = ['--format=json', '--', '--columns=name,tag', 'list', 'Port']
         result = self.run_vsctl(args, check_error=True)
@@ -470,23 +658,31 @@ class DeferredOVSBridge(object):
     bulk calls. It wraps also ALLOWED_PASSTHROUGHS calls to avoid mixing
     OVSBridge and DeferredOVSBridge uses.
     This class can be used as a context, in such case apply_flows is called on
-    __exit__ except if an exception is raised.
+    __exit__ except if an exception is raised or apply_on_exit is False.
     This class is not thread-safe, that's why for every use a new instance
     must be implemented.
     '''
     ALLOWED_PASSTHROUGHS = 'add_port', 'add_tunnel_port', 'delete_port'
 
     def __init__(self, br, full_ordered=False,
-                 order=('add', 'mod', 'del')):
+                 order=('add', 'mod', 'del'), use_bundle=False,
+                 apply_on_exit=True):
         '''Constructor.
 
         :param br: wrapped bridge
         :param full_ordered: Optional, disable flow reordering (slower)
         :param order: Optional, define in which order flow are applied
+        :param use_bundle: Optional, apply all flows in a single atomic
+                           'ovs-ofctl --bundle' call (implies full_ordered)
+        :param apply_on_exit: Optional, apply the flows when used as a
+                              context exits (the flows queued by
+                              deferred_flows() are applied by it)
         '''
 
         self.br = br
-        self.full_ordered = full_ordered
+        self.apply_on_exit = apply_on_exit
+        self.use_bundle = use_bundle
+        self.full_ordered = full_ordered or use_bundle
         self.order = order
         if not self.full_ordered:
             self.weights = dict((y, x) for x, y in enumerate(self.order))
@@ -512,6 +708,10 @@ class DeferredOVSBridge(object):
         if not action_flow_tuples:
             return
 
+        if self.use_bundle:
+            self.br.do_bundled_flows(action_flow_tuples)
+            return
+
         if not self.full_ordered:
             action_flow_tuples.sort(key=lambda af: self.weights[af[0]])
 
@@ -526,6 +726,8 @@ class DeferredOVSBridge(object):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
+        if not self.apply_on_exit:
+            return
         if exc_type is None:
             self.apply_flows()
         else:
@@ -533,6 +735,51 @@ class DeferredOVSBridge(object):
                           self.br.br_name)
 
 
+@contextlib.contextmanager
+def deferred_flows():
+    '''Defer the flow changes made on any OVSBridge until the block exits.
+
+    Within the block, add_flow, mod_flow and delete_flows calls made by the
+    current greenthread are queued per bridge, and then applied in order
+    with one ovs-ofctl call per bridge and kind of consecutive changes (or a
+    single call per bridge when ovs_ofctl_bundle is enabled).  Flows are
+    also applied if the block raises, as they would have been without
+    deferral.  Nested blocks are merged into the outermost one, and so are
+    the OVSBridge.deferred() contexts of the block.  Flows dumped within
+    the block do not reflect the deferred changes.
+    '''
+    if getattr(_deferred, 'bridges', None) is not None:
+        yield
+        return
+    _deferred.bridges = collections.OrderedDict()
+    try:
+        yield
+    finally:
+        deferred_brs = _deferred.bridges.values()
+        _deferred.bridges = None
+        for deferred_br in deferred_brs:
+            deferred_br.apply_flows()
+
+
+def apply_deferred_flows():
+    '''Apply the flow changes deferred so far by deferred_flows().
+
+    The block goes on deferring the flow changes made after this call.
+    '''
+    deferred_brs = getattr(_deferred, 'bridges', None) or {}
+    for deferred_br in deferred_brs.values():
+        deferred_br.apply_flows()
+
+
+def with_deferred_flows(f):
+    """Decorator running the whole function within deferred_flows()."""
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        with deferred_flows():
+            return f(*args, **kwargs)
+    return wrapper
+
+
 def get_bridge_for_iface(root_helper, iface):
     args = ["ovs-vsctl", "--timeout=%d" % cfg.CONF.ovs_vsctl_timeout,
             "iface-to-br", iface]
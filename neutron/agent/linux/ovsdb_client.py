@@ -0,0 +1,325 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Minimal OVSDB JSON-RPC client (RFC 7047).
+
+The client keeps a single connection to ovsdb-server open, monitors the
+Bridge, Port and Interface tables and keeps a local replica of the
+monitored columns up to date from the 'update' notifications sent by the
+server.  Read requests from ovs_lib are answered from this replica and
+writes are sent as 'transact' requests, so no ovs-vsctl process has to be
+spawned for them.
+"""
+
+import itertools
+import json
+import socket
+
+import eventlet
+from eventlet import event
+from eventlet import semaphore
+from oslo.serialization import jsonutils
+
+from neutron.i18n import _LE, _LW
+from neutron.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+OVSDB_DATABASE = 'Open_vSwitch'
+
+# Columns replicated locally, per table.
+MONITORED_COLUMNS = {
+    'Bridge': ['name', 'ports', 'datapath_id'],
+    'Port': ['name', 'interfaces', 'tag'],
+    'Interface': ['name', 'external_ids', 'ofport', 'type', 'options'],
+}
+
+# Columns which are sets of any size; they are always stored as lists.
+SET_COLUMNS = frozenset(['ports', 'interfaces'])
+
+# Columns which can be written with a transaction, with the python type of
+# their value.  Other writes go through ovs-vsctl.
+WRITABLE_COLUMNS = {
+    ('Port', 'tag'): int,
+}
+
+_RECV_SIZE = 65536
+
+
+class OvsdbClientError(Exception):
+    pass
+
+
+def parse_connection(connection):
+    """Return (family, address) for an OVSDB connection string."""
+    proto, _sep, target = connection.partition(':')
+    if proto == 'unix' and target:
+        return socket.AF_UNIX, target
+    if proto == 'tcp':
+        host, _sep, port = target.rpartition(':')
+        if host and port.isdigit():
+            return socket.AF_INET, (host, int(port))
+    raise OvsdbClientError(_('Invalid OVSDB connection: %s') % connection)
+
+
+def from_datum(datum, is_set=False):
+    """Convert an OVSDB JSON datum to a python value.
+
+    Maps become dicts and sets become lists, except for optional values
+    (sets of at most one element) which are returned as the element itself
+    or as an empty list when unset, matching ovs-vsctl output.
+    """
+    if isinstance(datum, list):
+        kind, value = datum
+        if kind == 'map':
+            return dict((from_datum(k), from_datum(v)) for k, v in value)
+        if kind == 'set':
+            items = [from_datum(v) for v in value]
+            if is_set or len(items) != 1:
+                return items
+            return items[0]
+        # 'uuid' and 'named-uuid' atoms
+        return [value] if is_set else value
+    return [datum] if is_set else datum
+
+
+def to_vsctl_str(value):
+    """Format a replicated value the way 'ovs-vsctl get' prints it."""
+    if isinstance(value, list):
+        return '[%s]' % ', '.join(to_vsctl_str(v) for v in value)
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join('%s="%s"' % (k, v)
+                                  for k, v in sorted(value.items()))
+    if isinstance(value, bool):
+        return str(value).lower()
+    return str(value)
+
+
+class OvsdbClient(object):
+    """Persistent connection to ovsdb-server with a replicated cache."""
+
+    def __init__(self, connection, timeout):
+        self.connection = connection
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._ids = itertools.count()
+        self._pending = {}
+        self._send_lock = semaphore.Semaphore()
+        self._connect_lock = semaphore.Semaphore()
+        self._reset_tables()
+
+    def _reset_tables(self):
+        self.tables = dict((table, {}) for table in MONITORED_COLUMNS)
+        self._names = dict((table, {}) for table in MONITORED_COLUMNS)
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def start(self):
+        """Connect and wait for the initial content of the replica."""
+        with self._connect_lock:
+            if self.connected:
+                return
+            family, address = parse_connection(self.connection)
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(address)
+            except socket.error:
+                sock.close()
+                raise
+            sock.settimeout(None)
+            self._sock = sock
+            self._reset_tables()
+            self._reader = eventlet.spawn(self._read_loop, sock)
+            requests = dict(
+                (table, {'columns': columns})
+                for table, columns in MONITORED_COLUMNS.iteritems())
+            try:
+                initial = self._request(
+                    'monitor', [OVSDB_DATABASE, None, requests])
+            except Exception:
+                self.stop()
+                raise
+            self._apply_updates(initial)
+
+    def stop(self):
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.close()
+            except socket.error:
+                pass
+        reader, self._reader = self._reader, None
+        if reader is not None and reader is not eventlet.getcurrent():
+            reader.kill()
+        pending, self._pending = self._pending, {}
+        for waiter in pending.itervalues():
+            waiter.send_exception(
+                OvsdbClientError(_('OVSDB connection closed')))
+        self._reset_tables()
+
+    def _send(self, message):
+        data = jsonutils.dumps(message)
+        with self._send_lock:
+            if not self.connected:
+                raise OvsdbClientError(_('OVSDB connection closed'))
+            self._sock.sendall(data)
+
+    def _request(self, method, params):
+        request_id = next(self._ids)
+        waiter = event.Event()
+        self._pending[request_id] = waiter
+        try:
+            self._send({'method': method, 'params': params,
+                        'id': request_id})
+            with eventlet.timeout.Timeout(self.timeout,
+                                          OvsdbClientError(
+                                              _('OVSDB request timed out'))):
+                return waiter.wait()
+        finally:
+            self._pending.pop(request_id, None)
+
+    def _read_loop(self, sock):
+        decoder = json.JSONDecoder()
+        buf = ''
+        try:
+            while True:
+                data = sock.recv(_RECV_SIZE)
+                if not data:
+                    break
+                buf += data
+                while True:
+                    buf = buf.lstrip()
+                    if not buf:
+                        break
+                    try:
+                        message, end = decoder.raw_decode(buf)
+                    except ValueError:
+                        # Incomplete message, wait for more data
+                        break
+                    buf = buf[end:]
+                    self._handle_message(message)
+        except Exception:
+            LOG.exception(_LE('Error while reading from OVSDB %s'),
+                          self.connection)
+        if self._sock is sock:
+            LOG.warn(_LW('Connection to OVSDB %s lost'), self.connection)
+            self.stop()
+
+    def _handle_message(self, message):
+        method = message.get('method')
+        if method is None:
+            waiter = self._pending.get(message.get('id'))
+            if waiter is None:
+                return
+            if message.get('error') is not None:
+                waiter.send_exception(OvsdbClientError(message['error']))
+            else:
+                waiter.send(message.get('result'))
+        elif method == 'update':
+            self._apply_updates(message['params'][1])
+        elif method == 'echo':
+            self._send({'id': message['id'], 'result': message['params'],
+                        'error': None})
+
+    def _apply_updates(self, table_updates):
+        for table, row_updates in table_updates.iteritems():
+            rows = self.tables[table]
+            names = self._names[table]
+            for uuid, update in row_updates.iteritems():
+                old_row = rows.pop(uuid, None)
+                if old_row is not None:
+                    names.pop(old_row.get('name'), None)
+                new = update.get('new')
+                if new is None:
+                    continue
+                row = dict((column, from_datum(value,
+                                               column in SET_COLUMNS))
+                           for column, value in new.iteritems())
+                row['_uuid'] = uuid
+                rows[uuid] = row
+                names[row.get('name')] = uuid
+
+    def has_column(self, table, column):
+        return column in MONITORED_COLUMNS.get(table, ())
+
+    def get_row(self, table, name):
+        uuid = self._names[table].get(name)
+        if uuid is not None:
+            return self.tables[table][uuid]
+
+    def get_rows(self, table, uuids):
+        rows = self.tables[table]
+        return [rows[uuid] for uuid in uuids if uuid in rows]
+
+    def get_bridge_ports(self, bridge_name):
+        """Return the Port rows of a bridge, excluding its local port."""
+        bridge = self.get_row('Bridge', bridge_name)
+        if bridge is None:
+            return []
+        return [port for port in self.get_rows('Port', bridge['ports'])
+                if port['name'] != bridge_name]
+
+    def get_port_interfaces(self, port):
+        return self.get_rows('Interface', port['interfaces'])
+
+    def get_bridge_for_port(self, port_name):
+        port = self.get_row('Port', port_name)
+        if port is None:
+            return
+        for bridge in self.tables['Bridge'].itervalues():
+            if port['_uuid'] in bridge['ports']:
+                return bridge['name']
+
+    def transact(self, operations):
+        result = self._request('transact', [OVSDB_DATABASE] + operations)
+        errors = [r for r in result if r and 'error' in r]
+        if errors or len(result) > len(operations):
+            raise OvsdbClientError(_('OVSDB transaction %(ops)s failed: '
+                                     '%(errors)s') % {'ops': operations,
+                                                      'errors': errors})
+        return result
+
+    def set_column(self, table, name, column, value):
+        if value is None:
+            datum = ['set', []]
+        else:
+            datum = WRITABLE_COLUMNS[(table, column)](value)
+        self.transact([{'op': 'update', 'table': table,
+                        'where': [['name', '==', name]],
+                        'row': {column: datum}}])
+
+
+_clients = {}
+
+
+def get_client(connection, timeout):
+    """Return a connected client shared by the whole process, or None."""
+    client = _clients.get(connection)
+    if client is None:
+        client = _clients[connection] = OvsdbClient(connection, timeout)
+    if not client.connected:
+        try:
+            client.start()
+        except Exception as e:
+            LOG.warn(_LW('Unable to connect to OVSDB %(conn)s, falling back '
+                         'to ovs-vsctl: %(err)s'),
+                     {'conn': connection, 'err': e})
+            return None
+    return client
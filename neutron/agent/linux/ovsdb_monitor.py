@@ -13,14 +13,36 @@
 #    under the License.
 
 import eventlet
+from oslo.serialization import jsonutils
 
 from neutron.agent.linux import async_process
-from neutron.i18n import _LE
+from neutron.i18n import _LE, _LW
 from neutron.openstack.common import log as logging
 
 
 LOG = logging.getLogger(__name__)
 
+OVSDB_ACTION_INITIAL = 'initial'
+OVSDB_ACTION_INSERT = 'insert'
+OVSDB_ACTION_DELETE = 'delete'
+OVSDB_ACTION_NEW = 'new'
+
+EVENT_ADDED = 'added'
+EVENT_REMOVED = 'removed'
+
+
+def _val_to_py(value):
+    """Convert a json value printed by ovsdb-client to a python value."""
+    if isinstance(value, list) and len(value) == 2:
+        kind, data = value
+        if kind == 'map':
+            return dict((_val_to_py(k), _val_to_py(v)) for k, v in data)
+        if kind == 'set':
+            return [_val_to_py(v) for v in data]
+        if kind == 'uuid':
+            return data
+    return value
+
 
 class OvsdbMonitor(async_process.AsyncProcess):
     """Manages an invocation of 'ovsdb-client monitor'."""
@@ -58,18 +80,24 @@ class SimpleInterfaceMonitor(OvsdbMonitor):
 
     The has_updates() method indicates whether changes to the ovsdb
     Interface table have been detected since the monitor started or
-    since the previous access.
+    since the previous access.  The get_events() method returns the
+    interfaces added or removed in the meantime, so that callers can
+    track ports incrementally instead of listing them all again.
     """
 
     def __init__(self, root_helper=None, respawn_interval=None):
         super(SimpleInterfaceMonitor, self).__init__(
             'Interface',
-            columns=['name', 'ofport'],
+            columns=['name', 'ofport', 'external_ids'],
             format='json',
             root_helper=root_helper,
             respawn_interval=respawn_interval,
         )
         self.data_received = False
+        self.new_events = []
+        # Events can not be trusted until the caller has done a full scan
+        # after the monitor (re)started.
+        self.events_lost = True
 
     @property
     def is_active(self):
@@ -86,7 +114,61 @@ class SimpleInterfaceMonitor(OvsdbMonitor):
         the absence of updates at the expense of potential false
         positives.
         """
-        return bool(list(self.iter_stdout())) or not self.is_active
+        return self.process_events() or not self.is_active
+
+    def process_events(self):
+        """Parse the pending monitor output into interface events.
+
+        Returns True if any output was received since the previous call.
+        """
+        received = False
+        for line in self.iter_stdout():
+            received = True
+            try:
+                output = jsonutils.loads(line)
+                headings = output['headings']
+                for row in output['data']:
+                    self._process_row(dict(zip(headings, row)))
+            except (ValueError, KeyError, TypeError):
+                LOG.warn(_LW('Unable to parse ovsdb monitor output: %s'),
+                         line)
+                self.events_lost = True
+        return received
+
+    def _process_row(self, row):
+        action = row['action']
+        if action in (OVSDB_ACTION_INITIAL, OVSDB_ACTION_INSERT,
+                      OVSDB_ACTION_NEW):
+            event = EVENT_ADDED
+        elif action == OVSDB_ACTION_DELETE:
+            event = EVENT_REMOVED
+        else:
+            # 'old' rows only carry the previous values of modified columns
+            return
+        self.new_events.append({'event': event,
+                                'name': row['name'],
+                                'ofport': _val_to_py(row['ofport']),
+                                'external_ids': _val_to_py(
+                                    row['external_ids'])})
+
+    def get_events(self):
+        """Return, in order, the interface events since the previous call.
+
+        Each event is a dict with the 'event' ('added' or 'removed'), and
+        the 'name', 'ofport' and 'external_ids' of the interface; changes
+        to an existing interface are reported as 'added'.  None is returned
+        when events may have been missed, e.g. because the monitor was
+        respawned, in which case the caller must do a full scan.
+        """
+        self.process_events()
+        events, self.new_events = self.new_events, []
+        if not self.is_active:
+            self.events_lost = True
+            return None
+        if self.events_lost:
+            self.events_lost = False
+            return None
+        return events
 
     def start(self, block=False, timeout=5):
         super(SimpleInterfaceMonitor, self).start()
@@ -97,6 +179,7 @@ class SimpleInterfaceMonitor(OvsdbMonitor):
 
     def _kill(self, *args, **kwargs):
         self.data_received = False
+        self.events_lost = True
         super(SimpleInterfaceMonitor, self)._kill(*args, **kwargs)
 
     def _read_stdout(self):
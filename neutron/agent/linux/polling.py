@@ -54,6 +54,14 @@ class BasePollingManager(object):
     def _is_polling_required(self):
         raise NotImplementedError()
 
+    def get_events(self):
+        """Return the interface events since the previous call.
+
+        None means that events are not available and that the caller has to
+        scan all the ports.
+        """
+        return None
+
     @property
     def is_polling_required(self):
         # Always consume the updates to minimize polling.
@@ -110,3 +118,6 @@ class InterfacePollingMinimizer(BasePollingManager):
         # collect output.
         eventlet.sleep()
         return self._monitor.has_updates
+
+    def get_events(self):
+        return self._monitor.get_events()
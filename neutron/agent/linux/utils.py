@@ -20,18 +20,124 @@ import shlex
 import socket
 import struct
 import tempfile
+import threading
 
 from eventlet.green import subprocess
 from eventlet import greenthread
+from eventlet import tpool
+from oslo.config import cfg
+from oslo.rootwrap import client
 from oslo.utils import excutils
 
+from neutron.agent.common import config
 from neutron.common import constants
 from neutron.common import utils
+from neutron.i18n import _LE
 from neutron.openstack.common import log as logging
 
 
 LOG = logging.getLogger(__name__)
 
+config.register_root_helper(cfg.CONF)
+
+
+class RootwrapDaemonHelper(object):
+    """Holds the shared client of the root helper daemon.
+
+    The daemon is spawned on first use and then kept running for the
+    lifetime of the agent, so commands sent through it do not pay for a
+    new sudo and rootwrap interpreter each time.  If the daemon can not be
+    started, it is disabled and callers fall back to the per-command
+    root helper.
+
+    The commands are run in native threads. The locks of the client are
+    green ones, which can not be waited on from a native thread: the
+    daemon is started and restarted from the greenthreads, and the native
+    threads call the proxy of the client directly. The proxy opens a
+    connection to the daemon for each thread using it, so the commands of
+    several threads run concurrently.
+    """
+    _client = None
+    _disabled = False
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        """There is no reason to instantiate this class."""
+        raise NotImplementedError()
+
+    @classmethod
+    def get_client(cls):
+        daemon_cmd = cfg.CONF.AGENT.root_helper_daemon
+        if not daemon_cmd or cls._disabled:
+            return None
+        with cls._lock:
+            if cls._client is None:
+                daemon_client = client.Client(shlex.split(daemon_cmd))
+                daemon_client._ensure_initialized()
+                cls._client = daemon_client
+            return cls._client
+
+    @classmethod
+    def execute(cls, daemon_client, cmd, process_input):
+        """Run a command through the client, from a native thread.
+
+        Returns None if the daemon must be restarted.
+        """
+        try:
+            return daemon_client._proxy.run_one_command(cmd, process_input)
+        except (EOFError, IOError):
+            return None
+
+    @classmethod
+    def disable(cls):
+        with cls._lock:
+            cls._disabled = True
+            cls._client = None
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._disabled = False
+            cls._client = None
+
+
+def addl_env_args(addl_env):
+    """Build arguments for adding additional environment vars with env."""
+
+    # NOTE: the daemon does not pass an environment to the commands it runs,
+    # so additional variables are set by prefixing the command with env.
+    if addl_env is None:
+        return []
+    return ['env'] + ['%s=%s' % pair for pair in addl_env.items()]
+
+
+def execute_rootwrap_daemon(cmd, process_input=None, addl_env=None):
+    """Run a command through the root helper daemon.
+
+    Returns a tuple of (returncode, stdout, stderr), or None when the daemon
+    is not configured or can not be used and the caller should fall back to
+    spawning the root helper itself.
+    """
+    cmd = map(str, addl_env_args(addl_env) + cmd)
+    try:
+        daemon_client = RootwrapDaemonHelper.get_client()
+        if daemon_client is None:
+            return None
+        LOG.debug("Running command (rootwrap daemon): %s", cmd)
+        # The client waits for the daemon on a blocking socket, it is run
+        # in a native thread to let the other greenthreads run meanwhile
+        result = tpool.execute(RootwrapDaemonHelper.execute, daemon_client,
+                               cmd, process_input)
+        if result is None:
+            # The client restarts the daemon and runs the command again
+            result = daemon_client.execute(cmd, process_input)
+        return result
+    except Exception:
+        LOG.exception(_LE("Unable to run command through the root helper "
+                          "daemon, falling back to the root helper"))
+        RootwrapDaemonHelper.disable()
+        return None
+
 
 def create_process(cmd, root_helper=None, addl_env=None):
     """Create a process object for the given command.
@@ -61,24 +167,31 @@ def execute(cmd, root_helper=None, process_input=None, addl_env=None,
             check_exit_code=True, return_stderr=False, log_fail_as_error=True,
             extra_ok_codes=None):
     try:
-        obj, cmd = create_process(cmd, root_helper=root_helper,
-                                  addl_env=addl_env)
-        _stdout, _stderr = obj.communicate(process_input)
-        obj.stdin.close()
+        result = None
+        if root_helper:
+            result = execute_rootwrap_daemon(cmd, process_input, addl_env)
+        if result is not None:
+            returncode, _stdout, _stderr = result
+        else:
+            obj, cmd = create_process(cmd, root_helper=root_helper,
+                                      addl_env=addl_env)
+            _stdout, _stderr = obj.communicate(process_input)
+            returncode = obj.returncode
+            obj.stdin.close()
         m = _("\nCommand: %(cmd)s\nExit code: %(code)s\nStdout: %(stdout)r\n"
-              "Stderr: %(stderr)r") % {'cmd': cmd, 'code': obj.returncode,
+              "Stderr: %(stderr)r") % {'cmd': cmd, 'code': returncode,
                                        'stdout': _stdout, 'stderr': _stderr}
 
         extra_ok_codes = extra_ok_codes or []
-        if obj.returncode and obj.returncode in extra_ok_codes:
-            obj.returncode = None
+        if returncode and returncode in extra_ok_codes:
+            returncode = None
 
-        if obj.returncode and log_fail_as_error:
+        if returncode and log_fail_as_error:
             LOG.error(m)
         else:
             LOG.debug(m)
 
-        if obj.returncode and check_exit_code:
+        if returncode and check_exit_code:
             raise RuntimeError(m)
     finally:
         # NOTE(termie): this appears to be necessary to let the subprocess
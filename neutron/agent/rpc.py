@@ -79,6 +79,7 @@ class PluginApi(object):
         1.3 - get_device_details rpc signature upgrade to obtain 'host' and
               return value to include fixed_ips and device_owner for
               the device port
+        1.4 - update_device_list
     '''
 
     def __init__(self, topic):
@@ -117,6 +118,33 @@ class PluginApi(object):
         return cctxt.call(context, 'update_device_up', device=device,
                           agent_id=agent_id, host=host)
 
+    def update_device_list(self, context, devices_up, devices_down,
+                           agent_id, host):
+        try:
+            cctxt = self.client.prepare(version='1.4')
+            res = cctxt.call(context, 'update_device_list',
+                             devices_up=devices_up, devices_down=devices_down,
+                             agent_id=agent_id, host=host)
+        except messaging.UnsupportedVersion:
+            # If the server has not been upgraded yet, update the devices
+            # one by one.
+            res = {'devices_up': [], 'failed_devices_up': [],
+                   'devices_down': [], 'failed_devices_down': []}
+            for device in devices_up:
+                try:
+                    self.update_device_up(context, device, agent_id, host)
+                except Exception:
+                    res['failed_devices_up'].append(device)
+                else:
+                    res['devices_up'].append(device)
+            for device in devices_down:
+                try:
+                    res['devices_down'].append(self.update_device_down(
+                        context, device, agent_id, host))
+                except Exception:
+                    res['failed_devices_down'].append(device)
+        return res
+
     def tunnel_sync(self, context, tunnel_ip, tunnel_type=None):
         cctxt = self.client.prepare()
         return cctxt.call(context, 'tunnel_sync', tunnel_ip=tunnel_ip,
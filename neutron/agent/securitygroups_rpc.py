@@ -44,7 +44,24 @@ security_group_opts = [
     cfg.BoolOpt(
         'enable_ipset',
         default=True,
-        help=_('Use ipset to speed-up the iptables based security groups.'))
+        help=_('Use ipset to speed-up the iptables based security groups.')),
+    cfg.BoolOpt(
+        'enable_shared_chains',
+        default=False,
+        help=_('Compile the rules of the security groups once into chains '
+               'shared by all the ports using the same security groups, '
+               'matching their remote IP prefixes with ipsets, instead of '
+               'repeating them in the chains of every port. Requires '
+               'enable_ipset.')),
+    cfg.BoolOpt(
+        'cache_security_group_info',
+        default=False,
+        help=_('Cache the rules and the member IPs of the security groups '
+               'in the server, tagged with the revision of their security '
+               'group, and serve the security group requests of the agents '
+               'from this cache until the revision changes. The revisions '
+               'are only updated when this option is enabled, so it must '
+               'have the same value on all the servers.'))
 ]
 cfg.CONF.register_opts(security_group_opts, 'SECURITYGROUP')
 
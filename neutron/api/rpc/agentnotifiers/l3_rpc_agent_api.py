@@ -105,10 +105,12 @@ class L3AgentNotifyAPI(object):
             LOG.error(_LE('No plugin for L3 routing registered. Cannot notify '
                           'agents with the message %s'), method)
             return
+        adminContext = (context.is_admin and
+                        context or context.elevated())
+        # The agents only fetch again the routers whose revision changed
+        plugin.bump_router_revisions(adminContext, router_ids)
         if utils.is_extension_supported(
                 plugin, constants.L3_AGENT_SCHEDULER_EXT_ALIAS):
-            adminContext = (context.is_admin and
-                            context or context.elevated())
             plugin.schedule_routers(adminContext, router_ids)
             self._agent_notification(
                 context, method, router_ids, operation, shuffle_agents)
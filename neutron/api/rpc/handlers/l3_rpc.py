@@ -40,7 +40,8 @@ class L3RpcCallback(object):
     # 1.2 Added methods for DVR support
     # 1.3 Added a method that returns the list of activated services
     # 1.4 Added L3 HA update_router_state
-    target = messaging.Target(version='1.4')
+    # 1.5 sync_routers returns deltas of the routers known by the agent
+    target = messaging.Target(version='1.5')
 
     @property
     def plugin(self):
@@ -59,21 +60,46 @@ class L3RpcCallback(object):
         """Sync routers according to filters to a specific agent.
 
         @param context: contain user information
-        @param kwargs: host, router_ids
+        @param kwargs: host, router_ids, known_routers
         @return: a list of routers
                  with their interfaces and floating_ips
+
+        known_routers maps the ids of routers known by the agent to their
+        revision_number and the digests of their sub-resources. Those
+        routers are returned without the sub-resources which did not
+        change, or with only their id when their revision did not change.
+        Without router_ids, the sync data is only built for the routers of
+        the agent which are not known or whose revision changed.
         """
         router_ids = kwargs.get('router_ids')
         host = kwargs.get('host')
+        known_routers = kwargs.get('known_routers') or {}
         context = neutron_context.get_admin_context()
+        scheduler = self.l3plugin and utils.is_extension_supported(
+            self.l3plugin, constants.L3_AGENT_SCHEDULER_EXT_ALIAS)
+        if scheduler and cfg.CONF.router_auto_schedule:
+            self.l3plugin.auto_schedule_routers(context, host, router_ids)
+        if scheduler and not router_ids and known_routers:
+            router_ids = (
+                self.l3plugin.list_active_router_ids_on_active_l3_agent(
+                    context, host))
+            if not router_ids:
+                return []
+        unchanged_routers = []
+        if self.l3plugin and router_ids and known_routers:
+            unchanged_routers = self._get_unchanged_routers(
+                context, host, router_ids, known_routers)
+            unchanged_ids = set(router['id'] for router in unchanged_routers)
+            router_ids = [router_id for router_id in router_ids
+                          if router_id not in unchanged_ids]
+            if not router_ids:
+                # None of the revisions changed
+                return unchanged_routers
         if not self.l3plugin:
             routers = {}
             LOG.error(_LE('No plugin for L3 routing registered! Will reply '
                           'to l3 agent with empty router dictionary.'))
-        elif utils.is_extension_supported(
-                self.l3plugin, constants.L3_AGENT_SCHEDULER_EXT_ALIAS):
-            if cfg.CONF.router_auto_schedule:
-                self.l3plugin.auto_schedule_routers(context, host, router_ids)
+        elif scheduler:
             routers = (
                 self.l3plugin.list_active_sync_routers_on_active_l3_agent(
                     context, host, router_ids))
@@ -82,10 +108,74 @@ class L3RpcCallback(object):
         if utils.is_extension_supported(
             self.plugin, constants.PORT_BINDING_EXT_ALIAS):
             self._ensure_host_set_on_ports(context, host, routers)
+        routers = [self._get_router_delta(router,
+                                          known_routers.get(router['id']))
+                   for router in routers]
+        routers.extend(unchanged_routers)
         LOG.debug("Routers returned to l3 agent:\n %s",
                   jsonutils.dumps(routers, indent=5))
         return routers
 
+    def _get_unchanged_routers(self, context, host, router_ids,
+                               known_routers):
+        """Return the known routers whose revision did not change.
+
+        The routers which are not active on the agent anymore, and the ones
+        with ports whose binding must be retried, are synced entirely.
+        """
+        router_ids = [router_id for router_id in router_ids
+                      if router_id in known_routers]
+        if router_ids and utils.is_extension_supported(
+                self.l3plugin, constants.L3_AGENT_SCHEDULER_EXT_ALIAS):
+            router_ids = (
+                self.l3plugin.list_active_router_ids_on_active_l3_agent(
+                    context, host, router_ids))
+        if not router_ids:
+            return []
+        revisions = self.l3plugin.get_router_revisions(context, router_ids)
+        unchanged_ids = set(
+            router_id for router_id, revision in revisions.items()
+            if revision == known_routers[router_id]['revision_number'])
+        if unchanged_ids and utils.is_extension_supported(
+                self.plugin, constants.PORT_BINDING_EXT_ALIAS):
+            unchanged_ids -= self._get_routers_with_unbound_ports(
+                context, unchanged_ids)
+        return [{'id': router_id,
+                 'revision_number': revisions[router_id],
+                 constants.ROUTER_BASE_REVISION_KEY: revisions[router_id]}
+                for router_id in router_ids if router_id in unchanged_ids]
+
+    def _get_routers_with_unbound_ports(self, context, router_ids):
+        """Return the routers with ports not bound or failed to bind.
+
+        _ensure_host_set_on_ports retries the binding of these ports.
+        """
+        ports = self.plugin.get_ports(
+            context, filters={'device_id': list(router_ids)},
+            fields=['device_id', 'device_owner', portbindings.HOST_ID,
+                    portbindings.VIF_TYPE])
+        return set(port['device_id'] for port in ports
+                   if port['device_owner'] !=
+                   constants.DEVICE_OWNER_DVR_INTERFACE and
+                   (not port.get(portbindings.HOST_ID) or
+                    port.get(portbindings.VIF_TYPE) ==
+                    portbindings.VIF_TYPE_BINDING_FAILED))
+
+    def _get_router_delta(self, router, known_router):
+        """Remove from a router the sub-resources known by the agent."""
+        if not known_router:
+            return router
+        known_digests = known_router.get('digests', {})
+        unchanged = [key for key, digest in
+                     utils.get_router_digests(router).items()
+                     if known_digests.get(key) == digest]
+        for key in unchanged:
+            del router[key]
+        router[constants.ROUTER_BASE_REVISION_KEY] = (
+            known_router['revision_number'])
+        router[constants.ROUTER_UNCHANGED_KEY] = unchanged
+        return router
+
     def _ensure_host_set_on_ports(self, context, host, routers):
         for router in routers:
             LOG.debug("Checking router: %(id)s for host: %(host)s",
@@ -250,11 +250,11 @@ class Controller(object):
             # FIXME(salvatore-orlando): obj_getter might return references to
             # other resources. Must check authZ on them too.
             # Omit items from list that should not be visible
+            policy_cache = {}
             obj_list = [obj for obj in obj_list
-                        if policy.check(request.context,
-                                        self._plugin_handlers[self.SHOW],
-                                        obj,
-                                        plugin=self._plugin)]
+                        if policy.check_cached(
+                            policy_cache, request.context,
+                            self._plugin_handlers[self.SHOW], obj)]
         # Use the first element in the list for discriminating which attributes
         # should be filtered out because of authZ policies
         # fields_to_add contains a list of attributes added for request policy
@@ -274,6 +274,77 @@ class Controller(object):
             collection[self._collection + "_links"] = pagination_links
         return collection
 
+    def _can_stream_items(self, request):
+        """Whether the list response can be streamed.
+
+        The response is streamed if the plugin can return the items by
+        chunks and if no pagination nor sorting is requested.
+        """
+        if not (cfg.CONF.stream_list_responses and
+                self._native_pagination and self._native_sorting):
+            return False
+        if self._allow_pagination and api_common.get_limit_and_marker(
+                request)[0]:
+            return False
+        if self._allow_sorting and api_common.list_args(request,
+                                                        'sort_key'):
+            return False
+        return True
+
+    def _streamed_items(self, request, parent_id=None):
+        """Retrieves the elements of the requested entity by chunks.
+
+        The elements are fetched from the plugin sorted by primary key,
+        cfg.CONF.stream_list_chunk_size at a time. The first chunk is
+        fetched right away, so that errors are reported before the
+        response is started, the others while the response is streamed.
+        """
+        original_fields, fields_to_add = self._do_field_list(
+            api_common.list_args(request, 'fields'))
+        if original_fields and self._primary_key not in original_fields:
+            # The primary key is the marker of the next chunk
+            original_fields.append(self._primary_key)
+            fields_to_add.append(self._primary_key)
+        filters = api_common.get_filters(request, self._attr_info,
+                                         ['fields', 'sort_key', 'sort_dir',
+                                          'limit', 'marker', 'page_reverse'])
+        limit = cfg.CONF.stream_list_chunk_size
+        kwargs = {'filters': filters,
+                  'fields': original_fields,
+                  'sorts': [(self._primary_key, True)],
+                  'limit': limit}
+        if parent_id:
+            kwargs[self._parent_id_name] = parent_id
+        obj_getter = getattr(self._plugin, self._plugin_handlers[self.LIST])
+        obj_list = obj_getter(request.context, **kwargs)
+
+        def items(obj_list):
+            # fields_to_strip is completed with the attributes excluded by
+            # the policies on the first visible element, as in _items
+            fields_to_strip = list(fields_to_add or [])
+            excluded = None
+            policy_cache = {}
+            while obj_list:
+                for obj in obj_list:
+                    if not policy.check_cached(
+                            policy_cache, request.context,
+                            self._plugin_handlers[self.SHOW], obj):
+                        continue
+                    if excluded is None:
+                        excluded = self._exclude_attributes_by_policy(
+                            request.context, obj)
+                        fields_to_strip += excluded
+                    yield self._filter_attributes(
+                        request.context, obj, fields_to_strip=fields_to_strip)
+                if len(obj_list) < limit:
+                    break
+                obj_list = obj_getter(request.context,
+                                      marker=obj_list[-1][self._primary_key],
+                                      **kwargs)
+
+        return wsgi_resource.StreamedCollection(self._collection,
+                                                items(obj_list))
+
     def _item(self, request, id, do_authz=False, field_list=None,
               parent_id=None):
         """Retrieves and formats a single element of the requested entity."""
@@ -308,6 +379,8 @@ class Controller(object):
         parent_id = kwargs.get(self._parent_id_name)
         # Ensure policy engine is initialized
         policy.init()
+        if self._can_stream_items(request):
+            return self._streamed_items(request, parent_id)
         return self._items(request, True, parent_id)
 
     def show(self, request, id, **kwargs):
@@ -382,14 +455,15 @@ class Controller(object):
                                                allow_bulk=self._allow_bulk)
         action = self._plugin_handlers[self.CREATE]
         # Check authz
+        deltas = {}
         if self._collection in body:
             # Have to account for bulk create
             items = body[self._collection]
-            deltas = {}
             bulk = True
         else:
             items = [body]
             bulk = False
+        tracked = quota.QUOTAS.is_tracked(self._resource)
         # Ensure policy engine is initialized
         policy.init()
         for item in items:
@@ -398,6 +472,10 @@ class Controller(object):
             policy.enforce(request.context,
                            action,
                            item[self._resource])
+            if tracked:
+                tenant_id = item[self._resource]['tenant_id']
+                deltas[tenant_id] = deltas.get(tenant_id, 0) + 1
+                continue
             try:
                 tenant_id = item[self._resource]['tenant_id']
                 count = quota.QUOTAS.count(request.context, self._resource,
@@ -417,6 +495,21 @@ class Controller(object):
                                          item[self._resource]['tenant_id'],
                                          **kwargs)
 
+        reservations = []
+        try:
+            if tracked:
+                # The usage of the tracked resources is a row per tenant,
+                # the resources are reserved until they are counted in it
+                for tenant_id, delta in deltas.items():
+                    reservations.append(quota.QUOTAS.make_reservation(
+                        request.context, tenant_id, self._resource, delta))
+            return self._create(request, body, action, parent_id)
+        finally:
+            for reservation_id in reservations:
+                quota.QUOTAS.release_reservation(request.context,
+                                                 reservation_id)
+
+    def _create(self, request, body, action, parent_id):
         def notify(create_result):
             notifier_method = self._resource + '.create.end'
             self._notifier.info(request.context,
@@ -20,12 +20,14 @@ Utility methods for working with WSGI servers redux
 import sys
 
 import netaddr
+from oslo.config import cfg
 from oslo import i18n
 import six
 import webob.dec
 import webob.exc
 
 from neutron.common import exceptions
+from neutron.db import stats as db_stats
 from neutron.i18n import _LE, _LI
 from neutron.openstack.common import log as logging
 from neutron.openstack.common import policy as common_policy
@@ -39,6 +41,19 @@ class Request(wsgi.Request):
     pass
 
 
+class StreamedCollection(object):
+    """A collection whose items are serialized as they are retrieved.
+
+    Returned by the controllers instead of a dict of the collection, the
+    items being an iterable which is only consumed while the response body
+    is written.
+    """
+
+    def __init__(self, collection, items):
+        self.collection = collection
+        self.items = items
+
+
 def Resource(controller, faults=None, deserializers=None, serializers=None):
     """Represents an API entity resource and the associated serialization and
     deserialization logic
@@ -134,6 +149,15 @@ def Resource(controller, faults=None, deserializers=None, serializers=None):
             raise webob.exc.HTTPInternalServerError(**kwargs)
 
         status = action_status.get(action, 200)
+        if isinstance(result, StreamedCollection):
+            if hasattr(serializer, 'serialize_collection'):
+                app_iter = _log_stream_errors(
+                    serializer.serialize_collection(result.collection,
+                                                    result.items), action)
+                return webob.Response(request=request, status=status,
+                                      content_type=content_type,
+                                      app_iter=app_iter)
+            result = {result.collection: list(result.items)}
         body = serializer.serialize(result)
         # NOTE(jkoelker) Comply with RFC2616 section 9.7
         if status == 204:
@@ -143,9 +167,43 @@ def Resource(controller, faults=None, deserializers=None, serializers=None):
         return webob.Response(request=request, status=status,
                               content_type=content_type,
                               body=body)
+    if cfg.CONF.enable_db_stats:
+        return _record_db_stats(resource, controller)
     return resource
 
 
+def _record_db_stats(resource, controller):
+    """Record the database statistics of the requests of a resource."""
+    name = (getattr(controller, '_collection', None) or
+            controller.__class__.__name__)
+
+    def recorded(environ, start_response):
+        route_args = environ.get('wsgiorg.routing_args')
+        action = route_args[1].get('action') if route_args else None
+        stats = db_stats.start('api:%s.%s' % (name, action))
+        try:
+            app_iter = resource(environ, start_response)
+        except Exception:
+            db_stats.finish(stats)
+            raise
+        return db_stats.RecordedAppIter(app_iter, stats)
+    return recorded
+
+
+def _log_stream_errors(chunks, action):
+    """Log the errors raised while a response body is streamed.
+
+    The status of the response is already sent at this point, so the body
+    is only truncated.
+    """
+    try:
+        for chunk in chunks:
+            yield chunk
+    except Exception:
+        LOG.exception(_LE('%s failed while streaming the response'), action)
+        raise
+
+
 def get_exception_data(e):
     """Extract the information about an exception.
 
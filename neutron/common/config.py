@@ -53,6 +53,12 @@ core_opts = [
                help=_("The base MAC address Neutron will use for VIFs")),
     cfg.IntOpt('mac_generation_retries', default=16,
                help=_("How many times Neutron will retry MAC generation")),
+    cfg.StrOpt('mac_allocator',
+               help=_("The class Neutron will use to generate the MAC "
+                      "addresses of the ports, e.g. "
+                      "neutron.db.mac_allocator.MacFilterAllocator. If not "
+                      "set, the uniqueness of every MAC address is checked "
+                      "in the database.")),
     cfg.BoolOpt('allow_bulk', default=True,
                 help=_("Allow the usage of the bulk API")),
     cfg.BoolOpt('allow_pagination', default=False,
@@ -63,12 +69,30 @@ core_opts = [
                help=_("The maximum number of items returned in a single "
                       "response, value was 'infinite' or negative integer "
                       "means no limit")),
+    cfg.BoolOpt('stream_list_responses', default=False,
+                help=_("Stream the responses of the unpaginated and "
+                       "unsorted list requests, fetching the resources from "
+                       "plugins supporting native pagination and sorting by "
+                       "chunks of stream_list_chunk_size resources")),
+    cfg.IntOpt('stream_list_chunk_size', default=500,
+               help=_("Number of resources fetched at once from the plugin "
+                      "when streaming a list response")),
     cfg.IntOpt('max_dns_nameservers', default=5,
                help=_("Maximum number of DNS nameservers")),
     cfg.IntOpt('max_subnet_host_routes', default=20,
                help=_("Maximum number of host routes per subnet")),
     cfg.IntOpt('max_fixed_ips_per_port', default=5,
                help=_("Maximum number of fixed ips per port")),
+    cfg.StrOpt('ip_allocator',
+               help=_("The class Neutron will use to allocate the fixed IPs "
+                      "of the ports, e.g. "
+                      "neutron.db.ip_allocator.IpIndexAllocator. If not "
+                      "set, the IPs are allocated from the availability "
+                      "ranges stored in the database. IpIndexAllocator "
+                      "does not update the availability ranges: it "
+                      "deletes them, and they are rebuilt from the IP "
+                      "allocations once the option is unset. All the "
+                      "servers must use the same allocator.")),
     cfg.IntOpt('dhcp_lease_duration', default=86400,
                deprecated_name='dhcp_lease_time',
                help=_("DHCP lease duration (in seconds). Use -1 to tell "
@@ -48,6 +48,13 @@ HA_ROUTER_STATE_KEY = '_ha_state'
 METERING_LABEL_KEY = '_metering_labels'
 FLOATINGIP_AGENT_INTF_KEY = '_floatingip_agent_interfaces'
 SNAT_ROUTER_INTF_KEY = '_snat_router_interfaces'
+# The sub-resources of the routers synced to the l3 agents, a delta of a
+# router known by an agent only includes the ones which changed
+ROUTER_FRAGMENT_KEYS = ('gw_port', 'routes', INTERFACE_KEY, FLOATINGIP_KEY,
+                        HA_INTERFACE_KEY, FLOATINGIP_AGENT_INTF_KEY,
+                        SNAT_ROUTER_INTF_KEY)
+ROUTER_BASE_REVISION_KEY = '_base_revision'
+ROUTER_UNCHANGED_KEY = '_unchanged'
 
 HA_NETWORK_NAME = 'HA network tenant %s'
 HA_SUBNET_NAME = 'HA subnet tenant %s'
@@ -31,6 +31,7 @@ import uuid
 
 from eventlet.green import subprocess
 from oslo.config import cfg
+from oslo.serialization import jsonutils
 from oslo.utils import excutils
 
 from neutron.common import constants as q_const
@@ -259,6 +260,14 @@ def diff_list_of_dict(old_list, new_list):
     return [str2dict(a) for a in added], [str2dict(r) for r in removed]
 
 
+def get_router_digests(router):
+    """Return the digests of the sub-resources of a router by key."""
+    return dict(
+        (key, hashlib.sha1(jsonutils.dumps(router[key],
+                                           sort_keys=True)).hexdigest())
+        for key in q_const.ROUTER_FRAGMENT_KEYS if key in router)
+
+
 def is_extension_supported(plugin, ext_alias):
     return ext_alias in getattr(
         plugin, "supported_extension_aliases", [])
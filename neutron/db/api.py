@@ -16,6 +16,8 @@
 from oslo.config import cfg
 from oslo.db.sqlalchemy import session
 
+from neutron.db import stats
+
 _FACADE = None
 
 
@@ -24,6 +26,8 @@ def _create_facade_lazily():
 
     if _FACADE is None:
         _FACADE = session.EngineFacade.from_config(cfg.CONF, sqlite_fk=True)
+        if cfg.CONF.enable_db_stats:
+            stats.instrument_engine(_FACADE.get_engine())
 
     return _FACADE
 
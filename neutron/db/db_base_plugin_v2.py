@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import random
 
 import netaddr
@@ -29,7 +30,10 @@ from neutron.common import exceptions as n_exc
 from neutron.common import ipv6_utils
 from neutron import context as ctx
 from neutron.db import common_db_mixin
+from neutron.db import ip_allocator
+from neutron.db import mac_allocator
 from neutron.db import models_v2
+from neutron.db import quota_usage
 from neutron.db import sqlalchemyutils
 from neutron.extensions import l3
 from neutron.i18n import _LE, _LI
@@ -51,6 +55,13 @@ LOG = logging.getLogger(__name__)
 # IP allocations being cleaned up by cascade.
 AUTO_DELETE_PORT_OWNERS = [constants.DEVICE_OWNER_DHCP]
 
+# Attributes of the ports which are columns of the ports table. When only
+# these attributes and the fixed IPs of the ports are requested, the ports
+# are listed without loading their models.
+PORT_COLUMNS = ('id', 'name', 'network_id', 'tenant_id', 'mac_address',
+                'admin_state_up', 'status', 'device_id', 'device_owner')
+MAX_PORTS_PER_QUERY = 500
+
 
 class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                         common_db_mixin.CommonDbMixin):
@@ -81,6 +92,8 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                          self.nova_notifier.send_port_status)
             event.listen(models_v2.Port.status, 'set',
                          self.nova_notifier.record_port_status_changed)
+        if cfg.CONF.QUOTAS.track_quota_usage:
+            quota_usage.listen_tracked_models()
 
     @classmethod
     def register_dict_extend_funcs(cls, resource, funcs):
@@ -128,6 +141,9 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
 
     @staticmethod
     def _generate_mac(context, network_id):
+        allocator = mac_allocator.get_mac_allocator()
+        if allocator:
+            return allocator.get_mac(context, network_id)
         base_mac = cfg.CONF.base_mac.split(':')
         max_retries = cfg.CONF.mac_generation_retries
         for i in range(max_retries):
@@ -160,6 +176,9 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
             mac_qry.filter_by(network_id=network_id,
                               mac_address=mac_address).one()
         except exc.NoResultFound:
+            allocator = mac_allocator.get_mac_allocator()
+            if allocator:
+                allocator.reserve(context, network_id, mac_address)
             return True
         return False
 
@@ -176,6 +195,9 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
             network_id=network_id,
             ip_address=ip_address,
             subnet_id=subnet_id).delete()
+        allocator = ip_allocator.get_ip_allocator()
+        if allocator:
+            allocator.release(context, subnet_id, ip_address)
 
     @staticmethod
     def _store_ip_allocation(context, ip_address, network_id, subnet_id,
@@ -192,10 +214,17 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
             ip_address=ip_address,
             subnet_id=subnet_id
         )
-        context.session.add(allocated)
+        if ip_allocator.get_ip_allocator():
+            # The IP allocator already stored the allocation, without port
+            context.session.merge(allocated)
+        else:
+            context.session.add(allocated)
 
     @staticmethod
     def _generate_ip(context, subnets):
+        allocator = ip_allocator.get_ip_allocator()
+        if allocator:
+            return allocator.allocate(context, subnets)
         try:
             return NeutronDbPluginV2._try_generate_ip(context, subnets)
         except n_exc.IpAddressGenerationFailure:
@@ -296,6 +325,11 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
     @staticmethod
     def _allocate_specific_ip(context, subnet_id, ip_address):
         """Allocate a specific IP address on the subnet."""
+        allocator = ip_allocator.get_ip_allocator()
+        if allocator:
+            subnet = context.session.query(models_v2.Subnet).get(subnet_id)
+            allocator.allocate_specific(context, subnet, ip_address)
+            return
         ip = int(netaddr.IPAddress(ip_address))
         range_qry = context.session.query(
             models_v2.IPAvailabilityRange).join(
@@ -1207,7 +1241,8 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
             first_ip=p['start'], last_ip=p['end'],
             subnet_id=id) for p in s['allocation_pools']]
         context.session.add_all(new_pools)
-        NeutronDbPluginV2._rebuild_availability_ranges(context, [s])
+        if not ip_allocator.get_ip_allocator():
+            NeutronDbPluginV2._rebuild_availability_ranges(context, [s])
         #Gather new pools for result:
         result_pools = [{'start': pool['start'],
                          'end': pool['end']}
@@ -1310,8 +1345,35 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
         return self._get_collection_count(context, models_v2.Subnet,
                                           filters=filters)
 
+    @staticmethod
+    def _prepare_bulk_macs(context, ports):
+        """Generate the MAC addresses of the ports of each network at once."""
+        allocator = mac_allocator.get_mac_allocator()
+        if not allocator:
+            return {}
+        counts = collections.Counter(
+            item['port']['network_id'] for item in ports['ports']
+            if item['port'].get('mac_address') is
+            attributes.ATTR_NOT_SPECIFIED)
+        return dict((network_id, allocator.prepare(context, network_id,
+                                                   count))
+                    for network_id, count in counts.iteritems())
+
+    @staticmethod
+    def _release_bulk_macs(prepared_macs):
+        """Release the prepared MAC addresses left by a failed creation."""
+        allocator = mac_allocator.get_mac_allocator()
+        if not allocator:
+            return
+        for network_id, macs in prepared_macs.iteritems():
+            allocator.release(network_id, macs)
+
     def create_port_bulk(self, context, ports):
-        return self._create_bulk('port', context, ports)
+        prepared_macs = self._prepare_bulk_macs(context, ports)
+        try:
+            return self._create_bulk('port', context, ports)
+        finally:
+            self._release_bulk_macs(prepared_macs)
 
     def create_port(self, context, port):
         p = port['port']
@@ -1444,7 +1506,14 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                  enable_eagerloads(False).filter_by(id=id))
         if not context.is_admin:
             query = query.filter_by(tenant_id=context.tenant_id)
-        query.delete()
+        if not cfg.CONF.QUOTAS.track_quota_usage:
+            query.delete()
+            return
+        # Query.delete() does not trigger the tracking of the quota usage
+        port = query.with_entities(models_v2.Port.tenant_id).first()
+        if port and query.delete():
+            quota_usage.update_in_use(context.session.connection(), 'port',
+                                      port.tenant_id, -1)
 
     def get_port(self, context, id, fields=None):
         port = self._get_port(context, id)
@@ -1485,11 +1554,51 @@ class NeutronDbPluginV2(neutron_plugin_base_v2.NeutronPluginBaseV2,
                                       sorts=sorts, limit=limit,
                                       marker_obj=marker_obj,
                                       page_reverse=page_reverse)
-        items = [self._make_port_dict(c, fields) for c in query]
+        if fields and set(fields) <= set(PORT_COLUMNS + ('fixed_ips',)):
+            items = self._make_port_dicts_from_columns(context, query, fields)
+        else:
+            items = [self._make_port_dict(c, fields) for c in query]
         if limit and page_reverse:
             items.reverse()
         return items
 
+    def _make_port_dicts_from_columns(self, context, query, fields):
+        """Build the dicts of the ports from the requested columns only.
+
+        The ports are not loaded with their relationships, nor extended by
+        the dict extend functions, whose attributes are not requested. The
+        fixed IPs, if requested, are fetched for all the ports at once.
+        """
+        names = [name for name in PORT_COLUMNS
+                 if name in fields or name == 'id']
+        query = query.with_entities(*[getattr(models_v2.Port, name)
+                                      for name in names])
+        items = []
+        seen_ids = set()
+        for row in query:
+            item = dict(zip(names, row))
+            # The ports filtered by fixed IPs are joined with their IPs
+            if item['id'] not in seen_ids:
+                seen_ids.add(item['id'])
+                items.append(item)
+
+        if 'fixed_ips' in fields:
+            fixed_ips = collections.defaultdict(list)
+            port_ids = [port['id'] for port in items]
+            IPAllocation = models_v2.IPAllocation
+            for i in range(0, len(port_ids), MAX_PORTS_PER_QUERY):
+                ip_query = context.session.query(
+                    IPAllocation.port_id, IPAllocation.subnet_id,
+                    IPAllocation.ip_address).filter(
+                        IPAllocation.port_id.in_(
+                            port_ids[i:i + MAX_PORTS_PER_QUERY]))
+                for port_id, subnet_id, ip_address in ip_query:
+                    fixed_ips[port_id].append({'subnet_id': subnet_id,
+                                               'ip_address': ip_address})
+            for item in items:
+                item['fixed_ips'] = fixed_ips[item['id']]
+        return [self._fields(item, fields) for item in items]
+
     def get_ports_count(self, context, filters=None):
         return self._get_ports_query(context, filters).count()
 
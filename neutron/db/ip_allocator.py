@@ -0,0 +1,250 @@
+# Copyright (c) 2015 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import bisect
+
+import netaddr
+from oslo.config import cfg
+from oslo.db import exception as db_exc
+from oslo.utils import importutils
+
+from neutron.common import exceptions as n_exc
+from neutron.db import models_v2
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+_allocators = {}
+
+
+def get_ip_allocator():
+    """Return the IP allocator configured with ip_allocator, if any."""
+    allocator_class = cfg.CONF.ip_allocator
+    if not allocator_class:
+        return None
+    if allocator_class not in _allocators:
+        _allocators[allocator_class] = importutils.import_object(
+            allocator_class)
+    return _allocators[allocator_class]
+
+
+class SubnetIpIndex(object):
+    """Sorted intervals of the free addresses of the pools of a subnet.
+
+    The addresses are handled as integers. The intervals are kept in two
+    sorted lists of their first and last addresses, so that taking the
+    first free address is O(1) and reserving or freeing a given address
+    is O(log n) to find its interval, n being the number of intervals.
+    """
+
+    def __init__(self, pools, allocated):
+        """Build the index of the pools without the allocated addresses.
+
+        :param pools: sorted list of (first, last) tuples of the pools
+        :param allocated: iterable of the allocated addresses
+        """
+        self.pools = pools
+        self._firsts = []
+        self._lasts = []
+        allocated = sorted(allocated)
+        for first, last in pools:
+            start = first
+            for ip in allocated[bisect.bisect_left(allocated, first):
+                                bisect.bisect_right(allocated, last)]:
+                if ip > start:
+                    self._firsts.append(start)
+                    self._lasts.append(ip - 1)
+                start = ip + 1
+            if start <= last:
+                self._firsts.append(start)
+                self._lasts.append(last)
+
+    def __len__(self):
+        return len(self._firsts)
+
+    def take(self):
+        """Remove the first free address from the index and return it.
+
+        Returns None if there is no free address.
+        """
+        if not self._firsts:
+            return
+        ip = self._firsts[0]
+        if ip == self._lasts[0]:
+            del self._firsts[0]
+            del self._lasts[0]
+        else:
+            self._firsts[0] = ip + 1
+        return ip
+
+    def remove(self, ip):
+        """Remove an address from the free addresses.
+
+        Returns False if the address was not free.
+        """
+        i = bisect.bisect_right(self._firsts, ip) - 1
+        if i < 0 or ip > self._lasts[i]:
+            return False
+        first, last = self._firsts[i], self._lasts[i]
+        if first == last:
+            del self._firsts[i]
+            del self._lasts[i]
+        elif ip == first:
+            self._firsts[i] = ip + 1
+        elif ip == last:
+            self._lasts[i] = ip - 1
+        else:
+            self._lasts[i] = ip - 1
+            self._firsts.insert(i + 1, ip + 1)
+            self._lasts.insert(i + 1, last)
+        return True
+
+    def add(self, ip):
+        """Give back an address of the pools to the free addresses."""
+        if not any(first <= ip <= last for first, last in self.pools):
+            return
+        i = bisect.bisect_right(self._firsts, ip)
+        if i > 0 and ip <= self._lasts[i - 1]:
+            # already free
+            return
+        merge_prev = i > 0 and self._lasts[i - 1] == ip - 1
+        merge_next = i < len(self._firsts) and self._firsts[i] == ip + 1
+        if merge_prev and merge_next:
+            self._lasts[i - 1] = self._lasts[i]
+            del self._firsts[i]
+            del self._lasts[i]
+        elif merge_prev:
+            self._lasts[i - 1] = ip
+        elif merge_next:
+            self._firsts[i] = ip
+        else:
+            self._firsts.insert(i, ip)
+            self._lasts.insert(i, ip)
+
+
+class IpIndexAllocator(object):
+    """Allocate IP addresses from an in-memory index of the free addresses.
+
+    Each API worker keeps a SubnetIpIndex per subnet, built from the
+    allocation pools and the IP allocations of the subnet. The addresses
+    are allocated optimistically: the IPAllocation row of a candidate
+    address is inserted in a savepoint, and if its primary key is already
+    used, by another worker or server, the next candidate is tried. The
+    IPAvailabilityRange table is neither read nor locked.
+
+    The index of a subnet is rebuilt when its allocation pools change or
+    when it runs out of free addresses, which also picks up the addresses
+    released by the other workers.
+
+    As the availability ranges are not kept up to date, the ranges of a
+    subnet are deleted when its index is built. If ip_allocator is unset
+    later on, the allocation from the ranges finds none and rebuilds them
+    from the IP allocations of the subnet.
+    """
+
+    def __init__(self):
+        self._indexes = {}
+
+    def _get_pools(self, context, subnet_id):
+        query = context.session.query(models_v2.IPAllocationPool.first_ip,
+                                      models_v2.IPAllocationPool.last_ip)
+        return sorted((int(netaddr.IPAddress(first_ip)),
+                       int(netaddr.IPAddress(last_ip)))
+                      for first_ip, last_ip in query.filter_by(
+                          subnet_id=subnet_id))
+
+    def _delete_availability_ranges(self, context, subnet_id):
+        pool_ids = [pool_id for pool_id, in context.session.query(
+            models_v2.IPAllocationPool.id).filter_by(subnet_id=subnet_id)]
+        if pool_ids:
+            context.session.query(models_v2.IPAvailabilityRange).filter(
+                models_v2.IPAvailabilityRange.allocation_pool_id.in_(
+                    pool_ids)).delete(synchronize_session=False)
+
+    def _build_index(self, context, subnet_id, pools):
+        LOG.debug("Building the IP index of subnet %s", subnet_id)
+        self._delete_availability_ranges(context, subnet_id)
+        query = context.session.query(models_v2.IPAllocation.ip_address)
+        allocated = [int(netaddr.IPAddress(ip_address))
+                     for ip_address, in query.filter_by(subnet_id=subnet_id)]
+        index = self._indexes[subnet_id] = SubnetIpIndex(pools, allocated)
+        return index
+
+    def _get_index(self, context, subnet_id):
+        pools = self._get_pools(context, subnet_id)
+        index = self._indexes.get(subnet_id)
+        if index is None or index.pools != pools:
+            index = self._build_index(context, subnet_id, pools)
+        return index
+
+    def _reserve(self, context, subnet, ip_address):
+        """Insert the allocation of an address, without any port yet.
+
+        Returns False if the address is already allocated.
+        """
+        # Flush the pending changes first, so that only the duplicate
+        # entries of the allocation are caught below
+        context.session.flush()
+        try:
+            with context.session.begin(nested=True):
+                context.session.add(models_v2.IPAllocation(
+                    network_id=subnet['network_id'],
+                    subnet_id=subnet['id'],
+                    ip_address=ip_address))
+        except db_exc.DBDuplicateEntry:
+            LOG.debug("IP %(ip_address)s of subnet %(subnet_id)s is "
+                      "already allocated, trying another one",
+                      {'ip_address': ip_address, 'subnet_id': subnet['id']})
+            return False
+        return True
+
+    def allocate(self, context, subnets):
+        """Allocate an IP address from one of the subnets."""
+        for subnet in subnets:
+            index = self._get_index(context, subnet['id'])
+            for rebuilt in (False, True):
+                ip = index.take()
+                while ip is not None:
+                    ip_address = str(netaddr.IPAddress(ip))
+                    if self._reserve(context, subnet, ip_address):
+                        LOG.debug("Allocated IP %(ip_address)s from subnet "
+                                  "%(subnet_id)s",
+                                  {'ip_address': ip_address,
+                                   'subnet_id': subnet['id']})
+                        return {'ip_address': ip_address,
+                                'subnet_id': subnet['id']}
+                    ip = index.take()
+                if rebuilt:
+                    break
+                # Pick up the addresses released by the other workers
+                index = self._build_index(context, subnet['id'], index.pools)
+            LOG.debug("All IPs from subnet %(subnet_id)s (%(cidr)s) "
+                      "allocated",
+                      {'subnet_id': subnet['id'], 'cidr': subnet['cidr']})
+        raise n_exc.IpAddressGenerationFailure(net_id=subnets[0]['network_id'])
+
+    def allocate_specific(self, context, subnet, ip_address):
+        """Allocate a given IP address of the subnet."""
+        index = self._get_index(context, subnet['id'])
+        index.remove(int(netaddr.IPAddress(ip_address)))
+        if not self._reserve(context, subnet, ip_address):
+            raise n_exc.IpAddressInUse(net_id=subnet['network_id'],
+                                       ip_address=ip_address)
+
+    def release(self, context, subnet_id, ip_address):
+        """Give back an IP address whose allocation was deleted."""
+        index = self._indexes.get(subnet_id)
+        if index is not None:
+            index.add(int(netaddr.IPAddress(ip_address)))
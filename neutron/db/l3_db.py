@@ -80,6 +80,10 @@ class Router(model_base.BASEV2, models_v2.HasId, models_v2.HasTenant):
         RouterPort,
         backref='router',
         lazy='dynamic')
+    # Incremented each time the agents are notified of a change of the
+    # router, its ports or its floating IPs
+    revision_number = sa.Column(sa.BigInteger, nullable=False, default=0,
+                                server_default='0')
 
 
 class FloatingIP(model_base.BASEV2, models_v2.HasId, models_v2.HasTenant):
@@ -948,7 +952,14 @@ class L3_NAT_dbonly_mixin(l3.RouterPluginBase):
         filters = {'id': router_ids} if router_ids else {}
         if active is not None:
             filters['admin_state_up'] = [active]
-        router_dicts = self.get_routers(context, filters=filters)
+        # The extensions of the routers and their gateway port are loaded
+        # with joins by the same query
+        router_dicts = []
+        for router in self._get_collection_query(context, Router,
+                                                 filters=filters):
+            router_dict = self._make_router_dict(router)
+            router_dict['revision_number'] = router.revision_number
+            router_dicts.append(router_dict)
         gw_port_ids = []
         if not router_dicts:
             return []
@@ -968,6 +979,24 @@ class L3_NAT_dbonly_mixin(l3.RouterPluginBase):
         # defensive approach regardless
         return self._build_routers_list(context, router_dicts, gw_ports)
 
+    def get_router_revisions(self, context, router_ids):
+        """Return the revision numbers of the routers by router id."""
+        if not router_ids:
+            return {}
+        query = context.session.query(Router.id, Router.revision_number)
+        query = query.filter(Router.id.in_(router_ids))
+        return dict(query)
+
+    def bump_router_revisions(self, context, router_ids):
+        """Increment the revision numbers of the routers."""
+        if not router_ids:
+            return
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(Router)
+            query = query.filter(Router.id.in_(router_ids))
+            query.update({Router.revision_number: Router.revision_number + 1},
+                         synchronize_session=False)
+
     def _get_sync_floating_ips(self, context, router_ids):
         """Query floating_ips that relate to list of router_ids."""
         if not router_ids:
@@ -988,15 +1017,14 @@ class L3_NAT_dbonly_mixin(l3.RouterPluginBase):
         device_owners = device_owners or [DEVICE_OWNER_ROUTER_INTF]
         if not router_ids:
             return []
-        qry = context.session.query(RouterPort)
+        qry = context.session.query(RouterPort.port_id)
         qry = qry.filter(
-            Router.id.in_(router_ids),
+            RouterPort.router_id.in_(router_ids),
             RouterPort.port_type.in_(device_owners)
         )
-
-        # TODO(markmcclain): This is suboptimal but was left to reduce
-        # changeset size since it is late in cycle
-        ports = [rp.port.id for rp in qry]
+        ports = [port_id for port_id, in qry]
+        if not ports:
+            return []
         interfaces = self._core_plugin.get_ports(context, {'id': ports})
         if interfaces:
             self._populate_subnet_for_ports(context, interfaces)
@@ -1027,23 +1055,30 @@ class L3_NAT_dbonly_mixin(l3.RouterPluginBase):
                 yield (port, fixed_ips[0])
 
         network_ids = set(p['network_id'] for p, _ in each_port_with_ip())
-        filters = {'network_id': [id for id in network_ids]}
-        fields = ['id', 'cidr', 'gateway_ip',
-                  'network_id', 'ipv6_ra_mode']
+        if not network_ids:
+            return
 
+        # Only the columns needed are queried, without the pools, DNS
+        # servers and host routes the subnet dicts are built with
         subnets_by_network = dict((id, []) for id in network_ids)
-        for subnet in self._core_plugin.get_subnets(context, filters, fields):
-            subnets_by_network[subnet['network_id']].append(subnet)
+        query = context.session.query(models_v2.Subnet.id,
+                                      models_v2.Subnet.cidr,
+                                      models_v2.Subnet.gateway_ip,
+                                      models_v2.Subnet.network_id,
+                                      models_v2.Subnet.ipv6_ra_mode)
+        query = query.filter(models_v2.Subnet.network_id.in_(network_ids))
+        for subnet in query:
+            subnets_by_network[subnet.network_id].append(subnet)
 
         for port, fixed_ip in each_port_with_ip():
             port['extra_subnets'] = []
             for subnet in subnets_by_network[port['network_id']]:
-                subnet_info = {'id': subnet['id'],
-                               'cidr': subnet['cidr'],
-                               'gateway_ip': subnet['gateway_ip'],
-                               'ipv6_ra_mode': subnet['ipv6_ra_mode']}
+                subnet_info = {'id': subnet.id,
+                               'cidr': subnet.cidr,
+                               'gateway_ip': subnet.gateway_ip,
+                               'ipv6_ra_mode': subnet.ipv6_ra_mode}
 
-                if subnet['id'] == fixed_ip['subnet_id']:
+                if subnet.id == fixed_ip['subnet_id']:
                     port['subnet'] = subnet_info
                 else:
                     port['extra_subnets'].append(subnet_info)
@@ -281,15 +281,14 @@ class L3_NAT_with_dvr_db_mixin(l3_db.L3_NAT_db_mixin,
         """Query router interfaces that relate to list of router_ids."""
         if not router_ids:
             return []
-        qry = context.session.query(l3_db.RouterPort)
+        qry = context.session.query(l3_db.RouterPort.port_id)
         qry = qry.filter(
             l3_db.RouterPort.router_id.in_(router_ids),
             l3_db.RouterPort.port_type == DEVICE_OWNER_DVR_SNAT
         )
-
-        # TODO(markmcclain): This is suboptimal but was left to reduce
-        # changeset size since it is late in cycle
-        ports = [rp.port.id for rp in qry]
+        ports = [port_id for port_id, in qry]
+        if not ports:
+            return []
         interfaces = self._core_plugin.get_ports(context, {'id': ports})
         LOG.debug("Return the SNAT ports: %s", interfaces)
         if interfaces:
@@ -342,8 +341,9 @@ class L3_NAT_with_dvr_db_mixin(l3_db.L3_NAT_db_mixin,
                 router_floatingips = router.get(l3_const.FLOATINGIP_KEY, [])
                 floatingip_agent_intfs = []
                 if router['distributed']:
-                    floating_ip['host'] = self.get_vm_port_hostid(
-                        context, floating_ip['port_id'])
+                    if 'host' not in floating_ip:
+                        floating_ip['host'] = self.get_vm_port_hostid(
+                            context, floating_ip['port_id'])
                     LOG.debug("Floating IP host: %s", floating_ip['host'])
                     # if no VM there won't be an agent assigned
                     if not floating_ip['host']:
@@ -377,9 +377,17 @@ class L3_NAT_with_dvr_db_mixin(l3_db.L3_NAT_db_mixin,
             context, router_ids=router_ids, active=active,
             device_owners=[l3_const.DEVICE_OWNER_ROUTER_INTF,
                            DEVICE_OWNER_DVR_INTERFACE])
-        # Add the port binding host to the floatingip dictionary
+        # Add the port binding host to the floatingip dictionary, the ports
+        # of all the floating IPs are queried at once
+        port_ids = [fip['port_id'] for fip in floating_ips if fip['port_id']]
+        ports = {}
+        if port_ids:
+            ports = dict((port['id'], port) for port in
+                         self._core_plugin.get_ports(context,
+                                                     {'id': port_ids}))
         for fip in floating_ips:
-            fip['host'] = self.get_vm_port_hostid(context, fip['port_id'])
+            fip['host'] = self.get_vm_port_hostid(context, fip['port_id'],
+                                                  ports.get(fip['port_id']))
         routers_dict = self._process_routers(context, routers)
         self._process_floating_ips(context, routers_dict, floating_ips)
         self._process_interfaces(routers_dict, interfaces)
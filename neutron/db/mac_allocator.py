@@ -0,0 +1,194 @@
+# Copyright (c) 2015 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import math
+import struct
+
+from oslo.config import cfg
+from oslo.utils import importutils
+from oslo.utils import timeutils
+
+from neutron.common import exceptions as n_exc
+from neutron.common import utils
+from neutron.db import models_v2
+from neutron.i18n import _LE
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# The filters are rebuilt from the database after this number of seconds, to
+# pick up the MAC addresses used by the other workers and servers
+FILTER_MAX_AGE = 60
+MIN_FILTER_CAPACITY = 1024
+
+_allocators = {}
+
+
+def get_mac_allocator():
+    """Return the MAC allocator configured with mac_allocator, if any."""
+    allocator_class = cfg.CONF.mac_allocator
+    if not allocator_class:
+        return None
+    if allocator_class not in _allocators:
+        _allocators[allocator_class] = importutils.import_object(
+            allocator_class)
+    return _allocators[allocator_class]
+
+
+class BloomFilter(object):
+    """Bloom filter of strings, stored in a bytearray.
+
+    A string which was added is always found in the filter, a string which
+    was not added is found with a probability of about error_rate as long
+    as no more than capacity strings were added.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.count = 0
+        self.size = max(8, int(-capacity * math.log(error_rate) /
+                               math.log(2) ** 2))
+        self.hashes = max(1, int(round(float(self.size) / capacity *
+                                       math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        h1, h2 = struct.unpack('>QQ', hashlib.md5(key).digest())
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+
+class MacFilterAllocator(object):
+    """Generate MAC addresses checked against in-memory filters.
+
+    Each API worker keeps a BloomFilter of the MAC addresses of the ports
+    of every network, loaded with a single query and updated with the MAC
+    addresses it hands out. The random MAC addresses found in the filter
+    are rejected without querying the database, the ones which are not are
+    confirmed unused in the database with a single query for all of them.
+    The rare false positives of the filter only cost another random MAC
+    address.
+
+    The filters do not see the ports deleted by this worker nor the ports
+    created by the other ones, so they are rebuilt after FILTER_MAX_AGE
+    seconds, and when they are full. They are never trusted to accept a
+    MAC address.
+    """
+
+    def __init__(self):
+        self._filters = {}
+        # MAC addresses generated in advance for the bulk port creations
+        self._pending = {}
+
+    def _build_filter(self, context, network_id, count):
+        query = context.session.query(models_v2.Port.mac_address)
+        macs = [mac for mac, in query.filter_by(network_id=network_id)]
+        pending = self._pending.get(network_id, [])
+        mac_filter = BloomFilter(max(MIN_FILTER_CAPACITY,
+                                     2 * (len(macs) + len(pending) + count)))
+        for mac in macs + pending:
+            mac_filter.add(mac)
+        self._filters[network_id] = (timeutils.utcnow(), mac_filter)
+        return mac_filter
+
+    def _get_filter(self, context, network_id, count=1):
+        built_at, mac_filter = self._filters.get(network_id, (None, None))
+        if (mac_filter is None or
+            mac_filter.count + count > mac_filter.capacity or
+            timeutils.is_older_than(built_at, FILTER_MAX_AGE)):
+            mac_filter = self._build_filter(context, network_id, count)
+        return mac_filter
+
+    @staticmethod
+    def _get_used_macs(context, network_id, macs):
+        query = context.session.query(models_v2.Port.mac_address)
+        query = query.filter(models_v2.Port.network_id == network_id,
+                             models_v2.Port.mac_address.in_(macs))
+        return set(mac for mac, in query)
+
+    def _generate_candidates(self, mac_filter, network_id, count):
+        base_mac = cfg.CONF.base_mac.split(':')
+        max_retries = cfg.CONF.mac_generation_retries
+        macs = []
+        while len(macs) < count:
+            for i in range(max_retries):
+                mac_address = utils.get_random_mac(base_mac)
+                if mac_address not in mac_filter:
+                    mac_filter.add(mac_address)
+                    macs.append(mac_address)
+                    break
+            else:
+                LOG.error(_LE("Unable to generate mac address after %s "
+                              "attempts"), max_retries)
+                raise n_exc.MacAddressGenerationFailure(net_id=network_id)
+        return macs
+
+    def generate(self, context, network_id, count=1):
+        """Generate count unused MAC addresses for the network."""
+        mac_filter = self._get_filter(context, network_id, count)
+        max_retries = cfg.CONF.mac_generation_retries
+        macs = []
+        for i in range(max_retries):
+            candidates = self._generate_candidates(mac_filter, network_id,
+                                                   count - len(macs))
+            # The MAC addresses used by the ports the filter does not know
+            # of are left in it
+            used = self._get_used_macs(context, network_id, candidates)
+            macs.extend(mac for mac in candidates if mac not in used)
+            if len(macs) == count:
+                return macs
+        LOG.error(_LE("Unable to generate mac address after %s attempts"),
+                  max_retries)
+        raise n_exc.MacAddressGenerationFailure(net_id=network_id)
+
+    def prepare(self, context, network_id, count):
+        """Generate in one shot the MAC addresses of count ports.
+
+        The MAC addresses are returned to be released once the ports are
+        created.
+        """
+        macs = self.generate(context, network_id, count)
+        self._pending.setdefault(network_id, []).extend(macs)
+        return macs
+
+    def release(self, network_id, macs):
+        """Forget the prepared MAC addresses which were not handed out."""
+        pending = self._pending.get(network_id)
+        if pending:
+            self._pending[network_id] = [mac for mac in pending
+                                         if mac not in macs]
+
+    def get_mac(self, context, network_id):
+        """Return an unused MAC address for a port of the network."""
+        pending = self._pending.get(network_id)
+        if pending:
+            return pending.pop(0)
+        return self.generate(context, network_id)[0]
+
+    def reserve(self, context, network_id, mac_address):
+        """Record a requested MAC address found unused in the database."""
+        pending = self._pending.get(network_id)
+        if pending and mac_address in pending:
+            pending.remove(mac_address)
+        self._get_filter(context, network_id).add(mac_address)
@@ -0,0 +1,60 @@
+# Copyright 2015 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""quota usages and reservations
+
+Revision ID: 1b2248b85f4a
+Revises: 1f5d8c2b3a9e
+Create Date: 2015-01-19 15:42:08.318231
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1b2248b85f4a'
+down_revision = '1f5d8c2b3a9e'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import sql
+
+
+def upgrade():
+    op.create_table(
+        'quotausages',
+        sa.Column('tenant_id', sa.String(length=255), nullable=False),
+        sa.Column('resource', sa.String(length=255), nullable=False),
+        sa.Column('in_use', sa.Integer(), nullable=False,
+                  server_default='0'),
+        sa.Column('reserved', sa.Integer(), nullable=False,
+                  server_default='0'),
+        sa.Column('dirty', sa.Boolean(), nullable=False,
+                  server_default=sql.true()),
+        sa.Column('synced_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('tenant_id', 'resource'))
+    op.create_table(
+        'reservations',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('tenant_id', sa.String(length=255), nullable=True),
+        sa.Column('resource', sa.String(length=255), nullable=True),
+        sa.Column('delta', sa.Integer(), nullable=False),
+        sa.Column('expiration', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'))
+    op.create_index('ix_reservations_tenant_id', 'reservations',
+                    ['tenant_id'])
+
+
+def downgrade():
+    op.drop_table('reservations')
+    op.drop_table('quotausages')
@@ -0,0 +1,46 @@
+# Copyright 2015 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""security group revisions
+
+Revision ID: 1f5d8c2b3a9e
+Revises: 28c0ffb8ebbd
+Create Date: 2015-01-12 10:21:35.561742
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1f5d8c2b3a9e'
+down_revision = '28c0ffb8ebbd'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'securitygrouprevisions',
+        sa.Column('security_group_id', sa.String(length=36), nullable=False),
+        sa.Column('revision', sa.Integer(), nullable=False,
+                  server_default='0'),
+        sa.ForeignKeyConstraint(['security_group_id'], ['securitygroups.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('security_group_id'))
+    op.execute("INSERT INTO securitygrouprevisions (security_group_id) "
+               "SELECT id FROM securitygroups")
+
+
+def downgrade():
+    op.drop_table('securitygrouprevisions')
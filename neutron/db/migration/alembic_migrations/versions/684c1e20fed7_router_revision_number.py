@@ -0,0 +1,39 @@
+# Copyright 2015 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""router revision number
+
+Revision ID: 684c1e20fed7
+Revises: 1b2248b85f4a
+Create Date: 2015-01-26 11:05:37.126704
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '684c1e20fed7'
+down_revision = '1b2248b85f4a'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('routers',
+                  sa.Column('revision_number', sa.BigInteger(),
+                            nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('routers', 'revision_number')
@@ -13,11 +13,17 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
+
+from oslo.config import cfg
+from oslo.db import exception as db_exc
+from oslo.utils import timeutils
 import sqlalchemy as sa
 
 from neutron.common import exceptions
 from neutron.db import model_base
 from neutron.db import models_v2
+from neutron.db import quota_usage
 
 
 class Quota(model_base.BASEV2, models_v2.HasId):
@@ -38,6 +44,10 @@ class DbQuotaDriver(object):
     The default driver utilizes the local database.
     """
 
+    # The resources whose usage is kept in the quotausages table when
+    # track_quota_usage is set
+    tracked_resources = frozenset(quota_usage.TRACKED_MODELS)
+
     @staticmethod
     def get_tenant_quotas(context, resources, tenant_id):
         """Given a list of resources, retrieve the quotas for the given
@@ -63,12 +73,17 @@ class DbQuotaDriver(object):
     def delete_tenant_quota(context, tenant_id):
         """Delete the quota entries for a given tenant_id.
 
-        Atfer deletion, this tenant will use default quota values in conf.
+        Atfer deletion, this tenant will use default quota values in conf,
+        and its tracked usage is counted again.
         """
         with context.session.begin():
             tenant_quotas = context.session.query(Quota)
             tenant_quotas = tenant_quotas.filter_by(tenant_id=tenant_id)
             tenant_quotas.delete()
+            # Count the usage of the tenant again at its next creation
+            tenant_usages = context.session.query(quota_usage.QuotaUsage)
+            tenant_usages = tenant_usages.filter_by(tenant_id=tenant_id)
+            tenant_usages.update({'dirty': True})
 
     @staticmethod
     def get_all_quotas(context, resources):
@@ -177,3 +192,99 @@ class DbQuotaDriver(object):
                  if quotas[key] >= 0 and quotas[key] < val]
         if overs:
             raise exceptions.OverQuota(overs=sorted(overs))
+
+    @staticmethod
+    def _resync_usage(context, usage):
+        """Count the resources and the live reservations of a usage."""
+        model = quota_usage.TRACKED_MODELS[usage.resource]
+        now = timeutils.utcnow()
+        usage.in_use = context.session.query(
+            sa.func.count(model.id)).filter(
+                model.tenant_id == usage.tenant_id).scalar()
+        Reservation = quota_usage.Reservation
+        reservations = context.session.query(Reservation).filter(
+            Reservation.tenant_id == usage.tenant_id,
+            Reservation.resource == usage.resource)
+        reservations.filter(Reservation.expiration < now).delete()
+        usage.reserved = reservations.with_entities(
+            sa.func.sum(Reservation.delta)).scalar() or 0
+        usage.dirty = False
+        usage.synced_at = now
+
+    def _make_reservation(self, context, tenant_id, resource, delta, limit):
+        with context.session.begin(subtransactions=True):
+            # The lock serializes the reservations of the tenant and the
+            # transactions creating and deleting its resources
+            usage = context.session.query(quota_usage.QuotaUsage).filter_by(
+                tenant_id=tenant_id,
+                resource=resource).with_lockmode('update').first()
+            if usage is None:
+                usage = quota_usage.QuotaUsage(tenant_id=tenant_id,
+                                               resource=resource,
+                                               in_use=0, reserved=0,
+                                               dirty=True)
+                context.session.add(usage)
+            if (usage.dirty or timeutils.is_older_than(
+                    usage.synced_at,
+                    cfg.CONF.QUOTAS.quota_usage_resync_interval)):
+                self._resync_usage(context, usage)
+            if usage.in_use + usage.reserved + delta > limit:
+                raise exceptions.OverQuota(overs=[resource])
+            usage.reserved += delta
+            expiration = timeutils.utcnow() + datetime.timedelta(
+                seconds=cfg.CONF.QUOTAS.reservation_expiration)
+            reservation = quota_usage.Reservation(tenant_id=tenant_id,
+                                                  resource=resource,
+                                                  delta=delta,
+                                                  expiration=expiration)
+            context.session.add(reservation)
+        return reservation.id
+
+    def make_reservation(self, context, tenant_id, resources, resource,
+                         delta):
+        """Reserve more of a tracked resource for a tenant.
+
+        The check reads the usage row of the tenant, which is kept up to
+        date by the transactions creating and deleting the resources, and
+        is counted again when missing, dirty or older than
+        quota_usage_resync_interval seconds.
+
+        :param context: The request context, for access checks.
+        :param tenant_id: The tenant_id to check the quota.
+        :param resources: A dictionary of the registered resources.
+        :param resource: The name of the resource to reserve.
+        :param delta: The number of resources to reserve.
+        :return: the ID of the reservation, None if the quota is unlimited
+        """
+        if delta < 0:
+            raise exceptions.InvalidQuotaValue(unders=[resource])
+        limit = self._get_quotas(context, tenant_id, resources,
+                                 [resource])[resource]
+        if limit < 0:
+            return
+        try:
+            return self._make_reservation(context, tenant_id, resource,
+                                          delta, limit)
+        except db_exc.DBDuplicateEntry:
+            # Another server created the usage row first
+            return self._make_reservation(context, tenant_id, resource,
+                                          delta, limit)
+
+    @staticmethod
+    def release_reservation(context, reservation_id):
+        """Release a reservation, once its resources are created or not."""
+        Reservation = quota_usage.Reservation
+        with context.session.begin(subtransactions=True):
+            reservation = context.session.query(Reservation).filter_by(
+                id=reservation_id).first()
+            if reservation is None:
+                # Expired and released by a resync
+                return
+            delta = reservation.delta
+            usage = context.session.query(quota_usage.QuotaUsage).filter_by(
+                tenant_id=reservation.tenant_id,
+                resource=reservation.resource).with_lockmode('update').first()
+            # A resync may have released it since it was read
+            if (context.session.query(Reservation).filter_by(
+                    id=reservation_id).delete() and usage):
+                usage.reserved = max(0, usage.reserved - delta)
@@ -0,0 +1,103 @@
+# Copyright (c) 2015 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo.config import cfg
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy import sql
+
+from neutron.db import model_base
+from neutron.db import models_v2
+
+cfg.CONF.import_opt('track_quota_usage', 'neutron.quota', group='QUOTAS')
+
+# The resources whose usage is tracked, with the model of their table
+TRACKED_MODELS = {
+    'network': models_v2.Network,
+    'subnet': models_v2.Subnet,
+    'port': models_v2.Port,
+}
+
+_listening = False
+
+
+class QuotaUsage(model_base.BASEV2):
+    """Represent the number of resources used and reserved by a tenant.
+
+    in_use is updated in the transactions which create and delete the
+    resources. It is counted again from the resources when the row is
+    dirty or was synced more than quota_usage_resync_interval seconds ago.
+    """
+    tenant_id = sa.Column(sa.String(255), primary_key=True)
+    resource = sa.Column(sa.String(255), primary_key=True)
+    in_use = sa.Column(sa.Integer, nullable=False, default=0,
+                       server_default='0')
+    reserved = sa.Column(sa.Integer, nullable=False, default=0,
+                         server_default='0')
+    dirty = sa.Column(sa.Boolean, nullable=False, default=True,
+                      server_default=sql.true())
+    synced_at = sa.Column(sa.DateTime)
+
+
+class Reservation(model_base.BASEV2, models_v2.HasId):
+    """Represent resources reserved by a creation in progress."""
+    tenant_id = sa.Column(sa.String(255), index=True)
+    resource = sa.Column(sa.String(255))
+    delta = sa.Column(sa.Integer, nullable=False)
+    expiration = sa.Column(sa.DateTime, nullable=False)
+
+
+def update_in_use(connection, resource, tenant_id, delta):
+    """Add delta to the usage of the resource by the tenant.
+
+    The update is made with the connection of the transaction changing the
+    resources, so it is rolled back with it. There is nothing to update
+    when the usage was never counted, it will be when first needed.
+    """
+    if not cfg.CONF.QUOTAS.track_quota_usage or not tenant_id:
+        return
+    usages = QuotaUsage.__table__
+    connection.execute(
+        usages.update().
+        where(sa.and_(usages.c.tenant_id == tenant_id,
+                      usages.c.resource == resource)).
+        values(in_use=usages.c.in_use + delta))
+
+
+def _track_insert(resource):
+    def after_insert(mapper, connection, target):
+        update_in_use(connection, resource, target.tenant_id, 1)
+    return after_insert
+
+
+def _track_delete(resource):
+    def after_delete(mapper, connection, target):
+        update_in_use(connection, resource, target.tenant_id, -1)
+    return after_delete
+
+
+def listen_tracked_models():
+    """Update the usages when the tracked resources are added and deleted.
+
+    The resources deleted with Query.delete() do not trigger the mapper
+    events, their usage must be updated with update_in_use.
+    """
+    global _listening
+    if _listening:
+        return
+    for resource, model in TRACKED_MODELS.items():
+        event.listen(model, 'after_insert', _track_insert(resource))
+        event.listen(model, 'after_delete', _track_delete(resource))
+    _listening = True
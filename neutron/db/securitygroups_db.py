@@ -13,6 +13,7 @@
 #    under the License.
 
 import netaddr
+from oslo.config import cfg
 import sqlalchemy as sa
 from sqlalchemy import orm
 from sqlalchemy.orm import exc
@@ -27,6 +28,10 @@ from neutron.extensions import securitygroup as ext_sg
 from neutron.openstack.common import uuidutils
 
 
+cfg.CONF.import_opt('cache_security_group_info',
+                    'neutron.agent.securitygroups_rpc',
+                    group='SECURITYGROUP')
+
 IP_PROTOCOL_MAP = {constants.PROTO_NAME_TCP: constants.PROTO_NUM_TCP,
                    constants.PROTO_NAME_UDP: constants.PROTO_NUM_UDP,
                    constants.PROTO_NAME_ICMP: constants.PROTO_NUM_ICMP,
@@ -90,6 +95,27 @@ class SecurityGroupRule(model_base.BASEV2, models_v2.HasId,
         primaryjoin="SecurityGroup.id==SecurityGroupRule.remote_group_id")
 
 
+class SecurityGroupRevision(model_base.BASEV2):
+    """Represents the revision of the rules and members of a security group.
+
+    The revision is increased whenever a rule or a port is added to or
+    removed from the security group while cache_security_group_info is
+    enabled, so that the servers caching them can tell when their copy is
+    stale.
+    """
+
+    security_group_id = sa.Column(sa.String(36),
+                                  sa.ForeignKey("securitygroups.id",
+                                                ondelete="CASCADE"),
+                                  primary_key=True)
+    revision = sa.Column(sa.Integer, nullable=False, default=0,
+                         server_default='0')
+    security_group = orm.relationship(
+        SecurityGroup,
+        backref=orm.backref('revision', uselist=False,
+                            cascade='all,delete'))
+
+
 class SecurityGroupDbMixin(ext_sg.SecurityGroupPluginBase):
     """Mixin class to add security group to db_base_plugin_v2."""
 
@@ -118,6 +144,8 @@ class SecurityGroupDbMixin(ext_sg.SecurityGroupPluginBase):
                                               tenant_id=tenant_id,
                                               name=s['name'])
             context.session.add(security_group_db)
+            context.session.add(SecurityGroupRevision(
+                security_group=security_group_db))
             for ethertype in ext_sg.sg_supported_ethertypes:
                 if s.get('name') == 'default':
                     # Allow intercommunication
@@ -238,6 +266,7 @@ class SecurityGroupDbMixin(ext_sg.SecurityGroupPluginBase):
             db = SecurityGroupPortBinding(port_id=port_id,
                                           security_group_id=security_group_id)
             context.session.add(db)
+            self._bump_security_group_revisions(context, [security_group_id])
 
     def _get_port_security_group_bindings(self, context,
                                           filters=None, fields=None):
@@ -251,8 +280,28 @@ class SecurityGroupDbMixin(ext_sg.SecurityGroupPluginBase):
         bindings = query.filter(
             SecurityGroupPortBinding.port_id == port_id)
         with context.session.begin(subtransactions=True):
+            security_group_ids = []
             for binding in bindings:
+                security_group_ids.append(binding['security_group_id'])
                 context.session.delete(binding)
+            self._bump_security_group_revisions(context, security_group_ids)
+
+    def _bump_security_group_revisions(self, context, security_group_ids):
+        """Increase the revision of the given security groups.
+
+        The revisions are only used by the cache of the security group
+        info, they are left alone when it is disabled so that the ports
+        sharing a security group do not all update its revision row.
+        """
+        if (not cfg.CONF.SECURITYGROUP.cache_security_group_info or
+                not security_group_ids):
+            return
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(SecurityGroupRevision)
+            query = query.filter(SecurityGroupRevision.security_group_id.in_(
+                set(security_group_ids)))
+            query.update({'revision': SecurityGroupRevision.revision + 1},
+                         synchronize_session=False)
 
     def create_security_group_rule_bulk(self, context, security_group_rule):
         return self._create_bulk('security_group_rule', context,
@@ -285,6 +334,7 @@ class SecurityGroupDbMixin(ext_sg.SecurityGroupPluginBase):
                     port_range_max=rule['port_range_max'],
                     remote_ip_prefix=rule.get('remote_ip_prefix'))
                 context.session.add(db)
+            self._bump_security_group_revisions(context, [security_group_id])
             ret.append(self._make_security_group_rule_dict(db))
         return ret
 
@@ -473,6 +523,8 @@ class SecurityGroupDbMixin(ext_sg.SecurityGroupPluginBase):
         with context.session.begin(subtransactions=True):
             rule = self._get_security_group_rule(context, id)
             context.session.delete(rule)
+            self._bump_security_group_revisions(context,
+                                                [rule['security_group_id']])
 
     def _extend_port_dict_security_group(self, port_res, port_db):
         # Security group bindings will be retrieved from the sqlalchemy
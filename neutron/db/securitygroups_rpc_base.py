@@ -14,6 +14,7 @@
 #    under the License.
 
 import netaddr
+from oslo.config import cfg
 from sqlalchemy import or_
 from sqlalchemy.orm import exc
 
@@ -23,12 +24,16 @@ from neutron.common import utils
 from neutron.db import allowedaddresspairs_db as addr_pair
 from neutron.db import models_v2
 from neutron.db import securitygroups_db as sg_db
+from neutron.extensions import allowedaddresspairs as ext_addr_pair
 from neutron.extensions import securitygroup as ext_sg
 from neutron.i18n import _LW
 from neutron.openstack.common import log as logging
 
 LOG = logging.getLogger(__name__)
 
+cfg.CONF.import_opt('cache_security_group_info',
+                    'neutron.agent.securitygroups_rpc',
+                    group='SECURITYGROUP')
 
 DIRECTION_IP_PREFIX = {'ingress': 'source_ip_prefix',
                        'egress': 'dest_ip_prefix'}
@@ -36,9 +41,45 @@ DIRECTION_IP_PREFIX = {'ingress': 'source_ip_prefix',
 DHCP_RULE_PORT = {4: (67, 68, q_const.IPv4), 6: (547, 546, q_const.IPv6)}
 
 
+class SecurityGroupRevisionCache(object):
+    """Cache of values computed from the content of security groups.
+
+    Every value is stored with the revision its security group had before
+    the value was loaded from the database, and is only returned while the
+    security group still has this revision.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, revisions, security_group_ids):
+        """Return the valid values and the ids of the missing ones."""
+        found = {}
+        missing = []
+        for sg_id in security_group_ids:
+            revision, value = self._entries.get(sg_id, (None, None))
+            if revision is not None and revision == revisions.get(sg_id):
+                found[sg_id] = value
+            else:
+                missing.append(sg_id)
+        return found, missing
+
+    def update(self, revisions, values):
+        for sg_id, value in values.iteritems():
+            revision = revisions.get(sg_id)
+            if revision is None:
+                # Nothing to validate the value with later
+                self._entries.pop(sg_id, None)
+            else:
+                self._entries[sg_id] = (revision, value)
+
+
 class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
     """Mixin class to add agent-based security group implementation."""
 
+    _sg_rules_cache = None
+    _sg_member_ips_cache = None
+
     def get_port_from_device(self, device):
         """Get port dict from device name on an agent.
 
@@ -134,6 +175,14 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
                 original_port.get(ext_sg.SECURITYGROUPS),
                 updated_port.get(ext_sg.SECURITYGROUPS))):
             need_notify = True
+        if (need_notify or
+            original_port.get(ext_addr_pair.ADDRESS_PAIRS) !=
+            updated_port.get(ext_addr_pair.ADDRESS_PAIRS)):
+            # The member IPs of the security groups of the port changed
+            self._bump_security_group_revisions(
+                context,
+                set(original_port.get(ext_sg.SECURITYGROUPS) or []) |
+                set(updated_port.get(ext_sg.SECURITYGROUPS) or []))
         return need_notify
 
     def notify_security_groups_member_updated(self, context, port):
@@ -156,10 +205,41 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
                    for fixed_ip in port['fixed_ips']):
                 self.notifier.security_groups_provider_updated(context)
         else:
+            # The bindings of a deleted port may have been removed by the
+            # cascade of the database, without bumping the revisions
+            self._bump_security_group_revisions(
+                context, port.get(ext_sg.SECURITYGROUPS))
             self.notifier.security_groups_member_updated(
                 context, port.get(ext_sg.SECURITYGROUPS))
 
+    def notify_security_groups_member_updated_bulk(self, context, ports):
+        """Notify update event of security group members of many ports.
+
+        Same as notify_security_groups_member_updated, but sends at most
+        one notification of each kind for all the ports.
+        """
+        provider_updated = False
+        security_groups = set()
+        for port in ports:
+            if port['device_owner'] == q_const.DEVICE_OWNER_DHCP:
+                provider_updated = True
+            elif port['device_owner'] == q_const.DEVICE_OWNER_ROUTER_INTF:
+                if any(netaddr.IPAddress(fixed_ip['ip_address']).version == 6
+                       for fixed_ip in port['fixed_ips']):
+                    provider_updated = True
+            else:
+                security_groups.update(port.get(ext_sg.SECURITYGROUPS) or [])
+        if provider_updated:
+            self.notifier.security_groups_provider_updated(context)
+        if security_groups:
+            security_groups = list(security_groups)
+            self._bump_security_group_revisions(context, security_groups)
+            self.notifier.security_groups_member_updated(context,
+                                                         security_groups)
+
     def security_group_info_for_ports(self, context, ports):
+        if cfg.CONF.SECURITYGROUP.cache_security_group_info:
+            return self._cached_security_group_info_for_ports(context, ports)
         sg_info = {'devices': ports,
                    'security_groups': {},
                    'sg_member_ips': {}}
@@ -185,19 +265,7 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
                 if ethertype not in remote_security_group_info[remote_gid]:
                     remote_security_group_info[remote_gid][ethertype] = []
 
-            direction = rule_in_db['direction']
-            rule_dict = {
-                'direction': direction,
-                'ethertype': ethertype}
-
-            for key in ('protocol', 'port_range_min', 'port_range_max',
-                        'remote_ip_prefix', 'remote_group_id'):
-                if rule_in_db.get(key):
-                    if key == 'remote_ip_prefix':
-                        direction_ip_prefix = DIRECTION_IP_PREFIX[direction]
-                        rule_dict[direction_ip_prefix] = rule_in_db[key]
-                        continue
-                    rule_dict[key] = rule_in_db[key]
+            rule_dict = self._make_rule_info_dict(rule_in_db)
             if security_group_id not in sg_info['security_groups']:
                 sg_info['security_groups'][security_group_id] = []
             if rule_dict not in sg_info['security_groups'][security_group_id]:
@@ -211,6 +279,134 @@ class SecurityGroupServerRpcMixin(sg_db.SecurityGroupDbMixin):
 
         return self._get_security_group_member_ips(context, sg_info)
 
+    def _make_rule_info_dict(self, rule_in_db):
+        direction = rule_in_db['direction']
+        rule_dict = {
+            'direction': direction,
+            'ethertype': rule_in_db['ethertype']}
+
+        for key in ('protocol', 'port_range_min', 'port_range_max',
+                    'remote_ip_prefix', 'remote_group_id'):
+            if rule_in_db.get(key):
+                if key == 'remote_ip_prefix':
+                    direction_ip_prefix = DIRECTION_IP_PREFIX[direction]
+                    rule_dict[direction_ip_prefix] = rule_in_db[key]
+                    continue
+                rule_dict[key] = rule_in_db[key]
+        return rule_dict
+
+    def _cached_security_group_info_for_ports(self, context, ports):
+        """Build the same info as security_group_info_for_ports.
+
+        The rules and the member IPs of the security groups are served from
+        the cache of this server when their revision did not change since
+        they were loaded, only the stale ones are read from the database.
+        """
+        sg_info = {'devices': ports,
+                   'security_groups': {},
+                   'sg_member_ips': {}}
+        with context.session.begin(subtransactions=True):
+            sg_ids_by_port = self._select_sg_ids_for_ports(context, ports)
+            sg_ids = set()
+            for port_sg_ids in sg_ids_by_port.values():
+                sg_ids.update(port_sg_ids)
+            # The revisions are read before the entries they validate
+            revisions = self._select_security_group_revisions(context, sg_ids)
+            rules = self._get_cached_security_group_rules(context, revisions,
+                                                          sg_ids)
+            remote_security_group_info = {}
+            for port_id, port_sg_ids in sg_ids_by_port.iteritems():
+                port = ports[port_id]
+                for sg_id in port_sg_ids:
+                    if not rules[sg_id]:
+                        continue
+                    source_groups = port.setdefault(
+                        'security_group_source_groups', [])
+                    sg_info['security_groups'][sg_id] = list(rules[sg_id])
+                    for rule in rules[sg_id]:
+                        remote_gid = rule.get('remote_group_id')
+                        if not remote_gid:
+                            continue
+                        if remote_gid not in source_groups:
+                            source_groups.append(remote_gid)
+                        remote_security_group_info.setdefault(
+                            remote_gid, set()).add(rule['ethertype'])
+
+            remote_gids = set(remote_security_group_info)
+            revisions.update(self._select_security_group_revisions(
+                context, remote_gids - sg_ids))
+            member_ips = self._get_cached_security_group_member_ips(
+                context, revisions, remote_gids)
+        for remote_gid, ethertypes in remote_security_group_info.iteritems():
+            sg_info['sg_member_ips'][remote_gid] = dict(
+                (ethertype, list(member_ips[remote_gid].get(ethertype, [])))
+                for ethertype in ethertypes)
+
+        # the provider rules do not belong to any security group, so these
+        # rules are never cached
+        self._apply_provider_rule(context, sg_info['devices'])
+        return sg_info
+
+    def _get_cached_security_group_rules(self, context, revisions, sg_ids):
+        if self._sg_rules_cache is None:
+            self._sg_rules_cache = SecurityGroupRevisionCache()
+        rules, missing = self._sg_rules_cache.get(revisions, sg_ids)
+        if missing:
+            loaded = self._select_rules_for_security_groups(context, missing)
+            self._sg_rules_cache.update(revisions, loaded)
+            rules.update(loaded)
+        return rules
+
+    def _get_cached_security_group_member_ips(self, context, revisions,
+                                              sg_ids):
+        if self._sg_member_ips_cache is None:
+            self._sg_member_ips_cache = SecurityGroupRevisionCache()
+        member_ips, missing = self._sg_member_ips_cache.get(revisions, sg_ids)
+        if missing:
+            loaded = {}
+            ips = self._select_ips_for_remote_group(context, missing)
+            for sg_id, sg_ips in ips.iteritems():
+                ips_by_ethertype = loaded[sg_id] = {}
+                for ip in sg_ips:
+                    ethertype = 'IPv%d' % netaddr.IPNetwork(ip).version
+                    ips_by_ethertype.setdefault(ethertype, []).append(ip)
+            self._sg_member_ips_cache.update(revisions, loaded)
+            member_ips.update(loaded)
+        return member_ips
+
+    def _select_sg_ids_for_ports(self, context, ports):
+        sg_ids_by_port = {}
+        if not ports:
+            return sg_ids_by_port
+        sg_binding_port = sg_db.SecurityGroupPortBinding.port_id
+        sg_binding_sgid = sg_db.SecurityGroupPortBinding.security_group_id
+        query = context.session.query(sg_binding_port, sg_binding_sgid)
+        query = query.filter(sg_binding_port.in_(ports.keys()))
+        for port_id, sg_id in query:
+            sg_ids_by_port.setdefault(port_id, []).append(sg_id)
+        return sg_ids_by_port
+
+    def _select_security_group_revisions(self, context, sg_ids):
+        if not sg_ids:
+            return {}
+        sgr_sgid = sg_db.SecurityGroupRevision.security_group_id
+        query = context.session.query(sgr_sgid,
+                                      sg_db.SecurityGroupRevision.revision)
+        query = query.filter(sgr_sgid.in_(sg_ids))
+        return dict(query)
+
+    def _select_rules_for_security_groups(self, context, sg_ids):
+        rules = dict((sg_id, []) for sg_id in sg_ids)
+        query = context.session.query(sg_db.SecurityGroupRule)
+        query = query.filter(
+            sg_db.SecurityGroupRule.security_group_id.in_(sg_ids))
+        for rule_in_db in query:
+            rule_dict = self._make_rule_info_dict(rule_in_db)
+            sg_rules = rules[rule_in_db['security_group_id']]
+            if rule_dict not in sg_rules:
+                sg_rules.append(rule_dict)
+        return rules
+
     def _get_security_group_member_ips(self, context, sg_info):
         ips = self._select_ips_for_remote_group(
             context, sg_info['sg_member_ips'].keys())
@@ -0,0 +1,270 @@
+# Copyright (c) 2015 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Statistics of the database usage of the API requests and RPC methods."""
+
+import contextlib
+import functools
+import heapq
+import threading
+import time
+
+from oslo.config import cfg
+from sqlalchemy import event
+
+from neutron.i18n import _LI, _LW
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+db_stats_opts = [
+    cfg.BoolOpt('enable_db_stats', default=False,
+                help=_('Record the number of database queries, the time '
+                       'spent running them and waiting for a connection of '
+                       'the pool, for every API request and RPC method.')),
+    cfg.FloatOpt('db_slow_statement_threshold', default=1.0,
+                 help=_('Log as a warning the database statements which run '
+                        'longer than this number of seconds.')),
+    cfg.IntOpt('db_stats_max_queries', default=100,
+               help=_('Log as a warning the API requests and RPC methods '
+                      'which run more than this number of database '
+                      'queries.')),
+    cfg.IntOpt('db_stats_slowest_statements', default=3,
+               help=_('Number of the slowest statements logged with the '
+                      'statistics of an API request or RPC method.')),
+    cfg.IntOpt('db_stats_report_interval', default=300,
+               help=_('Number of seconds between the reports in the log of '
+                      'the statistics of every API resource and RPC '
+                      'method. 0 disables the reports.')),
+]
+cfg.CONF.register_opts(db_stats_opts)
+
+# The statistics of the request or RPC handled by the current greenthread
+_local = threading.local()
+_totals = {}
+_engines = []
+_last_report = time.time()
+
+
+class RequestStats(object):
+    """Database usage of an API request or RPC method call."""
+
+    def __init__(self, tag):
+        self.tag = tag
+        self.queries = 0
+        self.db_time = 0.0
+        self.checkout_wait = 0.0
+        self.slowest = []
+
+    def add_statement(self, statement, duration):
+        self.queries += 1
+        self.db_time += duration
+        entry = (duration, statement)
+        if len(self.slowest) < cfg.CONF.db_stats_slowest_statements:
+            heapq.heappush(self.slowest, entry)
+        elif self.slowest and entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def __str__(self):
+        return ('%(queries)d queries in %(db_time).3fs, %(wait).3fs waiting '
+                'for a connection' % {'queries': self.queries,
+                                      'db_time': self.db_time,
+                                      'wait': self.checkout_wait})
+
+
+class TagStats(object):
+    """Database usage of all the calls with a tag since the start."""
+
+    def __init__(self):
+        self.calls = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.db_time = 0.0
+        self.checkout_wait = 0.0
+
+    def add(self, stats):
+        self.calls += 1
+        self.queries += stats.queries
+        self.max_queries = max(self.max_queries, stats.queries)
+        self.db_time += stats.db_time
+        self.checkout_wait += stats.checkout_wait
+
+    def __str__(self):
+        return ('%(calls)d calls, %(avg_queries).1f queries on average and '
+                'at most %(max_queries)d, %(avg_time).3fs in the database on '
+                'average, %(wait).3fs waiting for connections in total' %
+                {'calls': self.calls,
+                 'avg_queries': float(self.queries) / self.calls,
+                 'max_queries': self.max_queries,
+                 'avg_time': self.db_time / self.calls,
+                 'wait': self.checkout_wait})
+
+
+def current():
+    """Return the statistics being recorded in this greenthread, if any."""
+    return getattr(_local, 'stats', None)
+
+
+def start(tag):
+    """Start recording the statistics of the calls made with a tag."""
+    stats = RequestStats(tag)
+    _local.stats = stats
+    return stats
+
+
+def finish(stats):
+    """Stop recording the statistics started with start and log them."""
+    if current() is stats:
+        _local.stats = None
+    if not stats.queries:
+        return
+    _totals.setdefault(stats.tag, TagStats()).add(stats)
+    slowest = '; '.join('%.3fs: %s' % entry
+                        for entry in sorted(stats.slowest, reverse=True))
+    if stats.queries > cfg.CONF.db_stats_max_queries:
+        LOG.warn(_LW("%(tag)s ran %(stats)s. Slowest statements: "
+                     "%(slowest)s"),
+                 {'tag': stats.tag, 'stats': stats, 'slowest': slowest})
+    else:
+        LOG.debug("%(tag)s ran %(stats)s. Slowest statements: %(slowest)s",
+                  {'tag': stats.tag, 'stats': stats, 'slowest': slowest})
+    _report_periodically()
+
+
+@contextlib.contextmanager
+def record(tag):
+    stats = start(tag)
+    try:
+        yield stats
+    finally:
+        finish(stats)
+
+
+class RecordedAppIter(object):
+    """WSGI response body finishing the recording once it is written.
+
+    The body of a streamed response runs queries after the application
+    returned.
+    """
+
+    def __init__(self, app_iter, stats):
+        self._app_iter = app_iter
+        self._stats = stats
+
+    def __iter__(self):
+        return iter(self._app_iter)
+
+    def close(self):
+        try:
+            if hasattr(self._app_iter, 'close'):
+                self._app_iter.close()
+        finally:
+            finish(self._stats)
+
+
+class RecordedEndpoint(object):
+    """RPC endpoint recording the statistics of the methods it proxies."""
+
+    def __init__(self, endpoint):
+        self._endpoint = endpoint
+
+    def __getattr__(self, name):
+        attr = getattr(self._endpoint, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        tag = 'rpc:%s.%s' % (self._endpoint.__class__.__name__, name)
+
+        @functools.wraps(attr)
+        def recorded(*args, **kwargs):
+            with record(tag):
+                return attr(*args, **kwargs)
+        return recorded
+
+
+def report():
+    """Log the statistics of every tag and of the connection pools."""
+    for engine in _engines:
+        LOG.info(_LI("Database connection pool: %s"), engine.pool.status())
+    for tag, totals in sorted(_totals.items(),
+                              key=lambda item: -item[1].db_time):
+        LOG.info(_LI("%(tag)s: %(totals)s"), {'tag': tag, 'totals': totals})
+
+
+def _report_periodically():
+    global _last_report
+    interval = cfg.CONF.db_stats_report_interval
+    if interval and time.time() - _last_report > interval:
+        _last_report = time.time()
+        report()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    # The start time is kept on the execution context of the statement,
+    # which is discarded with it when the statement fails
+    if context is not None:
+        context.db_stats_start_time = time.time()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    start_time = getattr(context, 'db_stats_start_time', None)
+    if start_time is None:
+        return
+    duration = time.time() - start_time
+    stats = current()
+    if stats:
+        stats.add_statement(statement, duration)
+    if duration > cfg.CONF.db_slow_statement_threshold:
+        LOG.warn(_LW("Slow database statement (%(duration).3fs, "
+                     "%(tag)s): %(statement)s"),
+                 {'duration': duration, 'tag': stats.tag if stats else '-',
+                  'statement': statement})
+
+
+def _time_checkouts(pool):
+    # The pool has no event before a checkout, its connect method is
+    # wrapped to know the time spent waiting for a free connection
+    if getattr(pool, 'db_stats_timed', False):
+        return
+    connect = pool.connect
+
+    @functools.wraps(connect)
+    def timed_connect():
+        start_time = time.time()
+        try:
+            return connect()
+        finally:
+            stats = current()
+            if stats:
+                stats.checkout_wait += time.time() - start_time
+    pool.connect = timed_connect
+    pool.db_stats_timed = True
+
+
+def instrument_engine(engine):
+    """Record the statistics of the statements run by the engine."""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        # The pool of the engine is replaced on dispose, keeping the pool
+        # events of the engine: the checkouts of the new pool are timed
+        # from its first checkout on
+        _time_checkouts(engine.pool)
+
+    event.listen(engine, 'checkout', _checkout)
+    _time_checkouts(engine.pool)
+    _engines.append(engine)
@@ -871,6 +871,8 @@ class LinuxBridgeNeutronAgentRPC(sg_rpc.SecurityGroupAgentRpcMixin):
             # resync is needed
             return True
 
+        devices_up = []
+        devices_down = []
         for device_details in devices_details_list:
             device = device_details['device']
             LOG.debug("Port %s added", device)
@@ -895,43 +897,53 @@ class LinuxBridgeNeutronAgentRPC(sg_rpc.SecurityGroupAgentRpcMixin):
                         segmentation_id,
                         device_details['port_id']):
 
-                        # update plugin about port status
-                        self.plugin_rpc.update_device_up(self.context,
-                                                         device,
-                                                         self.agent_id,
-                                                         cfg.CONF.host)
+                        devices_up.append(device)
                     else:
-                        self.plugin_rpc.update_device_down(self.context,
-                                                           device,
-                                                           self.agent_id,
-                                                           cfg.CONF.host)
+                        devices_down.append(device)
                 else:
                     self.remove_port_binding(device_details['network_id'],
                                              device_details['port_id'])
             else:
                 LOG.info(_LI("Device %s not defined on plugin"), device)
-        return False
+
+        if not devices_up and not devices_down:
+            return False
+        # update plugin about port status
+        try:
+            devices_set = self.plugin_rpc.update_device_list(
+                self.context, devices_up, devices_down, self.agent_id,
+                cfg.CONF.host)
+        except Exception as e:
+            LOG.debug("Unable to update the status of %(devices)s: %(e)s",
+                      {'devices': devices_up + devices_down, 'e': e})
+            # resync is needed
+            return True
+        return bool(devices_set.get('failed_devices_up') or
+                    devices_set.get('failed_devices_down'))
 
     def treat_devices_removed(self, devices):
         resync = False
         self.remove_devices_filter(devices)
         for device in devices:
             LOG.info(_LI("Attachment %s removed"), device)
-            details = None
-            try:
-                details = self.plugin_rpc.update_device_down(self.context,
-                                                             device,
-                                                             self.agent_id,
-                                                             cfg.CONF.host)
-            except Exception as e:
-                LOG.debug("port_removed failed for %(device)s: %(e)s",
-                          {'device': device, 'e': e})
-                resync = True
-            if details and details['exists']:
-                LOG.info(_LI("Port %s updated."), device)
+        devices_down = []
+        try:
+            devices_set = self.plugin_rpc.update_device_list(
+                self.context, [], list(devices), self.agent_id,
+                cfg.CONF.host)
+            devices_down = devices_set.get('devices_down', [])
+            resync = bool(devices_set.get('failed_devices_down'))
+        except Exception as e:
+            LOG.debug("port_removed failed for %(devices)s: %(e)s",
+                      {'devices': devices, 'e': e})
+            resync = True
+        for details in devices_down:
+            if details['exists']:
+                LOG.info(_LI("Port %s updated."), details['device'])
             else:
-                LOG.debug("Device %s not defined on plugin", device)
-            self.br_mgr.remove_empty_bridges()
+                LOG.debug("Device %s not defined on plugin",
+                          details['device'])
+        self.br_mgr.remove_empty_bridges()
         return resync
 
     def scan_devices(self, previous, sync):
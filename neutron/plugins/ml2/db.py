@@ -77,6 +77,23 @@ def get_network_segments(session, network_id, filter_dynamic=False):
         return [_make_segment_dict(record) for record in records]
 
 
+def get_networks_segments(session, network_ids, filter_dynamic=False):
+    """Get the segments of several networks, grouped by network id."""
+    segments = dict((network_id, []) for network_id in network_ids)
+    if not network_ids:
+        return segments
+    with session.begin(subtransactions=True):
+        query = (session.query(models.NetworkSegment).
+                 filter(models.NetworkSegment.network_id.in_(network_ids)).
+                 order_by(models.NetworkSegment.segment_index))
+        if filter_dynamic is not None:
+            query = query.filter_by(is_dynamic=filter_dynamic)
+        for record in query:
+            segments[record.network_id].append(_make_segment_dict(record))
+
+        return segments
+
+
 def get_segment_by_id(session, segment_id):
     with session.begin(subtransactions=True):
         try:
@@ -207,6 +224,53 @@ def get_port(session, port_id):
             return
 
 
+def get_ports(session, port_ids):
+    """Get the port records matching several (possibly partial) port ids.
+
+    Returns a dict mapping each requested port id to its port record, or
+    to None when no port, or more than one port, matches it.
+    """
+    ports = dict((port_id, None) for port_id in port_ids)
+    if not port_ids:
+        return ports
+
+    # break large queries into smaller parts
+    if len(port_ids) > MAX_PORTS_PER_QUERY:
+        port_ids = list(port_ids)
+        for i in range(0, len(port_ids), MAX_PORTS_PER_QUERY):
+            ports.update(get_ports(session,
+                                   port_ids[i:i + MAX_PORTS_PER_QUERY]))
+        return ports
+
+    with session.begin(subtransactions=True):
+        # partial UUIDs must be individually matched with startswith.
+        # full UUIDs may be matched directly in an IN statement
+        partial_uuids = set(port_id for port_id in port_ids
+                            if not uuidutils.is_uuid_like(port_id))
+        full_uuids = set(port_ids) - partial_uuids
+        or_criteria = [models_v2.Port.id.startswith(port_id)
+                       for port_id in partial_uuids]
+        if full_uuids:
+            or_criteria.append(models_v2.Port.id.in_(full_uuids))
+
+        query = session.query(models_v2.Port).filter(or_(*or_criteria))
+        matches = {}
+        for record in query:
+            if record.id in full_uuids:
+                matches.setdefault(record.id, []).append(record)
+            for port_id in partial_uuids:
+                if record.id.startswith(port_id):
+                    matches.setdefault(port_id, []).append(record)
+
+    for port_id, records in matches.iteritems():
+        if len(records) > 1:
+            LOG.error(_LE("Multiple ports have port_id starting with %s"),
+                      port_id)
+            continue
+        ports[port_id] = records[0]
+    return ports
+
+
 def get_port_from_device_mac(device_mac):
     LOG.debug("get_port_from_device_mac() called for mac %s", device_mac)
     session = db_api.get_session()
@@ -590,6 +590,36 @@ class MechanismDriver(object):
         """
         pass
 
+    def create_ports_precommit(self, contexts):
+        """Allocate resources for new ports created in bulk.
+
+        :param contexts: list of PortContext instances describing the
+        ports.
+
+        Called inside transaction context on session, once for all the
+        ports of a bulk creation. The default implementation calls
+        create_port_precommit for each port; drivers can override it
+        to process the ports at once. Raising an exception will result
+        in a rollback of the current transaction.
+        """
+        for context in contexts:
+            self.create_port_precommit(context)
+
+    def create_ports_postcommit(self, contexts):
+        """Create ports created in bulk.
+
+        :param contexts: list of PortContext instances describing the
+        ports.
+
+        Called after the transaction completes, once for all the ports
+        of a bulk creation. The default implementation calls
+        create_port_postcommit for each port; drivers can override it
+        to process the ports at once. Raising an exception will result
+        in the deletion of all the ports.
+        """
+        for context in contexts:
+            self.create_port_postcommit(context)
+
     def update_port_precommit(self, context):
         """Update resources of a port.
 
@@ -120,9 +120,11 @@ class TypeManager(stevedore.named.NamedExtensionManager):
             value = None
         return value
 
-    def _extend_network_dict_provider(self, context, network):
+    def _extend_network_dict_provider(self, context, network,
+                                      segments=None):
         id = network['id']
-        segments = db.get_network_segments(context.session, id)
+        if segments is None:
+            segments = db.get_network_segments(context.session, id)
         if not segments:
             LOG.error(_LE("Network %s has no segments"), id)
             network[provider.NETWORK_TYPE] = None
@@ -500,6 +502,34 @@ class MechanismManager(stevedore.named.NamedExtensionManager):
         """
         self._call_on_drivers("create_port_postcommit", context)
 
+    def create_ports_precommit(self, contexts):
+        """Notify all mechanism drivers during bulk port creation.
+
+        :raises: neutron.plugins.ml2.common.MechanismDriverError
+        if any mechanism driver create_ports_precommit call fails.
+
+        Called within the database transaction, with the contexts of
+        all the ports created. If a mechanism driver raises an
+        exception, then a MechanismDriverError is propogated to the
+        caller, triggering a rollback. There is no guarantee that all
+        mechanism drivers are called in this case.
+        """
+        self._call_on_drivers("create_ports_precommit", contexts)
+
+    def create_ports_postcommit(self, contexts):
+        """Notify all mechanism drivers of bulk port creation.
+
+        :raises: neutron.plugins.ml2.common.MechanismDriverError
+        if any mechanism driver create_ports_postcommit call fails.
+
+        Called after the database transaction, with the contexts of all
+        the ports created. Errors raised by mechanism drivers are left
+        to propagate to the caller, where the ports will be deleted,
+        triggering any required cleanup. There is no guarantee that all
+        mechanism drivers are called in this case.
+        """
+        self._call_on_drivers("create_ports_postcommit", contexts)
+
     def update_port_precommit(self, context):
         """Notify all mechanism drivers during port update.
 
@@ -780,7 +780,12 @@ class Ml2Plugin(db_base_plugin_v2.NeutronDbPluginV2,
             # the fact that an error occurred.
             LOG.error(_LE("mechanism_manager.delete_subnet_postcommit failed"))
 
-    def create_port(self, context, port):
+    def _create_port_db(self, context, port, network=None):
+        """Create a port in the database, in the current transaction.
+
+        Returns the PortContext of the new port and the port if its host
+        changed.
+        """
         attrs = port['port']
         attrs['status'] = const.PORT_STATUS_DOWN
 
@@ -792,7 +797,8 @@ class Ml2Plugin(db_base_plugin_v2.NeutronDbPluginV2,
             result = super(Ml2Plugin, self).create_port(context, port)
             self.extension_manager.process_create_port(session, attrs, result)
             self._process_port_create_security_group(context, result, sgids)
-            network = self.get_network(context, result['network_id'])
+            if network is None:
+                network = self.get_network(context, result['network_id'])
             binding = db.add_port_binding(session, result['id'])
             mech_context = driver_context.PortContext(self, context, result,
                                                       network, binding)
@@ -805,6 +811,13 @@ class Ml2Plugin(db_base_plugin_v2.NeutronDbPluginV2,
                     attrs.get(addr_pair.ADDRESS_PAIRS)))
             self._process_port_create_extra_dhcp_opts(context, result,
                                                       dhcp_opts)
+        return mech_context, new_host_port
+
+    def create_port(self, context, port):
+        session = context.session
+        with session.begin(subtransactions=True):
+            mech_context, new_host_port = self._create_port_db(context, port)
+            result = mech_context.current
             self.mechanism_manager.create_port_precommit(mech_context)
 
         # Notification must be sent after the above transaction is complete
@@ -831,6 +844,64 @@ class Ml2Plugin(db_base_plugin_v2.NeutronDbPluginV2,
                 self.delete_port(context, result['id'])
         return bound_context._port
 
+    def create_port_bulk(self, context, ports):
+        """Create many ports in a single transaction.
+
+        The mechanism drivers are called once for all the ports, with
+        create_ports_precommit and create_ports_postcommit. If any port
+        fails to be created, none is.
+        """
+        prepared_macs = self._prepare_bulk_macs(context, ports)
+        networks = {}
+        mech_contexts = []
+        new_host_ports = []
+
+        session = context.session
+        try:
+            with session.begin(subtransactions=True):
+                for item in ports['ports']:
+                    network_id = item['port']['network_id']
+                    if network_id not in networks:
+                        networks[network_id] = self.get_network(context,
+                                                                network_id)
+                    mech_context, new_host_port = self._create_port_db(
+                        context, item, networks[network_id])
+                    mech_contexts.append(mech_context)
+                    new_host_ports.append(new_host_port)
+                self.mechanism_manager.create_ports_precommit(mech_contexts)
+        finally:
+            self._release_bulk_macs(prepared_macs)
+
+        results = [ctx.current for ctx in mech_contexts]
+        # Notification must be sent after the above transaction is complete
+        for new_host_port in new_host_ports:
+            self._notify_l3_agent_new_port(context, new_host_port)
+
+        try:
+            self.mechanism_manager.create_ports_postcommit(mech_contexts)
+        except ml2_exc.MechanismDriverError:
+            with excutils.save_and_reraise_exception():
+                LOG.error(_LE("mechanism_manager.create_ports_postcommit "
+                              "failed, deleting ports %s"),
+                          [result['id'] for result in results])
+                for result in results:
+                    self.delete_port(context, result['id'])
+
+        self.notify_security_groups_member_updated_bulk(context, results)
+
+        bound_contexts = []
+        for mech_context in mech_contexts:
+            try:
+                bound_contexts.append(self._bind_port_if_needed(mech_context))
+            except ml2_exc.MechanismDriverError:
+                with excutils.save_and_reraise_exception():
+                    LOG.error(_LE("_bind_port_if_needed failed, deleting "
+                                  "ports %s"),
+                              [result['id'] for result in results])
+                    for result in results:
+                        self.delete_port(context, result['id'])
+        return [bound_context._port for bound_context in bound_contexts]
+
     def update_port(self, context, id, port):
         attrs = port['port']
         need_port_update_notify = False
@@ -1103,6 +1174,126 @@ class Ml2Plugin(db_base_plugin_v2.NeutronDbPluginV2,
 
         return self._bind_port_if_needed(port_context)
 
+    def get_bound_ports_contexts(self, plugin_context, port_ids, host=None):
+        """Get the bound port contexts of several ports at once.
+
+        The ports, their bindings, networks and segments are fetched with a
+        few queries for all the ports. Returns a dict mapping each of the
+        (possibly partial) port ids to its bound port context, or to None
+        when the port or its binding is not found.
+        """
+        port_contexts = dict((port_id, None) for port_id in port_ids)
+        session = plugin_context.session
+        with session.begin(subtransactions=True):
+            ports_db = db.get_ports(session, port_ids)
+            networks, segments = self._get_networks_and_segments(
+                plugin_context,
+                set(port_db.network_id for port_db in ports_db.values()
+                    if port_db))
+            for port_id, port_db in ports_db.iteritems():
+                if not port_db:
+                    LOG.debug("No ports have port_id starting with %s",
+                              port_id)
+                    continue
+                port = self._make_port_dict(port_db)
+                network = networks[port['network_id']]
+                network_segments = segments[port['network_id']]
+                if port['device_owner'] == const.DEVICE_OWNER_DVR_INTERFACE:
+                    binding = db.get_dvr_port_binding_by_host(
+                        session, port['id'], host)
+                    if not binding:
+                        LOG.error(_LE("Binding info for DVR port %s not "
+                                      "found"), port_id)
+                        continue
+                    port_contexts[port_id] = driver_context.DvrPortContext(
+                        self, plugin_context, port, network, binding,
+                        network_segments=network_segments)
+                else:
+                    binding = port_db.port_binding
+                    if not binding:
+                        LOG.info(_LI("Binding info for port %s was not "
+                                     "found, it might have been deleted "
+                                     "already."), port_id)
+                        continue
+                    port_contexts[port_id] = driver_context.PortContext(
+                        self, plugin_context, port, network, binding,
+                        network_segments=network_segments)
+
+        for port_id, port_context in port_contexts.iteritems():
+            if port_context:
+                port_contexts[port_id] = self._bind_port_if_needed(
+                    port_context)
+        return port_contexts
+
+    def _get_networks_and_segments(self, context, network_ids):
+        """Get the networks with the given ids and their segments.
+
+        Returns a dict of the network dicts and a dict of their segment
+        lists, both keyed by network id.
+        """
+        segments = db.get_networks_segments(context.session,
+                                            list(network_ids))
+        networks = {}
+        if network_ids:
+            for network in super(Ml2Plugin, self).get_networks(
+                    context, filters={'id': list(network_ids)}):
+                self.type_manager._extend_network_dict_provider(
+                    context, network, segments=segments[network['id']])
+                networks[network['id']] = network
+        return networks, segments
+
+    def update_port_statuses(self, context, port_statuses, host=None):
+        """Update the status of several ports at once.
+
+        port_statuses maps the (possibly partial) port ids to their new
+        status. The statuses of the ports are changed in a single
+        transaction. Returns a dict mapping each of the port ids to the
+        non-truncated uuid if the port exists, or to None otherwise.
+        """
+        port_ids = dict((port_id, None) for port_id in port_statuses)
+        dvr_port_ids = []
+        mech_contexts = []
+        session = context.session
+        # REVISIT: Serialize this operation with a semaphore, as
+        # update_port_status does, to prevent deadlocks in the DB.
+        with contextlib.nested(lockutils.lock('db-access'),
+                               session.begin(subtransactions=True)):
+            ports = db.get_ports(session, port_statuses.keys())
+            networks, segments = self._get_networks_and_segments(
+                context, set(port.network_id for port in ports.values()
+                             if port))
+            for port_id, port in ports.iteritems():
+                if not port:
+                    LOG.warning(_LW("Port %(port)s updated up by agent not "
+                                    "found"), {'port': port_id})
+                    continue
+                if port['device_owner'] == const.DEVICE_OWNER_DVR_INTERFACE:
+                    # the status of DVR ports is derived from their
+                    # bindings on every host
+                    dvr_port_ids.append(port_id)
+                    continue
+                port_ids[port_id] = port['id']
+                status = port_statuses[port_id]
+                if port.status == status:
+                    continue
+                original_port = self._make_port_dict(port)
+                port.status = status
+                updated_port = self._make_port_dict(port)
+                mech_context = driver_context.PortContext(
+                    self, context, updated_port, networks[port.network_id],
+                    port.port_binding, original_port=original_port,
+                    network_segments=segments[port.network_id])
+                self.mechanism_manager.update_port_precommit(mech_context)
+                mech_contexts.append(mech_context)
+
+        for mech_context in mech_contexts:
+            self.mechanism_manager.update_port_postcommit(mech_context)
+
+        for port_id in dvr_port_ids:
+            port_ids[port_id] = self.update_port_status(
+                context, port_id, port_statuses[port_id], host)
+        return port_ids
+
     def update_port_status(self, context, port_id, status, host=None):
         """
         Returns port_id (non-truncated uuid) if the port exists.
@@ -1185,6 +1376,28 @@ class Ml2Plugin(db_base_plugin_v2.NeutronDbPluginV2,
             port_host = db.get_port_binding_host(port_id)
             return (port_host == host)
 
+    def ports_bound_to_host(self, context, port_ids, host):
+        """Return the subset of the (possibly partial) port ids whose
+        ports are bound to the given host.
+        """
+        bound_port_ids = set()
+        session = context.session
+        with session.begin(subtransactions=True):
+            for port_id, port in db.get_ports(session, port_ids).iteritems():
+                if not port:
+                    LOG.debug("No Port match for: %s", port_id)
+                    continue
+                if port['device_owner'] == const.DEVICE_OWNER_DVR_INTERFACE:
+                    bindings = db.get_dvr_port_bindings(session, port['id'])
+                    if any(b.host == host for b in bindings):
+                        bound_port_ids.add(port_id)
+                    else:
+                        LOG.debug("No binding found for DVR port %s",
+                                  port['id'])
+                elif port.port_binding and port.port_binding.host == host:
+                    bound_port_ids.add(port_id)
+        return bound_port_ids
+
     def get_ports_from_devices(self, devices):
         port_ids_to_devices = dict((self._device_to_port_id(device), device)
                                    for device in devices)
@@ -23,7 +23,7 @@ from neutron.common import rpc as n_rpc
 from neutron.common import topics
 from neutron.common import utils
 from neutron.extensions import portbindings
-from neutron.i18n import _LW
+from neutron.i18n import _LE, _LW
 from neutron import manager
 from neutron.openstack.common import log
 from neutron.plugins.common import constants as service_constants
@@ -44,7 +44,8 @@ class RpcCallbacks(type_tunnel.TunnelRpcCallbackMixin):
     #   1.3 get_device_details rpc signature upgrade to obtain 'host' and
     #       return value to include fixed_ips and device_owner for
     #       the device port
-    target = messaging.Target(version='1.3')
+    #   1.4 Support update_device_list
+    target = messaging.Target(version='1.4')
 
     def __init__(self, notifier, type_manager):
         self.setup_tunnel_callback_mixin(notifier, type_manager)
@@ -64,11 +65,27 @@ class RpcCallbacks(type_tunnel.TunnelRpcCallbackMixin):
         port_context = plugin.get_bound_port_context(rpc_context,
                                                      port_id,
                                                      host)
+        entry, new_status = self._get_device_details(device, agent_id,
+                                                     port_id, port_context)
+        if new_status:
+            plugin.update_port_status(rpc_context,
+                                      port_id,
+                                      new_status,
+                                      host)
+        LOG.debug("Returning: %s", entry)
+        return entry
+
+    def _get_device_details(self, device, agent_id, port_id, port_context):
+        """Build the details of a device from its bound port context.
+
+        Returns the details and the status the port must be updated to,
+        or None if its status is already right.
+        """
         if not port_context:
             LOG.warning(_LW("Device %(device)s requested by agent "
                             "%(agent_id)s not found in database"),
                         {'device': device, 'agent_id': agent_id})
-            return {'device': device}
+            return {'device': device}, None
 
         segment = port_context.bound_segment
         port = port_context.current
@@ -81,15 +98,12 @@ class RpcCallbacks(type_tunnel.TunnelRpcCallbackMixin):
                          'agent_id': agent_id,
                          'network_id': port['network_id'],
                          'vif_type': port[portbindings.VIF_TYPE]})
-            return {'device': device}
+            return {'device': device}, None
 
         new_status = (q_const.PORT_STATUS_BUILD if port['admin_state_up']
                       else q_const.PORT_STATUS_DOWN)
-        if port['status'] != new_status:
-            plugin.update_port_status(rpc_context,
-                                      port_id,
-                                      new_status,
-                                      host)
+        if port['status'] == new_status:
+            new_status = None
 
         entry = {'device': device,
                  'network_id': port['network_id'],
@@ -102,18 +116,41 @@ class RpcCallbacks(type_tunnel.TunnelRpcCallbackMixin):
                  'fixed_ips': port['fixed_ips'],
                  'device_owner': port['device_owner'],
                  'profile': port[portbindings.PROFILE]}
-        LOG.debug("Returning: %s", entry)
-        return entry
+        return entry, new_status
 
     def get_devices_details_list(self, rpc_context, **kwargs):
-        return [
-            self.get_device_details(
-                rpc_context,
-                device=device,
-                **kwargs
-            )
-            for device in kwargs.pop('devices', [])
-        ]
+        """Agent requests the details of several devices.
+
+        The ports of all the devices are fetched together and their
+        statuses are updated in a single transaction.
+        """
+        agent_id = kwargs.get('agent_id')
+        devices = kwargs.get('devices', [])
+        host = kwargs.get('host')
+        if not devices:
+            return []
+        LOG.debug("Details of devices %(devices)s requested by agent "
+                  "%(agent_id)s with host %(host)s",
+                  {'devices': devices, 'agent_id': agent_id, 'host': host})
+
+        plugin = manager.NeutronManager.get_plugin()
+        port_ids = dict((device, plugin._device_to_port_id(device))
+                        for device in devices)
+        port_contexts = plugin.get_bound_ports_contexts(
+            rpc_context, set(port_ids.values()), host)
+        entries = []
+        new_statuses = {}
+        for device in devices:
+            port_id = port_ids[device]
+            entry, new_status = self._get_device_details(
+                device, agent_id, port_id, port_contexts.get(port_id))
+            if new_status:
+                new_statuses[port_id] = new_status
+            entries.append(entry)
+        if new_statuses:
+            plugin.update_port_statuses(rpc_context, new_statuses, host)
+        LOG.debug("Returning: %s", entries)
+        return entries
 
     def update_device_down(self, rpc_context, **kwargs):
         """Device no longer exists on agent."""
@@ -161,11 +198,76 @@ class RpcCallbacks(type_tunnel.TunnelRpcCallbackMixin):
         port_id = plugin.update_port_status(rpc_context, port_id,
                                             q_const.PORT_STATUS_ACTIVE,
                                             host)
+        self._notify_l3_devices_up(rpc_context, [port_id])
+
+    def update_device_list(self, rpc_context, **kwargs):
+        """Devices are up or no longer exist on agent.
+
+        The statuses of the ports of all the devices are updated in a
+        single transaction.
+        """
+        agent_id = kwargs.get('agent_id')
+        host = kwargs.get('host')
+        devices_up = kwargs.get('devices_up') or []
+        devices_down = kwargs.get('devices_down') or []
+        LOG.debug("Devices %(devices_up)s up and devices %(devices_down)s "
+                  "no longer existing at agent %(agent_id)s",
+                  {'devices_up': devices_up, 'devices_down': devices_down,
+                   'agent_id': agent_id})
+        plugin = manager.NeutronManager.get_plugin()
+        port_ids = dict((device, plugin._device_to_port_id(device))
+                        for device in devices_up + devices_down)
+        try:
+            if host:
+                bound_port_ids = plugin.ports_bound_to_host(
+                    rpc_context, set(port_ids.values()), host)
+            else:
+                bound_port_ids = set(port_ids.values())
+            port_statuses = {}
+            for devices, status in ((devices_up, q_const.PORT_STATUS_ACTIVE),
+                                    (devices_down, q_const.PORT_STATUS_DOWN)):
+                for device in devices:
+                    if port_ids[device] in bound_port_ids:
+                        port_statuses[port_ids[device]] = status
+                    else:
+                        LOG.debug("Device %(device)s not bound to the"
+                                  " agent host %(host)s",
+                                  {'device': device, 'host': host})
+            updated_port_ids = plugin.update_port_statuses(
+                rpc_context, port_statuses, host)
+        except Exception:
+            LOG.exception(_LE("Failed to update the status of devices "
+                              "%(devices_up)s and %(devices_down)s"),
+                          {'devices_up': devices_up,
+                           'devices_down': devices_down})
+            return {'devices_up': [],
+                    'failed_devices_up': devices_up,
+                    'devices_down': [],
+                    'failed_devices_down': devices_down}
+
+        self._notify_l3_devices_up(
+            rpc_context, [updated_port_ids.get(port_ids[device])
+                          for device in devices_up
+                          if port_ids[device] in port_statuses])
+        return {'devices_up': devices_up,
+                'failed_devices_up': [],
+                'devices_down': [
+                    {'device': device,
+                     # devices not bound to the host are left as is
+                     'exists': (port_ids[device] not in port_statuses or
+                                bool(updated_port_ids[port_ids[device]]))}
+                    for device in devices_down],
+                'failed_devices_down': []}
+
+    def _notify_l3_devices_up(self, rpc_context, port_ids):
         l3plugin = manager.NeutronManager.get_service_plugins().get(
             service_constants.L3_ROUTER_NAT)
-        if (l3plugin and
-            utils.is_extension_supported(l3plugin,
-                                         q_const.L3_DISTRIBUTED_EXT_ALIAS)):
+        if not (port_ids and l3plugin and
+                utils.is_extension_supported(
+                    l3plugin, q_const.L3_DISTRIBUTED_EXT_ALIAS)):
+            return
+        plugin = manager.NeutronManager.get_plugin()
+        for port_id in port_ids:
             try:
                 port = plugin._get_port(rpc_context, port_id)
                 l3plugin.dvr_vmarp_table_update(rpc_context, port, "add")
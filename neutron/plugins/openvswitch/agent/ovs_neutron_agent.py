@@ -18,6 +18,7 @@ import hashlib
 import signal
 import sys
 import time
+import uuid
 
 import eventlet
 eventlet.monkey_patch()
@@ -31,6 +32,7 @@ from six import moves
 from neutron.agent import l2population_rpc
 from neutron.agent.linux import ip_lib
 from neutron.agent.linux import ovs_lib
+from neutron.agent.linux import ovsdb_monitor
 from neutron.agent.linux import polling
 from neutron.agent.linux import utils
 from neutron.agent import rpc as agent_rpc
@@ -52,6 +54,9 @@ from neutron.plugins.openvswitch.common import constants
 LOG = logging.getLogger(__name__)
 cfg.CONF.import_group('AGENT', 'neutron.plugins.openvswitch.common.config')
 
+# Flow cookies are 64 bits wide
+UINT64_BITMASK = (1 << 64) - 1
+
 # A placeholder for dead vlans.
 DEAD_VLAN_TAG = str(q_const.MAX_VLAN_TAG + 1)
 
@@ -195,8 +200,23 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         # Keep track of int_br's device count for use by _report_state()
         self.int_br_device_count = 0
 
+        # Every flow installed by this run of the agent carries this
+        # cookie, so that the flows of a previous run can be told apart
+        # and deleted once the agent is in sync.
+        self.agent_uuid_stamp = uuid.uuid4().int & UINT64_BITMASK
+        self.drop_flows_on_start = cfg.CONF.AGENT.drop_flows_on_start
+        self.cleanup_stale_flows_pending = not self.drop_flows_on_start
+
         self.int_br = ovs_lib.OVSBridge(integ_br, self.root_helper)
+        self.int_br.default_cookie = self.agent_uuid_stamp
         self.setup_integration_br()
+        # The flows of the previous run are kept until the agent is in sync,
+        # so the networks must get back the local VLANs their ports are
+        # tagged with, and no other network may be given one of them.
+        self._local_vlan_hints = {}
+        self._reserved_local_vlans = set()
+        if not self.drop_flows_on_start:
+            self._restore_local_vlan_map()
         # Stores port update notifications for processing in main rpc loop
         self.updated_ports = set()
         self.setup_rpc()
@@ -350,6 +370,7 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
             self._setup_tunnel_port(self.tun_br, tun_name, tunnel_ip,
                                     tunnel_type)
 
+    @ovs_lib.with_deferred_flows
     def fdb_add(self, context, fdb_entries):
         LOG.debug("fdb_add received")
         for lvm, agent_ports in self.get_agent_ports(fdb_entries,
@@ -364,6 +385,7 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                     self.fdb_add_tun(context, self.tun_br, lvm,
                                      agent_ports, self.tun_br_ofports)
 
+    @ovs_lib.with_deferred_flows
     def fdb_remove(self, context, fdb_entries):
         LOG.debug("fdb_remove received")
         for lvm, agent_ports in self.get_agent_ports(fdb_entries,
@@ -471,11 +493,13 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         if lvm:
             lvid = lvm.vlan
         else:
-            if not self.available_local_vlans:
-                LOG.error(_LE("No local VLAN available for net-id=%s"),
-                          net_uuid)
-                return
-            lvid = self.available_local_vlans.pop()
+            lvid = self._local_vlan_hints.pop(net_uuid, None)
+            if lvid is None:
+                if not self.available_local_vlans:
+                    LOG.error(_LE("No local VLAN available for net-id=%s"),
+                              net_uuid)
+                    return
+                lvid = self.available_local_vlans.pop()
             self.local_vlan_map[net_uuid] = LocalVLANMapping(lvid,
                                                              network_type,
                                                              physical_network,
@@ -654,6 +678,10 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         if cur_tag != str(lvm.vlan):
             self.int_br.set_db_attribute("Port", port.port_name, "tag",
                                          str(lvm.vlan))
+            # Record the network of the port, for its local VLAN to be
+            # restored when the agent restarts
+            self.int_br.set_db_attribute("Port", port.port_name,
+                                         "other_config:net_uuid", net_uuid)
             if port.ofport != -1:
                 self.int_br.delete_flows(in_port=port.ofport)
 
@@ -701,7 +729,9 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
     def setup_integration_br(self):
         '''Setup the integration bridge.
 
-        Create patch ports and remove all existing flows.
+        If drop_flows_on_start is set, remove the patch port to the tunnel
+        bridge and all existing flows, otherwise keep them until the new
+        flows are installed.
 
         :param bridge_name: the name of the integration bridge.
         :returns: the integration bridge
@@ -713,14 +743,52 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         self.int_br.create()
         self.int_br.set_secure_mode()
 
-        self.int_br.delete_port(cfg.CONF.OVS.int_peer_patch_port)
-        self.int_br.remove_all_flows()
+        if self.drop_flows_on_start:
+            self.int_br.delete_port(cfg.CONF.OVS.int_peer_patch_port)
+            self.int_br.remove_all_flows()
         # switch all traffic using L2 learning
         self.int_br.add_flow(priority=1, actions="normal")
         # Add a canary flow to int_br to track OVS restarts
         self.int_br.add_flow(table=constants.CANARY_TABLE, priority=0,
                              actions="drop")
 
+    def _restore_local_vlan_map(self):
+        '''Reserve the local VLANs of the ports bound by a previous run.
+
+        The local VLAN of a port is kept as a hint for the network recorded
+        in its other_config, and is not given to any other network until the
+        stale flows are deleted.
+        '''
+        ports = self.int_br.get_vif_ports()
+        if not ports:
+            return
+        port_tags = self.int_br.get_port_tag_dict()
+        for port in ports:
+            lvid = port_tags.get(port.port_name)
+            if not isinstance(lvid, int):
+                continue
+            if lvid in self.available_local_vlans:
+                self.available_local_vlans.remove(lvid)
+                self._reserved_local_vlans.add(lvid)
+            elif lvid not in self._reserved_local_vlans:
+                continue
+            other_config = self.int_br.db_get_map("Port", port.port_name,
+                                                  "other_config")
+            net_uuid = other_config.get('net_uuid')
+            if net_uuid and net_uuid not in self._local_vlan_hints:
+                LOG.debug("Restoring local vlan %(lvid)s for "
+                          "net-id=%(net_uuid)s",
+                          {'lvid': lvid, 'net_uuid': net_uuid})
+                self._local_vlan_hints[net_uuid] = lvid
+
+    def _release_reserved_local_vlans(self):
+        '''Free the reserved local VLANs no network has claimed back.'''
+        in_use = set(lvm.vlan for lvm in self.local_vlan_map.values())
+        self.available_local_vlans.update(self._reserved_local_vlans -
+                                          in_use)
+        self._reserved_local_vlans.clear()
+        self._local_vlan_hints.clear()
+
     def setup_ancillary_bridges(self, integ_br, tun_br):
         '''Setup ancillary bridges - for example br-ex.'''
         ovs_bridges = set(ovs_lib.get_bridges(self.root_helper))
@@ -757,8 +825,15 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         '''
         if not self.tun_br:
             self.tun_br = ovs_lib.OVSBridge(tun_br_name, self.root_helper)
+            self.tun_br.default_cookie = self.agent_uuid_stamp
 
-        self.tun_br.reset_bridge()
+        if self.drop_flows_on_start:
+            self.tun_br.reset_bridge()
+        else:
+            # Keep the bridge, its tunnel and patch ports and its flows until
+            # the new flows are installed, the patch ports keep their ofport
+            # and the traffic between the bridges is not interrupted.
+            self.tun_br.create()
         self.patch_tun_ofport = self.int_br.add_patch_port(
             cfg.CONF.OVS.int_peer_patch_port, cfg.CONF.OVS.tun_peer_patch_port)
         self.patch_int_ofport = self.tun_br.add_patch_port(
@@ -769,7 +844,8 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                           "version of OVS does not support tunnels or "
                           "patch ports. Agent terminated!"))
             exit(1)
-        self.tun_br.remove_all_flows()
+        if self.drop_flows_on_start:
+            self.tun_br.remove_all_flows()
 
     def setup_tunnel_br(self):
         '''Setup the tunnel bridge.
@@ -812,7 +888,10 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         # LEARN_FROM_TUN table will have a single flow using a learn action to
         # dynamically set-up flows in UCAST_TO_TUN corresponding to remote mac
         # addresses (assumes that lvid has already been set by a previous flow)
-        learned_flow = ("table=%s,"
+        # The learned flows carry the cookie of the agent, so that they are
+        # not deleted with the stale flows
+        learned_flow = ("cookie=%(cookie)#x,"
+                        "table=%(table)s,"
                         "priority=1,"
                         "hard_timeout=300,"
                         "NXM_OF_VLAN_TCI[0..11],"
@@ -820,7 +899,8 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                         "load:0->NXM_OF_VLAN_TCI[],"
                         "load:NXM_NX_TUN_ID[]->NXM_NX_TUN_ID[],"
                         "output:NXM_OF_IN_PORT[]" %
-                        constants.UCAST_TO_TUN)
+                        {'cookie': self.agent_uuid_stamp,
+                         'table': constants.UCAST_TO_TUN})
         # Once remote mac addresses are learnt, output packet to patch_int
         self.tun_br.add_flow(table=constants.LEARN_FROM_TUN,
                              priority=1,
@@ -897,7 +977,9 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                            'bridge': bridge})
                 sys.exit(1)
             br = ovs_lib.OVSBridge(bridge, self.root_helper)
-            br.remove_all_flows()
+            br.default_cookie = self.agent_uuid_stamp
+            if self.drop_flows_on_start:
+                br.remove_all_flows()
             br.add_flow(priority=1, actions="normal")
             self.phys_brs[physical_network] = br
 
@@ -978,6 +1060,57 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         port_info['removed'] = registered_ports - cur_ports
         return port_info
 
+    def _get_event_vif_id(self, device):
+        external_ids = device['external_ids'] or {}
+        if 'attached-mac' not in external_ids:
+            return
+        if 'iface-id' in external_ids:
+            return external_ids['iface-id']
+        if 'xs-vif-uuid' in external_ids:
+            return self.int_br.get_xapi_iface_id(external_ids['xs-vif-uuid'])
+
+    def _is_int_br_port(self, port_name):
+        br_name = self.int_br.get_bridge_name_for_port_name(port_name)
+        return (br_name or '').strip() == self.int_br.br_name
+
+    def process_ports_events(self, events, registered_ports,
+                             updated_ports=None):
+        """Compute port info from the ovsdb monitor events.
+
+        This is the incremental counterpart of scan_ports: instead of
+        listing every port of the integration bridge, only the interfaces
+        reported by the monitor since the previous iteration are looked at.
+        """
+        cur_ports = set(registered_ports)
+        if updated_ports is None:
+            updated_ports = set()
+        for device in events:
+            vif_id = self._get_event_vif_id(device)
+            if not vif_id:
+                continue
+            if device['event'] == ovsdb_monitor.EVENT_REMOVED:
+                cur_ports.discard(vif_id)
+                continue
+            ofport = device['ofport']
+            if not isinstance(ofport, int) or ofport <= 0:
+                # Not yet ready or failed, an event will follow if the
+                # interface eventually gets a valid ofport.
+                cur_ports.discard(vif_id)
+                continue
+            if vif_id in cur_ports:
+                updated_ports.add(vif_id)
+            elif self._is_int_br_port(device['name']):
+                cur_ports.add(vif_id)
+        self.int_br_device_count = len(cur_ports)
+        port_info = {'current': cur_ports}
+        updated_ports &= cur_ports
+        if updated_ports:
+            port_info['updated'] = updated_ports
+        if cur_ports != registered_ports:
+            port_info['added'] = cur_ports - registered_ports
+            port_info['removed'] = registered_ports - cur_ports
+        return port_info
+
     def check_changed_vlans(self, registered_ports):
         """Return ports which have lost their vlan tag.
 
@@ -1098,8 +1231,27 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                     br.delete_flows(in_port=ofport)
                     self.tun_br_ofports[tunnel_type].pop(remote_ip, None)
 
+    def update_devices_status(self, devices_up, devices_down):
+        """Report the status of several devices to the plugin at once."""
+        if not devices_up and not devices_down:
+            return
+        # The ports must be wired before their status is reported
+        ovs_lib.apply_deferred_flows()
+        devices_set = self.plugin_rpc.update_device_list(
+            self.context, devices_up, devices_down, self.agent_id,
+            cfg.CONF.host)
+        failed_devices = (devices_set.get('failed_devices_up', []) +
+                          devices_set.get('failed_devices_down', []))
+        if failed_devices:
+            raise DeviceListRetrievalError(
+                devices=failed_devices,
+                error=_('unable to update their status'))
+        return devices_set
+
     def treat_devices_added_or_updated(self, devices, ovs_restarted):
         skipped_devices = []
+        devices_up = []
+        devices_down = []
         try:
             devices_details_list = self.plugin_rpc.get_devices_details_list(
                 self.context,
@@ -1138,17 +1290,16 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                 # API server, thus possibly preventing instance spawn.
                 if details.get('admin_state_up'):
                     LOG.debug("Setting status for %s to UP", device)
-                    self.plugin_rpc.update_device_up(
-                        self.context, device, self.agent_id, cfg.CONF.host)
+                    devices_up.append(device)
                 else:
                     LOG.debug("Setting status for %s to DOWN", device)
-                    self.plugin_rpc.update_device_down(
-                        self.context, device, self.agent_id, cfg.CONF.host)
+                    devices_down.append(device)
                 LOG.info(_LI("Configuration for device %s completed."), device)
             else:
                 LOG.warn(_LW("Device %s not defined on plugin"), device)
                 if (port and port.ofport != -1):
                     self.port_dead(port)
+        self.update_devices_status(devices_up, devices_down)
         return skipped_devices
 
     def treat_ancillary_devices_added(self, devices):
@@ -1161,55 +1312,55 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         except Exception as e:
             raise DeviceListRetrievalError(devices=devices, error=e)
 
+        devices_up = []
         for details in devices_details_list:
             device = details['device']
             LOG.info(_LI("Ancillary Port %s added"), device)
+            devices_up.append(device)
 
-            # update plugin about port status
-            self.plugin_rpc.update_device_up(self.context,
-                                             device,
-                                             self.agent_id,
-                                             cfg.CONF.host)
+        # update plugin about port status
+        self.update_devices_status(devices_up, [])
 
-    def treat_devices_removed(self, devices):
-        resync = False
-        self.sg_agent.remove_devices_filter(devices)
+    def _update_devices_down(self, devices):
+        """Report removed devices to the plugin.
+
+        Returns the details of the devices which were updated and the
+        devices which failed to be.
+        """
         for device in devices:
             LOG.info(_LI("Attachment %s removed"), device)
-            try:
-                self.plugin_rpc.update_device_down(self.context,
-                                                   device,
-                                                   self.agent_id,
-                                                   cfg.CONF.host)
-            except Exception as e:
-                LOG.debug("port_removed failed for %(device)s: %(e)s",
-                          {'device': device, 'e': e})
-                resync = True
-                continue
-            self.port_unbound(device)
-        return resync
+        try:
+            devices_set = self.plugin_rpc.update_device_list(
+                self.context, [], list(devices), self.agent_id,
+                cfg.CONF.host)
+        except Exception as e:
+            LOG.debug("port_removed failed for %(devices)s: %(e)s",
+                      {'devices': devices, 'e': e})
+            return [], list(devices)
+        failed_devices = devices_set.get('failed_devices_down', [])
+        for device in failed_devices:
+            LOG.debug("port_removed failed for %s", device)
+        return devices_set.get('devices_down', []), failed_devices
+
+    def treat_devices_removed(self, devices):
+        self.sg_agent.remove_devices_filter(devices)
+        devices_down, failed_devices = self._update_devices_down(devices)
+        for details in devices_down:
+            self.port_unbound(details['device'])
+        return bool(failed_devices)
 
     def treat_ancillary_devices_removed(self, devices):
-        resync = False
-        for device in devices:
-            LOG.info(_LI("Attachment %s removed"), device)
-            try:
-                details = self.plugin_rpc.update_device_down(self.context,
-                                                             device,
-                                                             self.agent_id,
-                                                             cfg.CONF.host)
-            except Exception as e:
-                LOG.debug("port_removed failed for %(device)s: %(e)s",
-                          {'device': device, 'e': e})
-                resync = True
-                continue
+        devices_down, failed_devices = self._update_devices_down(devices)
+        for details in devices_down:
+            device = details['device']
             if details['exists']:
                 LOG.info(_LI("Port %s updated."), device)
                 # Nothing to do regarding local networking
             else:
                 LOG.debug("Device %s not defined on plugin", device)
-        return resync
+        return bool(failed_devices)
 
+    @ovs_lib.with_deferred_flows
     def process_network_ports(self, port_info, ovs_restarted):
         resync_a = False
         resync_b = False
@@ -1265,6 +1416,7 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         # If one of the above operations fails => resync with plugin
         return (resync_a | resync_b)
 
+    @ovs_lib.with_deferred_flows
     def process_ancillary_network_ports(self, port_info):
         resync_a = False
         resync_b = False
@@ -1345,6 +1497,17 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                 port_info.get('removed') or
                 port_info.get('updated'))
 
+    def cleanup_stale_flows(self):
+        bridges = [self.int_br] + self.phys_brs.values()
+        if self.enable_tunneling:
+            bridges.append(self.tun_br)
+        for bridge in bridges:
+            LOG.info(_LI("Cleaning stale %s flows"), bridge.br_name)
+            bridge.delete_stale_flows()
+        # The local VLANs of the previous run are not used by its flows
+        # anymore
+        self._release_reserved_local_vlans()
+
     def check_ovs_status(self):
         # Check for the canary flow
         canary_flow = self.int_br.dump_flows_for_table(constants.CANARY_TABLE)
@@ -1387,6 +1550,7 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
         updated_ports_copy = set()
         ancillary_ports = set()
         tunnel_sync = True
+        full_scan = True
         ovs_status = constants.OVS_NORMAL
         while self.run_daemon_loop:
             start = time.time()
@@ -1402,22 +1566,23 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                 ports.clear()
                 ancillary_ports.clear()
                 sync = False
+                full_scan = True
                 polling_manager.force_polling()
             ovs_status = self.check_ovs_status()
             if ovs_status == constants.OVS_RESTARTED:
-                self.setup_integration_br()
-                self.setup_physical_bridges(self.bridge_mappings)
-                if self.enable_tunneling:
-                    self.reset_tunnel_br()
-                    self.setup_tunnel_br()
-                    tunnel_sync = True
-                    if self.enable_distributed_routing:
-                        self.dvr_agent.reset_ovs_parameters(self.int_br,
-                                                     self.tun_br,
-                                                     self.patch_int_ofport,
-                                                     self.patch_tun_ofport)
-                        self.dvr_agent.reset_dvr_parameters()
-                        self.dvr_agent.setup_dvr_flows_on_integ_tun_br()
+                with ovs_lib.deferred_flows():
+                    self.setup_integration_br()
+                    self.setup_physical_bridges(self.bridge_mappings)
+                    if self.enable_tunneling:
+                        self.reset_tunnel_br()
+                        self.setup_tunnel_br()
+                        tunnel_sync = True
+                        if self.enable_distributed_routing:
+                            self.dvr_agent.reset_ovs_parameters(
+                                self.int_br, self.tun_br,
+                                self.patch_int_ofport, self.patch_tun_ofport)
+                            self.dvr_agent.reset_dvr_parameters()
+                            self.dvr_agent.setup_dvr_flows_on_integ_tun_br()
             elif ovs_status == constants.OVS_DEAD:
                 # Agent doesn't apply any operations when ovs is dead, to
                 # prevent unexpected failure or crash. Sleep and continue
@@ -1446,7 +1611,13 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                     updated_ports_copy = self.updated_ports
                     self.updated_ports = set()
                     reg_ports = (set() if ovs_restarted else ports)
-                    port_info = self.scan_ports(reg_ports, updated_ports_copy)
+                    events = polling_manager.get_events()
+                    if events is None or full_scan or ovs_restarted:
+                        port_info = self.scan_ports(reg_ports,
+                                                    updated_ports_copy)
+                    else:
+                        port_info = self.process_ports_events(
+                            events, reg_ports, updated_ports_copy)
                     LOG.debug("Agent rpc_loop - iteration:%(iter_num)d - "
                               "port information retrieved. "
                               "Elapsed:%(elapsed).3f",
@@ -1499,6 +1670,12 @@ class OVSNeutronAgent(sg_rpc.SecurityGroupAgentRpcCallbackMixin,
                             sync = sync | rc
 
                     polling_manager.polling_completed()
+                    full_scan = False
+                    # Once every port has been wired by this run of the
+                    # agent, the flows of the previous run can go.
+                    if self.cleanup_stale_flows_pending and not sync:
+                        self.cleanup_stale_flows()
+                        self.cleanup_stale_flows_pending = False
                 except Exception:
                     LOG.exception(_LE("Error while processing VIF ports"))
                     # Put the ports back in self.updated_port
@@ -79,6 +79,11 @@ agent_opts = [
                        "outgoing IP packet carrying GRE/VXLAN tunnel.")),
     cfg.BoolOpt('enable_distributed_routing', default=False,
                 help=_("Make the l2 agent run in DVR mode.")),
+    cfg.BoolOpt('drop_flows_on_start', default=False,
+                help=_("Reset the flow tables on agent start. If False, the "
+                       "existing flows are kept while the agent installs "
+                       "its own, and the flows left by a previous agent "
+                       "run are deleted once the agent is in sync.")),
 ]
 
 
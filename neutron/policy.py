@@ -38,6 +38,11 @@ from neutron.openstack.common import policy
 LOG = log.getLogger(__name__)
 
 _ENFORCER = None
+# The target keys read by the rules of the read actions, computed for the
+# rules in _TARGET_KEYS_RULES
+_TARGET_KEYS = {}
+_TARGET_KEYS_RULES = None
+_MISSING = object()
 ADMIN_CTX_POLICY = 'context_is_admin'
 ADVSVC_CTX_POLICY = 'context_is_advsvc'
 # Maps deprecated 'extension' policies to new-style policies
@@ -396,6 +401,99 @@ def check(context, action, target, plugin=None, might_not_exist=False):
     return result
 
 
+def _get_rule_target_keys(rule, rules, seen):
+    """Return the target keys read by a rule.
+
+    Returns None if the rule contains checks whose dependencies on the
+    target are unknown.
+    """
+    if isinstance(rule, (policy.TrueCheck, policy.FalseCheck,
+                         policy.RoleCheck)):
+        return set()
+    if isinstance(rule, policy.RuleCheck):
+        if rule.match in seen:
+            return set()
+        seen.add(rule.match)
+        try:
+            return _get_rule_target_keys(rules[rule.match], rules, seen)
+        except KeyError:
+            # The check fails whatever the target
+            return set()
+    if isinstance(rule, policy.NotCheck):
+        return _get_rule_target_keys(rule.rule, rules, seen)
+    if isinstance(rule, (policy.AndCheck, policy.OrCheck)):
+        keys = set()
+        for sub_rule in rule.rules:
+            sub_keys = _get_rule_target_keys(sub_rule, rules, seen)
+            if sub_keys is None:
+                return None
+            keys |= sub_keys
+        return keys
+    if isinstance(rule, OwnerCheck):
+        keys = set([rule.target_field])
+        for separator in (':', '_'):
+            if separator in rule.target_field:
+                parent_res = rule.target_field.split(separator, 1)[0]
+                parent_foreign_key = attributes.RESOURCE_FOREIGN_KEYS.get(
+                    "%ss" % parent_res)
+                if parent_foreign_key:
+                    keys.add(parent_foreign_key)
+                break
+        return keys
+    if isinstance(rule, FieldCheck):
+        return set([rule.field])
+    if type(rule) is policy.GenericCheck:
+        return set(re.findall(r'%\((.+?)\)s', rule.match))
+    return None
+
+
+def _get_target_keys(action):
+    """Return the sorted target keys read by the rule of a read action.
+
+    Returns None if they are unknown. The keys are computed once for the
+    current rules of the enforcer.
+    """
+    global _TARGET_KEYS_RULES
+    if _ENFORCER.rules is not _TARGET_KEYS_RULES:
+        _TARGET_KEYS.clear()
+        _TARGET_KEYS_RULES = _ENFORCER.rules
+    if action not in _TARGET_KEYS:
+        keys = _get_rule_target_keys(policy.RuleCheck('rule', action),
+                                     _ENFORCER.rules, set())
+        _TARGET_KEYS[action] = keys if keys is None else sorted(keys)
+    return _TARGET_KEYS[action]
+
+
+def check_cached(cache, context, action, target, might_not_exist=False):
+    """Verifies that a read action is valid on the target in this context.
+
+    Same as check, but the results are memoized in the cache dict by the
+    values of the target attributes read by the policy rule of the action,
+    so that checking many targets, e.g. the items of a list, mostly costs
+    a few dict lookups. The cache must only be used with a single context.
+    The checks of write actions, whose rules depend on the target, and of
+    rules with unknown checks are not memoized.
+
+    :param cache: dict memoizing the results
+    """
+    if might_not_exist and not (_ENFORCER.rules and action in _ENFORCER.rules):
+        return True
+    keys = None
+    if not get_resource_and_action(action)[1]:
+        keys = _get_target_keys(action)
+    if keys is None:
+        return check(context, action, target)
+    cache_key = (action,) + tuple(target.get(key, _MISSING) for key in keys)
+    try:
+        return cache[cache_key]
+    except KeyError:
+        result = cache[cache_key] = check(context, action, target)
+    except TypeError:
+        # Unhashable attribute value
+        return check(context, action, target)
+    return result
+
+
 def enforce(context, action, target, plugin=None):
     """Verifies that the action is valid on the target in this context.
 
@@ -53,6 +53,20 @@ quota_opts = [
     cfg.StrOpt('quota_driver',
                default=QUOTA_DB_DRIVER,
                help=_('Default driver to use for quota checks')),
+    cfg.BoolOpt('track_quota_usage',
+                default=False,
+                help=_('Keep track in the database of the number of '
+                       'networks, subnets and ports of each tenant, instead '
+                       'of counting them at every creation. Requires the '
+                       'database quota driver.')),
+    cfg.IntOpt('quota_usage_resync_interval',
+               default=600,
+               help=_('Number of seconds after which a tracked usage is '
+                      'counted again from the resources of the tenant.')),
+    cfg.IntOpt('reservation_expiration',
+               default=120,
+               help=_('Number of seconds after which the quota reserved by '
+                      'a creation which did not complete is released.')),
 ]
 # Register the configuration options
 cfg.CONF.register_opts(quota_opts, 'QUOTAS')
@@ -298,6 +312,37 @@ class QuotaEngine(object):
         return self.get_driver().limit_check(context, tenant_id,
                                              self._resources, values)
 
+    def is_tracked(self, resource):
+        """Check if the quota driver tracks the usage of the resource."""
+        if (not cfg.CONF.QUOTAS.track_quota_usage or
+                resource not in self._resources):
+            return False
+        return resource in getattr(self.get_driver(), 'tracked_resources',
+                                   ())
+
+    def make_reservation(self, context, tenant_id, resource, delta):
+        """Reserve more of a tracked resource for a tenant.
+
+        If the tenant would be over its quota, an OverQuota exception is
+        raised. Otherwise the method returns the ID of the reservation,
+        which must be released once the resources are created or failed
+        to be, or None if the quota of the tenant is unlimited.
+
+        :param context: The request context, for access checks.
+        :param tenant_id: The tenant_id to check the quota.
+        :param resource: The name of the resource, as a string.
+        :param delta: The number of resources to reserve.
+        """
+
+        return self.get_driver().make_reservation(context, tenant_id,
+                                                  self._resources,
+                                                  resource, delta)
+
+    def release_reservation(self, context, reservation_id):
+        """Release a reservation returned by make_reservation."""
+        if reservation_id:
+            self.get_driver().release_reservation(context, reservation_id)
+
     @property
     def resources(self):
         return self._resources
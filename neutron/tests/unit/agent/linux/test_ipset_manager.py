@@ -32,57 +32,34 @@ class BaseIpsetManagerTest(base.BaseTestCase):
             root_helper=self.root_helper)
         self.execute = mock.patch.object(self.ipset, "execute").start()
         self.expected_calls = []
-        self.expect_create()
 
     def verify_mock_calls(self):
         self.execute.assert_has_calls(self.expected_calls, any_order=False)
+        self.assertEqual(len(self.expected_calls), self.execute.call_count)
 
-    def expect_set(self, addresses):
-        temp_input = ['create IPv4fake_sgid-new hash:ip family inet']
-        temp_input.extend('add IPv4fake_sgid-new %s' % ip for ip in addresses)
-        input = '\n'.join(temp_input)
-        self.expected_calls.extend([
-            mock.call(['ipset', 'restore', '-exist'],
-                      process_input=input,
-                      root_helper=self.root_helper),
-            mock.call(['ipset', 'swap', TEST_SET_NAME_NEW, TEST_SET_NAME],
-                      process_input=None,
-                      root_helper=self.root_helper),
-            mock.call(['ipset', 'destroy', TEST_SET_NAME_NEW],
-                      process_input=None,
-                      root_helper=self.root_helper)])
-
-    def expect_add(self, addresses):
-        self.expected_calls.extend(
-            mock.call(['ipset', 'add', '-exist', TEST_SET_NAME, ip],
-                      process_input=None,
-                      root_helper=self.root_helper) for ip in addresses)
-
-    def expect_del(self, addresses):
-        self.expected_calls.extend(
-            mock.call(['ipset', 'del', TEST_SET_NAME, ip],
-                      process_input=None,
-                      root_helper=self.root_helper) for ip in addresses)
-
-    def expect_create(self):
+    def expect_restore(self, process_input):
         self.expected_calls.append(
-            mock.call(['ipset', 'create', '-exist', TEST_SET_NAME,
-                       'hash:ip', 'family', 'inet'],
-                      process_input=None,
+            mock.call(['ipset', 'restore', '-exist'],
+                      process_input='\n'.join(process_input),
                       root_helper=self.root_helper))
 
-    def expect_destroy(self):
-        self.expected_calls.append(
-            mock.call(['ipset', 'destroy', TEST_SET_NAME],
-                      process_input=None,
-                      root_helper=self.root_helper))
+    def create_input(self, set_type='hash:ip'):
+        return ['create %s %s family inet' % (TEST_SET_NAME, set_type)]
+
+    def refresh_input(self, addresses, set_type='hash:ip'):
+        return (['create %s %s family inet' % (TEST_SET_NAME_NEW, set_type)] +
+                ['add %s %s' % (TEST_SET_NAME_NEW, ip) for ip in addresses] +
+                ['swap %s %s' % (TEST_SET_NAME_NEW, TEST_SET_NAME),
+                 'destroy %s' % TEST_SET_NAME_NEW])
 
     def add_first_ip(self):
-        self.expect_set([FAKE_IPS[0]])
+        self.expect_restore(self.create_input() +
+                            self.refresh_input([FAKE_IPS[0]]))
         self.ipset.set_members(TEST_SET_ID, ETHERTYPE, [FAKE_IPS[0]])
 
     def add_all_ips(self):
-        self.expect_set(FAKE_IPS)
+        self.expect_restore(self.create_input() +
+                            self.refresh_input(FAKE_IPS))
         self.ipset.set_members(TEST_SET_ID, ETHERTYPE, FAKE_IPS)
 
 
@@ -96,26 +73,70 @@ class IpsetManagerTestCase(BaseIpsetManagerTest):
         self.add_first_ip()
         self.verify_mock_calls()
 
-    def test_set_members_adding_less_than_5(self):
+    def test_set_members_adding_members(self):
         self.add_first_ip()
-        self.expect_add(reversed(FAKE_IPS[1:5]))
+        self.ipset.set_members(TEST_SET_ID, ETHERTYPE, FAKE_IPS[0:3])
+        process_input = self.execute.call_args[1]['process_input']
+        self.assertEqual(
+            sorted(['add %s %s' % (TEST_SET_NAME, ip)
+                    for ip in FAKE_IPS[1:3]]),
+            sorted(process_input.split('\n')))
+        self.assertEqual(2, self.execute.call_count)
+
+    def test_set_members_deleting_members(self):
+        self.add_all_ips()
+        self.expect_restore(['del %s %s' % (TEST_SET_NAME, FAKE_IPS[5])])
         self.ipset.set_members(TEST_SET_ID, ETHERTYPE, FAKE_IPS[0:5])
         self.verify_mock_calls()
 
-    def test_set_members_deleting_less_than_5(self):
-        self.add_all_ips()
-        self.expect_del(reversed(FAKE_IPS[4:5]))
-        self.ipset.set_members(TEST_SET_ID, ETHERTYPE, FAKE_IPS[0:3])
+    def test_set_members_replacing_most_members(self):
+        self.add_first_ip()
+        self.expect_restore(self.refresh_input(FAKE_IPS[1:]))
+        self.ipset.set_members(TEST_SET_ID, ETHERTYPE, FAKE_IPS[1:])
         self.verify_mock_calls()
 
-    def test_set_members_adding_more_than_5(self):
-        self.add_first_ip()
-        self.expect_set(FAKE_IPS)
-        self.ipset.set_members(TEST_SET_ID, ETHERTYPE, FAKE_IPS)
+    def test_set_members_net_set(self):
+        self.expect_restore(self.create_input('hash:net') +
+                            self.refresh_input(['10.0.0.0/24'], 'hash:net'))
+        self.ipset.set_members(TEST_SET_ID, ETHERTYPE, ['10.0.0.0/24'],
+                               set_type=ipset_manager.IPSET_TYPE_NET)
+        self.verify_mock_calls()
+
+    def test_set_members_deferred(self):
+        self.ipset.defer_apply_on()
+        self.ipset.set_members(TEST_SET_ID, ETHERTYPE, [FAKE_IPS[0]])
+        self.ipset.set_members('other_sgid', ETHERTYPE, [FAKE_IPS[1]])
+        self.assertFalse(self.execute.called)
+
+        self.ipset.defer_apply_off()
+        other_name = ipset_manager.IpsetManager.get_name('other_sgid',
+                                                         ETHERTYPE)
+        self.expect_restore(
+            self.create_input() + self.refresh_input([FAKE_IPS[0]]) +
+            ['create %s hash:ip family inet' % other_name,
+             'create %s-new hash:ip family inet' % other_name,
+             'add %s-new %s' % (other_name, FAKE_IPS[1]),
+             'swap %s-new %s' % (other_name, other_name),
+             'destroy %s-new' % other_name])
         self.verify_mock_calls()
 
+    def test_set_members_failure_forgets_set(self):
+        self.add_first_ip()
+        self.execute.side_effect = RuntimeError()
+        self.assertRaises(RuntimeError, self.ipset.set_members,
+                          TEST_SET_ID, ETHERTYPE, FAKE_IPS[0:2])
+        self.assertFalse(self.ipset.set_exists(TEST_SET_ID, ETHERTYPE))
+
     def test_destroy(self):
         self.add_first_ip()
-        self.expect_destroy()
+        self.expect_restore(['destroy %s' % TEST_SET_NAME])
         self.ipset.destroy(TEST_SET_ID, ETHERTYPE)
         self.verify_mock_calls()
+        self.assertFalse(self.ipset.set_exists(TEST_SET_ID, ETHERTYPE))
+
+    def test_destroy_failure_keeps_set(self):
+        self.add_first_ip()
+        self.execute.side_effect = RuntimeError()
+        self.assertRaises(RuntimeError, self.ipset.destroy,
+                          TEST_SET_ID, ETHERTYPE)
+        self.assertTrue(self.ipset.set_exists(TEST_SET_ID, ETHERTYPE))
@@ -13,6 +13,8 @@
 #    under the License.
 
 import collections
+import contextlib
+
 import mock
 from oslo.config import cfg
 from oslo.serialization import jsonutils
@@ -363,6 +365,58 @@ class OVS_Lib_Test(base.BaseTestCase):
                           "actions=normal",
             root_helper=self.root_helper)
 
+    def test_add_flow_default_cookie(self):
+        self.br.default_cookie = 1234
+        self.br.add_flow(actions='normal')
+        self.br.mod_flow(actions='drop')
+        self.br.delete_flows(in_port=1)
+        self.execute.assert_has_calls([
+            mock.call(["ovs-ofctl", "add-flows", self.BR_NAME, '-'],
+                      process_input="hard_timeout=0,idle_timeout=0,"
+                                    "priority=1,cookie=1234,actions=normal",
+                      root_helper=self.root_helper),
+            mock.call(["ovs-ofctl", "mod-flows", self.BR_NAME, '-'],
+                      process_input="cookie=1234,actions=drop",
+                      root_helper=self.root_helper),
+            mock.call(["ovs-ofctl", "del-flows", self.BR_NAME, '-'],
+                      process_input="in_port=1",
+                      root_helper=self.root_helper)])
+
+    def test_add_flow_keeps_explicit_cookie(self):
+        self.br.default_cookie = 1234
+        self.br.add_flow(cookie=5, actions='normal')
+        self.execute.assert_called_once_with(
+            ["ovs-ofctl", "add-flows", self.BR_NAME, '-'],
+            process_input="hard_timeout=0,idle_timeout=0,priority=1,"
+                          "cookie=5,actions=normal",
+            root_helper=self.root_helper)
+
+    def test_get_flow_cookies(self):
+        self.execute.return_value = (
+            'NXST_FLOW reply (xid=0x4):\n'
+            ' cookie=0x0, duration=1.1s, table=0, priority=1 actions=NORMAL\n'
+            ' cookie=0x4d2, duration=1.1s, table=0, actions=drop\n'
+            ' cookie=0x4d2, duration=1.1s, table=23, actions=drop\n')
+        self.assertEqual(set([0, 1234]), self.br.get_flow_cookies())
+
+    def test_delete_stale_flows(self):
+        self.br.default_cookie = 1234
+        with contextlib.nested(
+            mock.patch.object(self.br, 'get_flow_cookies',
+                              return_value=set([0, 1234, 7])),
+            mock.patch.object(self.br, 'delete_flows')
+        ) as (get_flow_cookies, delete_flows):
+            self.br.delete_stale_flows()
+        delete_flows.assert_has_calls([mock.call(cookie='0x0/-1'),
+                                       mock.call(cookie='0x7/-1')],
+                                      any_order=True)
+        self.assertEqual(2, delete_flows.call_count)
+
+    def test_delete_stale_flows_without_default_cookie(self):
+        with mock.patch.object(self.br, 'get_flow_cookies') as get_cookies:
+            self.br.delete_stale_flows()
+        self.assertFalse(get_cookies.called)
+
     def _test_get_port_ofport(self, ofport, expected_result):
         pname = "tap99"
         self.execute.return_value = ofport
@@ -539,7 +593,8 @@ class OVS_Lib_Test(base.BaseTestCase):
         ofport = "6"
 
         # Each element is a tuple of (expected mock call, return_value)
-        command = ["ovs-vsctl", self.TO, "add-port", self.BR_NAME, pname]
+        command = ["ovs-vsctl", self.TO, "--", "--may-exist", "add-port",
+                   self.BR_NAME, pname]
         command.extend(["--", "set", "Interface", pname])
         command.extend(["type=patch", "options:peer=" + peer])
         expected_calls_and_values = [
@@ -1047,3 +1102,126 @@ class TestDeferredOVSBridge(base.BaseTestCase):
     def test_getattr_unallowed_attr_failure(self):
         with ovs_lib.DeferredOVSBridge(self.br) as deferred_br:
             self.assertRaises(AttributeError, getattr, deferred_br, 'failure')
+
+    def test_apply_bundle(self):
+        expected = [('add', self.add_flow_dict1),
+                    ('del', self.del_flow_dict1),
+                    ('mod', self.mod_flow_dict1)]
+        with ovs_lib.DeferredOVSBridge(self.br,
+                                       use_bundle=True) as deferred_br:
+            deferred_br.add_flow(**self.add_flow_dict1)
+            deferred_br.delete_flows(**self.del_flow_dict1)
+            deferred_br.mod_flow(**self.mod_flow_dict1)
+        self._verify_mock_call([])
+        self.br.do_bundled_flows.assert_called_once_with(expected)
+
+
+class TestDeferredFlows(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestDeferredFlows, self).setUp()
+        self.int_br = ovs_lib.OVSBridge('br-int', 'sudo')
+        self.tun_br = ovs_lib.OVSBridge('br-tun', 'sudo')
+        self.run_ofctl = mock.patch.object(ovs_lib.OVSBridge,
+                                           'run_ofctl').start()
+
+    def test_flows_applied_immediately_without_deferral(self):
+        self.int_br.add_flow(in_port=1, actions='drop')
+        self.assertEqual(1, self.run_ofctl.call_count)
+
+    def test_flows_applied_on_exit(self):
+        with ovs_lib.deferred_flows():
+            self.int_br.add_flow(in_port=1, actions='drop')
+            self.tun_br.delete_flows(in_port=2)
+            self.int_br.add_flow(in_port=3, actions='drop')
+            self.assertFalse(self.run_ofctl.called)
+        self.run_ofctl.assert_has_calls([
+            mock.call('add-flows', ['-'],
+                      'hard_timeout=0,idle_timeout=0,priority=1,in_port=1,'
+                      'actions=drop\n'
+                      'hard_timeout=0,idle_timeout=0,priority=1,in_port=3,'
+                      'actions=drop'),
+            mock.call('del-flows', ['-'], 'in_port=2')])
+        self.assertEqual(2, self.run_ofctl.call_count)
+
+    def test_flows_keep_their_order(self):
+        with ovs_lib.deferred_flows():
+            self.int_br.delete_flows(in_port=1)
+            self.int_br.add_flow(in_port=1, actions='drop')
+        self.assertEqual(['del-flows', 'add-flows'],
+                         [c[0][0] for c in self.run_ofctl.call_args_list])
+
+    def test_flows_applied_on_error(self):
+        try:
+            with ovs_lib.deferred_flows():
+                self.int_br.add_flow(in_port=1, actions='drop')
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(1, self.run_ofctl.call_count)
+
+    def test_apply_deferred_flows(self):
+        with ovs_lib.deferred_flows():
+            self.int_br.add_flow(in_port=1, actions='drop')
+            ovs_lib.apply_deferred_flows()
+            self.assertEqual(1, self.run_ofctl.call_count)
+            self.int_br.add_flow(in_port=2, actions='drop')
+            self.assertEqual(1, self.run_ofctl.call_count)
+        self.assertEqual(2, self.run_ofctl.call_count)
+
+    def test_apply_deferred_flows_without_deferral(self):
+        ovs_lib.apply_deferred_flows()
+        self.assertFalse(self.run_ofctl.called)
+
+    def test_nested_blocks_are_applied_by_outermost(self):
+        with ovs_lib.deferred_flows():
+            with ovs_lib.deferred_flows():
+                self.int_br.add_flow(in_port=1, actions='drop')
+            self.assertFalse(self.run_ofctl.called)
+            self.int_br.add_flow(in_port=2, actions='drop')
+        self.assertEqual(1, self.run_ofctl.call_count)
+
+    def test_remove_all_flows_drops_pending_flows(self):
+        with ovs_lib.deferred_flows():
+            self.int_br.add_flow(in_port=1, actions='drop')
+            self.int_br.remove_all_flows()
+            self.int_br.add_flow(in_port=2, actions='drop')
+        self.run_ofctl.assert_has_calls([
+            mock.call('del-flows', []),
+            mock.call('add-flows', ['-'],
+                      'hard_timeout=0,idle_timeout=0,priority=1,in_port=2,'
+                      'actions=drop')])
+        self.assertEqual(2, self.run_ofctl.call_count)
+
+    def test_bridge_deferred_context_joins_the_queue(self):
+        with ovs_lib.deferred_flows():
+            self.int_br.add_flow(in_port=1, actions='drop')
+            with self.int_br.deferred() as deferred_br:
+                deferred_br.delete_flows(in_port=2)
+            self.int_br.add_flow(in_port=3, actions='drop')
+            self.assertFalse(self.run_ofctl.called)
+        self.assertEqual(['add-flows', 'del-flows', 'add-flows'],
+                         [c[0][0] for c in self.run_ofctl.call_args_list])
+
+    def test_bundle(self):
+        cfg.CONF.set_override('ovs_ofctl_bundle', True)
+        with ovs_lib.deferred_flows():
+            self.int_br.delete_flows(in_port=1)
+            self.int_br.add_flow(in_port=1, actions='drop')
+        self.run_ofctl.assert_called_once_with(
+            'add-flows', ['--bundle', '-O', 'OpenFlow14', '-'],
+            'delete in_port=1\n'
+            'add hard_timeout=0,idle_timeout=0,priority=1,in_port=1,'
+            'actions=drop')
+
+    def test_many_ports_use_one_ofctl_call_per_bridge(self):
+        # A port binding burst, e.g. after an agent restart with 1000 ports,
+        # must not cost one ovs-ofctl process per flow.
+        with ovs_lib.deferred_flows():
+            for ofport in range(1, 1001):
+                self.int_br.delete_flows(in_port=ofport)
+                self.tun_br.add_flow(table=20, dl_vlan=ofport,
+                                     actions='drop')
+        self.assertEqual(2, self.run_ofctl.call_count)
+        self.assertEqual(1000, len(
+            self.run_ofctl.call_args_list[0][0][2].splitlines()))
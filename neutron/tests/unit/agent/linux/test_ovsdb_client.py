@@ -0,0 +1,227 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import socket
+
+import mock
+from oslo.config import cfg
+
+from neutron.agent.linux import ovs_lib
+from neutron.agent.linux import ovsdb_client
+from neutron.agent.linux import utils
+from neutron.tests import base
+
+
+def _uuid(value):
+    return ['uuid', value]
+
+
+INITIAL_UPDATES = {
+    'Bridge': {
+        'br-uuid': {'new': {
+            'name': 'br-int',
+            'ports': ['set', [_uuid('p0'), _uuid('p1'), _uuid('p2')]],
+            'datapath_id': '0000aabbccddeeff'}},
+    },
+    'Port': {
+        'p0': {'new': {'name': 'br-int', 'interfaces': _uuid('i0'),
+                       'tag': ['set', []]}},
+        'p1': {'new': {'name': 'tap1', 'interfaces': _uuid('i1'),
+                       'tag': 1}},
+        'p2': {'new': {'name': 'patch-tun', 'interfaces': _uuid('i2'),
+                       'tag': ['set', []]}},
+    },
+    'Interface': {
+        'i0': {'new': {'name': 'br-int', 'external_ids': ['map', []],
+                       'ofport': 65534, 'type': 'internal',
+                       'options': ['map', []]}},
+        'i1': {'new': {'name': 'tap1',
+                       'external_ids': ['map', [['iface-id', 'vif1'],
+                                                ['attached-mac', 'aa']]],
+                       'ofport': 3, 'type': '', 'options': ['map', []]}},
+        'i2': {'new': {'name': 'patch-tun', 'external_ids': ['map', []],
+                       'ofport': ['set', []], 'type': 'patch',
+                       'options': ['map', [['peer', 'patch-int']]]}},
+    },
+}
+
+
+class TestOvsdbHelpers(base.BaseTestCase):
+
+    def test_parse_connection_unix(self):
+        self.assertEqual((socket.AF_UNIX, '/var/run/db.sock'),
+                         ovsdb_client.parse_connection('unix:/var/run/db.sock'))
+
+    def test_parse_connection_tcp(self):
+        self.assertEqual((socket.AF_INET, ('127.0.0.1', 6640)),
+                         ovsdb_client.parse_connection('tcp:127.0.0.1:6640'))
+
+    def test_parse_connection_invalid(self):
+        self.assertRaises(ovsdb_client.OvsdbClientError,
+                          ovsdb_client.parse_connection, 'ssl:foo')
+
+    def test_from_datum(self):
+        self.assertEqual(1, ovsdb_client.from_datum(1))
+        self.assertEqual([], ovsdb_client.from_datum(['set', []]))
+        self.assertEqual(2, ovsdb_client.from_datum(['set', [2]]))
+        self.assertEqual(['a'], ovsdb_client.from_datum(_uuid('a'), True))
+        self.assertEqual({'k': 'v'},
+                         ovsdb_client.from_datum(['map', [['k', 'v']]]))
+
+    def test_to_vsctl_str(self):
+        self.assertEqual('[]', ovsdb_client.to_vsctl_str([]))
+        self.assertEqual('5', ovsdb_client.to_vsctl_str(5))
+        self.assertEqual('{a="1", b="2"}',
+                         ovsdb_client.to_vsctl_str({'b': '2', 'a': '1'}))
+
+
+class TestOvsdbClient(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestOvsdbClient, self).setUp()
+        self.client = ovsdb_client.OvsdbClient('tcp:127.0.0.1:6640', 10)
+        self.client._apply_updates(INITIAL_UPDATES)
+
+    def test_bridge_ports_exclude_local_port(self):
+        ports = self.client.get_bridge_ports('br-int')
+        self.assertEqual(set(['tap1', 'patch-tun']),
+                         set(p['name'] for p in ports))
+
+    def test_get_bridge_for_port(self):
+        self.assertEqual('br-int', self.client.get_bridge_for_port('tap1'))
+        self.assertIsNone(self.client.get_bridge_for_port('nope'))
+
+    def test_update_notification_modifies_and_deletes_rows(self):
+        self.client._handle_message({
+            'method': 'update', 'id': None,
+            'params': [None, {
+                'Port': {'p1': {'old': {'tag': 1},
+                                'new': {'name': 'tap1',
+                                        'interfaces': _uuid('i1'),
+                                        'tag': 2}},
+                         'p2': {'old': {'name': 'patch-tun'}}}}]})
+        self.assertEqual(2, self.client.get_row('Port', 'tap1')['tag'])
+        self.assertIsNone(self.client.get_row('Port', 'patch-tun'))
+
+    def test_echo_is_answered(self):
+        with mock.patch.object(self.client, '_send') as send:
+            self.client._handle_message({'method': 'echo', 'id': 'echo',
+                                         'params': []})
+        send.assert_called_once_with({'id': 'echo', 'result': [],
+                                      'error': None})
+
+    def test_response_wakes_up_waiter(self):
+        waiter = mock.Mock()
+        self.client._pending[7] = waiter
+        self.client._handle_message({'id': 7, 'result': ['ok'],
+                                     'error': None})
+        waiter.send.assert_called_once_with(['ok'])
+
+    def test_set_column(self):
+        with mock.patch.object(self.client, '_request',
+                               return_value=[{'count': 1}]) as request:
+            self.client.set_column('Port', 'tap1', 'tag', '4')
+        request.assert_called_once_with(
+            'transact', ['Open_vSwitch',
+                         {'op': 'update', 'table': 'Port',
+                          'where': [['name', '==', 'tap1']],
+                          'row': {'tag': 4}}])
+
+    def test_transact_raises_on_error(self):
+        with mock.patch.object(self.client, '_request',
+                               return_value=[{'error': 'constraint'}]):
+            self.assertRaises(ovsdb_client.OvsdbClientError,
+                              self.client.transact, [{'op': 'update'}])
+
+
+class TestOVSBridgeNative(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestOVSBridgeNative, self).setUp()
+        cfg.CONF.set_override('ovsdb_interface', 'native')
+        self.client = ovsdb_client.OvsdbClient('tcp:127.0.0.1:6640', 10)
+        self.client._apply_updates(INITIAL_UPDATES)
+        mock.patch.object(ovsdb_client, 'get_client',
+                          return_value=self.client).start()
+        self.execute = mock.patch.object(utils, 'execute').start()
+        self.br = ovs_lib.OVSBridge('br-int', 'sudo')
+
+    def test_get_port_name_list(self):
+        self.assertEqual(['patch-tun', 'tap1'], self.br.get_port_name_list())
+        self.assertFalse(self.execute.called)
+
+    def test_get_vif_port_set(self):
+        self.assertEqual(set(['vif1']), self.br.get_vif_port_set())
+        self.assertFalse(self.execute.called)
+
+    def test_get_vif_ports(self):
+        ports = self.br.get_vif_ports()
+        self.assertEqual(1, len(ports))
+        self.assertEqual('vif1', ports[0].vif_id)
+        self.assertEqual('3', ports[0].ofport)
+
+    def test_get_port_tag_dict(self):
+        self.assertEqual({'tap1': 1, 'patch-tun': []},
+                         self.br.get_port_tag_dict())
+
+    def test_db_get_val(self):
+        self.assertEqual('1', self.br.db_get_val('Port', 'tap1', 'tag'))
+        self.assertEqual('[]', self.br.db_get_val('Port', 'patch-tun',
+                                                  'tag'))
+        self.assertEqual('3', self.br.get_port_ofport('tap1'))
+        self.assertFalse(self.execute.called)
+
+    def test_get_unset_ofport_uses_vsctl(self):
+        self.execute.return_value = '4\n'
+        self.assertEqual('4', self.br.get_port_ofport('patch-tun'))
+        self.assertTrue(self.execute.called)
+
+    def test_get_val_of_missing_row_uses_vsctl(self):
+        self.execute.return_value = '5\n'
+        self.assertEqual('5', self.br.add_port('tap2'))
+        self.assertEqual(2, self.execute.call_count)
+
+    def test_db_get_map(self):
+        self.assertEqual({'peer': 'patch-int'},
+                         self.br.db_get_map('Interface', 'patch-tun',
+                                            'options'))
+
+    def test_db_get_unmonitored_column_uses_vsctl(self):
+        self.execute.return_value = '{rx_bytes=1}\n'
+        self.assertEqual({'rx_bytes': '1'}, self.br.get_port_stats('tap1'))
+        self.assertTrue(self.execute.called)
+
+    def test_bridge_exists(self):
+        self.assertTrue(self.br.bridge_exists('br-int'))
+        self.assertFalse(self.br.bridge_exists('br-ex'))
+
+    def test_set_db_attribute_tag(self):
+        with mock.patch.object(self.client, 'set_column') as set_column:
+            self.br.set_db_attribute('Port', 'tap1', 'tag', '5')
+            self.br.clear_db_attribute('Port', 'tap1', 'tag')
+        set_column.assert_has_calls([
+            mock.call('Port', 'tap1', 'tag', '5'),
+            mock.call('Port', 'tap1', 'tag', None)])
+        self.assertFalse(self.execute.called)
+
+    def test_set_db_attribute_other_column_uses_vsctl(self):
+        self.br.set_db_attribute('Interface', 'tap1', 'options:peer', 'x')
+        self.assertTrue(self.execute.called)
+
+    def test_falls_back_to_vsctl_without_connection(self):
+        ovsdb_client.get_client.return_value = None
+        self.execute.return_value = 'tap1\n'
+        self.assertEqual(['tap1'], self.br.get_port_name_list())
+        self.assertTrue(self.execute.called)
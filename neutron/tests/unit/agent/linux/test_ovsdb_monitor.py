@@ -14,6 +14,7 @@
 
 import eventlet.event
 import mock
+from oslo.serialization import jsonutils
 
 from neutron.agent.linux import ovsdb_monitor
 from neutron.tests import base
@@ -101,3 +102,49 @@ class TestSimpleInterfaceMonitor(base.BaseTestCase):
                 return_value=output):
             self.monitor._read_stdout()
         self.assertFalse(self.monitor.data_received)
+
+    def _set_output(self, *rows):
+        output = jsonutils.dumps({
+            'headings': ['row', 'action', 'name', 'ofport', 'external_ids'],
+            'data': list(rows)})
+        self.monitor.iter_stdout = mock.Mock(return_value=[output])
+
+    def _get_active_events(self):
+        target = ('neutron.agent.linux.ovsdb_monitor.SimpleInterfaceMonitor'
+                  '.is_active')
+        with mock.patch(target,
+                        new_callable=mock.PropertyMock(return_value=True)):
+            return self.monitor.get_events()
+
+    def test_get_events_returns_none_until_first_full_scan(self):
+        self._set_output(['u1', 'initial', 'tap1', 1, ['map', []]])
+        self.assertIsNone(self._get_active_events())
+        self.monitor.iter_stdout = mock.Mock(return_value=[])
+        self.assertEqual([], self._get_active_events())
+
+    def test_get_events_returns_none_if_not_active(self):
+        self.monitor.events_lost = False
+        self.assertIsNone(self.monitor.get_events())
+        self.assertTrue(self.monitor.events_lost)
+
+    def test_get_events(self):
+        self.monitor.events_lost = False
+        ext_ids = ['map', [['iface-id', 'vif1']]]
+        self._set_output(['u1', 'insert', 'tap1', ['set', []], ext_ids],
+                         ['u1', 'old', None, ['set', []], None],
+                         ['u1', 'new', 'tap1', 3, ext_ids],
+                         ['u2', 'delete', 'tap2', 4, ['map', []]])
+        expected = [
+            {'event': 'added', 'name': 'tap1', 'ofport': [],
+             'external_ids': {'iface-id': 'vif1'}},
+            {'event': 'added', 'name': 'tap1', 'ofport': 3,
+             'external_ids': {'iface-id': 'vif1'}},
+            {'event': 'removed', 'name': 'tap2', 'ofport': 4,
+             'external_ids': {}}]
+        self.assertEqual(expected, self._get_active_events())
+        self.assertEqual([], self.monitor.new_events)
+
+    def test_unparsable_output_loses_events(self):
+        self.monitor.events_lost = False
+        self.monitor.iter_stdout = mock.Mock(return_value=['garbage'])
+        self.assertIsNone(self._get_active_events())
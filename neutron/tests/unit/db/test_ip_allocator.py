@@ -0,0 +1,206 @@
+# Copyright (c) 2015 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+
+import mock
+
+from neutron.common import exceptions as n_exc
+from neutron import context
+from neutron.db import ip_allocator
+from neutron.db import models_v2
+from neutron.tests import base
+from neutron.tests.unit import test_db_plugin
+
+
+class SubnetIpIndexTestCase(base.BaseTestCase):
+
+    def _free(self, index):
+        return zip(index._firsts, index._lasts)
+
+    def test_build(self):
+        index = ip_allocator.SubnetIpIndex([(3, 10), (100, 120)],
+                                           [3, 78, 7, 110, 11, 4, 111])
+        self.assertEqual([(5, 6), (8, 10), (100, 109), (112, 120)],
+                         self._free(index))
+
+    def test_take(self):
+        index = ip_allocator.SubnetIpIndex([(3, 4), (10, 10)], [])
+        self.assertEqual([3, 4, 10, None],
+                         [index.take() for i in range(4)])
+
+    def test_remove(self):
+        index = ip_allocator.SubnetIpIndex([(3, 10)], [])
+        self.assertTrue(index.remove(5))
+        self.assertTrue(index.remove(3))
+        self.assertTrue(index.remove(10))
+        self.assertFalse(index.remove(5))
+        self.assertFalse(index.remove(11))
+        self.assertEqual([(4, 4), (6, 9)], self._free(index))
+
+    def test_add(self):
+        index = ip_allocator.SubnetIpIndex([(3, 10)], [3, 4, 5, 7, 9, 10])
+        index.add(5)
+        index.add(9)
+        index.add(4)
+        index.add(42)
+        self.assertEqual([(4, 6), (8, 9)], self._free(index))
+        index.add(7)
+        self.assertEqual([(4, 9)], self._free(index))
+
+
+class IpIndexAllocatorTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(IpIndexAllocatorTestCase, self).setUp()
+        self.allocator = ip_allocator.IpIndexAllocator()
+        self.subnet = {'id': 'subnet1', 'network_id': 'net1',
+                       'cidr': '10.0.0.0/24'}
+        self.pools = [(167772162, 167772164)]
+        self.allocated = []
+        mock.patch.object(self.allocator, '_get_pools',
+                          return_value=self.pools).start()
+        self.build = mock.patch.object(
+            self.allocator, '_build_index',
+            side_effect=self._build_index).start()
+        self.reserve = mock.patch.object(self.allocator, '_reserve').start()
+
+    def _build_index(self, context, subnet_id, pools):
+        index = ip_allocator.SubnetIpIndex(pools, self.allocated)
+        self.allocator._indexes[subnet_id] = index
+        return index
+
+    def test_allocate(self):
+        self.allocated.append(167772162)
+        self.reserve.return_value = True
+        self.assertEqual(
+            {'ip_address': '10.0.0.3', 'subnet_id': 'subnet1'},
+            self.allocator.allocate(mock.Mock(), [self.subnet]))
+        self.assertEqual(
+            {'ip_address': '10.0.0.4', 'subnet_id': 'subnet1'},
+            self.allocator.allocate(mock.Mock(), [self.subnet]))
+        self.assertEqual(1, self.build.call_count)
+
+    def test_allocate_retries_allocated_ip(self):
+        self.reserve.side_effect = [False, True]
+        self.assertEqual(
+            {'ip_address': '10.0.0.3', 'subnet_id': 'subnet1'},
+            self.allocator.allocate(mock.Mock(), [self.subnet]))
+
+    def test_allocate_rebuilds_exhausted_index(self):
+        self.reserve.return_value = True
+        self.allocated.extend([167772162, 167772163, 167772164])
+        self.allocator._get_index(mock.Mock(), 'subnet1')
+        # released by another worker
+        self.allocated.remove(167772163)
+        self.assertEqual(
+            {'ip_address': '10.0.0.3', 'subnet_id': 'subnet1'},
+            self.allocator.allocate(mock.Mock(), [self.subnet]))
+        self.assertEqual(2, self.build.call_count)
+
+    def test_allocate_exhausted_subnet(self):
+        self.reserve.return_value = False
+        self.assertRaises(n_exc.IpAddressGenerationFailure,
+                          self.allocator.allocate, mock.Mock(), [self.subnet])
+        self.assertEqual(6, self.reserve.call_count)
+
+    def test_allocate_specific_ip_in_use(self):
+        self.reserve.return_value = False
+        self.assertRaises(n_exc.IpAddressInUse,
+                          self.allocator.allocate_specific, mock.Mock(),
+                          self.subnet, '10.0.0.3')
+
+    def test_release(self):
+        self.reserve.return_value = True
+        for i in range(3):
+            self.allocator.allocate(mock.Mock(), [self.subnet])
+        self.allocator.release(mock.Mock(), 'subnet1', '10.0.0.3')
+        self.assertEqual(
+            {'ip_address': '10.0.0.3', 'subnet_id': 'subnet1'},
+            self.allocator.allocate(mock.Mock(), [self.subnet]))
+        self.assertEqual(1, self.build.call_count)
+
+
+class IpIndexAllocatorDbTestCase(test_db_plugin.NeutronDbPluginV2TestCase):
+
+    def setUp(self):
+        super(IpIndexAllocatorDbTestCase, self).setUp()
+        self.allocator = ip_allocator.IpIndexAllocator()
+        self.get_ip_allocator = mock.patch.object(
+            ip_allocator, 'get_ip_allocator',
+            return_value=self.allocator).start()
+
+    def test_create_ports(self):
+        with self.subnet() as subnet:
+            with contextlib.nested(self.port(subnet=subnet),
+                                   self.port(subnet=subnet)) as (p1, p2):
+                self.assertEqual('10.0.0.2',
+                                 p1['port']['fixed_ips'][0]['ip_address'])
+                self.assertEqual('10.0.0.3',
+                                 p2['port']['fixed_ips'][0]['ip_address'])
+                ctx = context.get_admin_context()
+                self.assertFalse(ctx.session.query(
+                    models_v2.IPAllocation).filter_by(port_id=None).count())
+
+    def test_create_port_with_ip_allocated_by_another_worker(self):
+        with self.subnet() as subnet:
+            with self.port(subnet=subnet):
+                with self.port(subnet=subnet):
+                    # make the index miss the allocation of 10.0.0.3, as
+                    # if it was made by another worker
+                    self.allocator._indexes[
+                        subnet['subnet']['id']].add(167772163)
+                    with self.port(subnet=subnet) as port:
+                        self.assertEqual(
+                            '10.0.0.4',
+                            port['port']['fixed_ips'][0]['ip_address'])
+
+    def test_create_port_with_specific_ip(self):
+        with self.subnet() as subnet:
+            fixed_ips = [{'subnet_id': subnet['subnet']['id'],
+                          'ip_address': '10.0.0.2'}]
+            with self.port(subnet=subnet, fixed_ips=fixed_ips):
+                with self.port(subnet=subnet) as port:
+                    self.assertEqual(
+                        '10.0.0.3',
+                        port['port']['fixed_ips'][0]['ip_address'])
+
+    def test_allocate_deletes_availability_ranges(self):
+        with self.subnet() as subnet:
+            with self.port(subnet=subnet):
+                ctx = context.get_admin_context()
+                self.assertFalse(ctx.session.query(
+                    models_v2.IPAvailabilityRange).count())
+
+    def test_create_port_after_unsetting_allocator(self):
+        with self.subnet() as subnet:
+            with self.port(subnet=subnet):
+                self.get_ip_allocator.return_value = None
+                with self.port(subnet=subnet) as port:
+                    self.assertEqual(
+                        '10.0.0.3',
+                        port['port']['fixed_ips'][0]['ip_address'])
+
+    def test_update_allocation_pools_keeps_ranges_deleted(self):
+        with self.subnet() as subnet:
+            with self.port(subnet=subnet):
+                data = {'subnet': {'allocation_pools': [
+                    {'start': '10.0.0.2', 'end': '10.0.0.100'}]}}
+                req = self.new_update_request('subnets', data,
+                                              subnet['subnet']['id'])
+                req.get_response(self.api)
+                ctx = context.get_admin_context()
+                self.assertFalse(ctx.session.query(
+                    models_v2.IPAvailabilityRange).count())
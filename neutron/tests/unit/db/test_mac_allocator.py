@@ -0,0 +1,207 @@
+# Copyright (c) 2015 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+
+import mock
+from oslo.config import cfg
+from oslo.utils import timeutils
+
+from neutron.common import exceptions as n_exc
+from neutron.db import mac_allocator
+from neutron import manager
+from neutron.tests import base
+from neutron.tests.unit import test_db_plugin
+
+
+class BloomFilterTestCase(base.BaseTestCase):
+
+    def test_contains(self):
+        mac_filter = mac_allocator.BloomFilter(100)
+        macs = ['fa:16:3e:00:00:%02x' % i for i in range(100)]
+        for mac in macs:
+            mac_filter.add(mac)
+        self.assertEqual(100, mac_filter.count)
+        self.assertTrue(all(mac in mac_filter for mac in macs))
+        false_positives = sum(1 for i in range(1000)
+                              if 'fa:16:3e:00:01:%02x' % i in mac_filter)
+        self.assertTrue(false_positives < 50)
+
+
+class MacFilterAllocatorTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(MacFilterAllocatorTestCase, self).setUp()
+        self.allocator = mac_allocator.MacFilterAllocator()
+        self.context = mock.Mock()
+        self.used = ['fa:16:3e:00:00:01']
+        # used by ports the filters do not know of
+        self.used_in_db = []
+        query = self.context.session.query.return_value
+        query.filter_by.side_effect = (
+            lambda network_id: [(mac,) for mac in self.used])
+        query.filter.side_effect = (
+            lambda *args: [(mac,) for mac in self.used_in_db])
+        self.random_mac = mock.patch(
+            'neutron.common.utils.get_random_mac').start()
+
+    def _query_count(self):
+        return self.context.session.query.call_count
+
+    def test_generate(self):
+        self.random_mac.side_effect = ['fa:16:3e:00:00:01',
+                                       'fa:16:3e:00:00:02',
+                                       'fa:16:3e:00:00:02',
+                                       'fa:16:3e:00:00:03']
+        self.assertEqual(['fa:16:3e:00:00:02', 'fa:16:3e:00:00:03'],
+                         self.allocator.generate(self.context, 'net1', 2))
+        # the filter is built and the MAC addresses confirmed
+        self.assertEqual(2, self._query_count())
+
+    def test_generate_confirmed_in_db(self):
+        self.used_in_db = ['fa:16:3e:00:00:02']
+        self.random_mac.side_effect = ['fa:16:3e:00:00:02',
+                                       'fa:16:3e:00:00:03']
+        self.assertEqual(['fa:16:3e:00:00:03'],
+                         self.allocator.generate(self.context, 'net1'))
+        self.assertEqual(3, self._query_count())
+
+    def test_generate_failure(self):
+        cfg.CONF.set_override('mac_generation_retries', 3)
+        self.random_mac.return_value = 'fa:16:3e:00:00:01'
+        self.assertRaises(n_exc.MacAddressGenerationFailure,
+                          self.allocator.generate, self.context, 'net1')
+        self.assertEqual(3, self.random_mac.call_count)
+
+    def test_prepare(self):
+        self.random_mac.side_effect = ['fa:16:3e:00:00:02',
+                                       'fa:16:3e:00:00:03',
+                                       'fa:16:3e:00:00:04']
+        self.assertEqual(['fa:16:3e:00:00:02', 'fa:16:3e:00:00:03'],
+                         self.allocator.prepare(self.context, 'net1', 2))
+        self.assertEqual(2, self._query_count())
+        self.assertEqual('fa:16:3e:00:00:02',
+                         self.allocator.get_mac(self.context, 'net1'))
+        self.assertEqual('fa:16:3e:00:00:03',
+                         self.allocator.get_mac(self.context, 'net1'))
+        self.assertEqual(2, self._query_count())
+        self.assertEqual('fa:16:3e:00:00:04',
+                         self.allocator.get_mac(self.context, 'net1'))
+        self.assertEqual(3, self._query_count())
+
+    def test_release(self):
+        self.random_mac.side_effect = ['fa:16:3e:00:00:02',
+                                       'fa:16:3e:00:00:03',
+                                       'fa:16:3e:00:00:04']
+        macs = self.allocator.prepare(self.context, 'net1', 2)
+        self.allocator.get_mac(self.context, 'net1')
+        self.allocator.release('net1', macs)
+        self.assertEqual([], self.allocator._pending['net1'])
+        self.assertEqual('fa:16:3e:00:00:04',
+                         self.allocator.get_mac(self.context, 'net1'))
+
+    def test_reserve(self):
+        self.allocator.reserve(self.context, 'net1', 'fa:16:3e:00:00:02')
+        self.random_mac.side_effect = ['fa:16:3e:00:00:02',
+                                       'fa:16:3e:00:00:03']
+        self.assertEqual(['fa:16:3e:00:00:03'],
+                         self.allocator.generate(self.context, 'net1'))
+
+    def test_reserve_removes_pending_mac(self):
+        self.random_mac.side_effect = ['fa:16:3e:00:00:02',
+                                       'fa:16:3e:00:00:03']
+        self.allocator.prepare(self.context, 'net1', 1)
+        self.allocator.reserve(self.context, 'net1', 'fa:16:3e:00:00:02')
+        self.assertEqual('fa:16:3e:00:00:03',
+                         self.allocator.get_mac(self.context, 'net1'))
+
+    def test_filter_rebuilt_when_old(self):
+        mac_filter = self.allocator._get_filter(self.context, 'net1')
+        # created by another worker
+        self.used.append('fa:16:3e:00:00:03')
+        self.assertIs(mac_filter,
+                      self.allocator._get_filter(self.context, 'net1'))
+        timeutils.set_time_override(timeutils.utcnow() + datetime.timedelta(
+            seconds=mac_allocator.FILTER_MAX_AGE + 1))
+        self.addCleanup(timeutils.clear_time_override)
+        mac_filter = self.allocator._get_filter(self.context, 'net1')
+        self.assertIn('fa:16:3e:00:00:03', mac_filter)
+        self.assertEqual(2, self._query_count())
+
+
+class MacFilterAllocatorDbTestCase(test_db_plugin.NeutronDbPluginV2TestCase):
+
+    def setUp(self):
+        super(MacFilterAllocatorDbTestCase, self).setUp()
+        self.allocator = mac_allocator.MacFilterAllocator()
+        mock.patch.object(mac_allocator, 'get_mac_allocator',
+                          return_value=self.allocator).start()
+
+    def test_create_port_with_mac_in_use(self):
+        with self.port() as port:
+            res = self._create_port(self.fmt, port['port']['network_id'],
+                                    mac_address=port['port']['mac_address'])
+            self.assertEqual(409, res.status_int)
+
+    def test_create_port_with_mac_in_use_after_restart(self):
+        with self.port() as port:
+            allocator = mac_allocator.MacFilterAllocator()
+            with mock.patch.object(mac_allocator, 'get_mac_allocator',
+                                   return_value=allocator):
+                res = self._create_port(
+                    self.fmt, port['port']['network_id'],
+                    mac_address=port['port']['mac_address'])
+            self.assertEqual(409, res.status_int)
+
+    def test_create_port_with_mac_used_by_other_worker(self):
+        with self.port() as port:
+            # created by another worker, once the filter of this one is built
+            network_id = port['port']['network_id']
+            with mock.patch.object(mac_allocator, 'get_mac_allocator',
+                                   return_value=(
+                                       mac_allocator.MacFilterAllocator())):
+                other_port = self._make_port(self.fmt, network_id)
+            res = self._create_port(
+                self.fmt, network_id,
+                mac_address=other_port['port']['mac_address'])
+            self.assertEqual(409, res.status_int)
+            self._delete('ports', other_port['port']['id'])
+
+    def test_create_ports_bulk_failure_releases_macs(self):
+        with self.network() as net:
+            network_id = net['network']['id']
+            plugin = manager.NeutronManager.get_plugin()
+            with mock.patch.object(plugin, 'create_port',
+                                   side_effect=ValueError):
+                res = self._create_port_bulk(self.fmt, 2, network_id,
+                                             'test', True)
+                self.assertEqual(500, res.status_int)
+            self.assertFalse(self.allocator._pending[network_id])
+
+    def test_create_ports_bulk(self):
+        with self.network() as net:
+            with mock.patch.object(self.allocator, 'prepare',
+                                   wraps=self.allocator.prepare) as prepare:
+                res = self._create_port_bulk(self.fmt, 3,
+                                             net['network']['id'],
+                                             'test', True)
+                self.assertEqual(201, res.status_int)
+            prepare.assert_called_once_with(mock.ANY, net['network']['id'],
+                                            3)
+            ports = self.deserialize(self.fmt, res)['ports']
+            self.assertEqual(3, len(set(p['mac_address'] for p in ports)))
+            self.assertFalse(self.allocator._pending[net['network']['id']])
+            for p in ports:
+                self._delete('ports', p['id'])
@@ -0,0 +1,134 @@
+# Copyright (c) 2015 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo.config import cfg
+import sqlalchemy as sa
+
+from neutron.db import stats
+from neutron.tests import base
+
+
+class RequestStatsTestCase(base.BaseTestCase):
+
+    def test_add_statement_keeps_slowest(self):
+        cfg.CONF.set_override('db_stats_slowest_statements', 2)
+        request_stats = stats.RequestStats('api:ports.index')
+        for duration in (0.3, 0.1, 0.5, 0.2):
+            request_stats.add_statement('SELECT %s' % duration, duration)
+        self.assertEqual(4, request_stats.queries)
+        self.assertAlmostEqual(1.1, request_stats.db_time)
+        self.assertEqual([(0.5, 'SELECT 0.5'), (0.3, 'SELECT 0.3')],
+                         sorted(request_stats.slowest, reverse=True))
+
+
+class DbStatsTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(DbStatsTestCase, self).setUp()
+        mock.patch.object(stats, '_totals', {}).start()
+        mock.patch.object(stats, '_engines', []).start()
+        self.log = mock.patch.object(stats, 'LOG').start()
+        self.engine = sa.create_engine('sqlite://')
+        stats.instrument_engine(self.engine)
+
+    def test_record(self):
+        with stats.record('api:ports.index') as request_stats:
+            self.assertIs(request_stats, stats.current())
+            self.engine.execute('SELECT 1')
+            self.engine.execute('SELECT 2')
+        self.assertIsNone(stats.current())
+        self.assertEqual(2, request_stats.queries)
+        self.assertEqual(1, stats._totals['api:ports.index'].calls)
+        self.assertEqual(2, stats._totals['api:ports.index'].max_queries)
+        self.assertFalse(self.log.warn.called)
+
+    def test_record_without_queries(self):
+        with stats.record('api:ports.index'):
+            pass
+        self.assertEqual({}, stats._totals)
+        self.assertFalse(self.log.debug.called)
+
+    def test_too_many_queries_logged(self):
+        cfg.CONF.set_override('db_stats_max_queries', 1)
+        with stats.record('rpc:Callbacks.get_ports'):
+            self.engine.execute('SELECT 1')
+            self.engine.execute('SELECT 2')
+        self.assertEqual(1, self.log.warn.call_count)
+
+    def test_slow_statement_logged(self):
+        cfg.CONF.set_override('db_slow_statement_threshold', -1.0)
+        self.engine.execute('SELECT 1')
+        self.assertEqual(1, self.log.warn.call_count)
+
+    def test_checkout_wait(self):
+        with stats.record('api:ports.index') as request_stats:
+            with mock.patch.object(stats, 'time') as fake_time:
+                fake_time.time.side_effect = [0.0, 0.5]
+                self.engine.pool.connect().close()
+        self.assertEqual(0.5, request_stats.checkout_wait)
+
+    def test_checkout_wait_after_dispose(self):
+        self.engine.dispose()
+        self.engine.execute('SELECT 1')
+        with stats.record('api:ports.index') as request_stats:
+            with mock.patch.object(stats, 'time') as fake_time:
+                fake_time.time.side_effect = [0.0, 0.5]
+                self.engine.pool.connect().close()
+        self.assertEqual(0.5, request_stats.checkout_wait)
+
+    def test_failed_statement(self):
+        with stats.record('api:ports.index') as request_stats:
+            self.assertRaises(sa.exc.OperationalError,
+                              self.engine.execute, 'SELECT * FROM missing')
+            conn = self.engine.connect()
+            with mock.patch.object(stats, 'time') as fake_time:
+                fake_time.time.side_effect = [10.0, 10.5]
+                conn.execute('SELECT 1')
+            conn.close()
+        self.assertEqual(1, request_stats.queries)
+        self.assertEqual(0.5, request_stats.db_time)
+
+    def test_report(self):
+        cfg.CONF.set_override('db_stats_report_interval', 1)
+        with mock.patch.object(stats, '_last_report', 0):
+            with stats.record('api:ports.index'):
+                self.engine.execute('SELECT 1')
+        # the pool and the tag statistics
+        self.assertEqual(2, self.log.info.call_count)
+
+    def test_recorded_app_iter(self):
+        app_iter = mock.MagicMock()
+        app_iter.__iter__.return_value = iter(['{"ports": []}'])
+        request_stats = stats.start('api:ports.index')
+        recorded = stats.RecordedAppIter(app_iter, request_stats)
+        self.assertEqual(['{"ports": []}'], list(recorded))
+        self.assertIs(request_stats, stats.current())
+        recorded.close()
+        app_iter.close.assert_called_once_with()
+        self.assertIsNone(stats.current())
+
+    def test_recorded_endpoint(self):
+        class Callbacks(object):
+            target = 'target'
+
+            def get_ports(self, context):
+                return stats.current().tag
+
+        endpoint = stats.RecordedEndpoint(Callbacks())
+        self.assertEqual('target', endpoint.target)
+        self.assertEqual('rpc:Callbacks.get_ports',
+                         endpoint.get_ports(mock.sentinel.context))
+        self.assertIsNone(stats.current())
@@ -341,9 +341,9 @@ class TestCiscoPortsV2(CiscoML2MechanismTestCase,
         ctx = context.get_admin_context()
         with self.network() as net:
             plugin_obj = manager.NeutronManager.get_plugin()
-            orig = plugin_obj.create_port
+            orig = plugin_obj._create_port_db
             with mock.patch.object(plugin_obj,
-                                   'create_port') as patched_plugin:
+                                   '_create_port_db') as patched_plugin:
 
                 def side_effect(*args, **kwargs):
                     return self._fail_second_call(patched_plugin, orig,
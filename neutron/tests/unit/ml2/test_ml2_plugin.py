@@ -14,6 +14,7 @@
 #    under the License.
 
 import contextlib
+import functools
 import mock
 import testtools
 import uuid
@@ -150,6 +151,72 @@ class TestMl2PortsV2(test_plugin.TestPortsV2, Ml2PluginV2TestCase):
                 mock.call(_("The port '%s' was deleted"), 'invalid-uuid')
             ])
 
+    def test_create_ports_bulk_emulated_plugin_failure(self):
+        # The native create_port_bulk does not call create_port, in which
+        # the fault is injected
+        plugin = manager.NeutronManager.get_plugin()
+        with mock.patch.object(
+                plugin, 'create_port_bulk',
+                new=functools.partial(
+                    base_plugin.NeutronDbPluginV2.create_port_bulk, plugin)):
+            super(TestMl2PortsV2,
+                  self).test_create_ports_bulk_emulated_plugin_failure()
+
+    def test_create_ports_bulk_native_plugin_failure(self):
+        ctx = context.get_admin_context()
+        with self.network() as net:
+            plugin = manager.NeutronManager.get_plugin()
+            orig = plugin._create_port_db
+            with mock.patch.object(plugin,
+                                   '_create_port_db') as patched_plugin:
+
+                def side_effect(*args, **kwargs):
+                    return self._fail_second_call(patched_plugin, orig,
+                                                  *args, **kwargs)
+
+                patched_plugin.side_effect = side_effect
+                res = self._create_port_bulk(self.fmt, 2, net['network']['id'],
+                                             'test', True, context=ctx)
+                # We expect a 500 as we injected a fault in the plugin
+                self._validate_behavior_on_bulk_failure(
+                    res, 'ports', webob.exc.HTTPServerError.code)
+
+    def test_create_ports_bulk_calls_drivers_once(self):
+        plugin = manager.NeutronManager.get_plugin()
+        with contextlib.nested(
+            mock.patch.object(mech_logger.LoggerMechanismDriver,
+                              'create_ports_precommit'),
+            mock.patch.object(mech_logger.LoggerMechanismDriver,
+                              'create_ports_postcommit'),
+            mock.patch.object(plugin, 'notify_security_groups_member_updated')
+        ) as (precommit, postcommit, notify):
+            with self.network() as net:
+                res = self._create_port_bulk(self.fmt, 2,
+                                             net['network']['id'],
+                                             'test', True)
+                self._validate_behavior_on_bulk_success(res, 'ports')
+                ports = self.deserialize(self.fmt, res)['ports']
+                for driver_call in (precommit, postcommit):
+                    contexts = driver_call.call_args[0][0]
+                    self.assertEqual(
+                        [port['id'] for port in ports],
+                        [mech_context.current['id']
+                         for mech_context in contexts])
+                self.assertFalse(notify.called)
+                for port in ports:
+                    self._delete('ports', port['id'])
+
+    def test_create_ports_bulk_postcommit_faulty(self):
+        with mock.patch.object(mech_test.TestMechanismDriver,
+                               'create_ports_postcommit',
+                               side_effect=ml2_exc.MechanismDriverError):
+            with self.network() as net:
+                res = self._create_port_bulk(self.fmt, 2,
+                                             net['network']['id'],
+                                             'test', True)
+                self._validate_behavior_on_bulk_failure(
+                    res, 'ports', webob.exc.HTTPServerError.code)
+
     def test_l3_cleanup_on_net_delete(self):
         l3plugin = manager.NeutronManager.get_service_plugins().get(
             service_constants.L3_ROUTER_NAT)
@@ -13,6 +13,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
+
 import mock
 
 from neutron import context
@@ -108,6 +110,42 @@ class PortBindingTestCase(test_plugin.NeutronDbPluginV2TestCase):
             self.assertIsNone(
                 self.plugin.get_bound_port_context(ctx, port['port']['id']))
 
+    def test_get_bound_ports_contexts(self):
+        ctx = context.get_admin_context()
+        with self.subnet() as subnet:
+            with contextlib.nested(self.port(subnet=subnet),
+                                   self.port(subnet=subnet)) as ports:
+                port1, port2 = ports
+                port_id1 = port1['port']['id']
+                port_id2 = port2['port']['id']
+                # emulating concurrent binding deletion
+                (ctx.session.query(ml2_models.PortBinding).
+                 filter_by(port_id=port_id2).delete())
+                port_contexts = self.plugin.get_bound_ports_contexts(
+                    ctx, [port_id1[:11], port_id2, 'fake_port_id'])
+                self.assertEqual(port_id1,
+                                 port_contexts[port_id1[:11]].current['id'])
+                self.assertIsNone(port_contexts[port_id2])
+                self.assertIsNone(port_contexts['fake_port_id'])
+
+    def test_update_port_statuses(self):
+        ctx = context.get_admin_context()
+        with self.subnet() as subnet:
+            with contextlib.nested(self.port(subnet=subnet),
+                                   self.port(subnet=subnet)) as ports:
+                port1, port2 = ports
+                port_id1 = port1['port']['id']
+                port_id2 = port2['port']['id']
+                res = self.plugin.update_port_statuses(
+                    ctx, {port_id1[:11]: 'ACTIVE', port_id2: 'BUILD',
+                          'fake_port_id': 'ACTIVE'})
+                self.assertEqual({port_id1[:11]: port_id1, port_id2: port_id2,
+                                  'fake_port_id': None}, res)
+                self.assertEqual('ACTIVE',
+                                 self.plugin.get_port(ctx, port_id1)['status'])
+                self.assertEqual('BUILD',
+                                 self.plugin.get_port(ctx, port_id2)['status'])
+
     def test_commit_dvr_port_binding(self):
         ctx = context.get_admin_context()
 
@@ -112,24 +112,42 @@ class RpcCallbacksTestCase(base.BaseTestCase):
                                  not self.plugin.update_port_status.called)
 
     def test_get_devices_details_list(self):
-        devices = [1, 2, 3, 4, 5]
-        kwargs = {'host': 'fake_host', 'agent_id': 'fake_agent_id'}
-        with mock.patch.object(self.callbacks, 'get_device_details',
-                               side_effect=devices) as f:
-            res = self.callbacks.get_devices_details_list('fake_context',
-                                                          devices=devices,
-                                                          **kwargs)
-            self.assertEqual(devices, res)
-            self.assertEqual(len(devices), f.call_count)
-            calls = [mock.call('fake_context', device=i, **kwargs)
-                     for i in devices]
-            f.assert_has_calls(calls)
+        devices = ['tap1', 'tap2']
+        port = collections.defaultdict(lambda: 'fake')
+        port['admin_state_up'] = True
+        port['status'] = constants.PORT_STATUS_DOWN
+        port_context = mock.MagicMock(current=port)
+        self.plugin._device_to_port_id.side_effect = lambda d: d[3:]
+        self.plugin.get_bound_ports_contexts.return_value = {
+            '1': port_context, '2': None}
+        res = self.callbacks.get_devices_details_list(
+            'fake_context', devices=devices, host='fake_host',
+            agent_id='fake_agent_id')
+        self.assertEqual(['tap1', 'tap2'], [d['device'] for d in res])
+        self.assertEqual('1', res[0]['port_id'])
+        self.assertEqual({'device': 'tap2'}, res[1])
+        self.plugin.get_bound_ports_contexts.assert_called_once_with(
+            'fake_context', set(['1', '2']), 'fake_host')
+        self.plugin.update_port_statuses.assert_called_once_with(
+            'fake_context', {'1': constants.PORT_STATUS_BUILD}, 'fake_host')
+        self.assertFalse(self.plugin.get_bound_port_context.called)
+        self.assertFalse(self.plugin.update_port_status.called)
+
+    def test_get_devices_details_list_port_status_equal_new_status(self):
+        port = collections.defaultdict(lambda: 'fake')
+        port['admin_state_up'] = True
+        port['status'] = constants.PORT_STATUS_BUILD
+        self.plugin._device_to_port_id.return_value = 'fake_port_id'
+        self.plugin.get_bound_ports_contexts.return_value = {
+            'fake_port_id': mock.MagicMock(current=port)}
+        self.callbacks.get_devices_details_list(
+            'fake_context', devices=['fake_device'], host='fake_host')
+        self.assertFalse(self.plugin.update_port_statuses.called)
 
     def test_get_devices_details_list_with_empty_devices(self):
-        with mock.patch.object(self.callbacks, 'get_device_details') as f:
-            res = self.callbacks.get_devices_details_list('fake_context')
-            self.assertFalse(f.called)
-            self.assertEqual([], res)
+        res = self.callbacks.get_devices_details_list('fake_context')
+        self.assertFalse(self.plugin.get_bound_ports_contexts.called)
+        self.assertEqual([], res)
 
     def _test_update_device_not_bound_to_host(self, func):
         self.plugin.port_bound_to_host.return_value = False
@@ -162,6 +180,49 @@ class RpcCallbacksTestCase(base.BaseTestCase):
             'fake_context', 'fake_port_id', constants.PORT_STATUS_DOWN,
             'fake_host')
 
+    def test_update_device_list(self):
+        self.plugin._device_to_port_id.side_effect = lambda d: d[3:]
+        self.plugin.ports_bound_to_host.return_value = set(['1', '2', '3'])
+        self.plugin.update_port_statuses.return_value = {
+            '1': '1-full', '2': '2-full', '3': None}
+        self.l3plugin.supported_extension_aliases = []
+        res = self.callbacks.update_device_list(
+            'fake_context', devices_up=['tap1'],
+            devices_down=['tap2', 'tap3', 'tap4'], host='fake_host')
+        self.plugin.update_port_statuses.assert_called_once_with(
+            'fake_context', {'1': constants.PORT_STATUS_ACTIVE,
+                             '2': constants.PORT_STATUS_DOWN,
+                             '3': constants.PORT_STATUS_DOWN}, 'fake_host')
+        self.assertEqual(
+            {'devices_up': ['tap1'],
+             'failed_devices_up': [],
+             'devices_down': [{'device': 'tap2', 'exists': True},
+                              {'device': 'tap3', 'exists': False},
+                              {'device': 'tap4', 'exists': True}],
+             'failed_devices_down': []}, res)
+        self.assertFalse(self.plugin.update_port_status.called)
+
+    def test_update_device_list_failed(self):
+        self.plugin._device_to_port_id.side_effect = lambda d: d[3:]
+        self.plugin.update_port_statuses.side_effect = Exception()
+        res = self.callbacks.update_device_list(
+            'fake_context', devices_up=['tap1'], devices_down=['tap2'])
+        self.assertEqual({'devices_up': [],
+                          'failed_devices_up': ['tap1'],
+                          'devices_down': [],
+                          'failed_devices_down': ['tap2']}, res)
+
+    def test_update_device_list_with_dvr(self):
+        self.plugin._device_to_port_id.side_effect = lambda d: d[3:]
+        self.plugin.update_port_statuses.return_value = {'1': '1-full'}
+        self.l3plugin.supported_extension_aliases = ['router', 'dvr']
+        self.callbacks.update_device_list('fake_context',
+                                          devices_up=['tap1'])
+        self.plugin._get_port.assert_called_once_with('fake_context',
+                                                      '1-full')
+        self.l3plugin.dvr_vmarp_table_update.assert_called_once_with(
+            'fake_context', self.plugin._get_port.return_value, 'add')
+
 
 class RpcApiTestCase(base.BaseTestCase):
 
@@ -243,6 +304,15 @@ class RpcApiTestCase(base.BaseTestCase):
                            agent_id='fake_agent_id', host='fake_host',
                            version='1.3')
 
+    def test_update_device_list(self):
+        rpcapi = agent_rpc.PluginApi(topics.PLUGIN)
+        self._test_rpc_api(rpcapi, None,
+                           'update_device_list', rpc_method='call',
+                           devices_up=['fake_device1', 'fake_device2'],
+                           devices_down=['fake_device3', 'fake_device4'],
+                           agent_id='fake_agent_id', host='fake_host',
+                           version='1.4')
+
     def test_update_device_down(self):
         rpcapi = agent_rpc.PluginApi(topics.PLUGIN)
         self._test_rpc_api(rpcapi, None,
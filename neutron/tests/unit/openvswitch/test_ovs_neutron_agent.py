@@ -116,6 +116,8 @@ class TestOvsNeutronAgent(base.BaseTestCase):
             mock.patch('neutron.plugins.openvswitch.agent.ovs_neutron_agent.'
                        'OVSNeutronAgent.setup_ancillary_bridges',
                        return_value=[]),
+            mock.patch('neutron.plugins.openvswitch.agent.ovs_neutron_agent.'
+                       'OVSNeutronAgent._restore_local_vlan_map'),
             mock.patch('neutron.agent.linux.ovs_lib.OVSBridge.'
                        'create'),
             mock.patch('neutron.agent.linux.ovs_lib.OVSBridge.'
@@ -159,8 +161,11 @@ class TestOvsNeutronAgent(base.BaseTestCase):
                                   fixed_ips, "compute:None", False)
         get_ovs_db_func.assert_called_once_with("Port", mock.ANY, "tag")
         if new_local_vlan != old_local_vlan:
-            set_ovs_db_func.assert_called_once_with(
-                "Port", mock.ANY, "tag", str(new_local_vlan))
+            self.assertEqual(
+                [mock.call("Port", mock.ANY, "tag", str(new_local_vlan)),
+                 mock.call("Port", mock.ANY, "other_config:net_uuid",
+                           net_uuid)],
+                set_ovs_db_func.call_args_list)
             if ofport != -1:
                 delete_flows_func.assert_called_once_with(in_port=port.ofport)
             else:
@@ -365,12 +370,16 @@ class TestOvsNeutronAgent(base.BaseTestCase):
 
         with contextlib.nested(
             mock.patch.object(self.agent, 'reclaim_local_vlan'),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
-                              return_value=None),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value={
+                                  'devices_down': [
+                                      {'device': self._port.vif_id,
+                                       'exists': True}],
+                                  'failed_devices_down': []}),
             mock.patch.object(self.agent.dvr_agent.int_br, 'delete_flows'),
             mock.patch.object(self.agent.dvr_agent.tun_br,
                               'delete_flows')) as (reclaim_vlan_fn,
-                                                   update_dev_down_fn,
+                                                   update_dev_list_fn,
                                                    delete_flows_int_fn,
                                                    delete_flows_tun_fn):
                 self.agent.treat_devices_removed([self._port.vif_id])
@@ -420,11 +429,15 @@ class TestOvsNeutronAgent(base.BaseTestCase):
 
         with contextlib.nested(
             mock.patch.object(self.agent, 'reclaim_local_vlan'),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
-                              return_value=None),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value={
+                                  'devices_down': [
+                                      {'device': self._compute_port.vif_id,
+                                       'exists': True}],
+                                  'failed_devices_down': []}),
             mock.patch.object(self.agent.dvr_agent.int_br,
                               'delete_flows')) as (reclaim_vlan_fn,
-                                                   update_dev_down_fn,
+                                                   update_dev_list_fn,
                                                    delete_flows_int_fn):
                 self.agent.treat_devices_removed([self._compute_port.vif_id])
                 self.assertTrue(delete_flows_int_fn.called)
@@ -477,11 +490,15 @@ class TestOvsNeutronAgent(base.BaseTestCase):
 
         with contextlib.nested(
             mock.patch.object(self.agent, 'reclaim_local_vlan'),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
-                              return_value=None),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value={
+                                  'devices_down': [
+                                      {'device': self._port.vif_id,
+                                       'exists': True}],
+                                  'failed_devices_down': []}),
             mock.patch.object(self.agent.dvr_agent.int_br,
                               'delete_flows')) as (reclaim_vlan_fn,
-                                                   update_dev_down_fn,
+                                                   update_dev_list_fn,
                                                    delete_flows_int_fn):
                 self.agent.treat_devices_removed([self._port.vif_id])
                 self.assertTrue(delete_flows_int_fn.called)
@@ -598,6 +615,81 @@ class TestOvsNeutronAgent(base.BaseTestCase):
     def test_port_dead_with_port_already_dead(self):
         self._test_port_dead(ovs_neutron_agent.DEAD_VLAN_TAG)
 
+    def test_agent_flows_use_run_cookie(self):
+        self.assertEqual(self.agent.agent_uuid_stamp,
+                         self.agent.int_br.default_cookie)
+        self.assertTrue(self.agent.cleanup_stale_flows_pending)
+
+    def test_setup_integration_br_keeps_patch_port(self):
+        with mock.patch.object(self.agent, 'int_br') as int_br:
+            self.agent.setup_integration_br()
+        self.assertFalse(int_br.delete_port.called)
+        self.assertFalse(int_br.remove_all_flows.called)
+
+    def test_setup_integration_br_drop_flows_on_start(self):
+        self.agent.drop_flows_on_start = True
+        with mock.patch.object(self.agent, 'int_br') as int_br:
+            self.agent.setup_integration_br()
+        int_br.delete_port.assert_called_once_with(
+            cfg.CONF.OVS.int_peer_patch_port)
+        int_br.remove_all_flows.assert_called_once_with()
+
+    def test_cleanup_stale_flows(self):
+        phys_br = mock.Mock()
+        self.agent.phys_brs = {'physnet1': phys_br}
+        self.agent.enable_tunneling = True
+        self.agent.tun_br = mock.Mock()
+        with mock.patch.object(self.agent.int_br,
+                               'delete_stale_flows') as int_cleanup:
+            self.agent.cleanup_stale_flows()
+        int_cleanup.assert_called_once_with()
+        phys_br.delete_stale_flows.assert_called_once_with()
+        self.agent.tun_br.delete_stale_flows.assert_called_once_with()
+
+    def _restore_local_vlan_map(self):
+        ports = [mock.Mock(port_name=name)
+                 for name in ('tap1', 'tap2', 'tap3', 'tap4')]
+        port_tags = {'tap1': 10, 'tap2': 10, 'tap3': 11, 'tap4': []}
+        other_configs = {'tap1': {'net_uuid': 'net1'},
+                         'tap2': {'net_uuid': 'net1'},
+                         'tap3': {}}
+        with mock.patch.object(self.agent, 'int_br') as int_br:
+            int_br.get_vif_ports.return_value = ports
+            int_br.get_port_tag_dict.return_value = port_tags
+            int_br.db_get_map.side_effect = (
+                lambda table, record, column: other_configs[record])
+            self.agent._restore_local_vlan_map()
+
+    def test_restore_local_vlan_map(self):
+        self._restore_local_vlan_map()
+        self.assertEqual({'net1': 10}, self.agent._local_vlan_hints)
+        self.assertEqual(set([10, 11]), self.agent._reserved_local_vlans)
+        self.assertNotIn(10, self.agent.available_local_vlans)
+        self.assertNotIn(11, self.agent.available_local_vlans)
+
+    def test_provision_local_vlan_reuses_restored_vlan(self):
+        self._restore_local_vlan_map()
+        with mock.patch.object(self.agent, 'int_br'):
+            self.agent.provision_local_vlan('net1', p_const.TYPE_LOCAL,
+                                            None, None)
+            self.agent.provision_local_vlan('net2', p_const.TYPE_LOCAL,
+                                            None, None)
+        self.assertEqual(10, self.agent.local_vlan_map['net1'].vlan)
+        self.assertNotIn(self.agent.local_vlan_map['net2'].vlan, (10, 11))
+
+    def test_cleanup_stale_flows_releases_reserved_vlans(self):
+        self._restore_local_vlan_map()
+        self.agent.local_vlan_map['net1'] = (
+            ovs_neutron_agent.LocalVLANMapping(10, None, None, None))
+        self.agent.phys_brs = {}
+        self.agent.enable_tunneling = False
+        with mock.patch.object(self.agent, 'int_br'):
+            self.agent.cleanup_stale_flows()
+        self.assertNotIn(10, self.agent.available_local_vlans)
+        self.assertIn(11, self.agent.available_local_vlans)
+        self.assertFalse(self.agent._reserved_local_vlans)
+        self.assertFalse(self.agent._local_vlan_hints)
+
     def mock_scan_ports(self, vif_port_set=None, registered_ports=None,
                         updated_ports=None, port_tags_dict=None):
         if port_tags_dict is None:  # Because empty dicts evaluate as False.
@@ -679,6 +771,65 @@ class TestOvsNeutronAgent(base.BaseTestCase):
                 vif_port_set, registered_ports, port_tags_dict=port_tags_dict)
         self.assertEqual(expected, actual)
 
+    def _port_event(self, event, name, vif_id, ofport=1):
+        return {'event': event, 'name': name, 'ofport': ofport,
+                'external_ids': {'iface-id': vif_id,
+                                 'attached-mac': 'aa:bb:cc:dd:ee:ff'}}
+
+    def mock_process_ports_events(self, events, registered_ports,
+                                  updated_ports=None, br_name='br-int'):
+        with contextlib.nested(
+            mock.patch.object(self.agent.int_br, 'get_vif_port_set'),
+            mock.patch.object(self.agent.int_br,
+                              'get_bridge_name_for_port_name',
+                              return_value=br_name),
+        ) as (get_vif_port_set, get_br_name):
+            self.agent.int_br.br_name = 'br-int'
+            port_info = self.agent.process_ports_events(
+                events, registered_ports, updated_ports)
+            self.assertFalse(get_vif_port_set.called)
+            return port_info, get_br_name
+
+    def test_process_ports_events_added_and_removed(self):
+        events = [self._port_event('added', 'tap3', 3),
+                  self._port_event('removed', 'tap2', 2)]
+        actual, get_br_name = self.mock_process_ports_events(
+            events, set([1, 2]))
+        expected = dict(current=set([1, 3]), added=set([3]),
+                        removed=set([2]))
+        self.assertEqual(expected, actual)
+        get_br_name.assert_called_once_with('tap3')
+
+    def test_process_ports_events_no_changes(self):
+        actual, _br = self.mock_process_ports_events([], set([1, 2]))
+        self.assertEqual({'current': set([1, 2])}, actual)
+
+    def test_process_ports_events_ignores_other_bridges(self):
+        events = [self._port_event('added', 'qg-1', 3)]
+        actual, _br = self.mock_process_ports_events(
+            events, set([1]), br_name='br-ex\n')
+        self.assertEqual({'current': set([1])}, actual)
+
+    def test_process_ports_events_ignores_not_ready_ports(self):
+        events = [self._port_event('added', 'tap3', 3, ofport=[]),
+                  self._port_event('added', 'tap4', 4, ofport=-1)]
+        actual, _br = self.mock_process_ports_events(events, set([1]))
+        self.assertEqual({'current': set([1])}, actual)
+
+    def test_process_ports_events_modified_port_is_updated(self):
+        events = [self._port_event('added', 'tap1', 1, ofport=5)]
+        actual, get_br_name = self.mock_process_ports_events(
+            events, set([1, 2]), set([2, 7]))
+        self.assertEqual({'current': set([1, 2]), 'updated': set([1, 2])},
+                         actual)
+        self.assertFalse(get_br_name.called)
+
+    def test_process_ports_events_add_then_remove(self):
+        events = [self._port_event('added', 'tap3', 3),
+                  self._port_event('removed', 'tap3', 3)]
+        actual, _br = self.mock_process_ports_events(events, set([1]))
+        self.assertEqual({'current': set([1])}, actual)
+
     def test_treat_devices_added_returns_raises_for_missing_device(self):
         with contextlib.nested(
             mock.patch.object(self.agent.plugin_rpc,
@@ -704,10 +855,10 @@ class TestOvsNeutronAgent(base.BaseTestCase):
                               return_value=[details]),
             mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
                               return_value=port),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_up'),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_down'),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value={}),
             mock.patch.object(self.agent, func_name)
-        ) as (get_dev_fn, get_vif_func, upd_dev_up, upd_dev_down, func):
+        ) as (get_dev_fn, get_vif_func, upd_dev_list, func):
             skip_devs = self.agent.treat_devices_added_or_updated([{}], False)
             # The function should not raise
             self.assertFalse(skip_devs)
@@ -748,18 +899,16 @@ class TestOvsNeutronAgent(base.BaseTestCase):
                               return_value=[dev_mock]),
             mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
                               return_value=None),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_up'),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_down'),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value={}),
             mock.patch.object(self.agent, 'treat_vif_port')
-        ) as (get_dev_fn, get_vif_func, upd_dev_up,
-              upd_dev_down, treat_vif_port):
+        ) as (get_dev_fn, get_vif_func, upd_dev_list, treat_vif_port):
             skip_devs = self.agent.treat_devices_added_or_updated([{}], False)
             # The function should return False for resync and no device
             # processed
             self.assertEqual(['the_skipped_one'], skip_devs)
             self.assertFalse(treat_vif_port.called)
-            self.assertFalse(upd_dev_down.called)
-            self.assertFalse(upd_dev_up.called)
+            self.assertFalse(upd_dev_list.called)
 
     def test_treat_devices_added_updated_put_port_down(self):
         fake_details_dict = {'admin_state_up': False,
@@ -780,29 +929,83 @@ class TestOvsNeutronAgent(base.BaseTestCase):
                               return_value=[fake_details_dict]),
             mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
                               return_value=mock.MagicMock()),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_up'),
-            mock.patch.object(self.agent.plugin_rpc, 'update_device_down'),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value={}),
             mock.patch.object(self.agent, 'treat_vif_port')
-        ) as (get_dev_fn, get_vif_func, upd_dev_up,
-              upd_dev_down, treat_vif_port):
+        ) as (get_dev_fn, get_vif_func, upd_dev_list, treat_vif_port):
             skip_devs = self.agent.treat_devices_added_or_updated([{}], False)
             # The function should return False for resync
             self.assertFalse(skip_devs)
             self.assertTrue(treat_vif_port.called)
-            self.assertTrue(upd_dev_down.called)
+            upd_dev_list.assert_called_once_with(
+                self.agent.context, [], ['xxx'], self.agent.agent_id,
+                mock.ANY)
+
+    def test_treat_devices_added_updated_raises_for_failed_update(self):
+        fake_details_dict = {'admin_state_up': True,
+                             'port_id': 'xxx',
+                             'device': 'xxx',
+                             'network_id': 'yyy',
+                             'physical_network': 'foo',
+                             'segmentation_id': 'bar',
+                             'network_type': 'baz',
+                             'fixed_ips': [],
+                             'device_owner': 'compute:None'
+                             }
+
+        with contextlib.nested(
+            mock.patch.object(self.agent.plugin_rpc,
+                              'get_devices_details_list',
+                              return_value=[fake_details_dict]),
+            mock.patch.object(self.agent.int_br, 'get_vif_port_by_id',
+                              return_value=mock.MagicMock()),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              return_value={'failed_devices_up': ['xxx']}),
+            mock.patch.object(self.agent, 'treat_vif_port')
+        ):
+            self.assertRaises(
+                ovs_neutron_agent.DeviceListRetrievalError,
+                self.agent.treat_devices_added_or_updated, ['xxx'], False)
+
+    def test_update_devices_status_applies_deferred_flows_first(self):
+        parent = mock.Mock()
+        with contextlib.nested(
+            mock.patch.object(self.agent.int_br, 'run_ofctl',
+                              new=parent.run_ofctl),
+            mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                              new=parent.update_device_list)
+        ):
+            parent.update_device_list.return_value = {}
+            with ovs_lib.deferred_flows():
+                self.agent.int_br.add_flow(in_port=1, actions='drop')
+                self.agent.update_devices_status(['dev1'], [])
+        self.assertEqual(['run_ofctl', 'update_device_list'],
+                         [call[0] for call in parent.mock_calls])
 
     def test_treat_devices_removed_returns_true_for_missing_device(self):
-        with mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
+        with mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
                                side_effect=Exception()):
-            self.assertTrue(self.agent.treat_devices_removed([{}]))
+            self.assertTrue(self.agent.treat_devices_removed(['dev1']))
+
+    def test_treat_devices_removed_returns_true_for_failed_device(self):
+        devices_set = {'devices_down': [], 'failed_devices_down': ['dev1']}
+        with mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                               return_value=devices_set):
+            with mock.patch.object(self.agent, 'port_unbound') as port_unbound:
+                self.assertTrue(self.agent.treat_devices_removed(['dev1']))
+        self.assertFalse(port_unbound.called)
 
     def _mock_treat_devices_removed(self, port_exists):
-        details = dict(exists=port_exists)
-        with mock.patch.object(self.agent.plugin_rpc, 'update_device_down',
-                               return_value=details):
+        devices_set = {'devices_down': [{'device': 'dev1',
+                                         'exists': port_exists}],
+                       'failed_devices_down': []}
+        with mock.patch.object(self.agent.plugin_rpc, 'update_device_list',
+                               return_value=devices_set) as upd_dev_list:
             with mock.patch.object(self.agent, 'port_unbound') as port_unbound:
-                self.assertFalse(self.agent.treat_devices_removed([{}]))
-        self.assertTrue(port_unbound.called)
+                self.assertFalse(self.agent.treat_devices_removed(['dev1']))
+        upd_dev_list.assert_called_once_with(
+            self.agent.context, [], ['dev1'], self.agent.agent_id, mock.ANY)
+        port_unbound.assert_called_once_with('dev1')
 
     def test_treat_devices_removed_unbinds_port(self):
         self._mock_treat_devices_removed(True)
@@ -1512,6 +1715,8 @@ class AncillaryBridgesTest(base.BaseTestCase):
             mock.patch('neutron.plugins.openvswitch.agent.ovs_neutron_agent.'
                        'OVSNeutronAgent.setup_integration_br',
                        return_value=mock.Mock()),
+            mock.patch('neutron.plugins.openvswitch.agent.ovs_neutron_agent.'
+                       'OVSNeutronAgent._restore_local_vlan_map'),
             mock.patch('neutron.agent.linux.utils.get_interface_mac',
                        return_value='00:00:00:00:00:01'),
             mock.patch('neutron.agent.linux.ovs_lib.OVSBridge.'
@@ -16,6 +16,7 @@
 
 import contextlib
 import time
+import uuid
 
 import mock
 from oslo.config import cfg
@@ -85,6 +86,10 @@ class TunnelTest(base.BaseTestCase):
         self.TUN_OFPORT = 22222
         self.MAP_TUN_INT_OFPORT = 33333
         self.MAP_TUN_PHY_OFPORT = 44444
+        self.AGENT_COOKIE = 0x1234
+        mock.patch.object(
+            ovs_neutron_agent.uuid, 'uuid4',
+            return_value=uuid.UUID(int=self.AGENT_COOKIE)).start()
 
         self.inta = mock.Mock()
         self.intb = mock.Mock()
@@ -106,6 +111,7 @@ class TunnelTest(base.BaseTestCase):
         self.mock_int_bridge.add_port.return_value = self.MAP_TUN_INT_OFPORT
         self.mock_int_bridge.add_patch_port.side_effect = (
             lambda tap, peer: self.ovs_int_ofports[tap])
+        self.mock_int_bridge.get_vif_ports.return_value = []
 
         self.mock_map_tun_bridge = self.ovs_bridges[self.MAP_TUN_BRIDGE]
         self.mock_map_tun_bridge.br_name = self.MAP_TUN_BRIDGE
@@ -147,15 +153,13 @@ class TunnelTest(base.BaseTestCase):
         self.mock_int_bridge_expected = [
             mock.call.create(),
             mock.call.set_secure_mode(),
-            mock.call.delete_port('patch-tun'),
-            mock.call.remove_all_flows(),
             mock.call.add_flow(priority=1, actions='normal'),
             mock.call.add_flow(priority=0, table=constants.CANARY_TABLE,
                                actions='drop'),
+            mock.call.get_vif_ports(),
         ]
 
         self.mock_map_tun_bridge_expected = [
-            mock.call.remove_all_flows(),
             mock.call.add_flow(priority=1, actions='normal'),
             mock.call.delete_port('phy-%s' % self.MAP_TUN_BRIDGE),
             mock.call.add_patch_port('phy-%s' % self.MAP_TUN_BRIDGE,
@@ -185,7 +189,7 @@ class TunnelTest(base.BaseTestCase):
         ]
 
         self.mock_tun_bridge_expected = [
-            mock.call.reset_bridge(),
+            mock.call.create(),
             mock.call.add_patch_port('patch-int', 'patch-tun'),
         ]
         self.mock_int_bridge_expected += [
@@ -193,7 +197,6 @@ class TunnelTest(base.BaseTestCase):
         ]
 
         self.mock_tun_bridge_expected += [
-            mock.call.remove_all_flows(),
             mock.call.add_flow(priority=1,
                                actions="resubmit(,%s)" %
                                constants.PATCH_LV_TO_TUN,
@@ -214,7 +217,8 @@ class TunnelTest(base.BaseTestCase):
                     table=constants.TUN_TABLE[tunnel_type],
                     priority=0,
                     actions="drop"))
-        learned_flow = ("table=%s,"
+        learned_flow = ("cookie=%#x,"
+                        "table=%s,"
                         "priority=1,"
                         "hard_timeout=300,"
                         "NXM_OF_VLAN_TCI[0..11],"
@@ -222,7 +226,7 @@ class TunnelTest(base.BaseTestCase):
                         "load:0->NXM_OF_VLAN_TCI[],"
                         "load:NXM_NX_TUN_ID[]->NXM_NX_TUN_ID[],"
                         "output:NXM_OF_IN_PORT[]" %
-                        constants.UCAST_TO_TUN)
+                        (self.AGENT_COOKIE, constants.UCAST_TO_TUN))
         self.mock_tun_bridge_expected += [
             mock.call.add_flow(table=constants.LEARN_FROM_TUN,
                                priority=1,
@@ -292,7 +296,7 @@ class TunnelTest(base.BaseTestCase):
     def test_construct_with_arp_responder(self):
         self._build_agent(l2_population=True, arp_responder=True)
         self.mock_tun_bridge_expected.insert(
-            5, mock.call.add_flow(table=constants.PATCH_LV_TO_TUN,
+            4, mock.call.add_flow(table=constants.PATCH_LV_TO_TUN,
                                   priority=1,
                                   proto="arp",
                                   dl_dst="ff:ff:ff:ff:ff:ff",
@@ -300,7 +304,7 @@ class TunnelTest(base.BaseTestCase):
                                   constants.ARP_RESPONDER)
         )
         self.mock_tun_bridge_expected.insert(
-            12, mock.call.add_flow(table=constants.ARP_RESPONDER,
+            11, mock.call.add_flow(table=constants.ARP_RESPONDER,
                                    priority=0,
                                    actions="resubmit(,%s)" %
                                    constants.FLOOD_TO_TUN)
@@ -441,6 +445,8 @@ class TunnelTest(base.BaseTestCase):
             mock.call.db_get_val('Port', VIF_PORT.port_name, 'tag'),
             mock.call.set_db_attribute('Port', VIF_PORT.port_name,
                                        'tag', str(LVM.vlan)),
+            mock.call.set_db_attribute('Port', VIF_PORT.port_name,
+                                       'other_config:net_uuid', NET_UUID),
             mock.call.delete_flows(in_port=VIF_PORT.ofport)
         ]
 
@@ -510,8 +516,13 @@ class TunnelTest(base.BaseTestCase):
 
         self.mock_int_bridge_expected += [
             mock.call.dump_flows_for_table(constants.CANARY_TABLE),
+            mock.call.delete_stale_flows(),
             mock.call.dump_flows_for_table(constants.CANARY_TABLE)
         ]
+        self.mock_map_tun_bridge_expected.append(
+            mock.call.delete_stale_flows())
+        self.mock_tun_bridge_expected.append(
+            mock.call.delete_stale_flows())
 
         with contextlib.nested(
             mock.patch.object(log.ContextAdapter, 'exception'),
@@ -571,15 +582,13 @@ class TunnelTestUseVethInterco(TunnelTest):
         self.mock_int_bridge_expected = [
             mock.call.create(),
             mock.call.set_secure_mode(),
-            mock.call.delete_port('patch-tun'),
-            mock.call.remove_all_flows(),
             mock.call.add_flow(priority=1, actions='normal'),
             mock.call.add_flow(table=constants.CANARY_TABLE, priority=0,
-                               actions="drop")
+                               actions="drop"),
+            mock.call.get_vif_ports(),
         ]
 
         self.mock_map_tun_bridge_expected = [
-            mock.call.remove_all_flows(),
             mock.call.add_flow(priority=1, actions='normal'),
             mock.call.delete_port('phy-%s' % self.MAP_TUN_BRIDGE),
             mock.call.add_port(self.intb),
@@ -601,7 +610,7 @@ class TunnelTestUseVethInterco(TunnelTest):
         ]
 
         self.mock_tun_bridge_expected = [
-            mock.call.reset_bridge(),
+            mock.call.create(),
             mock.call.add_patch_port('patch-int', 'patch-tun'),
         ]
         self.mock_int_bridge_expected += [
@@ -609,7 +618,6 @@ class TunnelTestUseVethInterco(TunnelTest):
         ]
 
         self.mock_tun_bridge_expected += [
-            mock.call.remove_all_flows(),
             mock.call.add_flow(priority=1,
                                in_port=self.INT_OFPORT,
                                actions="resubmit(,%s)" %
@@ -632,7 +640,8 @@ class TunnelTestUseVethInterco(TunnelTest):
                     table=constants.TUN_TABLE[tunnel_type],
                     priority=0,
                     actions="drop"))
-        learned_flow = ("table=%s,"
+        learned_flow = ("cookie=%#x,"
+                        "table=%s,"
                         "priority=1,"
                         "hard_timeout=300,"
                         "NXM_OF_VLAN_TCI[0..11],"
@@ -640,7 +649,7 @@ class TunnelTestUseVethInterco(TunnelTest):
                         "load:0->NXM_OF_VLAN_TCI[],"
                         "load:NXM_NX_TUN_ID[]->NXM_NX_TUN_ID[],"
                         "output:NXM_OF_IN_PORT[]" %
-                        constants.UCAST_TO_TUN)
+                        (self.AGENT_COOKIE, constants.UCAST_TO_TUN))
         self.mock_tun_bridge_expected += [
             mock.call.add_flow(table=constants.LEARN_FROM_TUN,
                                priority=1,
@@ -12,8 +12,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import eventlet
 import fixtures
 import mock
+from oslo.config import cfg
 import testtools
 
 from neutron.agent.linux import utils
@@ -119,6 +121,125 @@ class AgentUtilsExecuteTest(base.BaseTestCase):
                 self.assertTrue(log.debug.called)
 
 
+class AgentUtilsExecuteRootwrapDaemonTest(base.BaseTestCase):
+    def setUp(self):
+        super(AgentUtilsExecuteRootwrapDaemonTest, self).setUp()
+        cfg.CONF.set_override('root_helper_daemon', 'sudo daemon', 'AGENT')
+        utils.RootwrapDaemonHelper.reset()
+        self.addCleanup(utils.RootwrapDaemonHelper.reset)
+        self.client = mock.Mock()
+        client_p = mock.patch.object(utils.client, 'Client',
+                                     return_value=self.client)
+        self.client_cls = client_p.start()
+        self.run_one_command = self.client._proxy.run_one_command
+        self.create_process = mock.patch.object(utils,
+                                                'create_process').start()
+
+    def test_execute_uses_daemon(self):
+        self.run_one_command.return_value = (0, 'out', '')
+        result = utils.execute(['ls'], root_helper='sudo',
+                               process_input='in')
+        self.assertEqual('out', result)
+        self.client_cls.assert_called_once_with(['sudo', 'daemon'])
+        self.run_one_command.assert_called_once_with(['ls'], 'in')
+        self.assertFalse(self.create_process.called)
+
+    def test_execute_daemon_in_native_thread(self):
+        with mock.patch.object(utils.tpool, 'execute',
+                               return_value=(0, 'out', '')) as execute:
+            utils.execute(['ls'], root_helper='sudo', process_input='in')
+        execute.assert_called_once_with(utils.RootwrapDaemonHelper.execute,
+                                        self.client, ['ls'], 'in')
+
+    def test_execute_daemon_concurrently(self):
+        native_thread = eventlet.patcher.original('thread')
+        main_thread = native_thread.get_ident()
+        running = []
+        concurrency = []
+
+        def ensure_initialized():
+            # the daemon is started from the greenthread
+            self.assertEqual(main_thread, native_thread.get_ident())
+
+        def execute(cmd, process_input):
+            self.assertNotEqual(main_thread, native_thread.get_ident())
+            running.append(cmd)
+            concurrency.append(len(running))
+            eventlet.patcher.original('time').sleep(0.05)
+            running.remove(cmd)
+            return 0, 'out', ''
+
+        self.client._ensure_initialized.side_effect = ensure_initialized
+        self.run_one_command.side_effect = execute
+        pool = eventlet.GreenPool(4)
+        for i in range(8):
+            pool.spawn_n(utils.execute, ['ls', str(i)], root_helper='sudo')
+        pool.waitall()
+        self.client._ensure_initialized.assert_called_once_with()
+        self.assertEqual(8, self.run_one_command.call_count)
+        self.assertLess(1, max(concurrency))
+        self.assertFalse(self.client.execute.called)
+        self.assertFalse(self.create_process.called)
+
+    def test_execute_daemon_restarted_by_client(self):
+        self.run_one_command.side_effect = EOFError()
+        self.client.execute.return_value = (0, 'out', '')
+        self.assertEqual('out', utils.execute(['ls'], root_helper='sudo'))
+        self.client.execute.assert_called_once_with(['ls'], None)
+        self.assertFalse(self.create_process.called)
+
+    def test_execute_daemon_start_failure(self):
+        self.client._ensure_initialized.side_effect = OSError
+        self.create_process.return_value = (FakeCreateProcess(0), ['ls'])
+        utils.execute(['ls'], root_helper='sudo')
+        self.assertTrue(self.create_process.called)
+        self.assertIsNone(utils.RootwrapDaemonHelper.get_client())
+
+    def test_execute_daemon_client_is_shared(self):
+        self.run_one_command.return_value = (0, '', '')
+        utils.execute(['ls'], root_helper='sudo')
+        utils.execute(['ls'], root_helper='sudo')
+        self.assertEqual(1, self.client_cls.call_count)
+        self.assertEqual(2, self.run_one_command.call_count)
+
+    def test_execute_daemon_with_addl_env(self):
+        self.run_one_command.return_value = (0, '', '')
+        utils.execute(['ls'], root_helper='sudo', addl_env={'foo': 'bar'})
+        self.run_one_command.assert_called_once_with(
+            ['env', 'foo=bar', 'ls'], None)
+
+    def test_execute_daemon_return_code_raise_runtime(self):
+        self.run_one_command.return_value = (1, '', 'error')
+        self.assertRaises(RuntimeError, utils.execute, ['ls'],
+                          root_helper='sudo')
+
+    def test_execute_daemon_extra_ok_codes(self):
+        self.run_one_command.return_value = (2, 'out', '')
+        result = utils.execute(['ls'], root_helper='sudo',
+                               extra_ok_codes=[2])
+        self.assertEqual('out', result)
+
+    def test_execute_without_root_helper_skips_daemon(self):
+        self.create_process.return_value = FakeCreateProcess(0), ['ls']
+        utils.execute(['ls'])
+        self.assertFalse(self.client_cls.called)
+
+    def test_execute_falls_back_when_daemon_fails(self):
+        self.run_one_command.side_effect = OSError()
+        self.create_process.return_value = FakeCreateProcess(0), ['ls']
+        utils.execute(['ls'], root_helper='sudo')
+        utils.execute(['ls'], root_helper='sudo')
+        self.assertEqual(1, self.run_one_command.call_count)
+        self.assertEqual(2, self.create_process.call_count)
+
+    def test_execute_daemon_not_configured(self):
+        cfg.CONF.set_override('root_helper_daemon', None, 'AGENT')
+        self.create_process.return_value = FakeCreateProcess(0), ['ls']
+        utils.execute(['ls'], root_helper='sudo')
+        self.assertFalse(self.client_cls.called)
+        self.assertTrue(self.create_process.called)
+
+
 class AgentUtilsGetInterfaceMAC(base.BaseTestCase):
     def test_get_interface_mac(self):
         expect_val = '01:02:03:04:05:06'
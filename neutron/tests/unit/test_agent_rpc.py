@@ -70,6 +70,27 @@ class AgentRPCPluginApi(base.BaseTestCase):
     def test_update_device_down(self):
         self._test_rpc_call('update_device_down')
 
+    def test_update_device_list_unsupported(self):
+        agent = rpc.PluginApi('fake_topic')
+        ctxt = oslo_context.RequestContext('fake_user', 'fake_project')
+        details_down = {'device': 'fake_device2', 'exists': True}
+        with contextlib.nested(
+            mock.patch.object(agent.client, 'call'),
+            mock.patch.object(agent.client, 'prepare'),
+        ) as (
+            mock_call, mock_prepare
+        ):
+            mock_prepare.return_value = agent.client
+            mock_call.side_effect = [messaging.UnsupportedVersion('1.4'),
+                                     None, Exception(), details_down]
+            actual_val = agent.update_device_list(
+                ctxt, ['fake_device0', 'fake_device1'], ['fake_device2'],
+                'fake_agent_id', 'fake_host')
+        self.assertEqual({'devices_up': ['fake_device0'],
+                          'failed_devices_up': ['fake_device1'],
+                          'devices_down': [details_down],
+                          'failed_devices_down': []}, actual_val)
+
     def test_tunnel_sync(self):
         self._test_rpc_call('tunnel_sync')
 
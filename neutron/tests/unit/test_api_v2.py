@@ -617,6 +617,63 @@ class JSONV2TestCase(APIv2TestBase, testlib_api.WebTestCase):
         params['page_reverse'] = ['True']
         self.assertEqual(urlparse.parse_qs(url.query), params)
 
+    def _networks(self, count):
+        return sorted(({'id': str(_uuid()),
+                        'name': 'net%d' % i,
+                        'admin_state_up': True,
+                        'status': "ACTIVE",
+                        'tenant_id': '',
+                        'shared': False,
+                        'subnets': []} for i in range(count)),
+                      key=lambda network: network['id'])
+
+    def test_list_streamed(self):
+        cfg.CONF.set_override('stream_list_responses', True)
+        cfg.CONF.set_override('stream_list_chunk_size', 2)
+        networks = self._networks(3)
+        instance = self.plugin.return_value
+        instance.get_networks.side_effect = [networks[:2], networks[2:]]
+
+        res = self.api.get(_get_path('networks')).json
+
+        self.assertEqual(networks, res['networks'])
+        self.assertNotIn('networks_links', res)
+        instance.get_networks.assert_has_calls([
+            mock.call(mock.ANY, filters=mock.ANY, fields=mock.ANY,
+                      sorts=[('id', True)], limit=2),
+            mock.call(mock.ANY, filters=mock.ANY, fields=mock.ANY,
+                      sorts=[('id', True)], limit=2,
+                      marker=networks[1]['id'])])
+
+    def test_list_streamed_with_fields(self):
+        cfg.CONF.set_override('stream_list_responses', True)
+        networks = self._networks(2)
+        instance = self.plugin.return_value
+        instance.get_networks.return_value = [
+            dict((key, network[key]) for key in ('id', 'name', 'tenant_id'))
+            for network in networks]
+
+        res = self.api.get(_get_path('networks'),
+                           params={'fields': 'name'}).json
+
+        self.assertEqual([{'name': network['name']} for network in networks],
+                         res['networks'])
+        fields = instance.get_networks.call_args[1]['fields']
+        self.assertIn('id', fields)
+
+    def test_list_not_streamed_with_pagination(self):
+        cfg.CONF.set_override('stream_list_responses', True)
+        cfg.CONF.set_override('stream_list_chunk_size', 2)
+        instance = self.plugin.return_value
+        instance.get_networks.return_value = self._networks(1)
+
+        res = self.api.get(_get_path('networks'),
+                           params={'limit': ['3']}).json
+
+        self.assertEqual(1, len(res['networks']))
+        self.assertEqual(1, instance.get_networks.call_count)
+        self.assertEqual(3, instance.get_networks.call_args[1]['limit'])
+
     def test_list_pagination_with_last_page(self):
         id = str(_uuid())
         input_dict = {'id': id,
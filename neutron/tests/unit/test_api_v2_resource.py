@@ -14,6 +14,7 @@
 #    under the License.
 
 import mock
+from oslo.config import cfg
 from oslo import i18n
 from webob import exc
 import webtest
@@ -21,6 +22,7 @@ import webtest
 from neutron.api.v2 import resource as wsgi_resource
 from neutron.common import exceptions as n_exc
 from neutron import context
+from neutron.db import stats as db_stats
 from neutron.tests import base
 from neutron import wsgi
 
@@ -289,6 +291,20 @@ class ResourceTestCase(base.BaseTestCase):
         res = resource.delete('', extra_environ=environ)
         self.assertEqual(res.status_int, 204)
 
+    def test_db_stats_recorded(self):
+        cfg.CONF.set_override('enable_db_stats', True)
+        controller = mock.MagicMock()
+        controller._collection = 'tests'
+        controller.test = lambda request: {'tag': db_stats.current().tag}
+
+        resource = webtest.TestApp(wsgi_resource.Resource(controller))
+
+        environ = {'wsgiorg.routing_args': (None, {'action': 'test'})}
+        with mock.patch.object(db_stats, 'finish') as finish:
+            res = resource.get('', extra_environ=environ)
+        self.assertEqual({'tag': 'api:tests.test'}, res.json)
+        self.assertEqual('api:tests.test', finish.call_args[0][0].tag)
+
     def _test_error_log_level(self, map_webob_exc, expect_log_info=False,
                               use_fault_map=True):
         class TestException(n_exc.NeutronException):
@@ -942,6 +942,36 @@ fixed_ips=ip_address%%3D%s&fixed_ips=ip_address%%3D%s&fixed_ips=subnet_id%%3D%s
             self._test_list_resources('port', [port1],
                                       query_params=query_params)
 
+    def test_list_ports_with_column_fields(self):
+        with self.subnet() as subnet:
+            with contextlib.nested(self.port(subnet=subnet),
+                                   self.port(subnet=subnet)) as ports:
+                query_params = ('fields=id&fields=mac_address&'
+                                'fields=fixed_ips')
+                res = self._list('ports', query_params=query_params)
+                expected = [{'id': port['port']['id'],
+                             'mac_address': port['port']['mac_address'],
+                             'fixed_ips': port['port']['fixed_ips']}
+                            for port in ports]
+                self.assertEqual(sorted(expected),
+                                 sorted(res['ports']))
+
+    def test_list_ports_with_column_fields_filtered_by_fixed_ip(self):
+        with self.subnet() as subnet:
+            fixed_ips = [{'subnet_id': subnet['subnet']['id']},
+                         {'subnet_id': subnet['subnet']['id']}]
+            with self.port(subnet=subnet, fixed_ips=fixed_ips) as port:
+                query_params = ('fixed_ips=subnet_id%%3D%s&fields=id&'
+                                'fields=fixed_ips' % subnet['subnet']['id'])
+                res = self._list('ports', query_params=query_params)
+                self.assertEqual(1, len(res['ports']))
+                self.assertEqual(port['port']['id'], res['ports'][0]['id'])
+                self.assertEqual(
+                    sorted(ip['ip_address']
+                           for ip in port['port']['fixed_ips']),
+                    sorted(ip['ip_address']
+                           for ip in res['ports'][0]['fixed_ips']))
+
     def test_list_ports_public_network(self):
         with self.network(shared=True) as network:
             with self.subnet(network) as subnet:
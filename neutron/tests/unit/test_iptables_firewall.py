@@ -1484,6 +1484,8 @@ class IptablesFirewallEnhancedIpsetTestCase(BaseIptablesFirewallTestCase):
             mock.call.get_name('fake_sgid', 'IPv4'),
             mock.call.set_exists('fake_sgid', 'IPv6'),
             mock.call.get_name('fake_sgid', 'IPv6'),
+            mock.call.defer_apply_on(),
+            mock.call.defer_apply_off(),
             mock.call.destroy('fake_sgid', 'IPv4'),
             mock.call.destroy('fake_sgid', 'IPv6')]
 
@@ -1530,3 +1532,93 @@ class IptablesFirewallEnhancedIpsetTestCase(BaseIptablesFirewallTestCase):
         calls = [mock.call.destroy('fake_sgid', 'IPv4')]
 
         self.firewall.ipset.assert_has_calls(calls, True)
+
+
+class IptablesFirewallSharedChainsTestCase(BaseIptablesFirewallTestCase):
+    def setUp(self):
+        cfg.CONF.register_opts(sg_cfg.security_group_opts, 'SECURITYGROUP')
+        cfg.CONF.set_override('enable_shared_chains', True, 'SECURITYGROUP')
+        super(IptablesFirewallSharedChainsTestCase, self).setUp()
+        self.firewall.ipset = mock.Mock()
+        self.firewall.ipset.get_name.side_effect = (
+            ipset_manager.IpsetManager.get_name)
+        self.firewall.ipset.set_exists.return_value = True
+        self.firewall.sg_rules = {'fake_sgid': [
+            {'direction': 'ingress', 'ethertype': 'IPv4',
+             'protocol': 'tcp', 'port_range_min': 22, 'port_range_max': 22,
+             'source_ip_prefix': '10.0.1.0/24'},
+            {'direction': 'ingress', 'ethertype': 'IPv4',
+             'protocol': 'tcp', 'port_range_min': 22, 'port_range_max': 22,
+             'source_ip_prefix': '10.0.2.0/24'},
+            {'direction': 'ingress', 'ethertype': 'IPv4',
+             'protocol': 'tcp', 'port_range_min': 80, 'port_range_max': 80,
+             'source_ip_prefix': '10.0.3.0/24'},
+            {'direction': 'ingress', 'ethertype': 'IPv4',
+             'protocol': 'udp', 'source_ip_prefix': '0.0.0.0/0'}]}
+        self.shared_chain = self.firewall._shared_chain_name(
+            ['fake_sgid'], 'ingress')
+
+    def _fake_port(self, device='tapfake_dev'):
+        return {'device': device,
+                'mac_address': 'ff:ff:ff:ff:ff:ff',
+                'fixed_ips': [FAKE_IP['IPv4']],
+                'security_groups': ['fake_sgid']}
+
+    def _get_set_id(self):
+        set_id = self.firewall.ipset.set_members.call_args[0][0]
+        self.firewall.ipset.set_members.assert_called_once_with(
+            set_id, 'IPv4', ['10.0.1.0/24', '10.0.2.0/24'],
+            set_type=ipset_manager.IPSET_TYPE_NET)
+        return set_id
+
+    def test_shared_chain_aggregates_prefixes(self):
+        self.firewall.prepare_port_filter(self._fake_port())
+
+        set_name = ipset_manager.IpsetManager.get_name(self._get_set_id(),
+                                                       'IPv4')
+        calls = [mock.call.add_chain(self.shared_chain),
+                 mock.call.add_rule(self.shared_chain,
+                                    '-s 0.0.0.0/0 -p udp -m udp -j RETURN',
+                                    comment=None),
+                 mock.call.add_rule(self.shared_chain,
+                                    '-p tcp -m tcp --dport 22 -m set '
+                                    '--match-set %s src -j RETURN' % set_name,
+                                    comment=None),
+                 mock.call.add_rule(self.shared_chain,
+                                    '-s 10.0.3.0/24 -p tcp -m tcp --dport 80 '
+                                    '-j RETURN', comment=None),
+                 mock.call.add_rule(self.shared_chain, '-j $sg-fallback',
+                                    comment=None)]
+        self.v4filter_inst.assert_has_calls(calls)
+
+    def test_ports_of_same_groups_share_chain(self):
+        self.firewall.prepare_port_filter(self._fake_port())
+        self.firewall.prepare_port_filter(self._fake_port('tapfake_dev2'))
+
+        added_chains = [c[0][0] for c in
+                        self.v4filter_inst.add_chain.call_args_list]
+        # built once by each of the two setups of the chains
+        self.assertEqual(2, added_chains.count(self.shared_chain))
+        for chain in ('ifake_dev', 'ifake_dev2'):
+            self.v4filter_inst.add_rule.assert_any_call(
+                chain, '-j $%s' % self.shared_chain, comment=None)
+        rules = [c[0][1] for c in self.v4filter_inst.add_rule.call_args_list
+                 if c[0][0] in ('ifake_dev', 'ifake_dev2')]
+        self.assertNotIn('-s 0.0.0.0/0 -p udp -m udp -j RETURN', rules)
+
+    def test_unused_net_ipsets_are_destroyed(self):
+        port = self._fake_port()
+        self.firewall.prepare_port_filter(port)
+        set_id = self._get_set_id()
+        self.firewall.filter_defer_apply_on()
+        self.firewall.remove_port_filter(port)
+        self.firewall.filter_defer_apply_off()
+
+        self.v4filter_inst.remove_chain.assert_any_call(self.shared_chain)
+        self.firewall.ipset.destroy.assert_called_once_with(set_id, 'IPv4')
+        self.assertEqual({}, self.firewall.net_ipsets)
+
+    def test_shared_chains_require_ipset(self):
+        cfg.CONF.set_override('enable_ipset', False, 'SECURITYGROUP')
+        firewall = iptables_firewall.IptablesFirewallDriver()
+        self.assertFalse(firewall.enable_shared_chains)
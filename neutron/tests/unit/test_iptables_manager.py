@@ -129,17 +129,17 @@ class IptablesCommentsTestCase(base.BaseTestCase):
             (mock.call(['iptables-save', '-c'],
                        root_helper=self.root_helper),
              ''),
-            (mock.call(['iptables-restore', '-c'],
+            (mock.call(['iptables-restore', '-n', '-c'],
                        process_input=(
                            raw_dump + COMMENTED_NAT_DUMP + filter_dump_mod),
                        root_helper=self.root_helper),
              None),
-            (mock.call(['iptables-save', '-c'],
+            (mock.call(['iptables-save', '-t', 'filter', '-c'],
                        root_helper=self.root_helper),
              ''),
-            (mock.call(['iptables-restore', '-c'],
+            (mock.call(['iptables-restore', '-n', '-c'],
                        process_input=(
-                           raw_dump + COMMENTED_NAT_DUMP + FILTER_DUMP),
+                           FILTER_DUMP),
                        root_helper=self.root_helper
                        ),
              None),
@@ -204,23 +204,16 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
                          name[:11])
 
     def _extend_with_ip6tables_filter(self, expected_calls, filter_dump):
+        # Only the first apply touches the ip6tables filter table
         expected_calls.insert(2, (
             mock.call(['ip6tables-save', '-c'],
                       root_helper=self.root_helper),
             ''))
         expected_calls.insert(3, (
-            mock.call(['ip6tables-restore', '-c'],
+            mock.call(['ip6tables-restore', '-n', '-c'],
                       process_input=filter_dump,
                       root_helper=self.root_helper),
             None))
-        expected_calls.extend([
-            (mock.call(['ip6tables-save', '-c'],
-                      root_helper=self.root_helper),
-             ''),
-            (mock.call(['ip6tables-restore', '-c'],
-                      process_input=filter_dump,
-                      root_helper=self.root_helper),
-             None)])
 
     def _test_add_and_remove_chain_custom_binary_name_helper(self, use_ipv6):
         bn = ("abcdef" * 5)
@@ -233,23 +226,6 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
 
         iptables_args = {'bn': bn[:16]}
 
-        filter_dump = ('# Generated by iptables_manager\n'
-                       '*filter\n'
-                       ':neutron-filter-top - [0:0]\n'
-                       ':%(bn)s-FORWARD - [0:0]\n'
-                       ':%(bn)s-INPUT - [0:0]\n'
-                       ':%(bn)s-OUTPUT - [0:0]\n'
-                       ':%(bn)s-filter - [0:0]\n'
-                       ':%(bn)s-local - [0:0]\n'
-                       '[0:0] -A FORWARD -j neutron-filter-top\n'
-                       '[0:0] -A OUTPUT -j neutron-filter-top\n'
-                       '[0:0] -A neutron-filter-top -j %(bn)s-local\n'
-                       '[0:0] -A INPUT -j %(bn)s-INPUT\n'
-                       '[0:0] -A OUTPUT -j %(bn)s-OUTPUT\n'
-                       '[0:0] -A FORWARD -j %(bn)s-FORWARD\n'
-                       'COMMIT\n'
-                       '# Completed by iptables_manager\n' % iptables_args)
-
         filter_dump_ipv6 = ('# Generated by iptables_manager\n'
                             '*filter\n'
                             ':neutron-filter-top - [0:0]\n'
@@ -309,17 +285,10 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
             (mock.call(['iptables-save', '-c'],
                        root_helper=self.root_helper),
              ''),
-            (mock.call(['iptables-restore', '-c'],
+            (mock.call(['iptables-restore', '-n', '-c'],
                        process_input=raw_dump + nat_dump + filter_dump_mod,
                        root_helper=self.root_helper),
              None),
-            (mock.call(['iptables-save', '-c'],
-                       root_helper=self.root_helper),
-             ''),
-            (mock.call(['iptables-restore', '-c'],
-                       process_input=raw_dump + nat_dump + filter_dump,
-                       root_helper=self.root_helper),
-             None),
         ]
         if use_ipv6:
             self._extend_with_ip6tables_filter(expected_calls_and_values,
@@ -330,10 +299,13 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
         self.iptables.ipv4['filter'].add_chain('filter')
         self.iptables.apply()
 
+        # emptying an empty chain leaves nothing to apply
         self.iptables.ipv4['filter'].empty_chain('filter')
         self.iptables.apply()
 
         tools.verify_mock_calls(self.execute, expected_calls_and_values)
+        self.assertEqual(len(expected_calls_and_values),
+                         self.execute.call_count)
 
     def test_add_and_remove_chain_custom_binary_name(self):
         self._test_add_and_remove_chain_custom_binary_name_helper(False)
@@ -411,15 +383,15 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
             (mock.call(['iptables-save', '-c'],
                        root_helper=self.root_helper),
              ''),
-            (mock.call(['iptables-restore', '-c'],
+            (mock.call(['iptables-restore', '-n', '-c'],
                        process_input=raw_dump + nat_dump + filter_dump_mod,
                        root_helper=self.root_helper),
              None),
-            (mock.call(['iptables-save', '-c'],
+            (mock.call(['iptables-save', '-t', 'filter', '-c'],
                        root_helper=self.root_helper),
              ''),
-            (mock.call(['iptables-restore', '-c'],
-                       process_input=raw_dump + nat_dump + filter_dump,
+            (mock.call(['iptables-restore', '-n', '-c'],
+                       process_input=filter_dump,
                        root_helper=self.root_helper),
              None),
         ]
@@ -473,15 +445,15 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
             (mock.call(['iptables-save', '-c'],
                        root_helper=self.root_helper),
              ''),
-            (mock.call(['iptables-restore', '-c'],
+            (mock.call(['iptables-restore', '-n', '-c'],
                        process_input=RAW_DUMP + NAT_DUMP + filter_dump_mod,
                        root_helper=self.root_helper),
              None),
-            (mock.call(['iptables-save', '-c'],
+            (mock.call(['iptables-save', '-t', 'filter', '-c'],
                        root_helper=self.root_helper),
              ''),
-            (mock.call(['iptables-restore', '-c'],
-                       process_input=RAW_DUMP + NAT_DUMP + FILTER_DUMP,
+            (mock.call(['iptables-restore', '-n', '-c'],
+                       process_input=FILTER_DUMP,
                        root_helper=self.root_helper),
              None),
         ]
@@ -536,15 +508,15 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
             (mock.call(['iptables-save', '-c'],
                        root_helper=self.root_helper),
              ''),
-            (mock.call(['iptables-restore', '-c'],
+            (mock.call(['iptables-restore', '-n', '-c'],
                        process_input=RAW_DUMP + NAT_DUMP + filter_dump_mod,
                        root_helper=self.root_helper),
              None),
-            (mock.call(['iptables-save', '-c'],
+            (mock.call(['iptables-save', '-t', 'filter', '-c'],
                        root_helper=self.root_helper),
              ''),
-            (mock.call(['iptables-restore', '-c'],
-                       process_input=RAW_DUMP + NAT_DUMP + FILTER_DUMP,
+            (mock.call(['iptables-restore', '-n', '-c'],
+                       process_input=FILTER_DUMP,
                        root_helper=self.root_helper
                        ),
              None),
@@ -616,15 +588,15 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
             (mock.call(['iptables-save', '-c'],
                        root_helper=self.root_helper),
              ''),
-            (mock.call(['iptables-restore', '-c'],
+            (mock.call(['iptables-restore', '-n', '-c'],
                        process_input=RAW_DUMP + NAT_DUMP + filter_dump_mod,
                        root_helper=self.root_helper),
              None),
-            (mock.call(['iptables-save', '-c'],
+            (mock.call(['iptables-save', '-t', 'filter', '-c'],
                        root_helper=self.root_helper),
              ''),
-            (mock.call(['iptables-restore', '-c'],
-                       process_input=RAW_DUMP + NAT_DUMP + FILTER_DUMP,
+            (mock.call(['iptables-restore', '-n', '-c'],
+                       process_input=FILTER_DUMP,
                        root_helper=self.root_helper),
              None),
         ]
@@ -706,15 +678,15 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
             (mock.call(['iptables-save', '-c'],
                        root_helper=self.root_helper),
              ''),
-            (mock.call(['iptables-restore', '-c'],
+            (mock.call(['iptables-restore', '-n', '-c'],
                        process_input=RAW_DUMP + nat_dump_mod + FILTER_DUMP,
                        root_helper=self.root_helper),
              None),
-            (mock.call(['iptables-save', '-c'],
+            (mock.call(['iptables-save', '-t', 'nat', '-c'],
                        root_helper=self.root_helper),
              ''),
-            (mock.call(['iptables-restore', '-c'],
-                       process_input=RAW_DUMP + nat_dump + FILTER_DUMP,
+            (mock.call(['iptables-restore', '-n', '-c'],
+                       process_input=nat_dump,
                        root_helper=self.root_helper),
              None),
         ]
@@ -774,15 +746,15 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
             (mock.call(['iptables-save', '-c'],
                        root_helper=self.root_helper),
              ''),
-            (mock.call(['iptables-restore', '-c'],
+            (mock.call(['iptables-restore', '-n', '-c'],
                        process_input=raw_dump_mod + NAT_DUMP + FILTER_DUMP,
                        root_helper=self.root_helper),
              None),
-            (mock.call(['iptables-save', '-c'],
+            (mock.call(['iptables-save', '-t', 'raw', '-c'],
                        root_helper=self.root_helper),
              ''),
-            (mock.call(['iptables-restore', '-c'],
-                       process_input=RAW_DUMP + NAT_DUMP + FILTER_DUMP,
+            (mock.call(['iptables-restore', '-n', '-c'],
+                       process_input=RAW_DUMP,
                        root_helper=self.root_helper),
              None),
         ]
@@ -1014,29 +986,149 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
     def test_get_traffic_counters_with_zero_with_ipv6(self):
         self._test_get_traffic_counters_with_zero_helper(True)
 
-    def _test_find_last_entry(self, find_str):
-        filter_list = [':neutron-filter-top - [0:0]',
-                       ':%(bn)s-FORWARD - [0:0]',
-                       ':%(bn)s-INPUT - [0:0]',
-                       ':%(bn)s-local - [0:0]',
-                       ':%(wrap)s - [0:0]',
-                       ':%(bn)s-OUTPUT - [0:0]',
-                       '[0:0] -A FORWARD -j neutron-filter-top',
-                       '[0:0] -A OUTPUT -j neutron-filter-top'
-                       % IPTABLES_ARG]
-
-        return self.iptables._find_last_entry(filter_list, find_str)
-
-    def test_find_last_entry_old_dup(self):
-        find_str = 'neutron-filter-top'
-        match_str = '[0:0] -A OUTPUT -j neutron-filter-top'
-        ret_str = self._test_find_last_entry(find_str)
-        self.assertEqual(ret_str, match_str)
-
-    def test_find_last_entry_none(self):
-        find_str = 'neutron-filter-NOTFOUND'
-        ret_str = self._test_find_last_entry(find_str)
-        self.assertIsNone(ret_str)
+    def test_apply_without_changes(self):
+        self.execute.return_value = RAW_DUMP + NAT_DUMP + FILTER_DUMP
+        self.iptables.apply()
+        self.execute.assert_called_once_with(['iptables-save', '-c'],
+                                             root_helper=self.root_helper)
+
+    def test_apply_skips_unmodified_tables(self):
+        self.execute.return_value = RAW_DUMP + NAT_DUMP + FILTER_DUMP
+        self.iptables.apply()
+        self.execute.reset_mock()
+
+        self.iptables.apply()
+        self.assertFalse(self.execute.called)
+
+        self.iptables.ipv4['nat'].add_rule('OUTPUT', '-j DROP')
+        self.iptables.apply()
+        self.execute.assert_any_call(['iptables-save', '-t', 'nat', '-c'],
+                                     root_helper=self.root_helper)
+
+    def test_apply_with_cached_state(self):
+        cfg.CONF.set_override('cache_iptables_state', True, 'AGENT')
+        self.execute.return_value = RAW_DUMP + NAT_DUMP + FILTER_DUMP
+        self.iptables.apply()
+        self.execute.reset_mock()
+
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-j DROP')
+        self.iptables.apply()
+
+        expected_input = ('# Generated by iptables_manager\n'
+                          '*filter\n'
+                          '-I %(bn)s-INPUT 1 -j DROP\n'
+                          'COMMIT\n'
+                          '# Completed by iptables_manager\n' % IPTABLES_ARG)
+        self.execute.assert_called_once_with(['iptables-restore', '-n', '-c'],
+                                             process_input=expected_input,
+                                             root_helper=self.root_helper)
+
+    def test_apply_with_cached_state_failure(self):
+        cfg.CONF.set_override('cache_iptables_state', True, 'AGENT')
+        self.execute.return_value = RAW_DUMP + NAT_DUMP + FILTER_DUMP
+        self.iptables.apply()
+        self.execute.reset_mock()
+
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-j DROP')
+        self.execute.side_effect = [RuntimeError(), FILTER_DUMP, None]
+        self.iptables.apply()
+
+        self.execute.assert_has_calls([
+            mock.call(['iptables-restore', '-n', '-c'],
+                      process_input=mock.ANY, root_helper=self.root_helper),
+            mock.call(['iptables-save', '-t', 'filter', '-c'],
+                      root_helper=self.root_helper),
+            mock.call(['iptables-restore', '-n', '-c'],
+                      process_input=mock.ANY, root_helper=self.root_helper)])
+        self.assertFalse(self.iptables.ipv4['filter'].dirty_chains)
+
+    def test_apply_only_sends_changes(self):
+        self.execute.return_value = RAW_DUMP + NAT_DUMP + FILTER_DUMP
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-j DROP')
+        self.iptables.ipv4['filter'].add_rule('INPUT', '-s 10.0.0.1 -j ACCEPT',
+                                              top=True)
+        self.iptables.apply()
+
+        expected_input = ('# Generated by iptables_manager\n'
+                          '*filter\n'
+                          '-I %(bn)s-INPUT 1 -s 10.0.0.1 -j ACCEPT\n'
+                          '-I %(bn)s-INPUT 2 -j DROP\n'
+                          'COMMIT\n'
+                          '# Completed by iptables_manager\n' % IPTABLES_ARG)
+        self.execute.assert_called_with(['iptables-restore', '-n', '-c'],
+                                        process_input=expected_input,
+                                        root_helper=self.root_helper)
+
+    def test_apply_removes_stale_rules_and_chains(self):
+        filter_dump = FILTER_DUMP.replace(
+            'COMMIT\n',
+            ':%(bn)s-stale - [0:0]\n'
+            '[5:10] -A INPUT -j ACCEPT\n'
+            '[0:0] -A %(bn)s-INPUT -j %(bn)s-stale\n'
+            '[0:0] -A %(bn)s-stale -j DROP\n'
+            'COMMIT\n' % IPTABLES_ARG)
+        self.execute.return_value = RAW_DUMP + NAT_DUMP + filter_dump
+        self.iptables.apply()
+
+        expected_input = ('# Generated by iptables_manager\n'
+                          '*filter\n'
+                          '-F %(bn)s-INPUT\n'
+                          '-F %(bn)s-stale\n'
+                          '-X %(bn)s-stale\n'
+                          'COMMIT\n'
+                          '# Completed by iptables_manager\n' % IPTABLES_ARG)
+        self.execute.assert_called_with(['iptables-restore', '-n', '-c'],
+                                        process_input=expected_input,
+                                        root_helper=self.root_helper)
+
+    def test_apply_large_table(self):
+        rules = ['-s 10.%d.%d.0/24 -j RETURN' % (i // 256, i % 256)
+                 for i in range(50000)]
+        self.iptables.ipv4['filter'].add_chain('large')
+        for rule in rules:
+            self.iptables.ipv4['filter'].add_rule('large', rule)
+        filter_dump = FILTER_DUMP.replace(
+            'COMMIT\n',
+            ':%s-large - [0:0]\n' % IPTABLES_ARG['bn'] +
+            ''.join('[0:0] -A %s-large %s\n' % (IPTABLES_ARG['bn'], rule)
+                    for rule in rules) +
+            'COMMIT\n')
+        self.execute.return_value = RAW_DUMP + NAT_DUMP + filter_dump
+        self.iptables.ipv4['filter'].remove_rule('large', rules[100])
+        self.iptables.ipv4['filter'].add_rule('large', '-j DROP')
+        self.iptables.apply()
+
+        expected_input = ('# Generated by iptables_manager\n'
+                          '*filter\n'
+                          '-D %(bn)s-large 101\n'
+                          '-I %(bn)s-large 50000 -j DROP\n'
+                          'COMMIT\n'
+                          '# Completed by iptables_manager\n' % IPTABLES_ARG)
+        self.execute.assert_called_with(['iptables-restore', '-n', '-c'],
+                                        process_input=expected_input,
+                                        root_helper=self.root_helper)
+
+    def test_generate_chain_diff_iptables_commands(self):
+        old_rules = ['-A chain -j A', '-A chain -j B', '-A chain -j C']
+        new_rules = ['-A chain -j B', '-A chain -j D', '-A chain -j C']
+        self.assertEqual(
+            ['-D chain 1', '-I chain 2 -j D'],
+            iptables_manager._generate_chain_diff_iptables_commands(
+                'chain', old_rules, new_rules))
+
+    def test_generate_chain_diff_iptables_commands_reorder(self):
+        old_rules = ['-A chain -j A', '-A chain -j B', '-A chain -j A']
+        new_rules = ['-A chain -j B', '-A chain -j A']
+        self.assertEqual(
+            ['-D chain 3', '-D chain 2', '-I chain 1 -j B'],
+            iptables_manager._generate_chain_diff_iptables_commands(
+                'chain', old_rules, new_rules))
+
+    def test_generate_chain_diff_iptables_commands_unchanged(self):
+        rules = ['-A chain -j A', '-A chain -j B']
+        self.assertEqual(
+            [], iptables_manager._generate_chain_diff_iptables_commands(
+                'chain', rules, list(rules)))
 
 
 class IptablesManagerStateLessTestCase(base.BaseTestCase):
@@ -15,11 +15,14 @@
 
 import contextlib
 import copy
+import datetime
 
+import eventlet
 import mock
 import netaddr
 from oslo.config import cfg
 from oslo import messaging
+from oslo.utils import timeutils
 from testtools import matchers
 
 from neutron.agent.common import config as agent_config
@@ -27,6 +30,7 @@ from neutron.agent.l3 import agent as l3_agent
 from neutron.agent.l3 import ha
 from neutron.agent.l3 import link_local_allocator as lla
 from neutron.agent.l3 import router_info as l3router
+from neutron.agent.l3 import router_processing_queue as queue
 from neutron.agent.linux import interface
 from neutron.agent.linux import ra
 from neutron.common import config as base_config
@@ -1432,7 +1436,7 @@ vrrp_instance VR_1 {
                  'port_id': router[l3_constants.INTERFACE_KEY][0]['id']}]
 
             ri = l3router.RouterInfo(router['id'], self.conf.root_helper,
-                                     router=router)
+                                     router=copy.deepcopy(router))
             agent.external_gateway_added = mock.Mock()
             agent.process_router(ri)
             # Assess the call for putting the floating IP into Error
@@ -1440,6 +1444,150 @@ vrrp_instance VR_1 {
             mock_update_fip_status.assert_called_once_with(
                 mock.ANY, ri.router_id,
                 {fip_id: l3_constants.FLOATINGIP_STATUS_ERROR})
+            mock_update_fip_status.reset_mock()
+
+            # The floating IPs in error are processed again on the next
+            # update, even without change
+            ri.router = router
+            agent.process_router(ri)
+            self.assertEqual(1, mock_update_fip_status.call_count)
+
+    def _process_router_twice(self, agent, router, update):
+        ri = l3router.RouterInfo(router['id'], self.conf.root_helper,
+                                 router=copy.deepcopy(router))
+        agent.process_router(ri)
+        update(router)
+        ri.router = router
+        steps = ('_process_internal_ports', '_process_external_gateway',
+                 'routes_updated', '_process_snat_dnat_for_fip')
+        with contextlib.nested(*[mock.patch.object(agent, step)
+                                 for step in steps]) as mocks:
+            agent.process_router(ri)
+        return dict((step, m.called) for step, m in zip(steps, mocks))
+
+    def test_process_router_unchanged(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        router = prepare_router_data(enable_floating_ip=True)
+        called = self._process_router_twice(agent, router, lambda r: None)
+        self.assertFalse(any(called.values()))
+
+    def test_process_router_floating_ip_changed(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        router = prepare_router_data(enable_floating_ip=True)
+
+        def update(router):
+            fip = router[l3_constants.FLOATINGIP_KEY][0]
+            fip['fixed_ip_address'] = '10.0.0.2'
+
+        called = self._process_router_twice(agent, router, update)
+        self.assertEqual({'_process_internal_ports': False,
+                          '_process_external_gateway': False,
+                          'routes_updated': False,
+                          '_process_snat_dnat_for_fip': True}, called)
+
+    def test_process_router_interface_added_skips_unchanged_steps(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        router = prepare_router_data(enable_floating_ip=True)
+        called = self._process_router_twice(agent, router,
+                                             router_append_interface)
+        self.assertEqual({'_process_internal_ports': True,
+                          '_process_external_gateway': True,
+                          'routes_updated': False,
+                          '_process_snat_dnat_for_fip': False}, called)
+
+    def test_process_router_failed_processed_entirely(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        router = prepare_router_data()
+        ri = l3router.RouterInfo(router['id'], self.conf.root_helper,
+                                 router=copy.deepcopy(router))
+        with mock.patch.object(agent, 'routes_updated',
+                               side_effect=RuntimeError):
+            self.assertRaises(RuntimeError, agent.process_router, ri)
+        self.assertIsNone(ri.processed_router)
+        ri.router = router
+        with mock.patch.object(agent, 'routes_updated') as routes_updated:
+            agent.process_router(ri)
+        routes_updated.assert_called_once_with(ri)
+
+    def _prepare_processed_router(self, agent):
+        router = prepare_router_data(enable_floating_ip=True)
+        router['revision_number'] = 1
+        ri = l3router.RouterInfo(router['id'], self.conf.root_helper,
+                                 router=router)
+        ri.processed_router = copy.deepcopy(router)
+        agent.router_info[router['id']] = ri
+        return router
+
+    def test_fetch_routers_known_router(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        router = self._prepare_processed_router(agent)
+        fips = [{'id': _uuid(),
+                 'port_id': _uuid(),
+                 'floating_ip_address': '19.4.4.3',
+                 'fixed_ip_address': '10.0.0.2'}]
+        delta = {'id': router['id'],
+                 'distributed': False,
+                 'revision_number': 2,
+                 l3_constants.FLOATINGIP_KEY: fips,
+                 l3_constants.ROUTER_BASE_REVISION_KEY: 1,
+                 l3_constants.ROUTER_UNCHANGED_KEY: [
+                     'gw_port', 'routes', l3_constants.INTERFACE_KEY]}
+        self.plugin_api.get_routers.return_value = [delta]
+
+        routers = agent._fetch_routers([router['id']])
+
+        expected = dict(router, revision_number=2)
+        expected[l3_constants.FLOATINGIP_KEY] = fips
+        self.assertEqual([expected], routers)
+        known_router = self.plugin_api.get_routers.call_args[1][
+            'known_routers'][router['id']]
+        self.assertEqual(1, known_router['revision_number'])
+        self.assertEqual(
+            sorted(['gw_port', 'routes', l3_constants.INTERFACE_KEY,
+                    l3_constants.FLOATINGIP_KEY]),
+            sorted(known_router['digests']))
+
+    def test_fetch_routers_unchanged_revision(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        router = self._prepare_processed_router(agent)
+        self.plugin_api.get_routers.return_value = [
+            {'id': router['id'],
+             'revision_number': 1,
+             l3_constants.ROUTER_BASE_REVISION_KEY: 1}]
+        self.assertEqual([router], agent._fetch_routers([router['id']]))
+
+    def test_fetch_routers_revision_gap(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        router = self._prepare_processed_router(agent)
+        full_router = dict(router, revision_number=3)
+        self.plugin_api.get_routers.side_effect = [
+            [{'id': router['id'],
+              'revision_number': 3,
+              l3_constants.ROUTER_BASE_REVISION_KEY: 2,
+              l3_constants.ROUTER_UNCHANGED_KEY: []}],
+            [full_router]]
+        self.assertEqual([full_router], agent._fetch_routers([router['id']]))
+        self.plugin_api.get_routers.assert_called_with(mock.ANY,
+                                                       [router['id']])
+
+    def test_periodic_sync_routers_task_unchanged_router(self):
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        router = self._prepare_processed_router(agent)
+        new_router = prepare_router_data()
+        self.plugin_api.get_routers.return_value = [
+            {'id': router['id'],
+             'revision_number': 1,
+             l3_constants.ROUTER_BASE_REVISION_KEY: 1},
+            new_router]
+        with contextlib.nested(
+                mock.patch.object(agent, '_cleanup_namespaces'),
+                mock.patch.object(agent._queue, 'add')) as (cleanup, add):
+            agent.periodic_sync_routers_task(agent.context)
+        self.plugin_api.get_routers.assert_called_once_with(
+            agent.context, None, known_routers={router['id']: mock.ANY})
+        self.assertEqual(1, add.call_count)
+        self.assertEqual(new_router['id'], add.call_args[0][0].id)
+        self.assertFalse(agent.fullsync)
 
     def test_handle_router_snat_rules_distributed_without_snat_manager(self):
         ri = l3router.RouterInfo(
@@ -1586,6 +1734,61 @@ vrrp_instance VR_1 {
         agent.router_added_to_agent(None, [FAKE_ID])
         self.assertEqual(1, agent._queue.add.call_count)
 
+    def test_process_routers_loop_pool_size(self):
+        self.conf.set_override('router_processing_workers', 3)
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        with mock.patch.object(l3_agent.eventlet, 'GreenPool') as pool_cls:
+            pool_cls.return_value.spawn_n.side_effect = [None, RuntimeError]
+            self.assertRaises(RuntimeError, agent._process_routers_loop)
+        pool_cls.assert_called_once_with(size=3)
+
+    def test_process_router_updates_concurrently(self):
+        self.conf.set_override('router_processing_workers', 4)
+        agent = l3_agent.L3NATAgent(HOSTNAME, self.conf)
+        routers = [{'id': _uuid()} for i in range(8)]
+        now = timeutils.utcnow()
+        for timestamp in (now, now + datetime.timedelta(seconds=1)):
+            for router in routers:
+                agent._queue.add(queue.RouterUpdate(router['id'],
+                                                    queue.PRIORITY_RPC,
+                                                    router=router,
+                                                    timestamp=timestamp))
+        processing = set()
+        concurrency = []
+
+        def process_router(router):
+            # the updates of a router are never processed concurrently
+            self.assertNotIn(router['id'], processing)
+            processing.add(router['id'])
+            concurrency.append(len(processing))
+            eventlet.sleep(0.01)
+            processing.remove(router['id'])
+
+        pools = []
+        green_pool_cls = eventlet.GreenPool
+
+        def green_pool(size):
+            pools.append(green_pool_cls(size))
+            return pools[0]
+
+        with contextlib.nested(
+                mock.patch.object(agent, '_process_router_if_compatible',
+                                  side_effect=process_router),
+                mock.patch.object(l3_agent.eventlet, 'GreenPool',
+                                  side_effect=green_pool)):
+            loop = eventlet.spawn(agent._process_routers_loop)
+            try:
+                with eventlet.Timeout(5):
+                    while len(concurrency) < len(routers) * 2:
+                        eventlet.sleep(0.01)
+            finally:
+                loop.kill()
+                # the workers wait for the next update in the queue
+                for worker in list(pools[0].coroutines_running):
+                    eventlet.kill(worker)
+        self.assertEqual(4, max(concurrency))
+        self.assertEqual(16, len(concurrency))
+
     def test_destroy_fip_namespace(self):
         namespaces = ['qrouter-foo', 'qrouter-bar']
 
@@ -21,6 +21,7 @@ import mock
 import netaddr
 from oslo.config import cfg
 from oslo.utils import importutils
+from sqlalchemy import event
 from webob import exc
 
 from neutron.api.rpc.agentnotifiers import l3_rpc_agent_api
@@ -28,7 +29,9 @@ from neutron.api.rpc.handlers import l3_rpc
 from neutron.api.v2 import attributes
 from neutron.common import constants as l3_constants
 from neutron.common import exceptions as n_exc
+from neutron.common import utils
 from neutron import context
+from neutron.db import api as db_api
 from neutron.db import common_db_mixin
 from neutron.db import db_base_plugin_v2
 from neutron.db import external_net_db
@@ -1878,6 +1881,55 @@ class L3AgentDbTestCaseBase(L3NatTestCaseMixin):
             self.assertIsNotNone(floatingips[0]['fixed_ip_address'])
             self.assertIsNotNone(floatingips[0]['router_id'])
 
+    def _count_sync_data_queries(self, router_ids):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db_api.get_engine()
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            self.plugin.get_sync_data(context.get_admin_context(), router_ids)
+        finally:
+            event.remove(engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        return len(statements)
+
+    def test_l3_agent_routers_query_count(self):
+        with contextlib.nested(self.router(), self.router(),
+                               self.router()) as routers:
+            with contextlib.nested(self.subnet(cidr='10.0.0.0/24'),
+                                   self.subnet(cidr='10.0.1.0/24'),
+                                   self.subnet(cidr='10.0.2.0/24')) as subnets:
+                for r, s in zip(routers, subnets):
+                    self._router_interface_action('add', r['router']['id'],
+                                                  s['subnet']['id'], None)
+                router_ids = [r['router']['id'] for r in routers]
+                # The number of queries does not depend on the number of
+                # routers
+                self.assertEqual(
+                    self._count_sync_data_queries(router_ids[:1]),
+                    self._count_sync_data_queries(router_ids))
+                # clean-up
+                for r, s in zip(routers, subnets):
+                    self._router_interface_action('remove',
+                                                  r['router']['id'],
+                                                  s['subnet']['id'], None)
+
+    def test_l3_agent_routers_query_revision(self):
+        with self.router() as r:
+            router_id = r['router']['id']
+            ctx = context.get_admin_context()
+            routers = self.plugin.get_sync_data(ctx, [router_id])
+            revision = routers[0]['revision_number']
+            self.plugin.bump_router_revisions(ctx, [router_id])
+            routers = self.plugin.get_sync_data(ctx, [router_id])
+            self.assertEqual(revision + 1, routers[0]['revision_number'])
+            self.assertEqual({router_id: revision + 1},
+                             self.plugin.get_router_revisions(ctx,
+                                                              [router_id]))
+
     def _test_notify_op_agent(self, target_func, *args):
         l3_rpc_agent_api_str = (
             'neutron.api.rpc.agentnotifiers.l3_rpc_agent_api.L3AgentNotifyAPI')
@@ -2116,6 +2168,129 @@ class L3RpcCallbackTestCase(base.BaseTestCase):
         actual_message = mock_log.call_args[0][0]
         self.assertEqual(expected_message, actual_message)
 
+    def test_sync_routers_known_routers(self):
+        router = {'id': 'changed_router_id',
+                  'revision_number': 2,
+                  'gw_port': {'id': 'gw_port_id'},
+                  l3_constants.FLOATINGIP_KEY: [{'id': 'new_fip_id'}]}
+        known_router = {'revision_number': 1,
+                        'digests': utils.get_router_digests(
+                            {'gw_port': {'id': 'gw_port_id'},
+                             l3_constants.FLOATINGIP_KEY: [
+                                 {'id': 'old_fip_id'}]})}
+        known_routers = {'changed_router_id': known_router,
+                         'unchanged_router_id': {'revision_number': 5,
+                                                 'digests': {}}}
+        self.l3_rpc_cb.l3plugin.get_router_revisions.return_value = {
+            'changed_router_id': 2, 'unchanged_router_id': 5}
+        self.l3_rpc_cb.l3plugin.get_sync_data.return_value = [router]
+        routers = self.l3_rpc_cb.sync_routers(
+            mock.ANY, host='host',
+            router_ids=['changed_router_id', 'unchanged_router_id'],
+            known_routers=known_routers)
+        self.l3_rpc_cb.l3plugin.get_sync_data.assert_called_once_with(
+            mock.ANY, ['changed_router_id'])
+        self.assertEqual(
+            [{'id': 'changed_router_id',
+              'revision_number': 2,
+              l3_constants.FLOATINGIP_KEY: [{'id': 'new_fip_id'}],
+              l3_constants.ROUTER_BASE_REVISION_KEY: 1,
+              l3_constants.ROUTER_UNCHANGED_KEY: ['gw_port']},
+             {'id': 'unchanged_router_id',
+              'revision_number': 5,
+              l3_constants.ROUTER_BASE_REVISION_KEY: 5}],
+            routers)
+
+    def test_sync_routers_known_routers_unchanged(self):
+        self.l3_rpc_cb.l3plugin.get_router_revisions.return_value = {
+            'router_id': 5}
+        routers = self.l3_rpc_cb.sync_routers(
+            mock.ANY, host='host', router_ids=['router_id'],
+            known_routers={'router_id': {'revision_number': 5,
+                                         'digests': {}}})
+        self.assertFalse(self.l3_rpc_cb.l3plugin.get_sync_data.called)
+        self.assertEqual([{'id': 'router_id',
+                           'revision_number': 5,
+                           l3_constants.ROUTER_BASE_REVISION_KEY: 5}],
+                         routers)
+
+    def test_sync_routers_known_router_not_on_agent(self):
+        l3plugin = self.l3_rpc_cb.l3plugin
+        l3plugin.supported_extension_aliases = [
+            l3_constants.L3_AGENT_SCHEDULER_EXT_ALIAS]
+        l3plugin.list_active_router_ids_on_active_l3_agent.return_value = []
+        l3plugin.list_active_sync_routers_on_active_l3_agent.return_value = []
+        routers = self.l3_rpc_cb.sync_routers(
+            mock.ANY, host='host', router_ids=['router_id'],
+            known_routers={'router_id': {'revision_number': 5,
+                                         'digests': {}}})
+        self.assertEqual([], routers)
+        self.assertFalse(l3plugin.get_router_revisions.called)
+
+    def test_sync_routers_known_router_with_unbound_port(self):
+        self.l3_rpc_cb.plugin.supported_extension_aliases = [
+            l3_constants.PORT_BINDING_EXT_ALIAS]
+        self.l3_rpc_cb.plugin.get_ports.return_value = [
+            {'device_id': 'router_id',
+             'device_owner': l3_constants.DEVICE_OWNER_ROUTER_INTF,
+             portbindings.HOST_ID: 'host',
+             portbindings.VIF_TYPE: portbindings.VIF_TYPE_BINDING_FAILED}]
+        self.l3_rpc_cb.l3plugin.get_router_revisions.return_value = {
+            'router_id': 5}
+        router = {'id': 'router_id', 'revision_number': 5}
+        self.l3_rpc_cb.l3plugin.get_sync_data.return_value = [router]
+        with mock.patch.object(self.l3_rpc_cb,
+                               '_ensure_host_set_on_ports') as ensure_host:
+            self.l3_rpc_cb.sync_routers(
+                mock.ANY, host='host', router_ids=['router_id'],
+                known_routers={'router_id': {'revision_number': 5,
+                                             'digests': {}}})
+        self.l3_rpc_cb.l3plugin.get_sync_data.assert_called_once_with(
+            mock.ANY, ['router_id'])
+        ensure_host.assert_called_once_with(mock.ANY, 'host', [router])
+
+    def test_sync_routers_known_routers_of_agent(self):
+        l3plugin = self.l3_rpc_cb.l3plugin
+        l3plugin.supported_extension_aliases = [
+            l3_constants.L3_AGENT_SCHEDULER_EXT_ALIAS]
+        l3plugin.list_active_router_ids_on_active_l3_agent.side_effect = (
+            lambda context, host, router_ids=None: [
+                router_id for router_id in ['unchanged_router_id',
+                                            'new_router_id']
+                if not router_ids or router_id in router_ids])
+        l3plugin.get_router_revisions.return_value = {
+            'unchanged_router_id': 5}
+        l3plugin.list_active_sync_routers_on_active_l3_agent.return_value = [
+            {'id': 'new_router_id', 'revision_number': 0}]
+        routers = self.l3_rpc_cb.sync_routers(
+            mock.ANY, host='host',
+            known_routers={'unchanged_router_id': {'revision_number': 5,
+                                                   'digests': {}}})
+        l3plugin.get_router_revisions.assert_called_once_with(
+            mock.ANY, ['unchanged_router_id'])
+        (l3plugin.list_active_sync_routers_on_active_l3_agent.
+         assert_called_once_with(mock.ANY, 'host', ['new_router_id']))
+        l3plugin.auto_schedule_routers.assert_called_once_with(
+            mock.ANY, 'host', None)
+        self.assertEqual([{'id': 'new_router_id', 'revision_number': 0},
+                          {'id': 'unchanged_router_id',
+                           'revision_number': 5,
+                           l3_constants.ROUTER_BASE_REVISION_KEY: 5}],
+                         routers)
+
+    def test_sync_routers_known_routers_of_agent_without_routers(self):
+        l3plugin = self.l3_rpc_cb.l3plugin
+        l3plugin.supported_extension_aliases = [
+            l3_constants.L3_AGENT_SCHEDULER_EXT_ALIAS]
+        l3plugin.list_active_router_ids_on_active_l3_agent.return_value = []
+        routers = self.l3_rpc_cb.sync_routers(
+            mock.ANY, host='host',
+            known_routers={'router_id': {'revision_number': 5,
+                                         'digests': {}}})
+        self.assertEqual([], routers)
+        self.assertFalse(
+            l3plugin.list_active_sync_routers_on_active_l3_agent.called)
+
 
 class L3AgentDbIntTestCase(L3BaseForIntTests, L3AgentDbTestCaseBase):
 
@@ -498,6 +498,61 @@ class NeutronPolicyTestCase(base.BaseTestCase):
             common_policy.parse_rule,
             'tenant_id:(wrong_stuff)')
 
+    def test_check_cached_memoizes_by_target_keys(self):
+        policy.init()
+        cache = {}
+        with mock.patch.object(policy, 'check',
+                               wraps=policy.check) as check:
+            for tenant_id, shared, name, expected in (
+                    ('fake', False, 'net1', True),
+                    ('fake', False, 'net2', True),
+                    ('other', False, 'net3', False),
+                    ('other', True, 'net4', True),
+                    ('other', False, 'net5', False)):
+                target = {'tenant_id': tenant_id, 'shared': shared,
+                          'name': name}
+                self.assertEqual(expected, policy.check_cached(
+                    cache, self.context, 'get_network', target))
+        self.assertEqual(3, check.call_count)
+
+    def test_check_cached_write_action_not_memoized(self):
+        policy.init()
+        cache = {}
+        with mock.patch.object(policy, 'check',
+                               wraps=policy.check) as check:
+            for i in range(2):
+                policy.check_cached(cache, self.context, 'update_port',
+                                    {'tenant_id': 'fake',
+                                     const.ATTRIBUTES_TO_UPDATE: []})
+        self.assertEqual(2, check.call_count)
+
+    def test_check_cached_unknown_check_not_memoized(self):
+        self.rules['get_firewall_rule'] = common_policy.parse_rule(
+            'http:http://www.example.com')
+        policy.init()
+        self.assertIsNone(policy._get_target_keys('get_firewall_rule'))
+        with mock.patch.object(policy, 'check', return_value=True) as check:
+            for i in range(2):
+                policy.check_cached({}, self.context, 'get_firewall_rule',
+                                    {'tenant_id': 'fake'})
+        self.assertEqual(2, check.call_count)
+
+    def test_get_target_keys_parent_owner(self):
+        self.rules['get_subnet'] = common_policy.parse_rule(
+            'rule:admin_or_network_owner')
+        policy.init()
+        self.assertEqual(['network:tenant_id', 'network_id'],
+                         policy._get_target_keys('get_subnet'))
+
+    def test_get_target_keys_reset_with_rules(self):
+        policy.init()
+        self.assertEqual(['tenant_id'], policy._get_target_keys('get_port'))
+        self.rules['get_port'] = common_policy.parse_rule(
+            'rule:admin_or_network_owner')
+        policy.init()
+        self.assertEqual(['network:tenant_id', 'network_id'],
+                         policy._get_target_keys('get_port'))
+
     def _test_enforce_tenant_id_raises(self, bad_rule):
         self.rules['admin_or_owner'] = common_policy.parse_rule(bad_rule)
         # Trigger a policy with rule admin_or_owner
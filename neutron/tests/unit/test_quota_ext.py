@@ -13,10 +13,12 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
 import sys
 
 import mock
 from oslo.config import cfg
+from oslo.utils import timeutils
 import testtools
 from webob import exc
 import webtest
@@ -28,9 +30,11 @@ from neutron.common import constants
 from neutron.common import exceptions
 from neutron import context
 from neutron.db import quota_db
+from neutron.db import quota_usage
 from neutron import quota
 from neutron.tests import base
 from neutron.tests.unit import test_api_v2
+from neutron.tests.unit import test_db_plugin
 from neutron.tests.unit import testlib_api
 from neutron.tests.unit import testlib_plugin
 
@@ -402,6 +406,82 @@ class TestDbQuotaDriver(base.BaseTestCase):
                                                       target_tenant)
 
 
+class TestTrackedQuotaUsage(test_db_plugin.NeutronDbPluginV2TestCase):
+
+    def setUp(self):
+        super(TestTrackedQuotaUsage, self).setUp()
+        cfg.CONF.set_override('quota_driver', quota.QUOTA_DB_DRIVER,
+                              group='QUOTAS')
+        cfg.CONF.set_override('track_quota_usage', True, group='QUOTAS')
+        cfg.CONF.set_override('quota_port', 2, group='QUOTAS')
+        quota.QUOTAS._driver = None
+        self.addCleanup(setattr, quota.QUOTAS, '_driver', None)
+        quota_usage.listen_tracked_models()
+        self.ctx = context.get_admin_context()
+        self.driver = quota_db.DbQuotaDriver()
+
+    def _get_usage(self, resource='port'):
+        return self.ctx.session.query(quota_usage.QuotaUsage).filter_by(
+            tenant_id=self._tenant_id, resource=resource).one()
+
+    def test_create_ports_over_quota(self):
+        with self.network() as net:
+            net_id = net['network']['id']
+            ports = [self.deserialize(self.fmt, self._create_port(
+                self.fmt, net_id, expected_res_status=201))
+                for i in range(2)]
+            self._create_port(self.fmt, net_id, expected_res_status=409)
+            usage = self._get_usage()
+            self.assertEqual((2, 0), (usage.in_use, usage.reserved))
+            self._delete('ports', ports[0]['port']['id'])
+            self.ctx.session.refresh(usage)
+            self.assertEqual(1, usage.in_use)
+            self._create_port(self.fmt, net_id, expected_res_status=201)
+
+    def test_usage_not_counted_when_synced(self):
+        with self.network() as net:
+            self._create_port(self.fmt, net['network']['id'],
+                              expected_res_status=201)
+            with mock.patch.object(self.driver, '_resync_usage') as resync:
+                self.driver.make_reservation(
+                    self.ctx, self._tenant_id, quota.QUOTAS.resources,
+                    'port', 1)
+            self.assertFalse(resync.called)
+
+    def test_dirty_usage_counted_again(self):
+        with self.network() as net:
+            self._create_port(self.fmt, net['network']['id'],
+                              expected_res_status=201)
+            usage = self._get_usage()
+            with self.ctx.session.begin():
+                usage.in_use = 2
+            self._create_port(self.fmt, net['network']['id'],
+                              expected_res_status=409)
+            self.driver.delete_tenant_quota(self.ctx, self._tenant_id)
+            self._create_port(self.fmt, net['network']['id'],
+                              expected_res_status=201)
+
+    def test_expired_reservation_released(self):
+        self.driver.make_reservation(self.ctx, self._tenant_id,
+                                     quota.QUOTAS.resources, 'port', 2)
+        self.assertRaises(exceptions.OverQuota,
+                          self.driver.make_reservation, self.ctx,
+                          self._tenant_id, quota.QUOTAS.resources, 'port', 1)
+        timeutils.set_time_override(timeutils.utcnow() + datetime.timedelta(
+            seconds=cfg.CONF.QUOTAS.quota_usage_resync_interval + 1))
+        self.addCleanup(timeutils.clear_time_override)
+        reservation_id = self.driver.make_reservation(
+            self.ctx, self._tenant_id, quota.QUOTAS.resources, 'port', 1)
+        self.driver.release_reservation(self.ctx, reservation_id)
+        usage = self._get_usage()
+        self.assertEqual((0, 0), (usage.in_use, usage.reserved))
+
+    def test_unlimited_quota_not_reserved(self):
+        cfg.CONF.set_override('quota_port', -1, group='QUOTAS')
+        self.assertIsNone(self.driver.make_reservation(
+            self.ctx, self._tenant_id, quota.QUOTAS.resources, 'port', 1))
+
+
 class TestQuotaDriverLoad(base.BaseTestCase):
     def setUp(self):
         super(TestQuotaDriverLoad, self).setUp()
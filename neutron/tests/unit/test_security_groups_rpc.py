@@ -32,6 +32,7 @@ from neutron.common import constants as const
 from neutron.common import ipv6_utils as ipv6
 from neutron.common import rpc as n_rpc
 from neutron import context
+from neutron.db import securitygroups_db as sg_db
 from neutron.db import securitygroups_rpc_base as sg_db_rpc
 from neutron.extensions import allowedaddresspairs as addr_pair
 from neutron.extensions import securitygroup as ext_sg
@@ -1085,6 +1086,122 @@ class SGServerRpcCallBackTestCase(test_sg.SecurityGroupDBTestCase):
                 self._delete('ports', port_id1)
                 self._delete('ports', port_id2)
 
+    def _create_port_and_get_revision(self):
+        with self.network() as n:
+            with contextlib.nested(self.subnet(n),
+                                   self.security_group()) as (subnet_v4,
+                                                              sg1):
+                sg1_id = sg1['security_group']['id']
+                res = self._create_port(self.fmt, n['network']['id'],
+                                        security_groups=[sg1_id])
+                port_id = self.deserialize(self.fmt, res)['port']['id']
+                ctx = context.get_admin_context()
+                revision = ctx.session.query(
+                    sg_db.SecurityGroupRevision).get(sg1_id).revision
+                self._delete('ports', port_id)
+                return revision
+
+    def test_security_group_revision_on_port_create(self):
+        self.assertEqual(0, self._create_port_and_get_revision())
+
+
+class SGServerRpcCallBackWithCacheTestCase(SGServerRpcCallBackTestCase):
+    def setUp(self, plugin=None):
+        cfg.CONF.set_override('cache_security_group_info', True,
+                              group='SECURITYGROUP')
+        super(SGServerRpcCallBackWithCacheTestCase, self).setUp(plugin)
+        self.plugin = manager.NeutronManager.get_plugin()
+
+    def _get_info(self, devices):
+        ctx = context.get_admin_context()
+        # get_port_from_device of the test plugin alters the devices
+        for device in devices:
+            self.plugin.devices[device] = self.plugin.get_port(ctx, device)
+        return self.rpc.security_group_info_for_devices(ctx, devices=devices)
+
+    def test_security_group_revision_on_port_create(self):
+        self.assertTrue(self._create_port_and_get_revision())
+
+    def test_security_group_info_served_from_cache(self):
+        with self.network() as n:
+            with contextlib.nested(self.subnet(n),
+                                   self.security_group()) as (subnet_v4,
+                                                              sg1):
+                sg1_id = sg1['security_group']['id']
+                res = self._create_port(self.fmt, n['network']['id'],
+                                        security_groups=[sg1_id])
+                port_id = self.deserialize(self.fmt, res)['port']['id']
+                info = self._get_info([port_id])
+                with contextlib.nested(
+                    mock.patch.object(
+                        self.plugin, '_select_rules_for_security_groups'),
+                    mock.patch.object(
+                        self.plugin, '_select_ips_for_remote_group')
+                ) as (select_rules, select_ips):
+                    self.assertEqual(info, self._get_info([port_id]))
+                self.assertFalse(select_rules.called)
+                self.assertFalse(select_ips.called)
+                self._delete('ports', port_id)
+
+    def test_security_group_info_after_rule_created(self):
+        with self.network() as n:
+            with contextlib.nested(self.subnet(n),
+                                   self.security_group()) as (subnet_v4,
+                                                              sg1):
+                sg1_id = sg1['security_group']['id']
+                res = self._create_port(self.fmt, n['network']['id'],
+                                        security_groups=[sg1_id])
+                port_id = self.deserialize(self.fmt, res)['port']['id']
+                self.assertEqual(2, len(self._get_info(
+                    [port_id])['security_groups'][sg1_id]))
+                rule = self._build_security_group_rule(
+                    sg1_id, 'ingress', const.PROTO_NAME_TCP, '22', '22',
+                    remote_group_id=sg1_id)
+                res = self._create_security_group_rule(self.fmt, rule)
+                self.assertEqual(webob.exc.HTTPCreated.code, res.status_int)
+                rule_id = self.deserialize(
+                    self.fmt, res)['security_group_rule']['id']
+
+                info = self._get_info([port_id])
+                self.assertEqual(3, len(info['security_groups'][sg1_id]))
+                self.assertEqual(['10.0.0.2'],
+                                 info['sg_member_ips'][sg1_id][const.IPv4])
+
+                self._delete('security-group-rules', rule_id)
+                info = self._get_info([port_id])
+                self.assertEqual(2, len(info['security_groups'][sg1_id]))
+                self.assertEqual({}, info['sg_member_ips'])
+                self._delete('ports', port_id)
+
+    def test_security_group_info_after_member_added(self):
+        with self.network() as n:
+            with contextlib.nested(self.subnet(n),
+                                   self.security_group()) as (subnet_v4,
+                                                              sg1):
+                sg1_id = sg1['security_group']['id']
+                rule = self._build_security_group_rule(
+                    sg1_id, 'ingress', const.PROTO_NAME_TCP, '22', '22',
+                    remote_group_id=sg1_id)
+                res = self._create_security_group_rule(self.fmt, rule)
+                self.assertEqual(webob.exc.HTTPCreated.code, res.status_int)
+                res = self._create_port(self.fmt, n['network']['id'],
+                                        security_groups=[sg1_id])
+                port_id1 = self.deserialize(self.fmt, res)['port']['id']
+                self.assertEqual(['10.0.0.2'], self._get_info(
+                    [port_id1])['sg_member_ips'][sg1_id][const.IPv4])
+
+                res = self._create_port(self.fmt, n['network']['id'],
+                                        security_groups=[sg1_id])
+                port_id2 = self.deserialize(self.fmt, res)['port']['id']
+                self.assertEqual(['10.0.0.2', '10.0.0.3'], sorted(
+                    self._get_info([port_id1])['sg_member_ips'][sg1_id][
+                        const.IPv4]))
+
+                self._delete('ports', port_id2)
+                self.assertEqual(['10.0.0.2'], self._get_info(
+                    [port_id1])['sg_member_ips'][sg1_id][const.IPv4])
+                self._delete('ports', port_id1)
+
 
 class SGAgentRpcCallBackMixinTestCase(base.BaseTestCase):
     def setUp(self):
@@ -2624,13 +2741,22 @@ class TestSecurityGroupAgentWithIptables(base.BaseTestCase):
                             matchers.MatchesRegex(expected_regex))
 
     def _replay_iptables(self, v4_filter, v6_filter):
+        if self.expected_call_count:
+            # Only the filter table is modified after the first apply
+            self._register_mock_call(
+                ['iptables-save', '-t', 'filter', '-c'],
+                root_helper=self.root_helper,
+                return_value='')
+            v4_input = v4_filter
+        else:
+            self._register_mock_call(
+                ['iptables-save', '-c'],
+                root_helper=self.root_helper,
+                return_value='')
+            v4_input = IPTABLES_RAW + IPTABLES_NAT + v4_filter
         self._register_mock_call(
-            ['iptables-save', '-c'],
-            root_helper=self.root_helper,
-            return_value='')
-        self._register_mock_call(
-            ['iptables-restore', '-c'],
-            process_input=self._regex(IPTABLES_RAW + IPTABLES_NAT + v4_filter),
+            ['iptables-restore', '-n', '-c'],
+            process_input=self._regex(v4_input),
             root_helper=self.root_helper,
             return_value='')
         self._register_mock_call(
@@ -2638,7 +2764,7 @@ class TestSecurityGroupAgentWithIptables(base.BaseTestCase):
             root_helper=self.root_helper,
             return_value='')
         self._register_mock_call(
-            ['ip6tables-restore', '-c'],
+            ['ip6tables-restore', '-n', '-c'],
             process_input=self._regex(v6_filter),
             root_helper=self.root_helper,
             return_value='')
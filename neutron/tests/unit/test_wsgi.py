@@ -19,6 +19,7 @@ import urllib2
 
 import mock
 from oslo.config import cfg
+from oslo.serialization import jsonutils
 import testtools
 import webob
 import webob.exc
@@ -438,6 +439,21 @@ class JSONDictSerializerTest(base.BaseTestCase):
 
         self.assertEqual(result, expected_json)
 
+    def test_serialize_collection(self):
+        items = [dict(a=i) for i in range(5)]
+        serializer = wsgi.JSONDictSerializer()
+        serializer.ITEMS_PER_CHUNK = 2
+        chunks = list(serializer.serialize_collection('servers',
+                                                      iter(items)))
+        self.assertEqual(5, len(chunks))
+        self.assertEqual({'servers': items},
+                         jsonutils.loads(''.join(chunks)))
+
+    def test_serialize_empty_collection(self):
+        serializer = wsgi.JSONDictSerializer()
+        chunks = serializer.serialize_collection('servers', iter([]))
+        self.assertEqual({'servers': []}, jsonutils.loads(''.join(chunks)))
+
     def test_json_with_utf8(self):
         input_dict = dict(servers=dict(a=(2, '\xe7\xbd\x91\xe7\xbb\x9c')))
         expected_json = '{"servers":{"a":[2,"\\u7f51\\u7edc"]}}'
@@ -386,11 +386,35 @@ class DictSerializer(ActionDispatcher):
 class JSONDictSerializer(DictSerializer):
     """Default JSON request body serialization."""
 
+    # Number of items of a collection serialized in each chunk of a
+    # streamed body
+    ITEMS_PER_CHUNK = 100
+
     def default(self, data):
         def sanitizer(obj):
             return unicode(obj)
         return jsonutils.dumps(data, default=sanitizer)
 
+    def serialize_collection(self, collection, items):
+        """Serialize a collection of items incrementally.
+
+        Returns an iterator of the chunks of the JSON document
+        {collection: [item, ...]}, which only serializes the items as the
+        chunks are consumed.
+        """
+        yield '{%s: [' % jsonutils.dumps(collection)
+        separator = ''
+        chunk = []
+        for item in items:
+            chunk.append(self.default(item))
+            if len(chunk) >= self.ITEMS_PER_CHUNK:
+                yield separator + ', '.join(chunk)
+                separator = ', '
+                chunk = []
+        if chunk:
+            yield separator + ', '.join(chunk)
+        yield ']}'
+
 
 class ResponseHeaderSerializer(ActionDispatcher):
     """Default response headers serialization."""
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 OpenStack Foundation.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark the full resync of the routers of an L3 agent.
+
+The routers returned by a fake server go through the queue and the
+workers of the agent. Processing a router runs a number of root commands
+through the root helper daemon path of the agent, with a fake daemon
+client waiting for the given latency on a blocking call like the real
+one does. With --blocking the client is called in the greenthread of the
+router instead of a native thread, as it was before.
+
+    tools/with_venv.sh python tools/l3_agent_resync_benchmark.py \\
+        --routers 1000 --workers 8
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import shutil
+import tempfile
+import time
+
+import mock
+from oslo.config import cfg
+from oslo.messaging import conffixture as messaging_conffixture
+
+from neutron.agent.common import config as agent_config
+from neutron.agent.l3 import agent as l3_agent
+from neutron.agent.l3 import ha
+from neutron.agent.linux import interface
+from neutron.agent.linux import utils as linux_utils
+from neutron.common import config as base_config
+from neutron.common import rpc as n_rpc
+from neutron import context
+from neutron.openstack.common import uuidutils
+
+_blocking_sleep = eventlet.patcher.original('time').sleep
+
+
+class _FakeDaemonProxy(object):
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def run_one_command(self, cmd, stdin=None):
+        _blocking_sleep(self.latency)
+        return 0, '', ''
+
+
+class _FakeDaemonClient(object):
+    """Root helper daemon client whose commands take the given latency."""
+
+    def __init__(self, latency):
+        self._proxy = _FakeDaemonProxy(latency)
+
+    def execute(self, cmd, stdin=None):
+        return self._proxy.run_one_command(cmd, stdin)
+
+
+def _setup_conf(state_path, workers):
+    conf = agent_config.setup_conf()
+    conf.register_opts(base_config.core_opts)
+    conf.register_opts(l3_agent.L3NATAgent.OPTS)
+    conf.register_opts(ha.OPTS)
+    agent_config.register_interface_driver_opts_helper(conf)
+    agent_config.register_use_namespaces_opts_helper(conf)
+    agent_config.register_root_helper(conf)
+    conf.register_opts(interface.OPTS)
+    conf.set_override('interface_driver',
+                      'neutron.agent.linux.interface.NullDriver')
+    conf.set_override('state_path', state_path)
+    conf.set_override('router_processing_workers', workers)
+    return conf
+
+
+def run(args):
+    routers = [{'id': uuidutils.generate_uuid()}
+               for i in range(args.routers)]
+    state_path = tempfile.mkdtemp()
+    processed = []
+
+    daemon_client = _FakeDaemonClient(args.latency)
+
+    def run_command():
+        if args.blocking:
+            daemon_client.execute(['true'])
+        else:
+            linux_utils.execute_rootwrap_daemon(['true'])
+
+    def process_router(router):
+        for i in range(args.commands):
+            run_command()
+        processed.append(router['id'])
+
+    cfg.CONF(args=[], project='neutron')
+    messaging_conffixture.ConfFixture(cfg.CONF).transport_driver = 'fake'
+    n_rpc.init(cfg.CONF)
+    cfg.CONF.set_override('root_helper_daemon', 'benchmark', 'AGENT')
+    linux_utils.RootwrapDaemonHelper._client = daemon_client
+    try:
+        with mock.patch.object(l3_agent, 'L3PluginApi') as plugin_api:
+            plugin_api.return_value.get_routers.return_value = routers
+            agent = l3_agent.L3NATAgent(
+                'benchmark', _setup_conf(state_path, args.workers))
+        agent._clean_stale_namespaces = False
+        agent._process_router_if_compatible = process_router
+
+        start = time.time()
+        agent.periodic_sync_routers_task(context.get_admin_context())
+        eventlet.spawn_n(agent._process_routers_loop)
+        while len(processed) < len(routers):
+            eventlet.sleep(0.1)
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(state_path)
+
+    print('%d routers processed in %.2fs, %.1f routers per second' %
+          (len(routers), elapsed, len(routers) / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--routers', type=int, default=1000,
+                        help='Number of routers to resync')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Value of router_processing_workers')
+    parser.add_argument('--commands', type=int, default=20,
+                        help='Number of root commands run per router')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='Seconds taken by each root command')
+    parser.add_argument('--blocking', action='store_true',
+                        help='Block the greenthreads on the root commands')
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
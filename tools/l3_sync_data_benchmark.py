@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 OpenStack Foundation.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark the router sync data built by the server for the L3 agents.
+
+An in-memory sqlite database is seeded with routers having a gateway on
+a shared external network, a number of interfaces on their own network
+and a floating IP each. The sync data of all the routers is then built
+as for a full resync of an agent, reporting the time taken and the
+number of database queries run.
+
+    tools/with_venv.sh python tools/l3_sync_data_benchmark.py \\
+        --routers 5000 --interfaces 2
+"""
+
+import argparse
+import time
+
+from oslo.config import cfg
+
+from neutron.common import config as base_config  # noqa
+from neutron.common import constants
+from neutron import context
+from neutron.db import api as db_api
+from neutron.db import db_base_plugin_v2
+from neutron.db import external_net_db
+from neutron.db import l3_db
+from neutron.db import model_base
+from neutron.db import models_v2
+from neutron.db import stats
+from neutron.openstack.common import uuidutils
+
+TENANT_ID = 'benchmark'
+
+
+class SyncDataPlugin(db_base_plugin_v2.NeutronDbPluginV2,
+                     external_net_db.External_net_db_mixin,
+                     l3_db.L3_NAT_dbonly_mixin):
+    """Core and L3 plugin reading the seeded database."""
+
+    @property
+    def _core_plugin(self):
+        return self
+
+
+class _Seeder(object):
+
+    def __init__(self, session):
+        self.session = session
+        self.mac = 0
+
+    def network(self, cidr, external=False):
+        network_id = uuidutils.generate_uuid()
+        subnet_id = uuidutils.generate_uuid()
+        self.session.add(models_v2.Network(
+            id=network_id, tenant_id=TENANT_ID, name='',
+            status=constants.NET_STATUS_ACTIVE, admin_state_up=True,
+            shared=False))
+        if external:
+            self.session.add(
+                external_net_db.ExternalNetwork(network_id=network_id))
+        self.session.add(models_v2.Subnet(
+            id=subnet_id, tenant_id=TENANT_ID, name='',
+            network_id=network_id, ip_version=4, cidr=cidr,
+            gateway_ip=cidr.split('/')[0][:-1] + '1',
+            enable_dhcp=False, shared=False))
+        return network_id, subnet_id
+
+    def port(self, network_id, subnet_id, ip_address, device_id,
+             device_owner):
+        port_id = uuidutils.generate_uuid()
+        self.mac += 1
+        mac = 'fa:16:3e:%02x:%02x:%02x' % (self.mac >> 16 & 0xff,
+                                           self.mac >> 8 & 0xff,
+                                           self.mac & 0xff)
+        self.session.add(models_v2.Port(
+            id=port_id, tenant_id=TENANT_ID, name='', network_id=network_id,
+            mac_address=mac, admin_state_up=True,
+            status=constants.PORT_STATUS_ACTIVE, device_id=device_id,
+            device_owner=device_owner))
+        self.session.add(models_v2.IPAllocation(
+            port_id=port_id, ip_address=ip_address, subnet_id=subnet_id,
+            network_id=network_id))
+        return port_id
+
+
+def _external_ip(index):
+    return '172.%d.%d.%d' % (16 + (index >> 16 & 0x0f), index >> 8 & 0xff,
+                             index & 0xff)
+
+
+def seed(args):
+    session = db_api.get_session()
+    seeder = _Seeder(session)
+    with session.begin():
+        ext_net_id, ext_subnet_id = seeder.network('172.16.0.0/12',
+                                                   external=True)
+        for i in range(args.routers):
+            router_id = uuidutils.generate_uuid()
+            gw_port_id = seeder.port(
+                ext_net_id, ext_subnet_id, _external_ip(2 * i + 2), router_id,
+                constants.DEVICE_OWNER_ROUTER_GW)
+            session.add(l3_db.Router(
+                id=router_id, tenant_id=TENANT_ID, name='',
+                status=constants.NET_STATUS_ACTIVE, admin_state_up=True,
+                gw_port_id=gw_port_id))
+            session.add(l3_db.RouterPort(
+                router_id=router_id, port_id=gw_port_id,
+                port_type=constants.DEVICE_OWNER_ROUTER_GW))
+            for j in range(args.interfaces):
+                cidr = '10.%d.%d.0/24' % (i % 256, j)
+                network_id, subnet_id = seeder.network(cidr)
+                port_id = seeder.port(
+                    network_id, subnet_id, cidr.replace('.0/24', '.1'),
+                    router_id, constants.DEVICE_OWNER_ROUTER_INTF)
+                session.add(l3_db.RouterPort(
+                    router_id=router_id, port_id=port_id,
+                    port_type=constants.DEVICE_OWNER_ROUTER_INTF))
+            if args.interfaces:
+                fixed_port_id = seeder.port(
+                    network_id, subnet_id, cidr.replace('.0/24', '.10'),
+                    uuidutils.generate_uuid(), 'compute:nova')
+                fip_address = _external_ip(2 * i + 3)
+                fip_port_id = seeder.port(
+                    ext_net_id, ext_subnet_id, fip_address,
+                    uuidutils.generate_uuid(),
+                    constants.DEVICE_OWNER_FLOATINGIP)
+                session.add(l3_db.FloatingIP(
+                    id=uuidutils.generate_uuid(), tenant_id=TENANT_ID,
+                    floating_ip_address=fip_address,
+                    floating_network_id=ext_net_id,
+                    floating_port_id=fip_port_id,
+                    fixed_port_id=fixed_port_id,
+                    fixed_ip_address=cidr.replace('.0/24', '.10'),
+                    router_id=router_id))
+
+
+def run(args):
+    cfg.CONF.set_override('connection', 'sqlite://', group='database')
+    engine = db_api.get_engine()
+    model_base.BASEV2.metadata.create_all(engine)
+    stats.instrument_engine(engine)
+    seed(args)
+
+    plugin = SyncDataPlugin()
+    admin_context = context.get_admin_context()
+    with stats.record('benchmark:get_sync_data') as request_stats:
+        start = time.time()
+        routers = plugin.get_sync_data(admin_context)
+        elapsed = time.time() - start
+
+    print('Sync data of %d routers built in %.2fs: %s' %
+          (len(routers), elapsed, request_stats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--routers', type=int, default=1000,
+                        help='Number of routers to seed')
+    parser.add_argument('--interfaces', type=int, default=2,
+                        help='Number of interfaces of each router')
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()